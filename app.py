@@ -27,7 +27,9 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 # Importar componentes principales y funciones de inicialización
-from src.globals import app, socketio, scheduler, mqtt_state, global_state
+from src.globals import app, socketio, scheduler, global_state
+from src.connection_manager import connection_manager
+from src.cluster import cluster
 
 # Disable Zstd compression due to memory issues on some systems
 # Use Gzip instead which is more compatible and requires less memory
@@ -35,12 +37,18 @@ app.config['COMPRESS_ZSTD_LEVEL'] = 0   # Disable Zstandard
 app.config['COMPRESS_BR_LEVEL'] = 0     # Disable Brotli
 app.config['COMPRESS_GZIP_LEVEL'] = 6   # Use Gzip with level 6
 from src.database import init_db
-from src.persistence import load_config, cleanup_sensor_data, should_run_cleanup
+from src.persistence import load_config
+from src.sensor_writer import sensor_writer
+from src.device_stats import device_stats
+from src.ingest_pipeline import ingest_pipeline
+from src.rollups import backfill_rollups
+from src.retention import retention
 from src.routes import *
 from src.socket_handlers import *
 
-# Bandera para controlar el cierre
+# Bandera para controlar el cierre (la señal solo la activa; stop_server hace el cierre)
 shutdown_requested = False
+_stopped = False
 
 def signal_handler(sig, frame):
     """Manejador de señales para cierre limpio."""
@@ -50,11 +58,12 @@ def signal_handler(sig, frame):
 
 def stop_server():
     """Detiene todos los componentes del servidor de forma limpia."""
-    global shutdown_requested
+    global shutdown_requested, _stopped
     
-    if shutdown_requested:
+    if _stopped:
         return
     
+    _stopped = True
     shutdown_requested = True
     logger.info("Deteniendo servidor...")
     
@@ -66,19 +75,37 @@ def stop_server():
         except Exception as e:
             logger.error(f"Error deteniendo WSGI: {e}")
     
-    # 2. Desconectar cliente MQTT
-    client = mqtt_state.get('client')
-    if client:
-        try:
-            if client.is_connected():
-                logger.info("Desconectando cliente MQTT...")
-                client.loop_stop()
-                client.disconnect()
-                logger.info("Cliente MQTT desconectado")
-        except Exception as e:
-            logger.error(f"Error desconectando MQTT: {e}")
+    # 2. Ceder el liderazgo del cluster y desconectar los clientes MQTT de todos los servidores
+    try:
+        cluster.stop()
+    except Exception as e:
+        logger.error(f"Error liberando el liderazgo del cluster: {e}")
+    try:
+        logger.info("Desconectando clientes MQTT...")
+        connection_manager.disconnect_all()
+        logger.info("Clientes MQTT desconectados")
+    except Exception as e:
+        logger.error(f"Error desconectando MQTT: {e}")
+    
+    # 3. Procesar los mensajes encolados y volcar las lecturas de sensores pendientes
+    try:
+        ingest_pipeline.stop()
+    except Exception as e:
+        logger.error(f"Error vaciando el pipeline de ingesta: {e}")
+    try:
+        sensor_writer.stop()
+    except Exception as e:
+        logger.error(f"Error volcando datos de sensores: {e}")
+    try:
+        device_stats.stop()
+    except Exception as e:
+        logger.error(f"Error guardando estadísticas de dispositivos: {e}")
+    try:
+        retention.stop()
+    except Exception as e:
+        logger.error(f"Error deteniendo la retención de datos: {e}")
     
-    # 3. Forzar cierre de threads huérfanos
+    # 4. Forzar cierre de threads huérfanos
     logger.info("Cerrando threads huérfanos...")
     active_threads = threading.enumerate()
     for thread in active_threads:
@@ -92,7 +119,7 @@ def stop_server():
                 except Exception as e:
                     logger.warning(f"Error cerrando thread {thread.name}: {e}")
     
-    # 4. Shutdown del scheduler
+    # 5. Shutdown del scheduler
     try:
         if scheduler.running:
             scheduler.shutdown(wait=False)
@@ -120,19 +147,33 @@ def main():
         init_db()
         # 2. Cargar la configuración inicial
         load_config()
-        # 3. Limpieza de datos históricos si es necesario
-        if should_run_cleanup():
-            deleted = cleanup_sensor_data(days=30)
-            from src.persistence import update_cleanup_timestamp
-            update_cleanup_timestamp()
+        # 3. Rollups pendientes (la retención de datos históricos corre en segundo plano)
+        backfill_rollups()
 
     # 4. Cargar la clave secreta desde una variable de entorno si está disponible
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'mqtt-dashboard-secret-key-default')
 
     # 5. Iniciar el scheduler en modo pausado
     scheduler.start(paused=True)
+
+    # 6. Iniciar el escritor por lotes de datos de sensores y las instantáneas de estadísticas de dispositivos
+    sensor_writer.configure_from_settings()
+    sensor_writer.start()
+    device_stats.start()
+    retention.start()
+
+    # 7. Iniciar el pipeline de ingesta MQTT (saca el procesamiento del hilo de paho)
+    ingest_pipeline.configure_from_settings()
+    ingest_pipeline.start()
+
+    # 8. Modo cluster (SOCKETIO_MESSAGE_QUEUE): elección de líder entre workers
+    cluster.start()
+
+    # 9. Conectar todos los servidores configurados (en modo cluster lo hace el líder al ser elegido)
+    if not cluster.enabled:
+        connection_manager.connect_all(global_state['active_server_name'])
     
-    # 6. Configurar backup automático
+    # 10. Configurar backup automático
     def scheduled_backup_job():
         """Función de backup automático llamada por el scheduler."""
         try:
@@ -182,9 +223,10 @@ def main():
     configure_backup_job()
 
     # Imprimir información de inicio
+    port = int(os.environ.get('PORT', 5000))
     broker_info = global_state['active_server_config'].get('broker', 'N/A')
     port_info = global_state['active_server_config'].get('port', 'N/A')
-    print(f"Servidor web: http://localhost:5000")
+    print(f"Servidor web: http://localhost:{port}")
     print(f"Servidor MQTT por defecto: {global_state['active_server_name']} ({broker_info}:{port_info})")
     print(f"Scheduler: Iniciado y en pausa")
     print("="*60)
@@ -193,8 +235,8 @@ def main():
 
     try:
         # Crear servidor WSGI explícito para mejor control del cierre
-        wsgi_server = pywsgi.WSGIServer(('0.0.0.0', 5000), app, log=None)
-        logger.info("Servidor WSGI iniciado en puerto 5000")
+        wsgi_server = pywsgi.WSGIServer(('0.0.0.0', port), app, log=None)
+        logger.info(f"Servidor WSGI iniciado en puerto {port}")
         
         # Iniciar en un hilo para poder monitorear la bandera de cierre
         def serve_forever():
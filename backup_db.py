@@ -6,7 +6,9 @@ Este script realiza copias de seguridad automaticas de la base de datos SQLite.
 Puede ejecutarse como script independiente o integrarse con el scheduler.
 
 Funcionalidades:
-- Backup incremental con timestamp
+- Backup en caliente con la API de backup de SQLite (sin parar la aplicacion)
+- Backup incremental: bloques de tamano fijo direccionados por su hash,
+  solo se guardan los que cambian desde el backup anterior
 - Rotacion de backups antiguos (por defecto mantiene 7)
 - Compresion de archivos de backup
 - Logging detallado
@@ -16,13 +18,18 @@ Uso:
     python backup_db.py                    # Backup manual
     python backup_db.py --restore          # Restaurar ultimo backup
     python backup_db.py --list             # Listar backups disponibles
+    python backup_db.py --backup --full    # Backup completo comprimido (no incremental)
 """
 
 import os
 import sys
-import shutil
+import sqlite3
 import gzip
+import json
+import time
+import hashlib
 import logging
+import threading
 import argparse
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -42,9 +49,23 @@ DEFAULT_CONFIG = {
     'max_backups': 7,
     'compression': True,
     'enabled': False,
-    'interval_hours': 24
+    'interval_hours': 24,
+    'pages_per_step': 256,      # paginas copiadas entre cesiones al bucle de eventos
+    'memory_limit_mb': 256,     # BD mayores se copian a un fichero temporal en vez de a memoria
+    'chunk_size': 1024 * 1024,  # bytes escritos al comprimir entre cesiones
+    'compress_level': 6,
+    'incremental': True,        # manifiesto + almacen de bloques en lugar de una copia completa
+    'block_kb': 256,            # tamano de bloque del backup incremental (multiplo de la pagina)
+    'restore_check': 'integrity'  # 'integrity' (PRAGMA integrity_check) o 'quick' (quick_check)
 }
 
+CHUNKS_DIR = 'chunks'
+MANIFEST_SUFFIX = '.db.manifest'
+
+# Un backup en curso usa bloques que aun no figuran en ningun manifiesto:
+# la limpieza del almacen espera a que termine
+_store_lock = threading.Lock()
+
 class BackupManager:
     """Gestor de copias de seguridad de la base de datos."""
     
@@ -57,6 +78,11 @@ class BackupManager:
         
         self.backup_path = self.project_root / self.backup_dir
         self.db_path = self.project_root / self.db_file
+        self.pages_per_step = DEFAULT_CONFIG['pages_per_step']
+        self.memory_limit = DEFAULT_CONFIG['memory_limit_mb'] * 1024 * 1024
+        self.block_size = DEFAULT_CONFIG['block_kb'] * 1024
+        self.chunks_path = self.backup_path / CHUNKS_DIR
+        self.last_stats = {}
         
         # Crear directorio de backups si no existe
         self.backup_path.mkdir(parents=True, exist_ok=True)
@@ -78,30 +104,65 @@ class BackupManager:
         backups.sort(key=lambda x: x.stat().st_mtime, reverse=True)
         return backups
     
-    def create_backup(self) -> Optional[Path]:
-        """Crear una copia de seguridad de la base de datos."""
+    def create_backup(self, on_progress=None, incremental: bool = None) -> Optional[Path]:
+        """Crear una copia de seguridad de la base de datos mientras la aplicacion escribe.
+
+        La copia se hace con la API de backup de SQLite sobre una instantanea
+        fija (transaccion de lectura), por tramos de pages_per_step paginas
+        que ceden el bucle de eventos, y se escribe comprimida en una sola
+        pasada. on_progress(paginas_copiadas, paginas_totales) se llama tras
+        cada tramo. Las estadisticas quedan en self.last_stats.
+
+        Si incremental (por defecto DEFAULT_CONFIG['incremental']) el backup es
+        un manifiesto con la lista de bloques y solo se escriben en el almacen
+        los bloques que no existian (ver write_blocks).
+        """
         if not self.db_path.exists():
             logger.error(f"[ERROR] Base de datos no encontrada: {self.db_path}")
             return None
         
+        if incremental is None:
+            incremental = DEFAULT_CONFIG['incremental']
+        backup_file = self.backup_path / self.get_backup_filename()
+        if incremental:
+            backup_file = backup_file.with_name(backup_file.stem + MANIFEST_SUFFIX)
+        elif DEFAULT_CONFIG['compression']:
+            backup_file = Path(str(backup_file) + '.gz')
+        # Nombre oculto hasta terminar: list_backups() nunca ve una copia a medias
+        partial = backup_file.with_name('.' + backup_file.name + '.tmp')
+        
         try:
-            backup_file = self.backup_path / self.get_backup_filename()
-            
             logger.info(f"[BACKUP] Creando: {backup_file.name}")
-            shutil.copy2(self.db_path, backup_file)
+            started = time.monotonic()
+            self.last_stats = {'method': None, 'pages': 0, 'db_bytes': 0}
             
-            # Comprimir si esta habilitado
-            if DEFAULT_CONFIG['compression']:
-                compressed_file = Path(str(backup_file) + '.gz')
-                with open(backup_file, 'rb') as f_in:
-                    with gzip.open(compressed_file, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                backup_file.unlink()
-                backup_file = compressed_file
-                logger.info(f"[BACKUP] Comprimido: {backup_file.name}")
+            source = self.copy_online(on_progress)
+            try:
+                if incremental:
+                    with _store_lock:
+                        manifest = self.write_blocks(source)
+                        partial.write_text(json.dumps(manifest))
+                        os.replace(partial, backup_file)
+                else:
+                    self.write_stream(source, partial)
+                    os.replace(partial, backup_file)
+            finally:
+                if isinstance(source, Path):
+                    source.unlink(missing_ok=True)
             
-            size_mb = backup_file.stat().st_size / (1024 * 1024)
-            logger.info(f"[BACKUP] Tamano: {size_mb:.2f} MB")
+            duration = max(time.monotonic() - started, 1e-6)
+            size_bytes = backup_file.stat().st_size + self.last_stats.get('stored_bytes', 0)
+            self.last_stats.update({
+                'duration_s': round(duration, 3),
+                'size_mb': round(size_bytes / (1024 * 1024), 2),
+                'db_size_mb': round(self.last_stats['db_bytes'] / (1024 * 1024), 2),
+                'throughput_mb_s': round(self.last_stats['db_bytes'] / (1024 * 1024) / duration, 2),
+                'compressed': DEFAULT_CONFIG['compression'] or incremental,
+                'incremental': incremental,
+            })
+            logger.info(f"[BACKUP] Tamano: {self.last_stats['size_mb']:.2f} MB "
+                        f"({self.last_stats['db_size_mb']:.2f} MB de BD en {duration:.2f} s, "
+                        f"{self.last_stats['throughput_mb_s']:.1f} MB/s, {self.last_stats['method']})")
             
             # Rotar backups antiguos
             self.rotate_backups()
@@ -110,9 +171,169 @@ class BackupManager:
             return backup_file
             
         except Exception as e:
+            partial.unlink(missing_ok=True)
             logger.error(f"[ERROR] Backup: {e}")
             return None
     
+    def block_file(self, digest: str) -> Path:
+        return self.chunks_path / digest[:2] / f"{digest}.gz"
+    
+    def write_blocks(self, source) -> dict:
+        """Parte la copia en bloques de block_size y guarda los que no estan en el almacen.
+
+        Cada bloque se identifica por su SHA-256 y se guarda comprimido en
+        chunks/<2 primeros>/<hash>.gz. Los bloques sin cambios respecto a
+        cualquier backup retenido ya existen y no se vuelven a escribir, asi
+        que el coste (tiempo de compresion y disco) es proporcional a lo que
+        ha cambiado. Devuelve el manifiesto del backup.
+        """
+        blocks, new_blocks, stored_bytes = [], 0, 0
+        if isinstance(source, Path):
+            f_in = open(source, 'rb')
+            chunks = iter(lambda: f_in.read(self.block_size), b'')
+        else:
+            f_in = None
+            view = memoryview(source)
+            chunks = (view[offset:offset + self.block_size] for offset in range(0, len(view), self.block_size))
+        try:
+            for chunk in chunks:
+                digest = hashlib.sha256(chunk).hexdigest()
+                blocks.append(digest)
+                target = self.block_file(digest)
+                if not target.exists():
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    data = gzip.compress(chunk, compresslevel=DEFAULT_CONFIG['compress_level'])
+                    partial = target.with_name(f".{digest}.tmp")
+                    partial.write_bytes(data)
+                    os.replace(partial, target)
+                    new_blocks += 1
+                    stored_bytes += len(data)
+                time.sleep(0)
+        finally:
+            if f_in:
+                f_in.close()
+        
+        self.last_stats.update({'blocks': len(blocks), 'new_blocks': new_blocks, 'stored_bytes': stored_bytes})
+        logger.info(f"[BACKUP] Bloques: {new_blocks} nuevos de {len(blocks)} "
+                    f"({stored_bytes / (1024 * 1024):.2f} MB escritos)")
+        return {
+            'version': 1,
+            'created': datetime.now().isoformat(),
+            'db_bytes': self.last_stats['db_bytes'],
+            'block_size': self.block_size,
+            'blocks': blocks,
+            'new_blocks': new_blocks,
+            'stored_bytes': stored_bytes,
+        }
+    
+    def read_manifest(self, manifest_file: Path) -> dict:
+        return json.loads(Path(manifest_file).read_text())
+    
+    def reconstruct(self, manifest_file: Path, target: Path):
+        """Reconstruye en target la BD de un backup incremental, verificando cada bloque."""
+        manifest = self.read_manifest(manifest_file)
+        with open(target, 'wb') as f_out:
+            for digest in manifest['blocks']:
+                block = gzip.decompress(self.block_file(digest).read_bytes())
+                if hashlib.sha256(block).hexdigest() != digest:
+                    raise ValueError(f"Bloque corrupto: {digest}")
+                f_out.write(block)
+                time.sleep(0)
+    
+    def collect_blocks(self) -> int:
+        """Elimina del almacen los bloques que ya no usa ningun manifiesto."""
+        if not self.chunks_path.exists():
+            return 0
+        with _store_lock:
+            return self._collect_blocks()
+    
+    def _collect_blocks(self) -> int:
+        referenced = set()
+        for manifest_file in self.backup_path.glob(f"dashboard_backup_*{MANIFEST_SUFFIX}"):
+            try:
+                referenced.update(self.read_manifest(manifest_file)['blocks'])
+            except (OSError, ValueError, KeyError) as e:
+                # Un manifiesto ilegible no debe llevarse bloques de los demas
+                logger.warning(f"[CLEANUP] Manifiesto ilegible {manifest_file.name}: {e}")
+                return 0
+        removed = 0
+        for block in self.chunks_path.glob('*/*.gz'):
+            if block.stem not in referenced:
+                block.unlink()
+                removed += 1
+        if removed:
+            logger.info(f"[CLEANUP] Eliminados {removed} bloques sin referencias")
+        return removed
+    
+    def copy_online(self, on_progress=None):
+        """Copia consistente de la BD en caliente.
+
+        Devuelve la imagen de la BD en memoria (bytes) o, si supera
+        memory_limit_mb, la ruta de un fichero temporal con la copia.
+        """
+        src = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        target = None
+        try:
+            # La transaccion de lectura fija la instantanea (WAL): las escrituras
+            # concurrentes no reinician la copia ni la dejan a medias
+            src.execute("BEGIN")
+            page_size = src.execute("PRAGMA page_size").fetchone()[0]
+            page_count = src.execute("PRAGMA page_count").fetchone()[0]
+            self.last_stats['db_bytes'] = page_size * page_count
+            
+            if page_size * page_count > self.memory_limit:
+                target = self.backup_path / f".copy_{os.getpid()}_{int(time.time())}.db"
+                self.last_stats['method'] = 'backup_api_file'
+            else:
+                self.last_stats['method'] = 'backup_api'
+            
+            def progress(status, remaining, total):
+                self.last_stats['pages'] = total - remaining
+                if on_progress:
+                    on_progress(total - remaining, total)
+                time.sleep(0)  # cede el bucle de gevent entre tramos
+            
+            dst = sqlite3.connect(target or ':memory:')
+            try:
+                src.backup(dst, pages=self.pages_per_step, progress=progress)
+                src.execute("COMMIT")
+                return target if target else dst.serialize()
+            finally:
+                dst.close()
+        except Exception:
+            if target:
+                target.unlink(missing_ok=True)
+            raise
+        finally:
+            src.close()
+    
+    def write_stream(self, source, target: Path):
+        """Escribe la copia (bytes o ruta) en target, comprimida si esta habilitado, en una pasada."""
+        chunk_size = DEFAULT_CONFIG['chunk_size']
+        if DEFAULT_CONFIG['compression']:
+            out = gzip.open(target, 'wb', compresslevel=DEFAULT_CONFIG['compress_level'])
+        else:
+            out = open(target, 'wb')
+        with out:
+            if isinstance(source, Path):
+                with open(source, 'rb') as f_in:
+                    for chunk in iter(lambda: f_in.read(chunk_size), b''):
+                        out.write(chunk)
+                        time.sleep(0)
+            else:
+                view = memoryview(source)
+                for offset in range(0, len(view), chunk_size):
+                    out.write(view[offset:offset + chunk_size])
+                    time.sleep(0)
+    
+    def checkpoint_wal(self):
+        """Vuelca el WAL al fichero principal."""
+        try:
+            with sqlite3.connect(self.db_path, timeout=30) as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logger.warning(f"[BACKUP] No se pudo hacer checkpoint del WAL: {e}")
+    
     def rotate_backups(self):
         """Eliminar backups antiguos excediendo el limite."""
         backups = self.list_backups()
@@ -127,9 +348,10 @@ class BackupManager:
                     logger.info(f"   Eliminado: {backup.name}")
                 except Exception as e:
                     logger.warning(f"   Error: {e}")
+            self.collect_blocks()
     
     def restore_backup(self, backup_file: Path = None) -> bool:
-        """Restaurar base de datos desde un backup."""
+        """Restaurar base de datos desde un backup (con la aplicacion parada)."""
         if backup_file is None:
             backups = self.list_backups()
             if not backups:
@@ -139,14 +361,8 @@ class BackupManager:
         
         try:
             logger.info(f"[RESTORE] Desde: {backup_file}")
-            
-            if str(backup_file).endswith('.gz'):
-                with gzip.open(backup_file, 'rb') as f_in:
-                    with open(self.db_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-            else:
-                shutil.copy2(backup_file, self.db_path)
-            
+            staging = self.stage_restore(backup_file)
+            self.swap_in(staging)
             logger.info("[OK] Base de datos restaurada")
             return True
             
@@ -154,6 +370,79 @@ class BackupManager:
             logger.error(f"[ERROR] Restaurar: {e}")
             return False
     
+    def staging_path(self) -> Path:
+        return self.db_path.with_name(self.db_path.name + '.restore')
+    
+    def stage_restore(self, backup_file: Path) -> Path:
+        """Descomprime o reconstruye un backup en un fichero aparte y lo verifica.
+
+        La BD actual no se toca: si el backup esta corrupto se lanza una
+        excepcion y el fichero de preparacion se elimina. Cede el bucle de
+        eventos entre bloques. Devuelve la ruta lista para swap_in().
+        """
+        staging = self.staging_path()
+        chunk_size = DEFAULT_CONFIG['chunk_size']
+        try:
+            if str(backup_file).endswith(MANIFEST_SUFFIX):
+                self.reconstruct(backup_file, staging)
+            else:
+                opener = gzip.open if str(backup_file).endswith('.gz') else open
+                with opener(backup_file, 'rb') as f_in, open(staging, 'wb') as f_out:
+                    for chunk in iter(lambda: f_in.read(chunk_size), b''):
+                        f_out.write(chunk)
+                        time.sleep(0)
+            self.verify(staging)
+        except Exception:
+            staging.unlink(missing_ok=True)
+            raise
+        return staging
+    
+    def verify(self, path: Path, check: str = None) -> None:
+        """Comprueba la integridad de una BD (PRAGMA integrity_check o quick_check)."""
+        check = check or DEFAULT_CONFIG['restore_check']
+        pragma = 'quick_check' if check == 'quick' else 'integrity_check'
+        conn = sqlite3.connect(path)
+        try:
+            result = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+        finally:
+            conn.close()
+        if result != ['ok']:
+            raise ValueError(f"{pragma} fallido: {'; '.join(result[:5])}")
+        logger.info(f"[RESTORE] {pragma}: ok")
+    
+    def swap_in(self, staging: Path, timeout: float = 5) -> None:
+        """Sustituye la BD por el fichero preparado con un rename atomico.
+
+        Quien llame debe haber cerrado antes las conexiones a la BD. Para
+        comprobarlo se pasa la BD actual a journal_mode=DELETE: SQLite solo lo
+        permite sin otras conexiones abiertas, y al hacerlo vuelca el WAL y
+        borra -wal y -shm el mismo. Si queda alguna conexion se lanza
+        RuntimeError sin tocar nada. El rename se hace con un lock EXCLUSIVE
+        sobre el fichero anterior, de modo que nadie puede abrirlo ni escribir
+        en el entre la comprobacion y el rename.
+        """
+        conn = None
+        try:
+            if self.db_path.exists():
+                conn = sqlite3.connect(self.db_path, timeout=timeout, isolation_level=None)
+                try:
+                    mode = conn.execute("PRAGMA journal_mode=DELETE").fetchone()[0]
+                except sqlite3.OperationalError as e:
+                    raise RuntimeError(f"La BD sigue abierta por otra conexion: {e}")
+                if mode.lower() != 'delete':
+                    raise RuntimeError(f"La BD sigue abierta por otra conexion (journal_mode={mode})")
+                conn.execute("BEGIN EXCLUSIVE")
+            for suffix in ('-wal', '-shm'):
+                if Path(str(self.db_path) + suffix).exists():
+                    raise RuntimeError(f"La BD sigue abierta por otra conexion ({suffix} presente)")
+            os.replace(staging, self.db_path)
+        except Exception:
+            staging.unlink(missing_ok=True)
+            raise
+        finally:
+            if conn is not None:
+                conn.close()
+    
     def get_backup_info(self) -> dict:
         """Obtener informacion sobre los backups."""
         backups = self.list_backups()
@@ -170,6 +459,9 @@ class BackupManager:
             info['oldest_backup'] = backups[-1].name
             for backup in backups:
                 info['total_size_mb'] += backup.stat().st_size / (1024 * 1024)
+        if self.chunks_path.exists():
+            for block in self.chunks_path.glob('*/*.gz'):
+                info['total_size_mb'] += block.stat().st_size / (1024 * 1024)
         
         return info
     
@@ -184,6 +476,8 @@ class BackupManager:
             if mtime < cutoff:
                 backup.unlink()
                 deleted += 1
+        if deleted:
+            self.collect_blocks()
         
         logger.info(f"[CLEANUP] Eliminados {deleted} backups > {days} dias")
         return deleted
@@ -194,6 +488,7 @@ class BackupManager:
             backup_file = self.backup_path / filename
             if backup_file.exists():
                 backup_file.unlink()
+                self.collect_blocks()
                 logger.info(f"[DELETE] Eliminado: {filename}")
                 return True
             else:
@@ -211,11 +506,15 @@ class BackupManager:
         for backup in backups:
             try:
                 size_bytes = backup.stat().st_size
+                incremental = backup.name.endswith(MANIFEST_SUFFIX)
+                if incremental:
+                    # Lo que ocupo este backup: sus bloques nuevos
+                    size_bytes += self.read_manifest(backup).get('stored_bytes', 0)
                 size_mb = round(size_bytes / (1024 * 1024), 2)
                 mtime = datetime.fromtimestamp(backup.stat().st_mtime)
                 
                 # Generar display name
-                name_parts = backup.name.replace('dashboard_backup_', '').replace('.db.gz', '').replace('.db', '')
+                name_parts = backup.name.replace('dashboard_backup_', '').replace(MANIFEST_SUFFIX, '').replace('.db.gz', '').replace('.db', '')
                 display = mtime.strftime('%Y-%m-%d %H:%M')
                 
                 result.append({
@@ -223,7 +522,8 @@ class BackupManager:
                     'size_mb': size_mb,
                     'datetime': mtime.isoformat(),
                     'display': display,
-                    'is_compressed': str(backup).endswith('.gz')
+                    'is_compressed': str(backup).endswith('.gz') or incremental,
+                    'is_incremental': incremental
                 })
             except Exception as e:
                 logger.warning(f"[UI] Error procesando backup {backup.name}: {e}")
@@ -253,6 +553,7 @@ Ejemplos:
     )
     
     parser.add_argument('--backup', action='store_true', help='Crear backup')
+    parser.add_argument('--full', action='store_true', help='Backup completo (.db.gz) en vez de incremental')
     parser.add_argument('--restore', action='store_true', help='Restaurar backup')
     parser.add_argument('--list', action='store_true', help='Listar backups')
     parser.add_argument('--delete-old', type=int, metavar='DAYS', help='Eliminar backups antiguos')
@@ -274,7 +575,7 @@ Ejemplos:
         return
     
     if args.backup or args.auto:
-        manager.create_backup()
+        manager.create_backup(incremental=False if args.full else None)
     
     if args.restore:
         manager.restore_backup()
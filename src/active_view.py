@@ -0,0 +1,152 @@
+from collections.abc import MutableMapping, MutableSequence
+
+
+class _Unbound:
+    """Contenedores vacíos hasta que ConnectionManager fija la conexión visible."""
+
+    def __init__(self):
+        from src.topic_trie import TopicTrie
+        from src.trigger_engine import MessageTriggerEngine
+        self.state = {'client': None, 'background_task_started': False, 'connected': False}
+        self.devices = {}
+        self.topics = []
+        self.trie = TopicTrie()
+        self.alerts = []
+        self.tasks = {}
+        self.triggers = {}
+        self.trigger_engine = MessageTriggerEngine()
+
+
+class ActiveView:
+    """Puntero a la conexión que se muestra en la UI.
+
+    Los contenedores de src.globals (devices, subscribed_topics, alerts...)
+    son proxies que resuelven este puntero en cada acceso, así que cambiar
+    de servidor es una asignación y cada BrokerConnection conserva siempre
+    sus propios contenedores.
+    """
+
+    def __init__(self):
+        self.conn = None
+
+    def get(self):
+        conn = self.conn
+        if conn is None:
+            conn = self.conn = _Unbound()
+        return conn
+
+
+active_view = ActiveView()
+
+
+class ActiveProxy:
+    """Delega cualquier atributo en el contenedor 'attr' de la conexión visible."""
+
+    __slots__ = ('_attr',)
+
+    def __init__(self, attr):
+        self._attr = attr
+
+    def _target(self):
+        return getattr(active_view.get(), self._attr)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __len__(self):
+        return len(self._target())
+
+    def __contains__(self, value):
+        return value in self._target()
+
+    def __eq__(self, other):
+        if isinstance(other, ActiveProxy):
+            other = other._target()
+        return self._target() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<activo.{self._attr} {self._target()!r}>"
+
+
+class ActiveDict(ActiveProxy, MutableMapping):
+    """Proxy de un dict de la conexión visible."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    # Acceso directo a los métodos de dict (los de MutableMapping van clave a clave)
+    def get(self, key, default=None):
+        return self._target().get(key, default)
+
+    def setdefault(self, key, default=None):
+        return self._target().setdefault(key, default)
+
+    def pop(self, key, *default):
+        return self._target().pop(key, *default)
+
+    def update(self, *args, **kwargs):
+        self._target().update(*args, **kwargs)
+
+    def clear(self):
+        self._target().clear()
+
+    def keys(self):
+        return self._target().keys()
+
+    def values(self):
+        return self._target().values()
+
+    def items(self):
+        return self._target().items()
+
+    def copy(self):
+        return self._target().copy()
+
+
+class ActiveList(ActiveProxy, MutableSequence):
+    """Proxy de una list de la conexión visible."""
+
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        return self._target()[index]
+
+    def __setitem__(self, index, value):
+        self._target()[index] = value
+
+    def __delitem__(self, index):
+        del self._target()[index]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def insert(self, index, value):
+        self._target().insert(index, value)
+
+    def append(self, value):
+        self._target().append(value)
+
+    def extend(self, values):
+        self._target().extend(values)
+
+    def remove(self, value):
+        self._target().remove(value)
+
+    def clear(self):
+        self._target().clear()
+
+    def index(self, value, *args):
+        return self._target().index(value, *args)
@@ -0,0 +1,101 @@
+import operator
+import threading
+
+OPERATORS = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '==': operator.eq,
+}
+
+
+class CompiledAlert:
+    """Alerta con el umbral ya convertido y el operador resuelto a una función."""
+
+    __slots__ = ('id', 'name', 'metric', 'operator', 'compare', 'threshold', 'threshold_f', 'message', 'type')
+
+    def __init__(self, alert):
+        self.id = alert.get('id')
+        self.name = alert.get('name')
+        self.metric = alert['metric']
+        self.operator = alert['operator']
+        self.compare = OPERATORS.get(self.operator)
+        self.threshold = alert['value']
+        try:
+            self.threshold_f = float(self.threshold)
+        except (ValueError, TypeError):
+            self.threshold_f = None
+        self.message = alert.get('message') or ''
+        self.type = alert.get('type') or 'warning'
+
+    def matches(self, value):
+        """Compara el valor recibido con el umbral (numérico si ambos lo son; si no, '==' como texto)."""
+        if self.threshold_f is not None:
+            try:
+                return self.compare(float(value), self.threshold_f)
+            except (ValueError, TypeError):
+                pass
+        return self.operator == '==' and str(value) == str(self.threshold)
+
+
+class AlertEngine:
+    """Alertas de cada servidor compiladas en índices por dispositivo y métrica.
+
+    El índice de un servidor es {destino: {métrica: [CompiledAlert, ...]}},
+    donde destino es '*', 'dev_id' o 'dev_id@location' (los tres formatos que
+    admite Alert.device_id). Evaluar un mensaje solo mira las tres entradas
+    posibles y las métricas presentes en los datos, sin consultar la BD.
+
+    Las alertas deshabilitadas o con operador desconocido no se indexan.
+    add_alert/update_alert/delete_alert llaman a invalidate() y el índice se
+    reconstruye desde la BD en la siguiente evaluación.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def load(self, server_name, alerts):
+        """Compila la lista de alertas (dicts de get_alerts) de un servidor."""
+        index = {}
+        for alert in alerts:
+            if not alert.get('enabled', True) or alert.get('operator') not in OPERATORS:
+                continue
+            compiled = CompiledAlert(alert)
+            target = alert.get('device_id') or '*'
+            index.setdefault(target, {}).setdefault(compiled.metric, []).append(compiled)
+        with self._lock:
+            self._indexes[server_name] = index
+        return index
+
+    def invalidate(self, server_name=None):
+        """Descarta el índice de un servidor (o de todos)."""
+        with self._lock:
+            if server_name is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(server_name, None)
+
+    def is_loaded(self, server_name):
+        return server_name in self._indexes
+
+    def evaluate(self, server_name, device_id, location, device_data):
+        """Devuelve [(CompiledAlert, valor)] de las alertas disparadas por device_data."""
+        index = self._indexes.get(server_name)
+        if not index:
+            return []
+        triggered = []
+        for target in ('*', device_id, f"{device_id}@{location}"):
+            by_metric = index.get(target)
+            if not by_metric:
+                continue
+            for metric, compiled_alerts in by_metric.items():
+                if metric not in device_data:
+                    continue
+                value = device_data[metric]
+                for compiled in compiled_alerts:
+                    if compiled.matches(value):
+                        triggered.append((compiled, value))
+        return triggered
+
+
+alert_engine = AlertEngine()
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+
+from src.globals import socketio, config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_HZ = 10
+
+
+def _frame_interval():
+    try:
+        rate = float(config.get('settings', {}).get('broadcast_rate_hz', DEFAULT_RATE_HZ))
+    except (ValueError, TypeError):
+        rate = DEFAULT_RATE_HZ
+    return 1 / rate if rate > 0 else 0
+
+
+class Broadcaster:
+    """Planificador de emisiones Socket.IO a todos los clientes.
+
+    Las emisiones se agrupan en frames a un ritmo máximo (broadcast_rate_hz,
+    10 Hz por defecto), de modo que el tráfico hacia los navegadores queda
+    acotado aunque lleguen miles de mensajes MQTT por segundo:
+
+    - emit(event, data): eventos de estado ('topics_update', 'task_update'...).
+      Si el mismo evento se emite varias veces dentro de un frame solo se
+      envía el último; los anteriores cuentan como suprimidos.
+    - append(event, item): eventos acumulativos (entradas del historial).
+      Los items del frame se envían juntos como {'entries': [...]}, el más
+      reciente primero.
+
+    Si no hubo frames recientes, el siguiente sale de inmediato; solo se
+    espera cuando hay ráfagas.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._appends = {}
+        self._frame_scheduled = False
+        self._last_frame = 0.0
+        self.stats = {'frames': 0, 'sent': {}, 'suppressed': {}}
+
+    def emit(self, event, data):
+        """Encola un evento de estado; solo el último valor por frame se envía."""
+        with self._lock:
+            if event in self._pending:
+                self._count('suppressed', event)
+            self._pending[event] = data
+            self._schedule_frame()
+
+    def append(self, event, item):
+        """Añade un item a un evento acumulativo del siguiente frame."""
+        with self._lock:
+            items = self._appends.setdefault(event, [])
+            if items:
+                self._count('suppressed', event)
+            items.append(item)
+            self._schedule_frame()
+
+    def discard(self, event):
+        """Olvida lo pendiente de un evento (p. ej. historial al limpiarlo)."""
+        with self._lock:
+            self._pending.pop(event, None)
+            self._appends.pop(event, None)
+
+    def _count(self, kind, event):
+        counters = self.stats[kind]
+        counters[event] = counters.get(event, 0) + 1
+
+    def _schedule_frame(self):
+        if self._frame_scheduled:
+            return
+        self._frame_scheduled = True
+        socketio.start_background_task(self._delayed_frame)
+
+    def _delayed_frame(self):
+        delay = self._last_frame + _frame_interval() - time.monotonic()
+        if delay > 0:
+            socketio.sleep(delay)
+        self.flush()
+
+    def take_frame(self):
+        """Consume lo pendiente y devuelve la lista de (evento, datos) a emitir."""
+        with self._lock:
+            self._frame_scheduled = False
+            pending, appends = self._pending, self._appends
+            self._pending, self._appends = {}, {}
+
+        frame = list(pending.items())
+        for event, items in appends.items():
+            items.reverse()
+            frame.append((event, {'entries': items}))
+        return frame
+
+    def flush(self):
+        """Emite el frame pendiente. Devuelve el número de eventos emitidos."""
+        frame = self.take_frame()
+        if not frame:
+            return 0
+        self._last_frame = time.monotonic()
+        self.stats['frames'] += 1
+        for event, data in frame:
+            try:
+                socketio.emit(event, data)
+                self._count('sent', event)
+            except Exception as e:
+                logger.error(f"❌ Error emitiendo '{event}': {e}")
+        return len(frame)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'frames': self.stats['frames'],
+                'sent': dict(self.stats['sent']),
+                'suppressed': dict(self.stats['suppressed']),
+            }
+
+
+broadcaster = Broadcaster()
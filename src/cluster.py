@@ -0,0 +1,478 @@
+import functools
+import json
+import logging
+import os
+import socket
+import time
+
+from flask import session, request, has_request_context
+from sqlalchemy import update, delete, or_
+from sqlalchemy.exc import IntegrityError
+
+from src.globals import app, db, socketio, scheduler, config, devices_lock, SOCKETIO_MESSAGE_QUEUE
+from src.models import ClusterLease, ClusterCommand, ClusterState
+from src.shared_subscriptions import shared_group, share_topic, merge_device_views
+from src.state_snapshot import state_snapshot
+from src.db_gate import db_gate
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'mqtt'
+LEASE_TTL = 15           # s sin renovar tras los que otro worker puede tomar el liderazgo
+LEASE_RENEW = 3          # s entre renovaciones
+COMMAND_POLL = 0.25      # s entre lecturas de la cola de comandos (solo el líder)
+VIEW_PUBLISH = 1         # s mínimos entre publicaciones del estado compartido
+COMMAND_BATCH = 100
+VIEW_KEY = 'view'
+PARTIAL_PREFIX = 'partial:'  # + worker_id: dispositivos recibidos por ese worker (suscripciones compartidas)
+
+WORKER_ID = os.getenv('DASHBOARD_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Cluster:
+    """Coordinación de varios workers de app.py detrás de un balanceador.
+
+    Se activa con SOCKETIO_MESSAGE_QUEUE: los emits de Socket.IO se reparten
+    por esa cola, así que cualquier worker puede servir navegadores. La BD
+    (compartida) hace el resto:
+
+      - Elección de líder con un lease en cluster_leases. Solo el líder
+        abre las conexiones MQTT y tiene el scheduler en marcha; si deja de
+        renovar el lease durante LEASE_TTL, otro worker lo sustituye y
+        reconecta los servidores que estaban abiertos.
+      - Los eventos que modifican estado (@leader_event) recibidos por un
+        seguidor se guardan en cluster_commands y los aplica el líder, que
+        es quien tiene dispositivos, tareas y cachés en memoria.
+      - El líder publica en cluster_state la vista activa (dispositivos con
+        su seq, topics, tareas, historial) para que los seguidores puedan
+        enviar el estado inicial a sus navegadores.
+
+    Con mqtt_shared_group todos los workers se conectan a los servidores que
+    tiene abiertos el líder y se suscriben con $share/<grupo>/..., así que el
+    broker reparte la ingesta entre ellos. Cada seguidor publica en
+    cluster_state su vista parcial (partial:<worker_id>) y el líder la
+    incorpora a la suya con consolidate(); PINGs, scheduler y detección de
+    offline siguen siendo solo del líder.
+
+    Sin cola configurada el proceso es siempre líder y nada cambia.
+    """
+
+    def __init__(self, worker_id=WORKER_ID):
+        self.worker_id = worker_id
+        self.enabled = False
+        self._leader = False
+        self._running = False
+        self._events = {}
+        self._last_renew = 0.0
+        self._last_view = 0.0
+        self._published = None
+        self._partial_published = None
+        self._last_follow = 0.0
+        self._registry_followed = None
+        self.stats = {'elections': 0, 'forwarded': 0, 'applied': 0, 'views_published': 0,
+                      'partials_published': 0, 'merged': 0, 'registry_reloads': 0}
+
+    def configure(self, message_queue=SOCKETIO_MESSAGE_QUEUE):
+        self.enabled = bool(message_queue)
+
+    def is_leader(self):
+        return not self.enabled or self._leader
+
+    @property
+    def shared(self):
+        """True si todos los workers ingieren mediante suscripciones compartidas."""
+        return self.enabled and bool(shared_group())
+
+    # --- Elección de líder ---
+
+    def try_acquire(self, now=None):
+        """Toma o renueva el lease. Devuelve True si este worker es el líder."""
+        now = time.time() if now is None else now
+        try:
+            result = db.session.execute(
+                update(ClusterLease)
+                .where(ClusterLease.name == LEASE_NAME,
+                       or_(ClusterLease.owner == self.worker_id, ClusterLease.expires_at < now))
+                .values(owner=self.worker_id, expires_at=now + LEASE_TTL)
+            )
+            if result.rowcount:
+                db.session.commit()
+                return True
+            db.session.add(ClusterLease(name=LEASE_NAME, owner=self.worker_id, expires_at=now + LEASE_TTL))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Error renovando el lease de líder: {e}")
+            return False
+
+    def release(self):
+        try:
+            db.session.execute(delete(ClusterLease).where(ClusterLease.name == LEASE_NAME, ClusterLease.owner == self.worker_id))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Error liberando el lease de líder: {e}")
+
+    def _set_leader(self, leader):
+        if leader == self._leader:
+            return
+        self._leader = leader
+        if leader:
+            self.stats['elections'] += 1
+            logger.info(f"👑 Worker '{self.worker_id}' elegido líder")
+            self._on_elected()
+        else:
+            logger.warning(f"👑 Worker '{self.worker_id}' pierde el liderazgo")
+            self._on_demoted()
+
+    def _on_elected(self):
+        """Reabre las conexiones que tenía el líder anterior."""
+        from src.socket_handlers import _internal_mqtt_connect
+        view = self.shared_view() or {}
+        servers = view.get('connected_servers') or []
+        active = view.get('server_name')
+        if not view:
+            # Primer líder: se conectan todos los servidores configurados
+            from src.globals import global_state
+            from src.connection_manager import connection_manager
+            connection_manager.connect_all(global_state.get('active_server_name'))
+        # Fuera de una petición Socket.IO: _internal_mqtt_connect solo responde con reply(),
+        # que aquí no envía nada. El servidor que se mostraba se conecta el último para
+        # que quede como vista activa.
+        for server_name in [s for s in servers if s != active] + ([active] if active in servers else []):
+            _internal_mqtt_connect({'server_name': server_name})
+
+        if self.shared:
+            # Las conexiones que ya tenía como seguidor no vuelven a pasar por on_connect
+            from src.connection_manager import connection_manager
+            from src.mqtt_callbacks import start_leader_duties
+            for conn in connection_manager.connections():
+                if conn.is_connected():
+                    start_leader_duties(conn)
+
+    def _on_demoted(self):
+        from src.connection_manager import connection_manager
+        if not self.shared:
+            connection_manager.disconnect_all()
+        scheduler.pause()
+
+    # --- Reenvío de eventos al líder ---
+
+    def leader_event(self, event):
+        """Decorador para handlers de Socket.IO que deben ejecutarse en el líder.
+
+        En un seguidor el evento se encola (con el permiso de admin de la
+        sesión y el sid del cliente) y el handler no se ejecuta; el líder lo
+        aplicará con apply_commands(). Por eso estos handlers responden con
+        reply() o socketio.emit, nunca con flask_socketio.emit.
+        Estos handlers modifican estado, así que al terminar invalidan la
+        instantánea que se envía a los clientes que se conectan.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def run(data=None):
+                try:
+                    return fn(data) if data is not None else fn()
+                finally:
+                    state_snapshot.invalidate()
+            self._events[event] = run
+
+            @functools.wraps(fn)
+            def wrapper(data=None):
+                if self.is_leader():
+                    return run(data)
+                self.forward(event, data, bool(session.get('is_admin')), getattr(request, 'sid', None))
+            return wrapper
+        return decorator
+
+    def forward(self, event, data, is_admin, sid=None):
+        try:
+            db.session.add(ClusterCommand(event=event, data=json.dumps(data), is_admin=is_admin,
+                                          origin=self.worker_id, sid=sid, created_at=time.time()))
+            db.session.commit()
+            self.stats['forwarded'] += 1
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Error reenviando '{event}' al líder: {e}")
+
+    def apply_commands(self):
+        """Aplica, en orden de llegada, los eventos reenviados por los seguidores."""
+        commands = ClusterCommand.query.order_by(ClusterCommand.id).limit(COMMAND_BATCH).all()
+        if not commands:
+            return 0
+        for command in commands:
+            fn = self._events.get(command.event)
+            if fn is None:
+                logger.warning(f"⚠️ Comando de cluster desconocido: {command.event}")
+                continue
+            data = json.loads(command.data) if command.data else None
+            try:
+                with app.test_request_context():
+                    session['is_admin'] = command.is_admin
+                    # Sin petición Socket.IO: reply() responde a este sid con socketio.emit
+                    request.sid = command.sid
+                    fn(data) if data is not None else fn()
+                self.stats['applied'] += 1
+            except Exception as e:
+                logger.error(f"❌ Error aplicando '{command.event}' de {command.origin}: {e}")
+        db.session.execute(delete(ClusterCommand).where(ClusterCommand.id <= commands[-1].id))
+        db.session.commit()
+        return len(commands)
+
+    # --- Estado compartido ---
+
+    def build_view(self):
+        from src.globals import subscribed_topics, message_history, MAX_MESSAGES, global_state
+        from src.device_state import device_state
+        from src.connection_manager import connection_manager
+        from src.mqtt_callbacks import get_tasks_info_from_globals
+        from src.globals import device_registry
+        snapshot = device_state.snapshot()
+        active = connection_manager.active()
+        return {
+            'leader': self.worker_id,
+            'server_name': connection_manager.active_name or global_state.get('active_server_name'),
+            'connected': active.is_connected(),
+            'connected_servers': [c.server_name for c in connection_manager.connections() if c.is_connected()],
+            'seq': snapshot['seq'],
+            'devices': snapshot['devices'],
+            'topics': list(subscribed_topics),
+            'tasks': get_tasks_info_from_globals(),
+            'history': message_history.latest(MAX_MESSAGES),
+            'registry_version': device_registry.version,
+        }
+
+    def publish_view(self, force=False):
+        """Guarda la vista activa en cluster_state si ha cambiado."""
+        view = self.build_view()
+        fingerprint = (view['seq'], view['connected'], tuple(view['connected_servers']), view['server_name'],
+                       tuple(view['topics']), len(view['tasks']), view['history'][-1]['id'] if view['history'] else None,
+                       view['registry_version'])
+        if not force and fingerprint == self._published:
+            return False
+        if not self._put_state(VIEW_KEY, view):
+            return False
+        self._published = fingerprint
+        self.stats['views_published'] += 1
+        return True
+
+    def _put_state(self, key, value):
+        try:
+            value = json.dumps(value, default=str)
+            updated = db.session.execute(
+                update(ClusterState).where(ClusterState.key == key).values(value=value, updated_at=time.time())
+            ).rowcount
+            if not updated:
+                db.session.add(ClusterState(key=key, value=value, updated_at=time.time()))
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Error publicando el estado compartido ({key}): {e}")
+            return False
+
+    def shared_view(self):
+        """Última vista publicada por el líder (o None)."""
+        try:
+            row = db.session.get(ClusterState, VIEW_KEY)
+            return json.loads(row.value) if row else None
+        except Exception as e:
+            logger.error(f"❌ Error leyendo el estado compartido: {e}")
+            return None
+
+    # --- Suscripciones compartidas ---
+
+    def follow_connections(self):
+        """Seguidor: abre los mismos servidores que el líder y replica sus suscripciones."""
+        from src.connection_manager import connection_manager
+        view = self.shared_view() or {}
+        wanted = set(view.get('connected_servers') or [])
+        local = {conn.server_name: conn for conn in connection_manager.connections()}
+
+        for server_name, conn in local.items():
+            if server_name not in wanted and conn.client is not None and not conn.state.get('user_disconnected'):
+                connection_manager.disconnect(server_name)
+
+        for server_name in wanted:
+            conn = local.get(server_name)
+            # Un cliente que ya existe reconecta solo (paho); aquí solo se crean los que faltan
+            if conn is None or conn.client is None or conn.state.get('user_disconnected'):
+                if server_name not in config.get('servers', {}):
+                    continue
+                try:
+                    connection_manager.connect(server_name)
+                except Exception as e:
+                    logger.error(f"❌ Error conectando '{server_name}' como seguidor: {e}")
+
+        conn = local.get(view.get('server_name'))
+        if conn is not None and conn.is_connected():
+            topics = view.get('topics') or []
+            for topic in [t for t in conn.topics if t not in topics]:
+                conn.client.unsubscribe(share_topic(topic))
+                conn.topics.remove(topic)
+                conn.trie.remove(topic)
+            for topic in [t for t in topics if t not in conn.topics]:
+                conn.client.subscribe(share_topic(topic))
+                conn.topics.append(topic)
+                conn.trie.add(topic)
+
+        self.follow_registry(view)
+
+    def follow_registry(self, view):
+        """Seguidor: recarga la caché de whitelist/alias cuando el líder la ha cambiado.
+
+        Las altas y bajas de whitelist y los alias solo se aplican en el líder
+        (@leader_event); sin esto un seguidor descartaría los mensajes de
+        dispositivos recién añadidos a la whitelist.
+        """
+        from src.connection_manager import connection_manager
+        from src.persistence import load_device_registry
+        version = (view.get('leader'), view.get('registry_version'))
+        if version[1] is None or version == self._registry_followed:
+            return False
+        self._registry_followed = version
+        for conn in connection_manager.connections():
+            if conn.server_name:
+                load_device_registry(conn.server_name)
+        self.stats['registry_reloads'] += 1
+        return True
+
+    def publish_partial(self):
+        """Seguidor: publica los dispositivos de los que ha recibido mensajes."""
+        from src.connection_manager import connection_manager
+        partial, newest = {}, 0
+        for conn in connection_manager.connections():
+            seen = dict(conn.seen_at)
+            entries = {key: dict(conn.devices[key], seen_at=ts) for key, ts in seen.items() if key in conn.devices}
+            if entries:
+                partial[conn.server_name] = entries
+                newest = max(newest, max(seen.values()))
+        if not partial or newest == self._partial_published:
+            return False
+        if not self._put_state(PARTIAL_PREFIX + self.worker_id, partial):
+            return False
+        self._partial_published = newest
+        self.stats['partials_published'] += 1
+        return True
+
+    def consolidate(self):
+        """Líder: incorpora a sus conexiones lo recibido por los demás workers.
+
+        Solo se aplican los dispositivos con un mensaje más reciente que el
+        último que ha visto el líder; los cambios salen a la UI con el
+        publicador de la conexión como cualquier mensaje propio.
+        """
+        from src.connection_manager import connection_manager
+        own = PARTIAL_PREFIX + self.worker_id
+        views = {}
+        for row in ClusterState.query.filter(ClusterState.key.like(PARTIAL_PREFIX + '%')).all():
+            if row.key == own:
+                continue
+            for server_name, view in json.loads(row.value).items():
+                views.setdefault(server_name, []).append(view)
+
+        connections = {conn.server_name: conn for conn in connection_manager.connections()}
+        merged = 0
+        for server_name, server_views in views.items():
+            conn = connections.get(server_name)
+            if conn is None:
+                continue
+            for device_key, info in merge_device_views(server_views).items():
+                seen_at = info.pop('seen_at', 0)
+                if seen_at <= conn.seen_at.get(device_key, 0):
+                    continue
+                with devices_lock:
+                    is_new = device_key not in conn.devices
+                    conn.devices.setdefault(device_key, {}).update(info)
+                    conn.seen_at[device_key] = seen_at
+                if info.get('status') == 'online':
+                    conn.liveness.touch(device_key, seen_at)
+                elif info.get('status') == 'offline':
+                    conn.liveness.forget(device_key)
+                conn.publisher.mark(device_key, None if is_new else info.keys())
+                merged += 1
+        self.stats['merged'] += merged
+        return merged
+
+    # --- Bucle ---
+
+    def tick(self, now=None):
+        now = time.time() if now is None else now
+        if now - self._last_renew >= LEASE_RENEW:
+            self._last_renew = now
+            self._set_leader(self.try_acquire(now))
+        if self._leader:
+            self.apply_commands()
+            if self.shared:
+                self.consolidate()
+            if now - self._last_view >= VIEW_PUBLISH:
+                self._last_view = now
+                self.publish_view()
+        elif self.shared:
+            if now - self._last_follow >= LEASE_RENEW:
+                self._last_follow = now
+                self.follow_connections()
+            self.publish_partial()
+
+    def _run(self):
+        while self._running:
+            try:
+                with db_gate.hold(), app.app_context():
+                    self.tick()
+            except Exception as e:
+                logger.error(f"❌ Error en el bucle de cluster: {e}")
+            socketio.sleep(COMMAND_POLL)
+
+    def start(self):
+        if not self.enabled or self._running:
+            return
+        self._running = True
+        socketio.start_background_task(self._run)
+        logger.info(f"🧩 Modo cluster activo (worker '{self.worker_id}')")
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        with app.app_context():
+            if self._leader:
+                self.release()
+            try:
+                db.session.execute(delete(ClusterState).where(ClusterState.key == PARTIAL_PREFIX + self.worker_id))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"❌ Error borrando la vista parcial: {e}")
+        self._leader = False
+
+    def reply(self, event, data):
+        """Responde solo al cliente que envió el evento que se está atendiendo.
+
+        Dentro de un handler de Socket.IO equivale a flask_socketio.emit. Al
+        aplicar un ClusterCommand no hay petición Socket.IO: la respuesta va
+        con socketio.emit al sid guardado en el comando (la cola compartida la
+        entrega al worker donde está conectado). Sin sid, p. ej. en las
+        reconexiones de _on_elected(), no se responde.
+        """
+        sid = getattr(request, 'sid', None) if has_request_context() else None
+        if sid:
+            socketio.emit(event, data, to=sid)
+
+    def get_stats(self):
+        return {
+            'enabled': self.enabled,
+            'worker_id': self.worker_id,
+            'leader': self.is_leader(),
+            'shared_group': shared_group() if self.enabled else '',
+            **self.stats,
+        }
+
+
+cluster = Cluster()
+cluster.configure()
+leader_event = cluster.leader_event
+reply = cluster.reply
@@ -0,0 +1,309 @@
+import logging
+import threading
+import uuid
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import CallbackAPIVersion
+
+from src.globals import devices_lock, global_state, config, scheduler
+from src.topic_trie import TopicTrie
+from src.trigger_engine import MessageTriggerEngine
+from src.active_view import active_view
+from src.device_state import device_state
+from src.shared_subscriptions import shared_group
+from src.liveness import LivenessTracker
+from src.ping_scheduler import PingScheduler
+
+logger = logging.getLogger(__name__)
+
+# Campos de Server que obligan a reconectar si cambian
+CONNECTION_FIELDS = ('broker', 'port', 'username', 'password')
+
+
+def _new_state():
+    return {'client': None, 'background_task_started': False, 'connected': False}
+
+
+class _ViewPublisher:
+    """Publica en device_state solo mientras la conexión sea la visible.
+
+    Se comprueba en cada llamada, así que un callback que empezó con la
+    conexión activa no emite su estado si la UI cambia de servidor a mitad.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def mark(self, device_key, fields=None):
+        if self.conn.active:
+            device_state.mark(device_key, fields)
+
+    def mark_all(self, fields=None):
+        if self.conn.active:
+            device_state.mark_all(fields)
+
+    def mark_removed(self, device_key):
+        if self.conn.active:
+            device_state.mark_removed(device_key)
+
+    def broadcast_snapshot(self):
+        if self.conn.active:
+            device_state.broadcast_snapshot()
+
+
+class BrokerConnection:
+    """Un cliente paho y el estado de su servidor (dispositivos, suscripciones,
+    tareas, triggers y alertas).
+
+    Cada conexión conserva siempre sus propios contenedores. Los de
+    src.globals (mqtt_state, devices, subscribed_topics...) son proxies que
+    resuelven la conexión activa en cada acceso (src/active_view.py), así
+    que el código existente que trabaja con ellos sigue viendo el servidor
+    que se muestra en la UI.
+    """
+
+    def __init__(self, server_name):
+        self.server_name = server_name
+        self.active = False
+        self.state = _new_state()
+        self.devices = {}
+        self.topics = []
+        self.trie = TopicTrie()
+        self.alerts = []
+        self.tasks = {}
+        self.triggers = {}
+        self.trigger_engine = MessageTriggerEngine()
+        # Epoch del último mensaje recibido por dispositivo (consolidación entre workers)
+        self.seen_at = {}
+        self.liveness = LivenessTracker()
+        self.pinger = PingScheduler()
+        self.publisher = _ViewPublisher(self)
+
+    @property
+    def client(self):
+        return self.state.get('client')
+
+    def is_connected(self):
+        client = self.client
+        return client is not None and client.is_connected()
+
+    def connect(self, server_config):
+        """Crea el cliente paho y arranca su hilo de red."""
+        from src.mqtt_callbacks import on_connect, on_disconnect, on_message
+
+        settings = config.get('settings', {})
+        mqtt_keepalive = int(settings.get('mqtt_keepalive', 60))
+        mqtt_reconnect_delay = int(settings.get('mqtt_reconnect_delay', 5))
+        mqtt_clean_session = settings.get('mqtt_clean_session', 'true') == 'true'
+        group = shared_group()
+
+        client_id = f"flask-mqtt-dashboard-{uuid.uuid4()}"
+        userdata = {'server_name': self.server_name}
+        if group:
+            # Las suscripciones compartidas ($share) son de MQTT v5
+            client = mqtt.Client(client_id=client_id, callback_api_version=CallbackAPIVersion.VERSION2,
+                                 userdata=userdata, protocol=mqtt.MQTTv5)
+        else:
+            client = mqtt.Client(client_id=client_id, callback_api_version=CallbackAPIVersion.VERSION2,
+                                 userdata=userdata, clean_session=mqtt_clean_session)
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        client.on_message = on_message
+
+        if server_config.get('username'):
+            client.username_pw_set(server_config['username'], server_config.get('password'))
+
+        if group:
+            client.connect(server_config['broker'], server_config['port'], mqtt_keepalive, clean_start=mqtt_clean_session)
+        else:
+            client.connect(server_config['broker'], server_config['port'], mqtt_keepalive)
+        client.loop_start()
+        client.reconnect_delay_set(min_delay=mqtt_reconnect_delay, max_delay=mqtt_reconnect_delay * 2)
+
+        self.state['client'] = client
+        self.state['auto_reconnect'] = True
+        self.state['user_disconnected'] = False
+        logger.info(f"🔄 Conectado a {server_config['broker']}:{server_config['port']} (Servidor: {self.server_name}, keepalive={mqtt_keepalive}, reconnect={mqtt_reconnect_delay}s, clean_session={mqtt_clean_session}, share_group={group or '-'})")
+
+    def disconnect(self):
+        """Desconexión pedida por el usuario: sin reconexión automática."""
+        client = self.client
+        if client is None:
+            return
+        self.state['user_disconnected'] = True
+        self.state['auto_reconnect'] = False
+        client.loop_stop()
+        client.disconnect()
+
+    def summary(self):
+        return {
+            'server_name': self.server_name,
+            'connected': self.is_connected(),
+            'active': self.active,
+            'devices': len(self.devices),
+            'online': sum(1 for d in list(self.devices.values()) if d.get('status') == 'online'),
+        }
+
+
+class ConnectionManager:
+    """Conexiones MQTT simultáneas, una por Server configurado.
+
+    Cada servidor mantiene su cliente, sus dispositivos, suscripciones,
+    tareas programadas y alertas aunque no sea el que se está mostrando.
+    Cambiar de servidor en la UI es activate(): solo mueve el puntero de
+    active_view, sin copiar estado, reconectar ni recargar nada de la BD.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._connections = {}
+        # Vista por defecto mientras no hay ninguna conexión registrada
+        self._default = BrokerConnection(None)
+        self._active = None
+        self._set_active(self._default)
+
+    def _set_active(self, conn):
+        """Apunta la vista activa (y los proxies de src.globals) a conn."""
+        with devices_lock:
+            if self._active is not None:
+                self._active.active = False
+            conn.active = True
+            self._active = conn
+            active_view.conn = conn
+
+    @property
+    def active_name(self):
+        active = self._active
+        return active.server_name if active is not self._default else None
+
+    def active(self):
+        return self._active
+
+    def get(self, server_name):
+        """Conexión de un servidor registrado; None si no lo está."""
+        return self._connections.get(server_name)
+
+    def connections(self):
+        with self._lock:
+            return list(self._connections.values())
+
+    def find_task(self, task_id):
+        """Conexión propietaria de una tarea programada."""
+        for conn in self.connections():
+            if task_id in conn.tasks:
+                return conn
+        return self.active()
+
+    def any_connected(self):
+        return any(conn.state.get('connected') for conn in self.connections())
+
+    def activate(self, server_name):
+        """Muestra un servidor en la UI (crea su conexión si no existe)."""
+        with self._lock:
+            conn = self._connections.get(server_name)
+            if conn is None:
+                conn = BrokerConnection(server_name)
+                self._connections[server_name] = conn
+            if conn.active:
+                return conn
+            self._set_active(conn)
+            global_state['active_server_name'] = server_name
+            global_state['active_server_config'] = config.get('servers', {}).get(server_name, {})
+            logger.info(f"👁️ Vista activa: '{server_name}'")
+            return conn
+
+    def connect(self, server_name):
+        """Conecta un servidor (si no lo está ya) sin tocar las demás conexiones."""
+        server_config = config.get('servers', {}).get(server_name)
+        if not server_config:
+            raise KeyError(server_name)
+        with self._lock:
+            conn = self._connections.get(server_name)
+            if conn is None:
+                conn = BrokerConnection(server_name)
+                self._connections[server_name] = conn
+            if conn.is_connected():
+                return conn
+            if conn.client is not None:
+                conn.disconnect()
+            conn.connect(server_config)
+            return conn
+
+    def connect_all(self, active_name=None):
+        """Conecta todos los servidores configurados y muestra active_name (arranque)."""
+        servers = config.get('servers', {})
+        if active_name in servers:
+            self.activate(active_name)
+        for server_name in servers:
+            try:
+                self.connect(server_name)
+            except Exception as e:
+                logger.error(f"❌ Error conectando '{server_name}': {e}")
+
+    def rename(self, old_name, new_name):
+        """Re-indexa la conexión de un servidor renombrado, sin reconectar."""
+        with self._lock:
+            conn = self._connections.get(old_name)
+            if conn is None or old_name == new_name:
+                return conn
+            del self._connections[old_name]
+            conn.server_name = new_name
+            self._connections[new_name] = conn
+            client = conn.client
+            if client is not None:
+                # Los callbacks de paho identifican el servidor por su userdata
+                client.user_data_set({'server_name': new_name})
+        if conn.active:
+            global_state['active_server_name'] = new_name
+        logger.info(f"✏️ Conexión '{old_name}' renombrada a '{new_name}'")
+        return conn
+
+    def reconnect_if_changed(self, server_name, old_config):
+        """Reconecta un servidor editado si han cambiado broker, puerto o credenciales.
+
+        Solo afecta a conexiones con cliente (conectadas o reintentando).
+        Devuelve True si se ha reconectado.
+        """
+        new_config = config.get('servers', {}).get(server_name)
+        with self._lock:
+            conn = self._connections.get(server_name)
+            if conn is None or new_config is None or conn.client is None:
+                return False
+            if all(old_config.get(field) == new_config.get(field) for field in CONNECTION_FIELDS):
+                return False
+            conn.disconnect()
+            conn.connect(new_config)
+        return True
+
+    def disconnect(self, server_name):
+        conn = self._connections.get(server_name)
+        if conn is not None:
+            conn.disconnect()
+        return conn
+
+    def disconnect_all(self):
+        for conn in self.connections():
+            try:
+                conn.disconnect()
+            except Exception as e:
+                logger.error(f"Error desconectando '{conn.server_name}': {e}")
+
+    def remove(self, server_name):
+        """Desconecta y olvida un servidor (p. ej. al borrarlo)."""
+        with self._lock:
+            conn = self._connections.pop(server_name, None)
+        if conn is None:
+            return
+        conn.disconnect()
+        for task_id in list(conn.tasks):
+            if scheduler.get_job(task_id):
+                scheduler.remove_job(task_id)
+        if conn.active:
+            self._default = BrokerConnection(None)
+            self._set_active(self._default)
+
+    def summary(self):
+        return [conn.summary() for conn in self.connections()]
+
+
+connection_manager = ConnectionManager()
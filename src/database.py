@@ -23,6 +23,13 @@ def init_db():
             
             # Crear todas las tablas definidas en los modelos (por si acaso)
             db.create_all()
+
+            # Columnas nuevas en tablas existentes (create_all no altera tablas)
+            columns = {c['name'] for c in inspect(db.engine).get_columns('cluster_commands')}
+            if 'sid' not in columns:
+                with db.engine.begin() as conn:
+                    conn.exec_driver_sql("ALTER TABLE cluster_commands ADD COLUMN sid VARCHAR(64)")
+                logger.info("🗄️ Columna cluster_commands.sid añadida.")
         
         # Comprobar si hay servidores, si no, insertar por defecto
         if not Server.query.first():
@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class DbGate:
+    """Puerta de la BD para el trabajo en segundo plano.
+
+    La retención, las instantáneas de device_stats, el bucle de cluster y
+    las tareas programadas trabajan dentro de `with db_gate.hold():`.
+    quiesce() cierra la puerta (los hold() nuevos esperan) y espera a que
+    terminen los que ya están dentro; release() la vuelve a abrir. La usa
+    la restauración en caliente (src/db_restore.py) para que nadie tenga
+    una conexión abierta al fichero que se va a sustituir.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._inside = 0
+        self._closed = False
+        self.stats = {'quiesces': 0, 'timeouts': 0}
+
+    @property
+    def closing(self):
+        """True mientras la puerta está cerrada: los bucles largos deben cortar en el tramo actual."""
+        return self._closed
+
+    @contextmanager
+    def hold(self):
+        with self._cond:
+            while self._closed:
+                self._cond.wait()
+            self._inside += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._inside -= 1
+                self._cond.notify_all()
+
+    def quiesce(self, timeout=10):
+        """Cierra la puerta y espera a que salgan todos. Devuelve False si alguno sigue dentro tras timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self.stats['quiesces'] += 1
+            while self._inside:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    logger.warning(f"⚠️ {self._inside} tarea(s) siguen usando la BD tras {timeout}s")
+                    return False
+                self._cond.wait(remaining)
+        logger.info("⏸️ BD en reposo: trabajo en segundo plano detenido")
+        return True
+
+    def release(self):
+        """Vuelve a abrir la puerta (idempotente)."""
+        with self._cond:
+            if not self._closed:
+                return
+            self._closed = False
+            self._cond.notify_all()
+        logger.info("▶️ BD disponible para el trabajo en segundo plano")
+
+    def get_stats(self):
+        with self._cond:
+            return dict(self.stats, inside=self._inside, closed=self._closed)
+
+
+db_gate = DbGate()
@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from pathlib import Path
+
+from apscheduler.schedulers.base import STATE_RUNNING
+
+from src.globals import app, db, socketio, global_state, scheduler
+from src.ingest_pipeline import ingest_pipeline
+from src.sensor_writer import sensor_writer
+from src.connection_manager import connection_manager
+from src.cluster import cluster
+from src.db_gate import db_gate
+from src.state_snapshot import state_snapshot
+from src.database import init_db
+from src.persistence import load_config, load_known_devices_to_memory
+from src.mqtt_callbacks import reload_server_state
+
+logger = logging.getLogger(__name__)
+
+PAUSE_TIMEOUT = 10  # s máximos esperando a que la ingesta y el trabajo en segundo plano suelten la BD
+
+
+class OnlineRestore:
+    """Restauración de un backup sin reiniciar el proceso.
+
+    Fases, notificadas a los clientes con 'restore_progress':
+      1. staging: el backup se descomprime (o reconstruye) en
+         dashboard.db.restore y se verifica con PRAGMA integrity_check. La
+         BD actual sigue en servicio; si el backup está corrupto no se toca.
+      2. swapping: se pausan el pipeline de ingesta, el escritor de
+         sensores (los mensajes MQTT se quedan en sus colas) y el scheduler,
+         se cierra db_gate (retención, device_stats, cluster y tareas
+         programadas; ver src/db_gate.py), se cierran las conexiones del
+         engine y se hace el rename atómico. Si algo no suelta la BD en
+         PAUSE_TIMEOUT segundos, o swap_in encuentra otra conexión abierta
+         al fichero, la restauración se cancela sin tocar la BD.
+      3. reloading: init_db (tablas que falten en un backup antiguo), la
+         configuración y el estado en memoria de cada servidor conectado.
+         Si falla, la BD restaurada ya está en servicio: el resultado es
+         success con reload_error y restart_required.
+    Al terminar se reanuda la ingesta, que aplica los mensajes retenidos
+    sobre la BD restaurada.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self.last_result = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, backup_file, on_done=None):
+        """Lanza la restauración en segundo plano. Devuelve False si ya hay una en curso."""
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+        socketio.start_background_task(self._run, backup_file, on_done)
+        return True
+
+    def _run(self, backup_file, on_done):
+        try:
+            result = self.restore(backup_file)
+        finally:
+            self._running = False
+        if on_done:
+            on_done(result)
+
+    def restore(self, backup_file, manager=None):
+        """Restaura backup_file en el hilo actual. Devuelve un dict con el resultado y los tiempos."""
+        from backup_db import BackupManager
+        manager = manager or BackupManager()
+        backup_file = Path(backup_file)
+        result = {'success': False, 'filename': backup_file.name}
+        started = time.monotonic()
+        swapped = False
+        try:
+            self._progress('staging', result)
+            staging = manager.stage_restore(backup_file)
+            result['stage_s'] = round(time.monotonic() - started, 3)
+
+            self._progress('swapping', result)
+            swap_started = time.monotonic()
+            scheduler_paused = False
+            try:
+                if not ingest_pipeline.pause(PAUSE_TIMEOUT):
+                    raise RuntimeError("la ingesta no se ha detenido a tiempo")
+                sensor_writer.pause()
+                scheduler_paused = self._pause_scheduler()
+                if not db_gate.quiesce(PAUSE_TIMEOUT):
+                    raise RuntimeError("el trabajo en segundo plano no ha soltado la BD a tiempo")
+                self._swap(manager, staging)
+                swapped = True
+                self._progress('reloading', result)
+                self._reload()
+            finally:
+                result['swap_s'] = round(time.monotonic() - swap_started, 3)
+                result['buffered'] = ingest_pipeline.pending() + sensor_writer.pending()
+                db_gate.release()
+                if scheduler_paused:
+                    scheduler.resume()
+                sensor_writer.resume()
+                ingest_pipeline.resume()
+            result['success'] = True
+        except Exception as e:
+            if swapped:
+                # La BD restaurada ya está en servicio; lo que falla es recargar el estado en memoria
+                logger.warning(f"⚠️ {backup_file.name} restaurado, pero la recarga ha fallado: {e}")
+                result['success'] = True
+                result['reload_error'] = str(e)
+            else:
+                logger.error(f"❌ Error restaurando {backup_file.name}: {e}")
+                result['error'] = str(e)
+                # Cancelada antes del rename: el fichero preparado no se usa
+                manager.staging_path().unlink(missing_ok=True)
+
+        result['duration_s'] = round(time.monotonic() - started, 3)
+        # Los demás workers del cluster mantienen conexiones al fichero sustituido, y
+        # si la recarga ha fallado la memoria no corresponde a la BD: hay que reiniciar
+        result['restart_required'] = result['success'] and (cluster.enabled or 'reload_error' in result)
+        if result['success']:
+            logger.info(f"♻️ Restaurado {backup_file.name} en {result['duration_s']}s "
+                        f"(ingesta en pausa {result['swap_s']}s, {result['buffered']} mensajes retenidos)")
+        self.last_result = result
+        return result
+
+    def _pause_scheduler(self):
+        """Pausa el scheduler si está en marcha. Devuelve True si hay que reanudarlo."""
+        if scheduler.state != STATE_RUNNING:
+            return False
+        scheduler.pause()
+        return True
+
+    def _swap(self, manager, staging):
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+            manager.swap_in(staging)
+            # Conexiones abiertas entre los dos dispose apuntarían al fichero anterior
+            db.engine.dispose()
+
+    def _reload(self):
+        with app.app_context():
+            init_db()
+            load_config()
+            for conn in connection_manager.connections():
+                if conn.server_name and conn.is_connected():
+                    reload_server_state(conn)
+            active = global_state['active_server_name']
+            if active and active != "N/A":
+                load_known_devices_to_memory(active)
+        state_snapshot.invalidate()
+
+    def _progress(self, stage, result):
+        logger.info(f"♻️ Restauración de {result['filename']}: {stage}")
+        socketio.emit('restore_progress', {'stage': stage, 'filename': result['filename']})
+
+
+online_restore = OnlineRestore()
@@ -0,0 +1,99 @@
+import logging
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Valores por defecto; se pueden cambiar con variables de entorno (.env)
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_CACHE_SIZE_KB = 65536          # 64 MB de caché de páginas por conexión
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024  # 256 MB
+DEFAULT_SYNCHRONOUS = 'NORMAL'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (ValueError, TypeError):
+        return default
+
+
+def sqlite_pragmas():
+    """PRAGMAs que se aplican a cada conexión nueva, en orden.
+
+    - journal_mode=WAL: los lectores no bloquean al escritor ni al revés, así
+      que las consultas de historial no chocan con el escritor de sensores.
+    - synchronous=NORMAL: con WAL no se pierde consistencia ante un corte de
+      corriente; solo las últimas transacciones, a cambio de muchos menos fsync.
+    - busy_timeout: espera al lock en lugar de fallar con 'database is locked'.
+    - cache_size/mmap_size: más páginas en memoria para los rangos de historial.
+    - auto_vacuum=INCREMENTAL: solo tiene efecto al crear la BD; permite que
+      la retención (src/retention.py) libere páginas sin un VACUUM completo.
+    """
+    synchronous = os.getenv('SQLITE_SYNCHRONOUS', DEFAULT_SYNCHRONOUS).upper()
+    if synchronous not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        synchronous = DEFAULT_SYNCHRONOUS
+    return [
+        ('auto_vacuum', 'INCREMENTAL'),
+        ('journal_mode', 'WAL'),
+        ('synchronous', synchronous),
+        ('busy_timeout', _env_int('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS)),
+        ('cache_size', -_env_int('SQLITE_CACHE_SIZE_KB', DEFAULT_CACHE_SIZE_KB)),
+        ('mmap_size', _env_int('SQLITE_MMAP_SIZE', DEFAULT_MMAP_SIZE)),
+        ('temp_store', 'MEMORY'),
+    ]
+
+
+def _is_file_database(uri):
+    return uri.startswith('sqlite') and ':memory:' not in uri and 'mode=memory' not in uri
+
+
+def engine_options(uri):
+    """Opciones de create_engine para SQLALCHEMY_ENGINE_OPTIONS.
+
+    Con async_mode='gevent' cada greenlet (y los hilos de paho/APScheduler)
+    puede tomar su propia conexión, por lo que se usa un QueuePool amplio y
+    check_same_thread=False. Las BD en memoria (tests) conservan la
+    configuración por defecto de SQLAlchemy.
+    """
+    if not _is_file_database(uri):
+        return {}
+    busy_timeout = _env_int('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS)
+    return {
+        'poolclass': QueuePool,
+        'pool_size': _env_int('SQLITE_POOL_SIZE', DEFAULT_POOL_SIZE),
+        'max_overflow': _env_int('SQLITE_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW),
+        'pool_timeout': 30,
+        'connect_args': {'check_same_thread': False, 'timeout': busy_timeout / 1000},
+    }
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in sqlite_pragmas():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+
+def install(engine):
+    """Registra el hook que aplica los PRAGMAs al abrir cada conexión del engine."""
+    if not event.contains(engine, 'connect', _apply_pragmas):
+        event.listen(engine, 'connect', _apply_pragmas)
+
+
+def describe(engine):
+    """Estado actual de los PRAGMAs y del pool (para métricas)."""
+    info = {'pool': engine.pool.status()}
+    with engine.connect() as conn:
+        for pragma, _value in sqlite_pragmas():
+            info[pragma] = conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+    return info
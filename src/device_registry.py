@@ -0,0 +1,87 @@
+import threading
+
+
+class DeviceRegistry:
+    """Caché en memoria de los dispositivos registrados y de la whitelist.
+
+    Guarda el nombre visible (alias o nombre) por (servidor, dev_id, location)
+    y el conjunto de dispositivos permitidos, para que on_message no tenga que
+    consultar las tablas Device/Whitelist en cada mensaje.
+
+    Se carga por servidor con load_server() en on_connect y las funciones de
+    persistencia que modifican esas tablas la mantienen al día. Mientras un
+    servidor no esté cargado, is_loaded() devuelve False y los llamantes
+    deben consultar la BD.
+
+    'version' aumenta con cada cambio de whitelist o alias (no al cachear un
+    nombre leído de la BD). En modo cluster el líder la publica y los
+    seguidores recargan su caché cuando cambia.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}
+        self._whitelist = set()
+        self._loaded_servers = set()
+        self.version = 0
+
+    def load_server(self, server_name, devices, whitelist):
+        """Sustituye la caché de un servidor.
+
+        devices: iterable de (dev_id, location, display_name)
+        whitelist: iterable de (dev_id, location)
+        """
+        names = {(server_name, dev_id, location): name for dev_id, location, name in devices}
+        allowed = {(server_name, dev_id, location) for dev_id, location in whitelist}
+        with self._lock:
+            self._names = {k: v for k, v in self._names.items() if k[0] != server_name}
+            self._names.update(names)
+            self._whitelist = {k for k in self._whitelist if k[0] != server_name} | allowed
+            self._loaded_servers.add(server_name)
+
+    def invalidate_server(self, server_name=None):
+        """Olvida un servidor (o todos si server_name es None)."""
+        with self._lock:
+            self.version += 1
+            if server_name is None:
+                self._names = {}
+                self._whitelist = set()
+                self._loaded_servers = set()
+                return
+            self._names = {k: v for k, v in self._names.items() if k[0] != server_name}
+            self._whitelist = {k for k in self._whitelist if k[0] != server_name}
+            self._loaded_servers.discard(server_name)
+
+    def is_loaded(self, server_name):
+        return server_name in self._loaded_servers
+
+    def get_name(self, server_name, dev_id, location):
+        """Devuelve el nombre visible cacheado o None si el dispositivo no está en caché."""
+        return self._names.get((server_name, dev_id, location))
+
+    def set_name(self, server_name, dev_id, location, display_name):
+        # Bajo el lock: load_server/invalidate_server sustituyen los contenedores
+        with self._lock:
+            self._names[(server_name, dev_id, location)] = display_name
+
+    def rename(self, server_name, dev_id, location, display_name):
+        """Como set_name, para un cambio de alias (cuenta como cambio de versión)."""
+        with self._lock:
+            self._names[(server_name, dev_id, location)] = display_name
+            self.version += 1
+
+    def is_whitelisted(self, server_name, dev_id, location):
+        return (server_name, dev_id, location) in self._whitelist
+
+    def add_whitelisted(self, server_name, dev_id, location):
+        with self._lock:
+            self._whitelist.add((server_name, dev_id, location))
+            self.version += 1
+
+    def discard_whitelisted(self, server_name, dev_id, location):
+        with self._lock:
+            self._whitelist.discard((server_name, dev_id, location))
+            self.version += 1
+
+    def __len__(self):
+        return len(self._names)
@@ -0,0 +1,135 @@
+import logging
+import threading
+
+from src.globals import socketio, devices, devices_lock, config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATCH_WINDOW_MS = 250
+
+
+def _patch_window_seconds():
+    try:
+        return max(0, int(config.get('settings', {}).get('devices_patch_window_ms', DEFAULT_PATCH_WINDOW_MS))) / 1000
+    except (ValueError, TypeError):
+        return DEFAULT_PATCH_WINDOW_MS / 1000
+
+
+class DeviceStatePublisher:
+    """Difusión incremental del diccionario 'devices' a los navegadores.
+
+    En lugar de emitir 'devices_update' con toda la flota, los cambios se
+    anotan con mark() y se agrupan durante una ventana corta
+    (devices_patch_window_ms). Al cerrar la ventana se emite un único
+    'devices_patch' con solo los campos modificados y un número de secuencia
+    creciente:
+
+        {'seq': 42, 'devices': {'id@loc': {'status': 'online', ...}}, 'removed': ['otro@loc']}
+
+    Si un cliente detecta un salto en 'seq' pide 'request_devices_snapshot'
+    y recibe el estado completo con snapshot().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._seq = 0
+        self._dirty = {}
+        self._removed = set()
+        self._flush_scheduled = False
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def mark(self, device_key, fields=None):
+        """Anota un dispositivo como modificado. fields=None envía el dispositivo completo."""
+        with self._lock:
+            self._removed.discard(device_key)
+            if fields is None:
+                self._dirty[device_key] = None
+            elif device_key in self._dirty:
+                if self._dirty[device_key] is not None:
+                    self._dirty[device_key].update(fields)
+            else:
+                self._dirty[device_key] = set(fields)
+            self._schedule_flush()
+
+    def mark_all(self, fields=None):
+        """Anota todos los dispositivos en memoria como modificados."""
+        for device_key in list(devices.keys()):
+            self.mark(device_key, fields)
+
+    def mark_removed(self, device_key):
+        """Anota un dispositivo eliminado de 'devices'."""
+        with self._lock:
+            self._dirty.pop(device_key, None)
+            self._removed.add(device_key)
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        socketio.start_background_task(self._delayed_flush)
+
+    def _delayed_flush(self):
+        window = _patch_window_seconds()
+        if window:
+            socketio.sleep(window)
+        self.flush()
+
+    def build_patch(self):
+        """Consume los cambios pendientes y devuelve el patch (o None si no hay cambios).
+
+        Debe llamarse con _flush_lock adquirido para que los 'seq' salgan en orden.
+        """
+        with self._lock:
+            self._flush_scheduled = False
+            if not self._dirty and not self._removed:
+                return None
+            dirty, removed = self._dirty, self._removed
+            self._dirty, self._removed = {}, set()
+
+        # devices_lock se toma sin _lock para no invertir el orden de quien
+        # llama a mark() con devices_lock ya adquirido.
+        changed = {}
+        with devices_lock:
+            for device_key, fields in dirty.items():
+                device = devices.get(device_key)
+                if device is None:
+                    removed.add(device_key)
+                elif fields is None:
+                    changed[device_key] = dict(device)
+                else:
+                    changed[device_key] = {f: device.get(f) for f in fields}
+
+        self._seq += 1
+        return {'seq': self._seq, 'devices': changed, 'removed': sorted(removed)}
+
+    def flush(self):
+        """Emite los cambios pendientes como 'devices_patch'."""
+        with self._flush_lock:
+            patch = self.build_patch()
+            if patch is not None:
+                socketio.emit('devices_patch', patch)
+        return patch
+
+    def snapshot(self):
+        """Estado completo con el número de secuencia al que corresponde."""
+        with self._flush_lock:
+            with devices_lock:
+                return {'seq': self._seq, 'devices': {k: dict(v) for k, v in devices.items()}}
+
+    def broadcast_snapshot(self):
+        """Descarta los cambios pendientes y envía el estado completo a todos los clientes."""
+        with self._flush_lock:
+            with self._lock:
+                self._dirty, self._removed = {}, set()
+            self._seq += 1
+            with devices_lock:
+                snapshot = {'seq': self._seq, 'devices': {k: dict(v) for k, v in devices.items()}}
+            socketio.emit('devices_snapshot', snapshot)
+
+
+device_state = DeviceStatePublisher()
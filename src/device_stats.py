@@ -0,0 +1,295 @@
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.globals import app, db, config
+from src.models import DeviceStatsSnapshot
+from src.latency_histogram import LatencyHistogram
+from src.db_gate import db_gate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_SECONDS = 300
+
+
+class DeviceStats:
+    """Estadísticas acumuladas de un dispositivo.
+
+    La latencia se guarda en un LatencyHistogram (buckets fijos, sin
+    muestras), la disponibilidad como segundos online/offline y los PINGs
+    perdidos como PINGs enviados menos PONGs recibidos. Los PINGs a
+    iot/ping/all no se cuentan por dispositivo: se guarda el contador de
+    broadcasts del servidor en el momento de empezar (broadcast_base).
+    """
+
+    def __init__(self, broadcast_base=0):
+        self.latency = LatencyHistogram()
+        self.last_latency = None
+        self.pongs = 0
+        self.pings = 0
+        self.broadcast_base = broadcast_base
+        self.offline_events = 0
+        self.online_s = 0.0
+        self.offline_s = 0.0
+        self.status = None
+        self.since = None
+
+    def set_status(self, status, at):
+        if self.since is not None:
+            # Mensajes procesados fuera de orden: no restan tiempo
+            at = max(at, self.since)
+            if self.status == 'online':
+                self.online_s += at - self.since
+            elif self.status is not None:
+                self.offline_s += at - self.since
+        if status == 'offline' and self.status == 'online':
+            self.offline_events += 1
+        self.status = status
+        self.since = at
+
+    def pings_sent(self, broadcasts):
+        return self.pings + max(0, broadcasts - self.broadcast_base)
+
+    def summary(self, broadcasts, now):
+        online_s, offline_s = self.online_s, self.offline_s
+        if self.status is not None and self.since is not None and now > self.since:
+            if self.status == 'online':
+                online_s += now - self.since
+            else:
+                offline_s += now - self.since
+        observed = online_s + offline_s
+        pings = self.pings_sent(broadcasts)
+        return {
+            'latency': self.latency.snapshot(),
+            'last_latency': self.last_latency,
+            'pongs': self.pongs,
+            'pings': pings,
+            'missed_pings': max(0, pings - self.pongs),
+            'offline_events': self.offline_events,
+            'online_seconds': round(online_s, 1),
+            'uptime_ratio': round(online_s / observed, 4) if observed else None,
+        }
+
+    def to_dict(self, broadcasts):
+        return {
+            'latency': self.latency.to_dict(),
+            'last_latency': self.last_latency,
+            'pongs': self.pongs,
+            'pings': self.pings_sent(broadcasts),
+            'offline_events': self.offline_events,
+            'online_s': self.online_s,
+            'offline_s': self.offline_s,
+            'status': self.status,
+            'since': self.since,
+        }
+
+    @classmethod
+    def from_dict(cls, data, broadcasts):
+        stats = cls(broadcast_base=broadcasts)
+        stats.latency = LatencyHistogram.from_dict(data.get('latency') or {})
+        stats.last_latency = data.get('last_latency')
+        stats.pongs = data.get('pongs', 0)
+        stats.pings = data.get('pings', 0)
+        stats.offline_events = data.get('offline_events', 0)
+        stats.online_s = data.get('online_s', 0.0)
+        stats.offline_s = data.get('offline_s', 0.0)
+        stats.status = data.get('status')
+        stats.since = data.get('since')
+        return stats
+
+
+class DeviceStatsRegistry:
+    """Estadísticas por servidor y dispositivo, con instantáneas periódicas en la BD.
+
+    Se actualiza en cada PONG, PING y cambio de estado (coste O(1) salvo el
+    bisect del histograma). Un hilo de fondo guarda cada
+    device_stats_snapshot_s segundos los dispositivos modificados en la
+    tabla device_stats (una fila por dispositivo), que se vuelve a cargar al
+    conectar el servidor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._broadcasts = {}
+        self._dirty = set()
+        self._loaded = set()
+        self._thread = None
+        self._running = False
+        self._stop_event = threading.Event()
+        self.stats = {'snapshots': 0, 'rows_written': 0, 'failed': 0}
+
+    def _get(self, server_name, device_key):
+        key = (server_name, device_key)
+        stats = self._devices.get(key)
+        if stats is None:
+            stats = DeviceStats(broadcast_base=self._broadcasts.get(server_name, 0))
+            self._devices[key] = stats
+        self._dirty.add(key)
+        return stats
+
+    # --- Registro ---
+
+    def record_pong(self, server_name, device_key, latency_ms, at=None):
+        at = time.time() if at is None else at
+        with self._lock:
+            stats = self._get(server_name, device_key)
+            stats.pongs += 1
+            if latency_ms is not None and latency_ms >= 0:
+                stats.latency.record(latency_ms)
+                stats.last_latency = round(latency_ms, 2)
+            stats.set_status('online', at)
+
+    def record_ping(self, server_name, device_key):
+        with self._lock:
+            self._get(server_name, device_key).pings += 1
+
+    def record_broadcast(self, server_name):
+        with self._lock:
+            self._broadcasts[server_name] = self._broadcasts.get(server_name, 0) + 1
+
+    def record_status(self, server_name, device_key, status, at=None):
+        at = time.time() if at is None else at
+        with self._lock:
+            self._get(server_name, device_key).set_status(status, at)
+
+    # --- Consulta ---
+
+    def device_summary(self, server_name, device_key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            stats = self._devices.get((server_name, device_key))
+            if stats is None:
+                return None
+            return stats.summary(self._broadcasts.get(server_name, 0), now)
+
+    def fleet(self, server_name, sort='p90', limit=None, now=None):
+        """Resumen de todos los dispositivos de un servidor, los más lentos primero.
+
+        sort: percentil de latencia ('p50', 'p90', 'p99', 'avg', 'max'),
+        'missed_pings' o 'uptime_ratio' (este último de menor a mayor).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            broadcasts = self._broadcasts.get(server_name, 0)
+            rows = [dict(stats.summary(broadcasts, now), device_key=device_key)
+                    for (server, device_key), stats in self._devices.items() if server == server_name]
+
+        if sort == 'uptime_ratio':
+            rows.sort(key=lambda r: (r['uptime_ratio'] is None, r['uptime_ratio'] or 0))
+        elif sort == 'missed_pings':
+            rows.sort(key=lambda r: r['missed_pings'], reverse=True)
+        else:
+            sort = sort if sort in ('p50', 'p90', 'p99', 'avg', 'max') else 'p90'
+            rows.sort(key=lambda r: (r['latency'][sort] is not None, r['latency'][sort] or 0), reverse=True)
+        return rows[:limit] if limit else rows
+
+    def forget(self, server_name, device_key):
+        with self._lock:
+            self._devices.pop((server_name, device_key), None)
+            self._dirty.discard((server_name, device_key))
+
+    # --- Persistencia ---
+
+    def load_server(self, server_name):
+        """Carga las instantáneas de un servidor (solo la primera vez). Requiere app_context."""
+        if server_name in self._loaded:
+            return 0
+        try:
+            rows = DeviceStatsSnapshot.query.filter_by(server_name=server_name).all()
+        except Exception as e:
+            logger.error(f"❌ Error cargando estadísticas de dispositivos de '{server_name}': {e}")
+            return 0
+        with self._lock:
+            broadcasts = self._broadcasts.get(server_name, 0)
+            for row in rows:
+                key = (server_name, f"{row.device_id}@{row.location}")
+                if key in self._devices:
+                    continue
+                try:
+                    self._devices[key] = DeviceStats.from_dict(json.loads(row.data), broadcasts)
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"⚠️ Estadísticas inválidas para {key}: {e}")
+            self._loaded.add(server_name)
+        logger.info(f"📥 Estadísticas de {len(rows)} dispositivos cargadas para '{server_name}'.")
+        return len(rows)
+
+    def snapshot(self):
+        """Guarda en la BD los dispositivos modificados. Devuelve el número de filas."""
+        now = time.time()
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for server_name, device_key in dirty:
+                stats = self._devices.get((server_name, device_key))
+                if stats is None or '@' not in device_key:
+                    continue
+                device_id, location = device_key.split('@', 1)
+                rows.append({
+                    'server_name': server_name,
+                    'device_id': device_id,
+                    'location': location,
+                    'data': json.dumps(stats.to_dict(self._broadcasts.get(server_name, 0))),
+                    'updated_at': now,
+                })
+        if not rows:
+            return 0
+        try:
+            with db_gate.hold(), app.app_context():
+                stmt = sqlite_insert(DeviceStatsSnapshot.__table__)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['server_name', 'device_id', 'location'],
+                    set_={'data': stmt.excluded.data, 'updated_at': stmt.excluded.updated_at}
+                )
+                db.session.execute(stmt, rows)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            with self._lock:
+                self._dirty |= dirty
+            self.stats['failed'] += 1
+            logger.error(f"❌ Error guardando estadísticas de dispositivos: {e}")
+            return 0
+        self.stats['snapshots'] += 1
+        self.stats['rows_written'] += len(rows)
+        return len(rows)
+
+    def _interval(self):
+        try:
+            return max(1, int(config.get('settings', {}).get('device_stats_snapshot_s', DEFAULT_SNAPSHOT_SECONDS)))
+        except (ValueError, TypeError):
+            return DEFAULT_SNAPSHOT_SECONDS
+
+    def start(self):
+        """Arranca el hilo de instantáneas (idempotente)."""
+        if self._running:
+            return
+        self._running = True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='device-stats', daemon=True)
+        self._thread.start()
+        logger.info(f"📊 Estadísticas de dispositivos: instantánea cada {self._interval()}s")
+
+    def stop(self, timeout=5):
+        """Detiene el hilo y guarda lo pendiente."""
+        if self._running:
+            self._running = False
+            self._stop_event.set()
+            if self._thread:
+                self._thread.join(timeout)
+                self._thread = None
+        self.snapshot()
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval()):
+            self.snapshot()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, devices=len(self._devices), dirty=len(self._dirty))
+
+
+device_stats = DeviceStatsRegistry()
@@ -0,0 +1,102 @@
+import math
+
+MAX_POINTS = 1000
+
+# Resoluciones con nombre aceptadas por get_sensor_data_for_device (en segundos)
+RESOLUTIONS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600,
+    '6h': 21600,
+    '1d': 86400,
+}
+
+
+def parse_resolution(resolution):
+    """Normaliza la resolución pedida por el cliente.
+
+    Devuelve 'auto', 'raw', 'lttb' o un número de segundos por bucket.
+    Acepta las claves de RESOLUTIONS, un entero de segundos o None ('auto').
+    """
+    if resolution is None or resolution == '':
+        return 'auto'
+    if isinstance(resolution, str):
+        value = resolution.strip().lower()
+        if value in ('auto', 'raw', 'lttb'):
+            return value
+        if value in RESOLUTIONS:
+            return RESOLUTIONS[value]
+        try:
+            resolution = int(value)
+        except ValueError:
+            raise ValueError(f"Resolución no válida: {resolution}")
+    seconds = int(resolution)
+    if seconds <= 0:
+        raise ValueError(f"Resolución no válida: {resolution}")
+    return seconds
+
+
+def bucket_seconds_for_range(start, end, max_points=MAX_POINTS):
+    """Tamaño de bucket (segundos, entero) para que el rango quepa en max_points."""
+    span = max(1, (end - start).total_seconds())
+    return max(1, math.ceil(span / max_points))
+
+
+def lttb(points, threshold, key=lambda p: (p[0], p[1])):
+    """Largest-Triangle-Three-Buckets: reduce una serie a 'threshold' puntos.
+
+    points: lista ordenada por x. key(p) devuelve (x, y) numéricos; los puntos
+    con y None no se eligen salvo que todo el bucket sea None. Se conservan el
+    primer y el último punto y, en cada bucket intermedio, el que forma el
+    triángulo de mayor área con el punto elegido anterior y la media del
+    bucket siguiente, lo que mantiene los picos visibles en el gráfico.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Media del bucket siguiente
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = avg_y = 0.0
+        valid = 0
+        for p in points[avg_start:avg_end]:
+            x, y = key(p)
+            if y is not None:
+                avg_x += x
+                avg_y += y
+                valid += 1
+        if valid:
+            avg_x /= valid
+            avg_y /= valid
+        else:
+            avg_x, avg_y = key(points[min(avg_start, n - 1)])
+            avg_y = avg_y or 0.0
+
+        # Punto del bucket actual con el triángulo de mayor área
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = key(points[a])
+        ay = ay or 0.0
+        max_area = -1.0
+        chosen = range_start
+        for j in range(range_start, range_end):
+            x, y = key(points[j])
+            if y is None:
+                continue
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+
+        sampled.append(points[chosen])
+        a = chosen
+
+    sampled.append(points[-1])
+    return sampled
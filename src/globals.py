@@ -6,6 +6,13 @@ from flask_socketio import SocketIO
 from flask_sqlalchemy import SQLAlchemy
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from src.active_view import ActiveProxy, ActiveDict, ActiveList
+from src.device_registry import DeviceRegistry
+from src.message_history import MessageHistory
+from src import db_tuning
+from src.message_bus import socketio_options
+from src.state_snapshot import SnapshotJSON
+
 # Cargar variables de entorno desde .env
 load_dotenv()
 
@@ -18,10 +25,15 @@ basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 db_path = os.path.join(basedir, 'dashboard.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_tuning.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
 # --- Extensions ---
 db = SQLAlchemy(app)
-socketio = SocketIO(app, async_mode='gevent')
+with app.app_context():
+    db_tuning.install(db.engine)  # WAL, synchronous=NORMAL, busy_timeout... en cada conexión
+# Con SOCKETIO_MESSAGE_QUEUE varios workers de app.py comparten los emits (ver src/cluster.py)
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+socketio = SocketIO(app, async_mode='gevent', json=SnapshotJSON, **socketio_options(SOCKETIO_MESSAGE_QUEUE))
 scheduler = BackgroundScheduler()
 
 # --- Compression ---
@@ -30,24 +42,30 @@ compress = Compress(app)
 compress.init_app(app)
 
 # --- Global State Variables ---
-mqtt_state = {'client': None, 'background_task_started': False, 'connected': False}
 config = {'servers': {}, 'settings': {}}
 global_state = {'active_server_name': "N/A", 'active_server_config': {}}
-subscribed_topics = []
-devices = {}
 devices_lock = Lock()
-scheduled_tasks = {}
-message_triggers = {}
-alerts = []
+device_registry = DeviceRegistry()  # Caché de Device/Whitelist para on_message
+
+# Estado del servidor que se muestra en la UI: proxies a los contenedores de
+# su BrokerConnection (ver src/active_view.py y src/connection_manager.py)
+mqtt_state = ActiveDict('state')
+subscribed_topics = ActiveList('topics')
+subscription_trie = ActiveProxy('trie')  # Índice de subscribed_topics para el matching por mensaje
+devices = ActiveDict('devices')
+scheduled_tasks = ActiveDict('tasks')
+message_triggers = ActiveDict('triggers')
+alerts = ActiveList('alerts')
 
 # --- Message History ---
-MAX_MESSAGES = 100
-message_history = []
+MAX_MESSAGES = 100  # Capacidad por defecto y número de entradas que recibe el navegador
+message_history = MessageHistory(MAX_MESSAGES)  # Buffer circular, ver 'message_history_capacity'
 
 # --- MQTT Topics ---
 DEVICE_STATUS_TOPIC = "iot/status/+/+"
 DEVICE_PONG_TOPIC = "iot/pong/+/+"
 DEVICE_PING_TOPIC = "iot/ping/all"
+DEVICE_PING_TOPIC_PREFIX = "iot/ping"  # + /<device_id>/<location> en modo 'staggered'
 DEVICE_CONFIG_TOPIC = "iot/config/+/+"
 DEVICE_CMD_TOPIC_PREFIX = "iot/cmd"
 DEVICE_CMD_BROADCAST_TOPIC = f"{DEVICE_CMD_TOPIC_PREFIX}/all/all"
@@ -62,6 +80,7 @@ def load_subscriptions_to_memory():
             topics = load_subscriptions(server_name)
             subscribed_topics.clear()
             subscribed_topics.extend(topics)
+            subscription_trie.rebuild(subscribed_topics)
             import logging
             logger = logging.getLogger()
             logger.info(f"📚 Suscripciones cargadas para '{server_name}': {len(topics)} topics")
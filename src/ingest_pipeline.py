@@ -0,0 +1,332 @@
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+
+from src.globals import config
+from src.latency_histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_WORKERS = 4
+DEFAULT_POLICY = 'drop-oldest'
+DEFAULT_SAMPLE_EVERY = 10
+DEFAULT_BLOCK_TIMEOUT_MS = 1000
+POLICIES = ('drop-oldest', 'block', 'sample')
+
+# Etapas medidas por mensaje, en orden
+STAGES = ('queue', 'parse', 'registry', 'persistence', 'alerts', 'broadcast', 'total')
+
+# Fracción de la cola a partir de la cual la política 'sample' empieza a muestrear
+SAMPLE_HIGH_WATER = 0.8
+
+
+# Topics de dispositivo cuyo orden importa: iot/<tipo>/<device_id>/<location>
+DEVICE_MESSAGE_TYPES = ('status', 'pong', 'config')
+
+_COUNTERS = ('received', 'processed', 'failed', 'dropped', 'sampled_out')
+
+
+def device_key_for_topic(topic):
+    """Clave de orden de un topic: 'device_id@location' o el propio topic."""
+    parts = topic.split('/', 4)
+    if len(parts) >= 4 and parts[0] == 'iot' and parts[1] in DEVICE_MESSAGE_TYPES:
+        return f"{parts[2]}@{parts[3]}"
+    return topic
+
+
+def _setting(key, default, cast=int):
+    try:
+        return cast(config.get('settings', {}).get(key, default))
+    except (ValueError, TypeError):
+        return default
+
+
+class StageClock:
+    """Cronómetro por etapas: cada lap(nombre) registra el tiempo desde el anterior."""
+
+    __slots__ = ('_histograms', '_last')
+
+    def __init__(self, histograms):
+        self._histograms = histograms
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        histogram = self._histograms.get(stage)
+        if histogram is not None:
+            histogram.record((now - self._last) * 1000)
+        self._last = now
+
+
+class _NullClock:
+    __slots__ = ()
+
+    def lap(self, stage):
+        pass
+
+
+NULL_CLOCK = _NullClock()
+
+
+class _Lane:
+    """Cola serie con su propio worker: sus mensajes se procesan en orden."""
+
+    def __init__(self, index, capacity):
+        self.index = index
+        self.capacity = capacity
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.busy = False
+        self.sample_counter = 0
+        self.high_water = 0
+        self.counters = dict.fromkeys(_COUNTERS, 0)
+
+
+class IngestPipeline:
+    """Colas acotadas entre el hilo de red de paho y el procesamiento de mensajes.
+
+    on_message solo llama a submit() con (topic, payload, servidor, hora de
+    recepción). El mensaje va a una de N lanes (ingest_workers) según el hash
+    de su clave: 'device_id@location' para iot/status|pong|config/<id>/<loc>
+    y el topic para el resto. Cada lane tiene un único worker, así que los
+    mensajes de un mismo dispositivo se procesan en orden (status y luego
+    offline nunca se invierten) mientras dispositivos distintos avanzan en
+    paralelo. El worker ejecuta el handler (parseo -> registro ->
+    persistencia -> alertas -> difusión) midiendo cada etapa en un
+    LatencyHistogram.
+
+    ingest_queue_size es la capacidad total, repartida entre las lanes. Si
+    la lane de un mensaje está llena se aplica ingest_overflow_policy:
+      - drop-oldest: se descarta el mensaje más antiguo de esa lane.
+      - block: el hilo de paho espera hasta ingest_block_timeout_ms y, si
+        sigue llena, se descarta el mensaje nuevo.
+      - sample: por encima del 80% de ocupación solo se admite uno de cada
+        ingest_sample_every mensajes; con la lane llena se descarta el nuevo.
+    """
+
+    def __init__(self, handler=None, queue_size=DEFAULT_QUEUE_SIZE, workers=DEFAULT_WORKERS, policy=DEFAULT_POLICY):
+        self.handler = handler
+        self.queue_size = queue_size
+        self.workers = workers
+        self.policy = policy
+        self.sample_every = DEFAULT_SAMPLE_EVERY
+        self.block_timeout = DEFAULT_BLOCK_TIMEOUT_MS / 1000
+        self._running = False
+        self._paused = False
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._build_lanes()
+
+    def _build_lanes(self):
+        capacity = max(1, self.queue_size // self.workers)
+        self._lanes = [_Lane(i, capacity) for i in range(self.workers)]
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def paused(self):
+        return self._paused
+
+    @property
+    def stats(self):
+        """Contadores agregados de todas las lanes."""
+        totals = dict.fromkeys(_COUNTERS, 0)
+        for lane in self._lanes:
+            for key, value in lane.counters.items():
+                totals[key] += value
+        totals['queue_high_water'] = max(lane.high_water for lane in self._lanes)
+        return totals
+
+    def configure_from_settings(self):
+        """Lee tamaño de cola, número de lanes y política de config['settings']."""
+        if self._running:
+            logger.warning("⚠️ El pipeline de ingesta está en marcha; la configuración se aplicará al reiniciarlo")
+            return
+        self.queue_size = max(1, _setting('ingest_queue_size', DEFAULT_QUEUE_SIZE))
+        self.workers = max(1, _setting('ingest_workers', DEFAULT_WORKERS))
+        policy = _setting('ingest_overflow_policy', DEFAULT_POLICY, str)
+        self.policy = policy if policy in POLICIES else DEFAULT_POLICY
+        self.sample_every = max(1, _setting('ingest_sample_every', DEFAULT_SAMPLE_EVERY))
+        self.block_timeout = max(0, _setting('ingest_block_timeout_ms', DEFAULT_BLOCK_TIMEOUT_MS)) / 1000
+        self._build_lanes()
+
+    def start(self):
+        """Arranca un worker por lane (idempotente)."""
+        if self._running:
+            return
+        self._running = True
+        for lane in self._lanes:
+            lane.thread = threading.Thread(target=self._run, args=(lane,), name=f'ingest-{lane.index}', daemon=True)
+            lane.thread.start()
+        logger.info(f"📥 Pipeline de ingesta iniciado (lanes={self.workers}, cola={self.queue_size}, política={self.policy})")
+
+    def stop(self, timeout=5):
+        """Detiene los workers tras vaciar las colas."""
+        if not self._running:
+            return
+        self._running = False
+        for lane in self._lanes:
+            with lane.cond:
+                lane.cond.notify_all()
+        for lane in self._lanes:
+            if lane.thread is not None:
+                lane.thread.join(timeout)
+                lane.thread = None
+        self.drain()
+        stats = self.stats
+        logger.info(f"📥 Pipeline de ingesta detenido ({stats['processed']} procesados, {stats['dropped']} descartados)")
+
+    def pause(self, timeout=5):
+        """Retiene los mensajes en las colas hasta resume() (p. ej. mientras se sustituye la BD).
+
+        submit() sigue admitiendo mensajes con la política de desbordamiento
+        habitual. Espera a que los workers terminen el mensaje en curso;
+        devuelve False si alguno no ha terminado en timeout segundos.
+        """
+        self._paused = True
+        deadline = time.monotonic() + timeout
+        for lane in self._lanes:
+            with lane.cond:
+                while lane.busy:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.warning(f"⚠️ La lane {lane.index} sigue procesando un mensaje tras la pausa")
+                        return False
+                    lane.cond.wait(remaining)
+        logger.info(f"⏸️ Pipeline de ingesta en pausa ({self.pending()} mensajes retenidos)")
+        return True
+
+    def resume(self):
+        """Reanuda el procesamiento de los mensajes retenidos."""
+        if not self._paused:
+            return
+        self._paused = False
+        for lane in self._lanes:
+            with lane.cond:
+                lane.cond.notify_all()
+        logger.info(f"▶️ Pipeline de ingesta reanudado ({self.pending()} mensajes pendientes)")
+
+    def lane_for(self, topic):
+        """Lane asignada a un topic (estable para un mismo dispositivo)."""
+        if len(self._lanes) == 1:
+            return self._lanes[0]
+        key = device_key_for_topic(topic)
+        return self._lanes[zlib.crc32(key.encode('utf-8')) % len(self._lanes)]
+
+    def submit(self, topic, payload, server_name):
+        """Encola un mensaje desde el hilo de red. Devuelve False si se descartó."""
+        item = (topic, payload, server_name, time.time())
+        lane = self.lane_for(topic)
+        with lane.cond:
+            lane.counters['received'] += 1
+            if not self._admit_locked(lane):
+                return False
+            lane.queue.append(item)
+            depth = len(lane.queue)
+            if depth > lane.high_water:
+                lane.high_water = depth
+            lane.cond.notify_all()
+        return True
+
+    def _admit_locked(self, lane):
+        depth = len(lane.queue)
+        if self.policy == 'sample' and depth >= lane.capacity * SAMPLE_HIGH_WATER:
+            lane.sample_counter += 1
+            if lane.sample_counter % self.sample_every:
+                lane.counters['sampled_out'] += 1
+                return False
+        if depth < lane.capacity:
+            return True
+        if self.policy == 'drop-oldest':
+            lane.queue.popleft()
+            lane.counters['dropped'] += 1
+            return True
+        if self.policy == 'block':
+            deadline = time.monotonic() + self.block_timeout
+            while len(lane.queue) >= lane.capacity and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                lane.cond.wait(remaining)
+            if len(lane.queue) < lane.capacity:
+                return True
+        lane.counters['dropped'] += 1
+        return False
+
+    def pending(self):
+        return sum(len(lane.queue) for lane in self._lanes)
+
+    def process(self, item, lane=None):
+        """Ejecuta el handler para un mensaje midiendo las etapas."""
+        topic, payload, server_name, received_at = item
+        counters = (lane or self._lanes[0]).counters
+        started = time.perf_counter()
+        self.histograms['queue'].record(max(0.0, time.time() - received_at) * 1000)
+        clock = StageClock(self.histograms)
+        try:
+            self.handler(topic, payload, server_name, received_at, clock)
+            counters['processed'] += 1
+        except Exception as e:
+            counters['failed'] += 1
+            logger.error(f"❌ Error procesando mensaje de '{topic}': {e}")
+        self.histograms['total'].record((time.perf_counter() - started) * 1000)
+
+    def drain(self):
+        """Procesa en el hilo actual lo que quede en las colas, lane a lane."""
+        for lane in self._lanes:
+            while True:
+                with lane.cond:
+                    if not lane.queue:
+                        break
+                    item = lane.queue.popleft()
+                    lane.cond.notify_all()
+                self.process(item, lane)
+
+    def _run(self, lane):
+        while True:
+            with lane.cond:
+                while self._running and (self._paused or not lane.queue):
+                    lane.cond.wait(1)
+                if self._paused or not lane.queue:
+                    if not self._running:
+                        return
+                    continue
+                item = lane.queue.popleft()
+                lane.busy = True
+                # Despierta a un submit() bloqueado por la política 'block'
+                lane.cond.notify_all()
+            try:
+                self.process(item, lane)
+            finally:
+                with lane.cond:
+                    lane.busy = False
+                    lane.cond.notify_all()
+
+    def get_stats(self):
+        stats = self.stats
+        lanes = []
+        for lane in self._lanes:
+            with lane.cond:
+                depth = len(lane.queue)
+            lanes.append({
+                'depth': depth,
+                'high_water': lane.high_water,
+                'processed': lane.counters['processed'],
+                'dropped': lane.counters['dropped'],
+            })
+        stats['pending'] = sum(lane['depth'] for lane in lanes)
+        stats['lanes'] = lanes
+        stats['policy'] = self.policy
+        stats['workers'] = self.workers
+        stats['paused'] = self._paused
+        stats['queue_size'] = self.queue_size
+        stats['stages'] = {stage: h.snapshot() for stage, h in self.histograms.items()}
+        return stats
+
+
+ingest_pipeline = IngestPipeline()
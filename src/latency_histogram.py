@@ -0,0 +1,91 @@
+import bisect
+import threading
+
+# Límites superiores de los buckets en milisegundos (escala aproximadamente logarítmica)
+DEFAULT_BOUNDS_MS = (
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+    1000, 2500, 5000, 10000, 30000, 60000,
+)
+
+
+class LatencyHistogram:
+    """Histograma de latencias con buckets fijos, de coste O(log buckets) por muestra.
+
+    No guarda las muestras: los percentiles se estiman con el límite
+    superior del bucket en el que caen, suficiente para métricas operativas.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS_MS):
+        self._lock = threading.Lock()
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def record(self, value_ms):
+        index = bisect.bisect_left(self.bounds, value_ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value_ms
+            if self.min is None or value_ms < self.min:
+                self.min = value_ms
+            if self.max is None or value_ms > self.max:
+                self.max = value_ms
+
+    def percentile(self, fraction):
+        """Estimación del percentil (0-1) como límite superior de su bucket."""
+        with self._lock:
+            return self._percentile(fraction)
+
+    def _percentile(self, fraction):
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        """Estado completo (para persistirlo y restaurarlo con from_dict)."""
+        with self._lock:
+            return {'bounds': list(self.bounds), 'counts': list(self.counts), 'count': self.count,
+                    'total': self.total, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data.get('bounds') or DEFAULT_BOUNDS_MS)
+        counts = data.get('counts') or []
+        if len(counts) == len(histogram.counts):
+            histogram.counts = list(counts)
+            histogram.count = data.get('count', sum(counts))
+            histogram.total = data.get('total', 0.0)
+            histogram.min = data.get('min')
+            histogram.max = data.get('max')
+        return histogram
+
+    def snapshot(self):
+        """Resumen serializable: count, avg, min, max, p50, p90, p99 (ms)."""
+        with self._lock:
+            if not self.count:
+                return {'count': 0, 'avg': None, 'min': None, 'max': None, 'p50': None, 'p90': None, 'p99': None}
+            return {
+                'count': self.count,
+                'avg': round(self.total / self.count, 3),
+                'min': round(self.min, 3),
+                'max': round(self.max, 3),
+                'p50': self._percentile(0.5),
+                'p90': self._percentile(0.9),
+                'p99': self._percentile(0.99),
+            }
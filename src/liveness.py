@@ -0,0 +1,94 @@
+import heapq
+import threading
+import time
+
+DEFAULT_TIMEOUT = 90.0   # refresh_interval (30) * (max_missed_pings (2) + 1)
+COMPACT_MIN = 1024       # entradas obsoletas toleradas antes de reconstruir el heap
+
+
+def liveness_timeout(settings):
+    """Segundos sin PONG/estado tras los que un dispositivo pasa a offline.
+
+    Equivale al bucle anterior: offline al superar max_missed_pings ciclos
+    de refresh_interval sin respuesta.
+    """
+    try:
+        interval = int(settings.get('refresh_interval', 30))
+        max_missed_pings = int(settings.get('max_missed_pings', 2))
+    except (ValueError, TypeError):
+        interval, max_missed_pings = 30, 2
+    return interval * (max_missed_pings + 1)
+
+
+class LivenessTracker:
+    """Plazos de vida de los dispositivos de una conexión.
+
+    Cada mensaje de vida (PONG o estado online) fija el plazo del
+    dispositivo en ahora + timeout y lo apila en un heap ordenado por plazo.
+    expire() solo mira la cima del heap, así que comprobar la flota cuesta
+    lo que cuesten los dispositivos que caducan, no su tamaño. Los plazos
+    sustituidos por un mensaje posterior se quedan en el heap y se descartan
+    al llegar a la cima (o al compactar si se acumulan demasiados).
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._deadlines = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, device_key):
+        return device_key in self._deadlines
+
+    def touch(self, device_key, at=None, scale=1):
+        """Registra una señal de vida del dispositivo.
+
+        scale multiplica el timeout (dispositivos con el intervalo de PING ampliado).
+        """
+        deadline = (time.time() if at is None else at) + self.timeout * scale
+        with self._lock:
+            if self._deadlines.get(device_key, 0) >= deadline:
+                return
+            self._deadlines[device_key] = deadline
+            heapq.heappush(self._heap, (deadline, device_key))
+            if len(self._heap) > 2 * len(self._deadlines) + COMPACT_MIN:
+                self._compact()
+
+    def forget(self, device_key):
+        """Deja de vigilar un dispositivo (reportó offline o se eliminó)."""
+        with self._lock:
+            self._deadlines.pop(device_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._deadlines.clear()
+            self._heap.clear()
+
+    def next_deadline(self):
+        """Plazo más próximo, o None si no hay dispositivos vigilados."""
+        with self._lock:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def expire(self, now=None):
+        """Devuelve (y deja de vigilar) los dispositivos cuyo plazo ha vencido."""
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, device_key = heapq.heappop(self._heap)
+                if self._deadlines.get(device_key) == deadline:
+                    del self._deadlines[device_key]
+                    expired.append(device_key)
+        return expired
+
+    def _discard_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        self._heap = [(deadline, device_key) for device_key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,58 @@
+import queue
+import threading
+
+import socketio
+
+# URL especial para la cola en memoria (varios servidores Socket.IO en un mismo proceso)
+LOOPBACK_URL = 'loopback://'
+
+
+class LoopbackManager(socketio.PubSubManager):
+    """Cola de mensajes de Socket.IO en memoria.
+
+    Sustituto de Redis/AMQP para pruebas y desarrollo: todas las instancias
+    del mismo proceso comparten el bus, así que un emit en un servidor
+    Socket.IO llega a los clientes conectados a cualquiera de los demás.
+    Los mensajes se serializan a JSON igual que con un backend real.
+    """
+    name = 'loopback'
+
+    _inboxes = []
+    _inboxes_lock = threading.Lock()
+
+    def initialize(self):
+        self._inbox = queue.Queue()
+        with self._inboxes_lock:
+            LoopbackManager._inboxes.append(self._inbox)
+        super().initialize()
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        with self._inboxes_lock:
+            inboxes = list(LoopbackManager._inboxes)
+        for inbox in inboxes:
+            inbox.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+    def close(self):
+        with self._inboxes_lock:
+            if self._inbox in LoopbackManager._inboxes:
+                LoopbackManager._inboxes.remove(self._inbox)
+
+
+def socketio_options(message_queue):
+    """Argumentos de SocketIO() para la cola configurada.
+
+    Sin cola: un único proceso (comportamiento por defecto).
+    'loopback://': LoopbackManager en memoria.
+    Cualquier otra URL (redis://, amqp://, kafka://...) se pasa tal cual a
+    Flask-SocketIO, que necesita el paquete cliente correspondiente.
+    """
+    if not message_queue:
+        return {}
+    if message_queue == LOOPBACK_URL:
+        return {'client_manager': LoopbackManager()}
+    return {'message_queue': message_queue}
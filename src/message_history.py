@@ -0,0 +1,185 @@
+import heapq
+import threading
+from collections import deque
+
+from src.topic_trie import topic_matches
+
+MAX_HISTORY_CAPACITY = 100000
+
+
+class MessageHistory:
+    """Historial de mensajes MQTT en un buffer circular de capacidad fija.
+
+    append() es O(1): cada entrada recibe un 'id' creciente y ocupa la ranura
+    id % capacidad, sobrescribiendo la más antigua cuando el buffer está
+    lleno. Además se mantienen índices por topic y por dirección ('in'/'out')
+    con los ids de cada entrada, de modo que query() puede paginar y filtrar
+    sin recorrer todo el buffer.
+
+    Se comporta como la lista que sustituye: len(), iteración e indexación
+    devuelven las entradas de la más reciente a la más antigua.
+    """
+
+    def __init__(self, capacity):
+        self._lock = threading.Lock()
+        self._capacity = self._clamp(capacity)
+        self._slots = [None] * self._capacity
+        self._next_id = 1
+        self._count = 0
+        self._by_topic = {}
+        self._by_direction = {}
+
+    @staticmethod
+    def _clamp(capacity):
+        return max(1, min(int(capacity), MAX_HISTORY_CAPACITY))
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def last_id(self):
+        return self._next_id - 1
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.latest(self._count))
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and 0 <= index < self._count:
+            entry = self._get(self.last_id - index)
+            if entry is not None:
+                return entry
+        return self.latest(self._count)[index]
+
+    def _get(self, entry_id):
+        entry = self._slots[entry_id % self._capacity]
+        if entry is None or entry['id'] != entry_id:
+            return None
+        return entry
+
+    def _index(self, entry):
+        entry_id = entry['id']
+        self._by_topic.setdefault(entry['topic'], deque()).append(entry_id)
+        self._by_direction.setdefault(entry.get('direction', 'in'), deque()).append(entry_id)
+
+    def _unindex(self, entry):
+        # La entrada expulsada es siempre la más antigua, así que también es
+        # la primera de sus índices.
+        for index, key in ((self._by_topic, entry['topic']), (self._by_direction, entry.get('direction', 'in'))):
+            ids = index.get(key)
+            if ids and ids[0] == entry['id']:
+                ids.popleft()
+                if not ids:
+                    del index[key]
+
+    def append(self, entry):
+        """Añade una entrada (se le asigna 'id') y devuelve la propia entrada."""
+        with self._lock:
+            entry['id'] = self._next_id
+            self._next_id += 1
+            slot = entry['id'] % self._capacity
+            evicted = self._slots[slot]
+            if evicted is not None:
+                self._unindex(evicted)
+            else:
+                self._count += 1
+            self._slots[slot] = entry
+            self._index(entry)
+        return entry
+
+    def clear(self):
+        """Vacía el historial. Los ids siguen creciendo para que los clientes no vean duplicados."""
+        with self._lock:
+            self._slots = [None] * self._capacity
+            self._count = 0
+            self._by_topic = {}
+            self._by_direction = {}
+
+    def resize(self, capacity):
+        """Cambia la capacidad conservando las entradas más recientes que quepan."""
+        capacity = self._clamp(capacity)
+        with self._lock:
+            if capacity == self._capacity:
+                return
+            entries = self._latest(min(self._count, capacity))
+            entries.reverse()
+            self._capacity = capacity
+            self._slots = [None] * capacity
+            self._count = len(entries)
+            self._by_topic = {}
+            self._by_direction = {}
+            for entry in entries:
+                self._slots[entry['id'] % capacity] = entry
+                self._index(entry)
+
+    def configure_from_settings(self, settings, default):
+        """Aplica el ajuste 'message_history_capacity' de config['settings']."""
+        try:
+            capacity = int(settings.get('message_history_capacity', default))
+        except (ValueError, TypeError):
+            capacity = default
+        self.resize(capacity)
+
+    def _latest(self, limit, before_id=None):
+        result = []
+        entry_id = self.last_id if before_id is None else min(before_id - 1, self.last_id)
+        oldest = self._next_id - self._count
+        while entry_id >= oldest and len(result) < limit:
+            entry = self._get(entry_id)
+            if entry is not None:
+                result.append(entry)
+            entry_id -= 1
+        return result
+
+    def latest(self, limit, before_id=None):
+        """Devuelve hasta 'limit' entradas, la más reciente primero."""
+        with self._lock:
+            return self._latest(limit, before_id)
+
+    def topics(self):
+        """Topics presentes en el historial con su número de entradas."""
+        with self._lock:
+            return {topic: len(ids) for topic, ids in self._by_topic.items()}
+
+    def _candidate_ids(self, topic, direction):
+        """Iteradores de ids (del más reciente al más antiguo) que cumplen los filtros."""
+        if topic:
+            if '+' in topic or '#' in topic:
+                topics = [t for t in self._by_topic if topic_matches(t, topic)]
+            else:
+                topics = [topic] if topic in self._by_topic else []
+            return [reversed(self._by_topic[t]) for t in topics], direction
+        if direction:
+            return [reversed(self._by_direction.get(direction, ()))], None
+        return None, None
+
+    def query(self, topic=None, direction=None, before_id=None, limit=100):
+        """Página del historial filtrada por topic (admite + y #) y/o dirección.
+
+        Devuelve las entradas de la más reciente a la más antigua con id menor
+        que before_id. Para la página siguiente se pasa como before_id el id
+        de la última entrada recibida.
+        """
+        limit = max(1, min(int(limit), MAX_HISTORY_CAPACITY))
+        with self._lock:
+            sources, direction_filter = self._candidate_ids(topic, direction)
+            if sources is None:
+                return self._latest(limit, before_id)
+
+            result = []
+            merged = heapq.merge(*sources, reverse=True) if len(sources) > 1 else (sources[0] if sources else ())
+            for entry_id in merged:
+                if before_id is not None and entry_id >= before_id:
+                    continue
+                entry = self._get(entry_id)
+                if entry is None:
+                    continue
+                if direction_filter and entry.get('direction', 'in') != direction_filter:
+                    continue
+                result.append(entry)
+                if len(result) >= limit:
+                    break
+            return result
@@ -124,6 +124,43 @@ class SensorData(db.Model):
     temp_h = db.Column(db.Float)
     temp_st = db.Column(db.Float)
 
+class SensorRollupMixin:
+    """Agregados de SensorData por dispositivo e intervalo (ver src/rollups.py).
+
+    'bucket' es el inicio del intervalo en segundos epoch UTC. Por métrica se
+    guardan suma, número de valores no nulos, mínimo y máximo, de modo que los
+    buckets se pueden combinar sin volver a leer las lecturas originales.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(100), nullable=False)
+    location = db.Column(db.String(100), nullable=False)
+    bucket = db.Column(db.Integer, nullable=False, index=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    temp_c_sum = db.Column(db.Float, nullable=False, default=0)
+    temp_c_n = db.Column(db.Integer, nullable=False, default=0)
+    temp_c_min = db.Column(db.Float)
+    temp_c_max = db.Column(db.Float)
+    temp_h_sum = db.Column(db.Float, nullable=False, default=0)
+    temp_h_n = db.Column(db.Integer, nullable=False, default=0)
+    temp_h_min = db.Column(db.Float)
+    temp_h_max = db.Column(db.Float)
+    temp_st_sum = db.Column(db.Float, nullable=False, default=0)
+    temp_st_n = db.Column(db.Integer, nullable=False, default=0)
+    temp_st_min = db.Column(db.Float)
+    temp_st_max = db.Column(db.Float)
+
+class SensorRollup1m(SensorRollupMixin, db.Model):
+    __tablename__ = 'sensor_rollup_1m'
+    __table_args__ = (db.UniqueConstraint('device_id', 'location', 'bucket', name='_rollup_1m_uc'),)
+
+class SensorRollup1h(SensorRollupMixin, db.Model):
+    __tablename__ = 'sensor_rollup_1h'
+    __table_args__ = (db.UniqueConstraint('device_id', 'location', 'bucket', name='_rollup_1h_uc'),)
+
+class SensorRollup1d(SensorRollupMixin, db.Model):
+    __tablename__ = 'sensor_rollup_1d'
+    __table_args__ = (db.UniqueConstraint('device_id', 'location', 'bucket', name='_rollup_1d_uc'),)
+
 class Alert(db.Model):
     __tablename__ = 'alerts'
     id = db.Column(db.Integer, primary_key=True)
@@ -160,3 +197,41 @@ class DeviceLog(db.Model):
     timestamp = db.Column(db.DateTime, default=db.func.now(), index=True)
     __table_args__ = (db.Index('idx_log_device_location', 'device_id', 'location'),)
 
+
+
+class ClusterLease(db.Model):
+    """Lease de liderazgo entre workers de app.py (ver src/cluster.py)."""
+    __tablename__ = 'cluster_leases'
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)
+
+
+class ClusterCommand(db.Model):
+    """Evento de Socket.IO recibido por un worker seguidor y pendiente de aplicar en el líder."""
+    __tablename__ = 'cluster_commands'
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(100), nullable=False)
+    data = db.Column(db.Text)  # JSON
+    is_admin = db.Column(db.Boolean, default=False, nullable=False)
+    origin = db.Column(db.String(100), nullable=False)
+    sid = db.Column(db.String(64))  # Cliente Socket.IO que envió el evento (para reply())
+    created_at = db.Column(db.Float, nullable=False)
+
+
+class ClusterState(db.Model):
+    """Estado publicado por el líder para que los seguidores lo sirvan (JSON por clave)."""
+    __tablename__ = 'cluster_state'
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+
+class DeviceStatsSnapshot(db.Model):
+    """Última instantánea de las estadísticas de latencia/disponibilidad de un dispositivo (ver src/device_stats.py)."""
+    __tablename__ = 'device_stats'
+    server_name = db.Column(db.String(100), primary_key=True)
+    device_id = db.Column(db.String(100), primary_key=True)
+    location = db.Column(db.String(100), primary_key=True)
+    data = db.Column(db.Text, nullable=False)  # JSON
+    updated_at = db.Column(db.Float, nullable=False)
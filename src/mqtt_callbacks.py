@@ -1,73 +1,48 @@
 import logging
 import json
-import re
 import time
 from datetime import datetime
 
 from src.globals import (
     app,
-    mqtt_state,
-    subscribed_topics, devices, devices_lock, scheduled_tasks, alerts,
-    socketio, scheduler, message_history, MAX_MESSAGES,
+    subscription_trie, devices_lock, scheduled_tasks,
+    socketio, scheduler, message_history,
     global_state,
-    DEVICE_STATUS_TOPIC, DEVICE_PONG_TOPIC, DEVICE_PING_TOPIC, DEVICE_CMD_BROADCAST_TOPIC, DEVICE_CONFIG_TOPIC,
+    DEVICE_STATUS_TOPIC, DEVICE_PONG_TOPIC, DEVICE_PING_TOPIC, DEVICE_PING_TOPIC_PREFIX, DEVICE_CMD_BROADCAST_TOPIC, DEVICE_CONFIG_TOPIC,
     config
 )
-from src.persistence import load_subscriptions, load_tasks, load_message_triggers, insert_sensor_data, get_alerts, get_or_create_device, is_device_allowed, get_all_known_devices, add_device_event
+from src.topic_trie import topic_matches
+from src.broadcaster import broadcaster
+from src.alert_engine import alert_engine
+from src.connection_manager import connection_manager
+from src.ingest_pipeline import ingest_pipeline, NULL_CLOCK
+from src.shared_subscriptions import share_topic
+from src.cluster import cluster
+from src.liveness import liveness_timeout
+from src.device_stats import device_stats
+from src.persistence import load_subscriptions, load_tasks, load_message_triggers, insert_sensor_data, get_alerts, get_or_create_device, is_device_allowed, get_all_known_devices, add_device_event, add_device_events, load_device_registry
 
 logger = logging.getLogger(__name__)
 
-def topic_matches(topic, subscription):
-    """Comprueba si un topic coincide con una suscripción MQTT (soporta + y #)."""
-    if subscription == "#":
-        return True
-    
-    topic_parts = topic.split('/')
-    sub_parts = subscription.split('/')
-    
-    i = 0
-    while i < len(sub_parts):
-        if sub_parts[i] == '#':
-            return True
-        if i >= len(topic_parts):
-            return False
-        if sub_parts[i] != '+' and sub_parts[i] != topic_parts[i]:
-            return False
-        i += 1
-    
-    return i == len(topic_parts)
+LIVENESS_RESOLUTION = 1.0  # s mínimos entre despertares del bucle (agrupa los plazos cercanos)
 
 def check_alerts(device_id, location, device_data, server_name):
     """Comprueba si los datos de un dispositivo disparan alguna alerta."""
-    with app.app_context():
-        try:
-            active_alerts = get_alerts(server_name)
-            for alert in active_alerts:
-                device_matches = (alert['device_id'] == '*') or \
-                                 (alert['device_id'] == f"{device_id}@{location}") or \
-                                 (alert['device_id'] == device_id)
-                
-                if not alert['enabled'] or not device_matches:
-                    continue
-
-                if alert['metric'] in device_data:
-                    actual_value, threshold_value = device_data[alert['metric']], alert['value']
-                    operator = alert['operator']
-                    try:
-                        actual_value_f, threshold_value_f = float(actual_value), float(threshold_value)
-                        if (operator == '>' and actual_value_f > threshold_value_f) or \
-                           (operator == '<' and actual_value_f < threshold_value_f) or \
-                           (operator == '==' and actual_value_f == threshold_value_f):
-                            message = alert['message'].format(device_name=device_data.get('name', device_id), value=actual_value)
-                            logger.warning(f"🚨 ALERTA DISPARADA: {message}")
-                            socketio.emit('new_alert', {'message': message, 'type': alert.get('type', 'warning')})
-                    except (ValueError, TypeError):
-                        if operator == '==' and str(actual_value) == str(threshold_value):
-                            message = alert['message'].format(device_name=device_data.get('name', device_id), value=actual_value)
-                            logger.warning(f"🚨 ALERTA DISPARADA: {message}")
-                            socketio.emit('new_alert', {'message': message, 'type': alert.get('type', 'warning')})
-        except Exception as e:
-            logger.error(f"❌ Error al comprobar alertas para {device_id}@{location}: {e}")
+    try:
+        if not alert_engine.is_loaded(server_name):
+            with app.app_context():
+                alert_engine.load(server_name, get_alerts(server_name))
+
+        for alert, actual_value in alert_engine.evaluate(server_name, device_id, location, device_data):
+            try:
+                message = alert.message.format(device_name=device_data.get('name', device_id), value=actual_value)
+            except (KeyError, IndexError, ValueError) as e:
+                logger.error(f"❌ Mensaje de alerta '{alert.name}' inválido: {e}")
+                continue
+            logger.warning(f"🚨 ALERTA DISPARADA: {message}")
+            socketio.emit('new_alert', {'message': message, 'type': alert.type})
+    except Exception as e:
+        logger.error(f"❌ Error al comprobar alertas para {device_id}@{location}: {e}")
 
 def add_message_to_history(topic, payload, force=False, direction='in'):
     """
@@ -76,14 +51,11 @@ def add_message_to_history(topic, payload, force=False, direction='in'):
     direction: 'in' (recibido) o 'out' (enviado).
     """
     
-    is_system_msg = topic in ['SISTEMA', 'ERROR'] or not topic_matches(topic, '#/#')
+    is_system_msg = topic in ['SISTEMA', 'ERROR']
     is_subscribed = False
     
     if not is_system_msg and not force:
-        for sub in subscribed_topics:
-            if topic_matches(topic, sub):
-                is_subscribed = True
-                break
+        is_subscribed = subscription_trie.has_match(topic)
     
     if is_system_msg or is_subscribed or force:
         timestamp = datetime.now().strftime('%H:%M:%S')
@@ -94,78 +66,124 @@ def add_message_to_history(topic, payload, force=False, direction='in'):
             'direction': direction
         }
         
-        message_history.insert(0, message_data)
-        
-        while len(message_history) > MAX_MESSAGES:
-            message_history.pop()
-        
-        socketio.emit('history_update', {'history': message_history})
+        message_history.append(message_data)
+        broadcaster.append('history_append', message_data)
+
+def mark_devices_offline(conn, device_keys, max_missed_pings):
+    """Pasa a offline los dispositivos cuyo plazo de vida ha vencido.
 
-def auto_refresh_loop():
-    """Bucle que envía pings periódicamente y gestiona la tolerancia a fallos."""
-    from src.globals import config, devices, app
-    logger.info("🔄 Bucle de auto-refresco iniciado.")
+    Solo se emiten los dispositivos que cambian de estado y sus eventos se
+    guardan en una única transacción.
+    """
+    events = []
+    with devices_lock:
+        for device_key in device_keys:
+            device = conn.devices.get(device_key)
+            if device is None or device.get('status') == 'offline':
+                continue
+            device['status'] = 'offline'
+            device['missed_pings'] = max_missed_pings + 1
+            device_stats.record_status(conn.server_name, device_key, 'offline')
+            conn.publisher.mark(device_key, ('status', 'missed_pings'))
+            device_id, location = device_key.split('@', 1)
+            events.append((device_id, location, 'disconnected', f'Sin respuesta tras {max_missed_pings} intentos'))
+    for device_id, location, _, _ in events:
+        logger.info(f"🔌 Dispositivo '{device_id}@{location}' marcado como offline (sin respuesta).")
+    add_device_events(events)
+    return len(events)
+
+def auto_refresh_loop(conn):
+    """Bucle que envía pings periódicamente y gestiona la tolerancia a fallos de una conexión.
+
+    La detección de offline no recorre la flota: conn.liveness guarda el
+    plazo de cada dispositivo (último PONG/estado + refresh_interval *
+    (max_missed_pings + 1)) y el bucle se despierta en el siguiente PING o
+    en el siguiente plazo, lo que llegue antes. Los PING los planifica
+    conn.pinger: uno a iot/ping/all por ciclo o, con ping_mode='staggered',
+    uno por dispositivo repartidos a lo largo del intervalo.
+    """
+    from src.globals import config
+    logger.info(f"🔄 Bucle de auto-refresco iniciado ({conn.server_name}).")
     
     socketio.sleep(5)
 
-    while mqtt_state['connected']:
+    # Dispositivos online sin plazo (p. ej. vistos antes de ser líder): se vigilan desde ahora
+    now = time.time()
+    conn.liveness.timeout = liveness_timeout(config.get('settings', {}))
+    for device_key, device in list(conn.devices.items()):
+        if device.get('status') == 'online' and device_key not in conn.liveness:
+            conn.liveness.touch(device_key, now)
+
+    next_ping = now
+    staggered = False
+    # Con varios workers solo el líder envía PINGs y marca dispositivos offline
+    while conn.state['connected'] and cluster.is_leader():
+        settings = config.get('settings', {})
         try:
-            interval_str = config.get('settings', {}).get('refresh_interval', '30')
-            interval = int(interval_str)
-            
-            max_missed_pings_str = config.get('settings', {}).get('max_missed_pings', '2')
-            max_missed_pings = int(max_missed_pings_str)
-
+            interval = int(settings.get('refresh_interval', '30'))
+            max_missed_pings = int(settings.get('max_missed_pings', '2'))
         except (ValueError, TypeError):
             interval = 30
             max_missed_pings = 2
+        conn.liveness.timeout = liveness_timeout(settings)
         
-        client = mqtt_state.get('client')
-        if client and client.is_connected():
-            logger.info(f"🔄 Auto-refresco: Verificando dispositivos y enviando PING. Próximo ciclo en {interval}s.")
-            
-            if devices:
-                for device_key in list(devices.keys()):
-                    if device_key not in devices:
-                        continue
-                    missed = devices[device_key].get('missed_pings', 0) + 1
-                    devices[device_key]['missed_pings'] = missed
-                    
-                    if missed > max_missed_pings:
-                        if devices[device_key].get('status') != 'offline':
-                            logger.info(f"🔌 Dispositivo '{device_key}' marcado como offline (sin respuesta).")
-                            devices[device_key]['status'] = 'offline'
-                            device_id, location = device_key.split('@')
-                            # AGREGAR: Contexto de aplicación para operaciones DB
-                            with app.app_context():
-                                try:
-                                    add_device_event(device_id, location, 'disconnected', f'Sin respuesta tras {max_missed_pings} intentos')
-                                except Exception as e:
-                                    logger.error(f'❌ Error registrando evento de dispositivo: {e}')
-
-                socketio.emit('devices_update', {'devices': devices})
-            
-            ping_command = json.dumps({"cmd": "PING", "time": int(time.time())})
-            mqtt_qos = int(config['settings'].get('mqtt_default_qos', 1))
-            client.publish(DEVICE_PING_TOPIC, ping_command, qos=mqtt_qos)
-            
-            socketio.sleep(interval)
-        else:
-            logger.warning("🔄 Auto-refresco: Cliente no conectado. Deteniendo bucle.")
+        client = conn.client
+        if not (client and client.is_connected()):
+            logger.warning(f"🔄 Auto-refresco ({conn.server_name}): Cliente no conectado. Deteniendo bucle.")
             break
+
+        now = time.time()
+        expired = conn.liveness.expire(now)
+        if expired:
+            mark_devices_offline(conn, expired, max_missed_pings)
+
+        pinger = conn.pinger
+        pinger.configure(settings)
+        if pinger.staggered and not staggered:
+            for device_key in list(conn.devices):
+                pinger.track(device_key, now)
+        staggered = pinger.staggered
+        mqtt_qos = int(settings.get('mqtt_default_qos', 1))
+
+        if staggered:
+            due = pinger.due(now)
+            if due:
+                ping_command = json.dumps({"cmd": "PING", "time": int(now)})
+                for device_key in due:
+                    device_id, location = device_key.split('@', 1)
+                    client.publish(f"{DEVICE_PING_TOPIC_PREFIX}/{device_id}/{location}", ping_command, qos=mqtt_qos)
+                    device_stats.record_ping(conn.server_name, device_key)
+                logger.debug(f"🔄 Auto-refresco ({conn.server_name}): PING a {len(due)} de {len(pinger)} dispositivos.")
+            next_ping = pinger.next_due() or now + interval
+        elif now >= next_ping:
+            logger.info(f"🔄 Auto-refresco ({conn.server_name}): Enviando PING ({len(conn.liveness)} dispositivos vigilados). Próximo ciclo en {interval}s.")
+            ping_command = json.dumps({"cmd": "PING", "time": int(now)})
+            client.publish(DEVICE_PING_TOPIC, ping_command, qos=mqtt_qos)
+            pinger.broadcast_sent(now)
+            device_stats.record_broadcast(conn.server_name)
+            next_ping = now + interval
+
+        wake_at = next_ping
+        deadline = conn.liveness.next_deadline()
+        if deadline is not None:
+            wake_at = min(wake_at, deadline)
+        socketio.sleep(max(LIVENESS_RESOLUTION, wake_at - time.time()))
     
-    mqtt_state['background_task_started'] = False
-    logger.info("🔄 Bucle de auto-refresco detenido.")
+    conn.state['background_task_started'] = False
+    logger.info(f"🔄 Bucle de auto-refresco detenido ({conn.server_name}).")
 
 def on_connect(client, userdata, flags, reason_code, properties=None):
     """Callback para cuando el cliente se conecta al broker MQTT."""
     server_name = userdata.get('server_name', 'N/A')
+    conn = connection_manager.get(server_name)
+    if conn is None:
+        # Servidor eliminado mientras el cliente seguía vivo
+        return
 
     if reason_code.value == 0:
-        mqtt_state['connected'] = True
-        mqtt_state['auto_reconnect'] = True
-        mqtt_state['user_disconnected'] = False
-        socketio.emit('mqtt_reconnecting', {'reconnecting': False})
+        conn.state['connected'] = True
+        conn.state['auto_reconnect'] = True
+        conn.state['user_disconnected'] = False
         
         active_server_id = None
         from src.globals import config
@@ -177,108 +195,187 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
 
         # Cargar suscripciones del servidor desde BD
         with app.app_context():
-            subscribed_topics.clear()
-            subscribed_topics.extend(load_subscriptions(server_name))
-
-        # Enviar mqtt_status CON las suscripciones del servidor
-        socketio.emit('mqtt_status', {
-            'connected': True,
-            'active_server_id': active_server_id,
-            'topics': list(subscribed_topics)
-        })
+            conn.topics[:] = load_subscriptions(server_name)
+            conn.trie.rebuild(conn.topics)
+            load_device_registry(server_name)
+            device_stats.load_server(server_name)
+
+        if conn.active:
+            socketio.emit('mqtt_reconnecting', {'reconnecting': False})
+            # Enviar mqtt_status CON las suscripciones del servidor
+            socketio.emit('mqtt_status', {
+                'connected': True,
+                'active_server_id': active_server_id,
+                'topics': list(conn.topics)
+            })
 
         logger.info(f"✅ Conectado al broker MQTT: {server_name}")
         add_message_to_history('SISTEMA', f'✅ Conectado a {server_name}')
         
-        client.subscribe(DEVICE_STATUS_TOPIC)
-        client.subscribe(DEVICE_PONG_TOPIC)
-        client.subscribe(DEVICE_CONFIG_TOPIC)
+        client.subscribe(share_topic(DEVICE_STATUS_TOPIC))
+        client.subscribe(share_topic(DEVICE_PONG_TOPIC))
+        client.subscribe(share_topic(DEVICE_CONFIG_TOPIC))
         
         with app.app_context():
-            subscribed_topics.clear()
-            subscribed_topics.extend(load_subscriptions(server_name))
-            for topic in subscribed_topics:
-                client.subscribe(topic)
-            socketio.emit('topics_update', {'topics': subscribed_topics})
+            for topic in conn.topics:
+                client.subscribe(share_topic(topic))
             
-            load_tasks(server_name)
-            socketio.emit('task_update', {'tasks': get_tasks_info_from_globals()})
-
-            load_message_triggers(server_name)
-            from src.globals import message_triggers
-            socketio.emit('message_triggers_update', {'triggers': list(message_triggers.values())})
+            load_tasks(server_name, conn.tasks)
+            load_message_triggers(server_name, conn.triggers, conn.trigger_engine)
 
-            alerts.clear()
-            alerts.extend(get_alerts(server_name))
-            socketio.emit('alerts_update', {'alerts': alerts})
+            conn.alerts[:] = get_alerts(server_name)
+            alert_engine.load(server_name, conn.alerts)
 
-        logger.info("📢 Solicitando estado inicial de dispositivos...")
-        mqtt_qos = int(config['settings'].get('mqtt_default_qos', 1))
-        client.publish(DEVICE_PING_TOPIC, json.dumps({"cmd": "PING", "time": int(time.time())}), qos=mqtt_qos)
-        client.publish(DEVICE_CMD_BROADCAST_TOPIC, json.dumps({"cmd": "STATUS"}), qos=mqtt_qos)
-        client.publish(DEVICE_CMD_BROADCAST_TOPIC, json.dumps({"cmd": "GET_CONFIG"}), qos=mqtt_qos)
+        if conn.active:
+            broadcaster.emit('topics_update', {'topics': conn.topics})
+            broadcaster.emit('task_update', {'tasks': get_tasks_info_from_globals()})
+            broadcaster.emit('message_triggers_update', {'triggers': list(conn.triggers.values())})
+            broadcaster.emit('alerts_update', {'alerts': conn.alerts})
 
-        if not mqtt_state.get('background_task_started'):
-            mqtt_state['background_task_started'] = True
-            socketio.start_background_task(target=auto_refresh_loop)
-
-        scheduler.resume()
-        logger.info("⏰ Scheduler reanudado.")
+        if cluster.is_leader():
+            start_leader_duties(conn)
     else:
-        mqtt_state['auto_reconnect'] = False
+        conn.state['auto_reconnect'] = False
         logger.info(f"⚠️ Desconectado del broker MQTT: {server_name}")
         add_message_to_history('SISTEMA', f'⚠️ Desconectado de {server_name}')
         # Limpiar suscripciones al desconectar
-        subscribed_topics.clear()
-        socketio.emit('mqtt_status', {'connected': False, 'active_server_id': None, 'topics': []})
+        conn.topics.clear()
+        conn.trie.clear()
+        if conn.active:
+            socketio.emit('mqtt_status', {'connected': False, 'active_server_id': None, 'topics': []})
+
+def start_leader_duties(conn):
+    """Pide el estado inicial de los dispositivos y arranca el auto-refresco y el scheduler.
+
+    En modo cluster solo lo hace el líder: con suscripciones compartidas los
+    demás workers mantienen su conexión solo para ingerir su parte de los mensajes.
+    """
+    client = conn.client
+    if client is None:
+        return
+    logger.info("📢 Solicitando estado inicial de dispositivos...")
+    mqtt_qos = int(config['settings'].get('mqtt_default_qos', 1))
+    now = time.time()
+    client.publish(DEVICE_PING_TOPIC, json.dumps({"cmd": "PING", "time": int(now)}), qos=mqtt_qos)
+    conn.pinger.broadcast_sent(now)
+    device_stats.record_broadcast(conn.server_name)
+    client.publish(DEVICE_CMD_BROADCAST_TOPIC, json.dumps({"cmd": "STATUS"}), qos=mqtt_qos)
+    client.publish(DEVICE_CMD_BROADCAST_TOPIC, json.dumps({"cmd": "GET_CONFIG"}), qos=mqtt_qos)
+
+    if not conn.state.get('background_task_started'):
+        conn.state['background_task_started'] = True
+        socketio.start_background_task(auto_refresh_loop, conn)
+
+    scheduler.resume()
+    logger.info("⏰ Scheduler reanudado.")
+
+def reload_server_state(conn):
+    """Vuelve a cargar de la BD el estado de un servidor conectado (tras restaurar un backup).
+
+    Sustituye suscripciones, caché de dispositivos, tareas, triggers y
+    alertas, y ajusta las suscripciones del cliente a la diferencia de
+    topics. Requiere app_context.
+    """
+    server_name = conn.server_name
+    previous = set(conn.topics)
+    conn.topics[:] = load_subscriptions(server_name)
+    conn.trie.rebuild(conn.topics)
+    load_device_registry(server_name)
+    load_tasks(server_name, conn.tasks)
+    load_message_triggers(server_name, conn.triggers, conn.trigger_engine)
+    conn.alerts[:] = get_alerts(server_name)
+    alert_engine.load(server_name, conn.alerts)
+
+    client = conn.client
+    if client is not None:
+        for topic in previous - set(conn.topics):
+            client.unsubscribe(share_topic(topic))
+        for topic in set(conn.topics) - previous:
+            client.subscribe(share_topic(topic))
 
 def on_disconnect(client, userdata, flags, reason_code, properties=None):
     """Callback para cuando el cliente se desconecta del broker MQTT."""
     server_name = userdata.get('server_name', 'N/A')
+    conn = connection_manager.get(server_name)
+    if conn is None:
+        # Servidor eliminado mientras el cliente seguía vivo
+        return
     
-    mqtt_state['connected'] = False
+    conn.state['connected'] = False
     
-    is_auto_reconnect = mqtt_state.get('auto_reconnect', False)
-    is_manual_disconnect = mqtt_state.get('user_disconnected', False)
+    is_auto_reconnect = conn.state.get('auto_reconnect', False)
+    is_manual_disconnect = conn.state.get('user_disconnected', False)
     
     if is_auto_reconnect and not is_manual_disconnect:
-        socketio.emit('mqtt_reconnecting', {'reconnecting': True})
+        if conn.active:
+            socketio.emit('mqtt_reconnecting', {'reconnecting': True})
         logger.info(f"🔄 Reconectando al broker MQTT: {server_name}...")
         add_message_to_history('SISTEMA', f'🔄 Reconectando a {server_name}...')
     else:
-        mqtt_state['auto_reconnect'] = False
+        conn.state['auto_reconnect'] = False
         logger.info(f"⚠️ Desconectado del broker MQTT: {server_name}")
         add_message_to_history('SISTEMA', f'⚠️ Desconectado de {server_name}')
-        socketio.emit('mqtt_status', {'connected': False, 'active_server_id': None, 'topics': []})
+        if conn.active:
+            socketio.emit('mqtt_status', {'connected': False, 'active_server_id': None, 'topics': []})
     
-    scheduler.pause()
-    logger.info("⏰ Scheduler pausado.")
-    scheduler.remove_all_jobs()
+    # Solo se retiran los jobs de este servidor; el scheduler se pausa si no queda ninguno conectado
+    for task_id in list(conn.tasks):
+        if scheduler.get_job(task_id):
+            scheduler.remove_job(task_id)
+    if not connection_manager.any_connected():
+        scheduler.pause()
+        logger.info("⏰ Scheduler pausado.")
     
-    scheduled_tasks.clear()
-    subscribed_topics.clear()
-    alerts.clear()
+    conn.tasks.clear()
+    conn.topics.clear()
+    conn.trie.clear()
+    conn.alerts.clear()
+    conn.liveness.clear()
+    conn.pinger.clear()
     
     with devices_lock:
-        for device_key in list(devices.keys()):
-            if device_key in devices:
-                devices[device_key]['status'] = 'offline'
-                devices[device_key]['missed_pings'] = 0
+        for device_key in list(conn.devices.keys()):
+            if device_key in conn.devices:
+                conn.devices[device_key]['status'] = 'offline'
+                conn.devices[device_key]['missed_pings'] = 0
+                device_stats.record_status(server_name, device_key, 'offline')
+    conn.publisher.mark_all(('status',))
     
-    socketio.emit('task_update', {'tasks': []})
-    socketio.emit('topics_update', {'topics': []})
-    socketio.emit('devices_update', {'devices': devices})
-    socketio.emit('alerts_update', {'alerts': []})
+    if conn.active:
+        broadcaster.emit('task_update', {'tasks': []})
+        broadcaster.emit('topics_update', {'topics': []})
+        broadcaster.emit('alerts_update', {'alerts': []})
 
 def on_message(client, userdata, msg):
-    """Callback para cuando se recibe un mensaje MQTT."""
-    global devices
-    payload_str = msg.payload.decode('utf-8')
-    timestamp = datetime.now().strftime('%H:%M:%S')
+    """Callback de paho: solo encola el mensaje en el pipeline de ingesta.
+
+    Si el pipeline no está en marcha (scripts, tests) se procesa en el acto.
+    """
     server_name = userdata.get('server_name', 'N/A')
+    if ingest_pipeline.running:
+        ingest_pipeline.submit(msg.topic, msg.payload, server_name)
+    else:
+        process_message(msg.topic, msg.payload, server_name)
+
+
+def process_message(topic, payload, server_name, received_at=None, clock=NULL_CLOCK):
+    """Procesa un mensaje MQTT: parseo, registro, persistencia, alertas y difusión.
+
+    clock.lap(etapa) acumula el tiempo de cada etapa en los histogramas del pipeline.
+    El estado que se actualiza es el de la conexión del servidor (server_name);
+    solo la conexión visible emite cambios a la UI y escribe en el historial.
+    """
+    conn = connection_manager.get(server_name)
+    if conn is None:
+        logger.debug(f"Mensaje de un servidor no registrado ('{server_name}') descartado: {topic}")
+        return
+    devices = conn.devices
+    publisher = conn.publisher
+    payload_str = payload.decode('utf-8') if isinstance(payload, bytes) else payload
+    timestamp = datetime.fromtimestamp(received_at or time.time()).strftime('%H:%M:%S')
     
     try:
-        topic_parts = msg.topic.split('/')
+        topic_parts = topic.split('/')
 
         # Determinar si es un mensaje de dispositivo y extraer device_id/location
         device_id, location = None, None
@@ -294,10 +391,15 @@ def on_message(client, userdata, msg):
             device_id, location = topic_parts[2], topic_parts[3]
             message_type = 'config'
 
+        clock.lap('parse')
+
         # Si no es un mensaje de dispositivo conocido, procesar como mensaje genérico
         if device_id is None or location is None:
-            add_message_to_history(msg.topic, payload_str, direction='in')
-            check_message_triggers(msg.topic, payload_str)
+            if conn.active:
+                add_message_to_history(topic, payload_str, direction='in')
+            clock.lap('broadcast')
+            check_message_triggers(topic, payload_str, conn)
+            clock.lap('alerts')
             return
 
 
@@ -306,28 +408,38 @@ def on_message(client, userdata, msg):
             _, created = get_or_create_device(device_id, device_id, location, server_name)
             if created:
                 # Si es nuevo, notificar al frontend para que actualice los comboboxes
-                socketio.emit('known_devices_update', {'known_devices': get_all_known_devices(server_name)})
+                if conn.active:
+                    broadcaster.emit('known_devices_update', {'known_devices': get_all_known_devices(server_name)})
 
             # Ahora, comprobar si está permitido para continuar
             if not is_device_allowed(server_name, device_id, location):
                 logger.debug(f"🚫 Dispositivo '{device_id}@{location}' bloqueado por whitelist. Registrado pero no mostrado.")
                 return
+        clock.lap('registry')
 
         device_key = f"{device_id}@{location}"
+        conn.seen_at[device_key] = received_at or time.time()
 
-        is_subscribed = any(topic_matches(msg.topic, sub) for sub in subscribed_topics)
+        is_subscribed = conn.active and conn.trie.has_match(topic)
         if is_subscribed:
             history_title = device_key
-            history_payload = f"Topic: {msg.topic}\n{payload_str}"
+            history_payload = f"Topic: {topic}\n{payload_str}"
             add_message_to_history(history_title, history_payload, force=True, direction='in')
+        clock.lap('broadcast')
 
         # Procesar según el tipo de mensaje
         if message_type == 'pong':
             data = json.loads(payload_str)
+            clock.lap('parse')
 
             if data.get("cmd") == "PONG":
                 ping_time = data.get("time", 0)
-                latency = (time.time() - ping_time) * 1000 if ping_time > 0 else -1
+                pong_at = received_at or time.time()
+                # Con la hora exacta del envío; si no se encuentra, con el 'time' (segundos) del PONG
+                latency = conn.pinger.on_pong(device_key, ping_time, pong_at)
+                if latency is None:
+                    latency = (pong_at - ping_time) * 1000 if ping_time > 0 else -1
+                device_stats.record_pong(server_name, device_key, latency, pong_at)
                 
                 was_offline = False
                 if device_key in devices and devices[device_key].get('status') == 'offline':
@@ -339,7 +451,9 @@ def on_message(client, userdata, msg):
                     display_name, was_created = get_or_create_device(device_id, device_id, location, server_name)
                     if was_created:
                         known_devices = get_all_known_devices(server_name)
-                        socketio.emit('known_devices_update', {'known_devices': known_devices})
+                        if conn.active:
+                            broadcaster.emit('known_devices_update', {'known_devices': known_devices})
+                clock.lap('registry')
                 
                 if device_key not in devices:
                     update_data['id'] = device_id
@@ -347,15 +461,22 @@ def on_message(client, userdata, msg):
                 elif devices[device_key].get('name') != display_name:
                     update_data['name'] = display_name
                 
+                is_new_device = device_key not in devices
                 devices.setdefault(device_key, {}).update(update_data)
-                socketio.emit('devices_update', {'devices': devices})
+                conn.liveness.touch(device_key, received_at, conn.pinger.backoff(device_key))
+                if conn.pinger.staggered:
+                    conn.pinger.track(device_key, pong_at)
+                publisher.mark(device_key, None if is_new_device else update_data.keys())
+                clock.lap('broadcast')
                 
                 if was_offline:
                     add_device_event(device_id, location, 'connected', f'Latencia: {latency:.2f}ms')
+                    clock.lap('persistence')
         
         elif topic_parts[0:2] == ['iot', 'config']:
             try:
                 data = json.loads(payload_str)
+                clock.lap('parse')
 
                 with app.app_context():
                     device_key = f"{data.get('device_id', device_id)}@{data.get('location', location)}"
@@ -400,40 +521,50 @@ def on_message(client, userdata, msg):
 
                     logger.info(f"Config actualizada para {device_key}: firmware={data.get('firmware')}, mac={data.get('mac')}, heap={data.get('heap')}")
 
-                    socketio.emit('devices_update', {'devices': devices})
-                    socketio.emit('device_config_update', {
-                        'device_id': data.get('device_id', device_id),
-                        'location': data.get('location', location),
-                        'config': {
-                            'firmware': data.get('firmware', 'Unknown'),
-                            'mac': data.get('mac', 'N/A'),
-                            'heap': data.get('heap', 0),
-                            'chip_id': data.get('chip_id', 'N/A'),
-                            'sensor': data.get('sensor', {}),
-                            'ip': data.get('ip', 'N/A'),
-                            'uptime': data.get('uptime', 0)
-                        }
-                    })
+                    publisher.mark(device_key)
+                    if conn.active:
+                        socketio.emit('device_config_update', {
+                            'device_id': data.get('device_id', device_id),
+                            'location': data.get('location', location),
+                            'config': {
+                                'firmware': data.get('firmware', 'Unknown'),
+                                'mac': data.get('mac', 'N/A'),
+                                'heap': data.get('heap', 0),
+                                'chip_id': data.get('chip_id', 'N/A'),
+                                'sensor': data.get('sensor', {}),
+                                'ip': data.get('ip', 'N/A'),
+                                'uptime': data.get('uptime', 0)
+                            }
+                        })
                 
             except json.JSONDecodeError as e:
                 logger.error(f"❌ Error parsing config payload: {e}")
-                add_message_to_history('ERROR', f'Error parseando config de {msg.topic}: {e}', direction='in')
+                add_message_to_history('ERROR', f'Error parseando config de {topic}: {e}', direction='in')
         elif message_type == 'status':
             data = json.loads(payload_str)
+            clock.lap('parse')
 
             if data.get('status') == 'offline':
                 logger.info(f"🔌 Dispositivo '{device_key}' reportó offline.")
+                is_new_device = device_key not in devices
                 devices.setdefault(device_key, {'id': device_id, 'name': device_id, 'location': location}).update({'status': 'offline', 'last_seen': timestamp, 'missed_pings': 0})
-                socketio.emit('devices_update', {'devices': devices})
+                conn.liveness.forget(device_key)
+                device_stats.record_status(server_name, device_key, 'offline', received_at)
+                publisher.mark(device_key, None if is_new_device else ('status', 'last_seen'))
+                clock.lap('broadcast')
                 add_device_event(device_id, location, 'offline', 'Reporte de estado offline')
+                clock.lap('persistence')
                 check_alerts(device_id, location, {'status': 'offline'}, server_name)
+                clock.lap('alerts')
                 return
 
             with app.app_context():
                 display_name, was_created = get_or_create_device(device_id, data.get('device', device_id), location, server_name)
                 if was_created:
                     known_devices = get_all_known_devices(server_name)
-                    socketio.emit('known_devices_update', {'known_devices': known_devices})
+                    if conn.active:
+                        broadcaster.emit('known_devices_update', {'known_devices': known_devices})
+            clock.lap('registry')
 
             device_info = {
                 'id': device_id,
@@ -455,13 +586,20 @@ def on_message(client, userdata, msg):
             if 'temp_st' in data: device_info['temp_st'], has_sensor_data = data['temp_st'], True
 
             devices.setdefault(device_key, {}).update(device_info)
-            socketio.emit('devices_update', {'devices': devices})
+            conn.liveness.touch(device_key, received_at, conn.pinger.backoff(device_key))
+            if conn.pinger.staggered:
+                conn.pinger.track(device_key, received_at or time.time())
+            device_stats.record_status(server_name, device_key, 'online', received_at)
+            publisher.mark(device_key)
+            clock.lap('broadcast')
 
             if has_sensor_data:
                 with app.app_context():
                     insert_sensor_data(device_id, location, data)
+                clock.lap('persistence')
             
             check_alerts(device_id, location, device_info, server_name)
+            clock.lap('alerts')
 
         elif message_type == 'config':
             try:
@@ -495,53 +633,61 @@ def on_message(client, userdata, msg):
                     # Si es un string (tipo de sensor), convertir a objeto
                     sensor_info = {'type': str(sensor_info)}
 
-                socketio.emit('device_config_update', {
-                    'device_id': device_id,
-                    'location': location,
-                    'config': {
-                        'firmware': data.get('firmware', 'Unknown'),
-                        'mac': data.get('mac', 'N/A'),
-                        'heap': data.get('heap', 0),
-                        'chip_id': data.get('chip_id', 'N/A'),
-                        'sensor': sensor_info
-                    }
-                })
+                if conn.active:
+                    socketio.emit('device_config_update', {
+                        'device_id': device_id,
+                        'location': location,
+                        'config': {
+                            'firmware': data.get('firmware', 'Unknown'),
+                            'mac': data.get('mac', 'N/A'),
+                            'heap': data.get('heap', 0),
+                            'chip_id': data.get('chip_id', 'N/A'),
+                            'sensor': sensor_info
+                        }
+                    })
 
             except json.JSONDecodeError as e:
                 logger.error(f"❌ Error parsing config de {device_id}@{location}: {e}")
 
     except (json.JSONDecodeError, IndexError) as e:
-        logger.warning(f"Could not process message payload: {msg.topic} | {payload_str} | Error: {e}")
+        logger.warning(f"Could not process message payload: {topic} | {payload_str} | Error: {e}")
+
+
+ingest_pipeline.handler = process_message
 
 
-def check_message_triggers(topic, payload_str):
-    """Check if a message matches any message triggers and execute actions."""
-    from src.globals import message_triggers, mqtt_state, devices_lock
+def check_message_triggers(topic, payload_str, conn=None):
+    """Check if a message matches any message triggers and execute actions.
+
+    conn: BrokerConnection whose triggers apply (defaults to the active view).
+    """
+    if conn is None:
+        conn = connection_manager.active()
+    message_triggers = conn.triggers
 
     if not message_triggers:
         return
 
     try:
+        matched = conn.trigger_engine.match(topic)
+        if not matched:
+            return
+
         # Try to parse payload as JSON
         try:
             payload_data = json.loads(payload_str)
         except:
             payload_data = payload_str
 
-        for trigger_id, trigger in message_triggers.items():
-            if not trigger.get('enabled', True):
+        for compiled in matched:
+            trigger_id = compiled.trigger_id
+            trigger = message_triggers.get(trigger_id)
+            if not trigger or not trigger.get('enabled', True):
                 continue
 
-            # Check if topic matches pattern
-            if not _topic_matches(topic, trigger['topic_pattern']):
+            if not compiled.condition(payload_data):
                 continue
 
-            # Evaluate condition if exists
-            condition = trigger.get('trigger_condition')
-            if condition:
-                if not _evaluate_trigger_condition(condition, payload_data):
-                    continue
-
             # Condition met - execute action
             logger.info(f"Message trigger activated: {trigger['name']} (topic: {topic})")
 
@@ -558,7 +704,7 @@ def check_message_triggers(topic, payload_str):
                 if action_topic and action_payload:
                     from src.task_utils import process_placeholders
                     processed_payload = process_placeholders(action_payload)
-                    client = mqtt_state.get('client')
+                    client = conn.client
                     if client and client.is_connected():
                         mqtt_qos = int(config['settings'].get('mqtt_default_qos', 1))
                         client.publish(action_topic, processed_payload, qos=mqtt_qos)
@@ -586,80 +732,6 @@ def check_message_triggers(topic, payload_str):
         logger.error(f"Error checking message triggers: {e}")
 
 
-def _topic_matches(topic, pattern):
-    """Check if a topic matches a pattern (supports + and # wildcards)."""
-    topic_parts = topic.split('/')
-    pattern_parts = pattern.split('/')
-
-    if len(topic_parts) != len(pattern_parts):
-        return False
-
-    for t, p in zip(topic_parts, pattern_parts):
-        if p == '#':
-            return True
-        if p == '+':
-            continue
-        if t != p:
-            return False
-
-    return True
-
-
-def _evaluate_trigger_condition(condition, payload_data):
-    """Evaluate a trigger condition against payload data."""
-    if not condition:
-        return True
-
-    # Simple comparison: "field > value"
-    match = re.match(r'(\w+)\s*(==|!=|<|>|<=|>=)\s*(.+)', condition)
-    if match:
-        field, op, value = match.groups()
-
-        # Get field value from payload
-        field_value = payload_data
-        for key in field.split('.'):
-            if isinstance(field_value, dict):
-                field_value = field_value.get(key)
-            else:
-                return False
-
-        # Parse comparison value
-        if value.startswith("'") and value.endswith("'"):
-            value = value[1:-1]
-        else:
-            try:
-                value = float(value)
-            except ValueError:
-                pass
-
-        # Evaluate
-        try:
-            if op == '==':
-                return field_value == value
-            elif op == '!=':
-                return field_value != value
-            elif op == '>':
-                return float(field_value) > float(value)
-            elif op == '<':
-                return float(field_value) < float(value)
-            elif op == '>=':
-                return float(field_value) >= float(value)
-            elif op == '<=':
-                return float(field_value) <= float(value)
-        except (ValueError, TypeError):
-            return False
-
-    # Try simple eval as fallback
-    try:
-        local_vars = {}
-        if isinstance(payload_data, dict):
-            local_vars.update(payload_data)
-        result = eval(condition, {"__builtins__": {}}, local_vars)
-        return bool(result)
-    except:
-        return False
-
-
 def get_tasks_info_from_globals():
     """Función auxiliar para evitar importación circular en on_connect."""
     result = []
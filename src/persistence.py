@@ -1,14 +1,28 @@
 import logging
 from datetime import datetime, timedelta, timezone
 import hashlib
+import calendar
+from itertools import chain
+
+from sqlalchemy import select, func, cast, Integer
 
 from src.globals import (
     db, config, global_state, app,
-    scheduled_tasks, scheduler, devices, devices_lock # Importar devices y lock
+    scheduled_tasks, scheduler, devices, devices_lock, # Importar devices y lock
+    device_registry
 )
 from src.models import Server, Task, Subscription, Setting, SensorData, Alert, Device, Whitelist, DeviceEvent, Group, DeviceLog, MessageTrigger
 from src.database import serialize_schedule_data, deserialize_schedule_data
 from src.task_utils import _create_task_trigger, execute_scheduled_task
+from src.device_state import device_state
+from src.downsampling import MAX_POINTS, parse_resolution, bucket_seconds_for_range, lttb
+from src import rollups
+from src.alert_engine import alert_engine
+from src.trigger_engine import trigger_engine
+from src.device_stats import device_stats
+from src.state_snapshot import state_snapshot
+from src.sensor_archive import sensor_archive
+from src.retention import retention
 
 logger = logging.getLogger(__name__)
 
@@ -72,7 +86,34 @@ def load_config():
             'mqtt_keepalive': '60',
             'mqtt_reconnect_delay': '5',
             'mqtt_default_qos': '1',
-            'mqtt_clean_session': 'true'
+            'mqtt_clean_session': 'true',
+            'mqtt_shared_group': '',
+            'ping_mode': 'broadcast',
+            'ping_max_backoff': '4',
+            'ping_stable_after': '3',
+            'device_stats_snapshot_s': '300',
+            'sensor_write_batch_size': '500',
+            'sensor_write_flush_ms': '1000',
+            'sensor_write_max_pending': '50000',
+            'devices_patch_window_ms': '250',
+            'broadcast_rate_hz': '10',
+            'message_history_capacity': '100',
+            'ingest_queue_size': '10000',
+            'ingest_workers': '4',
+            'ingest_overflow_policy': 'drop-oldest',
+            'ingest_sample_every': '10',
+            'ingest_block_timeout_ms': '1000',
+            'rollup_retention_1m_days': '7',
+            'rollup_retention_1h_days': '90',
+            'rollup_retention_1d_days': '730',
+            'sensor_archive_enabled': 'true',
+            'retention_sensor_data_days': '30',
+            'retention_device_events_days': '30',
+            'retention_device_logs_days': '30',
+            'retention_interval_hours': '24',
+            'retention_batch_size': '2000',
+            'retention_pause_ms': '50',
+            'retention_vacuum_pages': '2000'
         }
         for key, default_value in defaults.items():
             if key not in settings_data:
@@ -80,8 +121,13 @@ def load_config():
         
         config['servers'] = servers_data
         config['settings'] = settings_data
+
+        from src.globals import message_history, MAX_MESSAGES
+        message_history.configure_from_settings(settings_data, MAX_MESSAGES)
         
-        last_server = settings_data.get('last_selected_server')
+        # Con conexiones abiertas manda el servidor que se está mostrando
+        from src.connection_manager import connection_manager
+        last_server = connection_manager.active_name or settings_data.get('last_selected_server')
         
         if not last_server or last_server not in servers_data:
             last_server = next(iter(servers_data), None)
@@ -127,8 +173,11 @@ def update_server(server_id, server_data):
     try:
         server = Server.query.get(server_id)
         if server:
+            old_name = server.name
             server.name, server.broker, server.port, server.username, server.password = server_data['name'], server_data['broker'], server_data['port'], server_data['username'], server_data['password']
             db.session.commit()
+            if old_name != server.name:
+                device_registry.invalidate_server(old_name)
             logger.info(f"✅ Servidor ID {server_id} actualizado.")
             return True
         return False
@@ -142,8 +191,10 @@ def delete_server(server_id):
     try:
         server = Server.query.get(server_id)
         if server:
+            server_name = server.name
             db.session.delete(server)
             db.session.commit()
+            device_registry.invalidate_server(server_name)
             logger.info(f"🗑️ Servidor ID {server_id} eliminado.")
             return True
         return False
@@ -153,11 +204,19 @@ def delete_server(server_id):
         return False
 
 # --- Tasks ---
-def load_tasks(server_name):
-    """Carga las tareas del servidor especificado desde la base de datos."""
-    global scheduled_tasks
-    scheduler.remove_all_jobs()
-    scheduled_tasks.clear()
+def load_tasks(server_name, tasks=None):
+    """Carga las tareas del servidor especificado desde la base de datos.
+
+    tasks: diccionario destino (por defecto scheduled_tasks, el del servidor
+    activo). Solo se sustituyen los jobs de ese diccionario; las tareas de
+    otros servidores conectados siguen programadas.
+    """
+    if tasks is None:
+        tasks = scheduled_tasks
+    for task_id in list(tasks):
+        if scheduler.get_job(task_id):
+            scheduler.remove_job(task_id)
+    tasks.clear()
     
     try:
         tasks_from_db = Task.query.filter_by(server_name=server_name).all()
@@ -169,8 +228,8 @@ def load_tasks(server_name):
             if trigger:
                 scheduler.add_job(execute_scheduled_task, trigger, args=[task.id, task_info['topic'], task_info['payload']], id=task.id, name=task_info['name'])
                 if not task_info.get('enabled', True): scheduler.pause_job(task.id)
-                scheduled_tasks[task.id] = task_info
-        logger.info(f"✅ {len(scheduled_tasks)} tarea(s) cargada(s) para '{server_name}'.")
+                tasks[task.id] = task_info
+        logger.info(f"✅ {len(tasks)} tarea(s) cargada(s) para '{server_name}'.")
     except Exception as e:
         logger.error(f"❌ Error al cargar tareas: {e}")
 
@@ -218,10 +277,16 @@ def update_task_execution(task_id, last_run, new_executions_count):
 
 
 # --- Message Triggers ---
-def load_message_triggers(server_name):
-    """Carga los MessageTriggers del servidor especificado desde la base de datos."""
+def load_message_triggers(server_name, triggers=None, engine=None):
+    """Carga los MessageTriggers del servidor especificado desde la base de datos.
+
+    triggers/engine: destino (por defecto message_triggers y trigger_engine,
+    los del servidor activo).
+    """
     from src.globals import message_triggers
-    message_triggers.clear()
+    if triggers is None:
+        triggers, engine = message_triggers, trigger_engine
+    triggers.clear()
 
     try:
         triggers_from_db = MessageTrigger.query.filter_by(server_name=server_name).all()
@@ -238,15 +303,17 @@ def load_message_triggers(server_name):
                 'trigger_count': trigger.trigger_count,
                 'last_triggered': trigger.last_triggered
             }
-            message_triggers[trigger.id] = trigger_info
-        logger.info(f"{len(message_triggers)} message trigger(s) loaded for '{server_name}'.")
+            triggers[trigger.id] = trigger_info
+        logger.info(f"{len(triggers)} message trigger(s) loaded for '{server_name}'.")
     except Exception as e:
         logger.error(f"Error loading message triggers: {e}")
+    (engine or trigger_engine).rebuild(triggers)
 
 
 def save_message_triggers(server_name):
     """Guarda todos los MessageTriggers en memoria para un servidor en la base de datos."""
     from src.globals import message_triggers
+    trigger_engine.rebuild(message_triggers)
 
     try:
         MessageTrigger.query.filter_by(server_name=server_name).delete()
@@ -379,78 +446,253 @@ def save_subscriptions(server_name, subscriptions):
 
 # --- Sensor Data ---
 def insert_sensor_data(device_id, location, data):
-    """Inserta una nueva lectura de sensor."""
+    """Inserta una nueva lectura de sensor.
+
+    Si el escritor por lotes está en marcha la lectura solo se encola; si no
+    (scripts, tests), se guarda directamente.
+    """
+    from src.sensor_writer import sensor_writer
+    if sensor_writer.running:
+        sensor_writer.enqueue(device_id, location, data)
+        return
     try:
-        new_data = SensorData(device_id=device_id, location=location, temp_c=data.get('temp_c'), temp_h=data.get('temp_h'), temp_st=data.get('temp_st'))
+        new_data = SensorData(device_id=device_id, location=location, timestamp=datetime.now(timezone.utc).replace(tzinfo=None), temp_c=data.get('temp_c'), temp_h=data.get('temp_h'), temp_st=data.get('temp_st'))
         db.session.add(new_data)
+        rollups.update_rollups([{
+            'device_id': device_id, 'location': location, 'timestamp': new_data.timestamp,
+            'temp_c': new_data.temp_c, 'temp_h': new_data.temp_h, 'temp_st': new_data.temp_st
+        }])
         db.session.commit()
         logger.debug(f"📊 Datos de sensor para '{device_id}' guardados.")
     except Exception as e:
         logger.error(f"❌ Error guardando datos de sensor: {e}")
         db.session.rollback()
 
-def get_sensor_data_for_device(device_id, location, start_date=None, end_date=None):
-    """Recupera datos de sensor para un dispositivo, con downsampling si es necesario."""
+def _sensor_data_range(start_date, end_date):
+    """Convierte las fechas 'YYYY-MM-DD' de la petición en (inicio, fin).
+
+    Sin fechas (o con formato inválido) devuelve las últimas 24h con fin None.
+    """
+    if start_date and end_date and str(start_date).strip() and str(end_date).strip():
+        try:
+            start_of_day = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0)
+            end_of_day = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+            logger.info(f"[SENSOR_DATA] Filtrando entre {start_of_day} y {end_of_day}")
+            return start_of_day, end_of_day
+        except ValueError:
+            logger.warning(f"[SENSOR_DATA] Formato de fecha inválido: start={start_date}, end={end_date}")
+    elif start_date and str(start_date).strip():
+        try:
+            start_of_day = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0)
+            end_of_day = start_of_day + timedelta(days=1, seconds=-1)
+            logger.info(f"[SENSOR_DATA] Filtrando desde {start_of_day} hasta {end_of_day}")
+            return start_of_day, end_of_day
+        except ValueError:
+            logger.warning(f"[SENSOR_DATA] Formato de fecha inválido: start={start_date}")
+    elif end_date and str(end_date).strip():
+        try:
+            end_of_day = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+            start_of_day = end_of_day - timedelta(days=1, seconds=-1)
+            logger.info(f"[SENSOR_DATA] Filtrando desde {start_of_day} hasta {end_of_day}")
+            return start_of_day, end_of_day
+        except ValueError:
+            logger.warning(f"[SENSOR_DATA] Formato de fecha inválido: end={end_date}")
+    else:
+        logger.info(f"[SENSOR_DATA] Sin filtro de fecha, mostrando ultimas 24h")
+
+    return datetime.now() - timedelta(hours=24), None
+
+
+SENSOR_METRICS = ('temp_c', 'temp_h', 'temp_st')
+SENSOR_STREAM_BATCH = 2000
+
+
+def _raw_sensor_rows(conditions):
+    """Itera las lecturas del rango como tuplas (sin objetos ORM), por lotes."""
+    stmt = (
+        select(SensorData.id, SensorData.timestamp, SensorData.temp_c, SensorData.temp_h, SensorData.temp_st)
+        .where(*conditions)
+        .order_by(SensorData.timestamp.asc())
+        .execution_options(yield_per=SENSOR_STREAM_BATCH)
+    )
+    return db.session.execute(stmt)
+
+
+def _bucketed_sensor_data(device_id, location, conditions, range_start, bucket_seconds):
+    """Agrupa en SQL por intervalos de bucket_seconds desde range_start: media, mínimo y máximo por métrica.
+
+    Cada bucket mantiene la forma de una lectura ('temp_c' es la media y
+    'timestamp' el inicio del bucket) y añade 'temp_c_min', 'temp_c_max', ... y 'count'.
+    """
+    origin = calendar.timegm(range_start.timetuple())
+    epoch = cast(func.strftime('%s', SensorData.timestamp), Integer)
+    bucket = ((epoch - origin) // bucket_seconds).label('bucket')
+    columns = [bucket, func.count().label('count')]
+    for metric in SENSOR_METRICS:
+        column = getattr(SensorData, metric)
+        columns += [
+            func.avg(column).label(metric),
+            func.min(column).label(f'{metric}_min'),
+            func.max(column).label(f'{metric}_max'),
+        ]
+    stmt = (
+        select(*columns)
+        .where(*conditions)
+        .group_by(bucket)
+        .order_by(bucket)
+        .execution_options(yield_per=SENSOR_STREAM_BATCH)
+    )
+
+    data = []
+    for row in db.session.execute(stmt):
+        point = {
+            'id': None,
+            'device_id': device_id,
+            'location': location,
+            'timestamp': format_timestamp_utc(range_start + timedelta(seconds=row.bucket * bucket_seconds)),
+            'count': row.count,
+        }
+        for metric in SENSOR_METRICS:
+            avg = getattr(row, metric)
+            point[metric] = round(avg, 2) if avg is not None else None
+            point[f'{metric}_min'] = getattr(row, f'{metric}_min')
+            point[f'{metric}_max'] = getattr(row, f'{metric}_max')
+        data.append(point)
+    return data
+
+
+def _bucket_rows(rows, device_id, location, range_start, bucket_seconds):
+    """Equivalente en Python de _bucketed_sensor_data para lecturas ya leídas (archivo)."""
+    origin = calendar.timegm(range_start.timetuple())
+    buckets = {}
+    for row in rows:
+        bucket = (calendar.timegm(row.timestamp.timetuple()) - origin) // bucket_seconds
+        agg = buckets.get(bucket)
+        if agg is None:
+            agg = buckets[bucket] = {'count': 0, **{m: [0.0, 0, None, None] for m in SENSOR_METRICS}}
+        agg['count'] += 1
+        for metric in SENSOR_METRICS:
+            value = getattr(row, metric)
+            if value is None:
+                continue
+            stat = agg[metric]
+            stat[0] += value
+            stat[1] += 1
+            stat[2] = value if stat[2] is None else min(stat[2], value)
+            stat[3] = value if stat[3] is None else max(stat[3], value)
+
+    data = []
+    for bucket in sorted(buckets):
+        agg = buckets[bucket]
+        point = {
+            'id': None,
+            'device_id': device_id,
+            'location': location,
+            'timestamp': format_timestamp_utc(range_start + timedelta(seconds=bucket * bucket_seconds)),
+            'count': agg['count'],
+        }
+        for metric in SENSOR_METRICS:
+            total, count, low, high = agg[metric]
+            point[metric] = round(total / count, 2) if count else None
+            point[f'{metric}_min'] = low
+            point[f'{metric}_max'] = high
+        data.append(point)
+    return data
+
+
+def _merge_buckets(older, newer):
+    """Une dos series de buckets ordenadas; el bucket del borde se combina ponderando por 'count'."""
+    if not older or not newer or older[-1]['timestamp'] != newer[0]['timestamp']:
+        return older + newer
+    a, b = older[-1], newer[0]
+    merged = dict(b, count=a['count'] + b['count'])
+    for metric in SENSOR_METRICS:
+        values = [(p[metric], p['count']) for p in (a, b) if p[metric] is not None]
+        merged[metric] = round(sum(v * c for v, c in values) / sum(c for _, c in values), 2) if values else None
+        lows = [p[f'{metric}_min'] for p in (a, b) if p[f'{metric}_min'] is not None]
+        highs = [p[f'{metric}_max'] for p in (a, b) if p[f'{metric}_max'] is not None]
+        merged[f'{metric}_min'] = min(lows) if lows else None
+        merged[f'{metric}_max'] = max(highs) if highs else None
+    return older[:-1] + [merged] + newer[1:]
+
+
+def get_sensor_data_for_device(device_id, location, start_date=None, end_date=None, resolution=None):
+    """Recupera datos de sensor para un dispositivo, con downsampling si es necesario.
+
+    resolution:
+      - None/'auto': lecturas originales si caben en MAX_POINTS; si no, buckets
+        de tiempo calculados en SQL para no superar MAX_POINTS.
+      - 'raw': todas las lecturas originales.
+      - 'lttb': MAX_POINTS lecturas originales elegidas con LTTB sobre temp_c.
+      - '1m', '5m', '15m', '1h', '6h', '1d' o segundos: buckets de ese tamaño
+        con media/mín/máx por métrica.
+
+    Los buckets de un minuto o más se calculan desde el rollup más grueso que
+    encaje (1d/1h/1m) y cuya retención cubra el rango, en lugar de desde
+    sensor_data.
+
+    Si el rango llega a lecturas ya movidas al archivo (cleanup_sensor_data)
+    se leen de sensor_archive y se unen a las de sensor_data.
+    """
     try:
-        logger.info(f"[SENSOR_DATA] get_device_id={device_id}, location={location}")
+        logger.info(f"[SENSOR_DATA] get_device_id={device_id}, location={location}, resolution={resolution}")
         logger.info(f"[SENSOR_DATA] start_date={start_date} (type: {type(start_date)}), end_date={end_date} (type: {type(end_date)})")
-        
-        query = SensorData.query.filter_by(device_id=device_id, location=location)
-
-        if start_date and end_date and str(start_date).strip() and str(end_date).strip():
-            try:
-                start_of_day = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0)
-                end_of_day = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-            except ValueError:
-                logger.warning(f"[SENSOR_DATA] Formato de fecha inválido: start={start_date}, end={end_date}")
-                since = datetime.now() - timedelta(hours=24)
-                query = query.filter(SensorData.timestamp >= since)
-            else:
-                logger.info(f"[SENSOR_DATA] Filtrando entre {start_of_day} y {end_of_day}")
-                query = query.filter(SensorData.timestamp.between(start_of_day, end_of_day))
-        elif start_date and str(start_date).strip():
-            try:
-                start_of_day = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0)
-                end_of_day = start_of_day + timedelta(days=1, seconds=-1)
-            except ValueError:
-                logger.warning(f"[SENSOR_DATA] Formato de fecha inválido: start={start_date}")
-                since = datetime.now() - timedelta(hours=24)
-                query = query.filter(SensorData.timestamp >= since)
-            else:
-                logger.info(f"[SENSOR_DATA] Filtrando desde {start_of_day} hasta {end_of_day}")
-                query = query.filter(SensorData.timestamp.between(start_of_day, end_of_day))
-        elif end_date and str(end_date).strip():
-            try:
-                end_of_day = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-                start_of_day = end_of_day - timedelta(days=1, seconds=-1)
-            except ValueError:
-                logger.warning(f"[SENSOR_DATA] Formato de fecha inválido: end={end_date}")
-                since = datetime.now() - timedelta(hours=24)
-                query = query.filter(SensorData.timestamp >= since)
-            else:
-                logger.info(f"[SENSOR_DATA] Filtrando desde {start_of_day} hasta {end_of_day}")
-                query = query.filter(SensorData.timestamp.between(start_of_day, end_of_day))
+
+        try:
+            mode = parse_resolution(resolution)
+        except ValueError as e:
+            logger.warning(f"[SENSOR_DATA] {e}, se usa 'auto'")
+            mode = 'auto'
+
+        range_start, range_end = _sensor_data_range(start_date, end_date)
+        # Lecturas antiguas movidas al archivo columnar (src/sensor_archive.py)
+        archived = sensor_archive.covers(device_id, location, range_start, range_end)
+        conditions = [SensorData.device_id == device_id, SensorData.location == location]
+        if range_end is None:
+            conditions.append(SensorData.timestamp >= range_start)
         else:
-            since = datetime.now() - timedelta(hours=24)
-            logger.info(f"[SENSOR_DATA] Sin filtro de fecha, mostrando ultimas 24h desde {since}")
-            query = query.filter(SensorData.timestamp >= since)
-
-        results = query.order_by(SensorData.timestamp.asc()).all()
-
-        MAX_POINTS = 1000
-        total_points = len(results)
-
-        if total_points > MAX_POINTS:
-            data = []
-            step = total_points / MAX_POINTS
-            for i in range(MAX_POINTS):
-                index = int(i * step)
-                row = results[index]
-                data.append({'id': row.id, 'device_id': row.device_id, 'location': row.location, 'timestamp': format_timestamp_utc(row.timestamp), 'temp_c': row.temp_c, 'temp_h': row.temp_h, 'temp_st': row.temp_st})
-            logger.info(f"Downsampling aplicado: {total_points} -> {len(data)} puntos.")
+            conditions.append(SensorData.timestamp.between(range_start, range_end))
+
+        if mode == 'auto':
+            total_points = rollups.count_readings(device_id, location, range_start, range_end)
+            if not total_points:
+                total_points = db.session.scalar(select(func.count()).select_from(SensorData).where(*conditions))
+                if archived:
+                    total_points += sensor_archive.count(device_id, location, range_start, range_end)
+            if total_points <= MAX_POINTS:
+                mode = 'raw'
+            else:
+                mode = bucket_seconds_for_range(range_start, range_end or datetime.now())
+                rollup = rollups.select_rollup(mode, range_start)
+                if rollup:
+                    # Múltiplo exacto del rollup para que cada punto combine buckets enteros
+                    mode = -(-mode // rollup[1]) * rollup[1]
+                logger.info(f"Downsampling en SQL: {total_points} lecturas en buckets de {mode}s.")
+
+        if mode in ('raw', 'lttb'):
+            rows = _raw_sensor_rows(conditions)
+            if archived:
+                # Todo lo archivado es anterior a lo que queda en sensor_data
+                rows = chain(sensor_archive.rows(device_id, location, range_start, range_end), rows)
+            if mode == 'lttb':
+                rows = list(rows)
+                total_points = len(rows)
+                rows = lttb(rows, MAX_POINTS, key=lambda r: (r.timestamp.timestamp(), r.temp_c))
+                logger.info(f"Downsampling LTTB aplicado: {total_points} -> {len(rows)} puntos.")
+            return [{'id': row.id, 'device_id': device_id, 'location': location, 'timestamp': format_timestamp_utc(row.timestamp), 'temp_c': row.temp_c, 'temp_h': row.temp_h, 'temp_st': row.temp_st} for row in rows]
+
+        rollup = rollups.select_rollup(mode, range_start)
+        if rollup and mode % rollup[1] == 0:
+            data = rollups.query_rollup(device_id, location, range_start, range_end, mode, rollup)
+            logger.info(f"[SENSOR_DATA] {len(data)} buckets de {mode}s desde rollup {rollup[0]}")
             return data
-        else:
-            return [{'id': row.id, 'device_id': row.device_id, 'location': row.location, 'timestamp': format_timestamp_utc(row.timestamp), 'temp_c': row.temp_c, 'temp_h': row.temp_h, 'temp_st': row.temp_st} for row in results]
+
+        data = _bucketed_sensor_data(device_id, location, conditions, range_start, mode)
+        if archived:
+            archive_rows = sensor_archive.rows(device_id, location, range_start, range_end)
+            data = _merge_buckets(_bucket_rows(archive_rows, device_id, location, range_start, mode), data)
+        logger.info(f"[SENSOR_DATA] {len(data)} buckets de {mode}s")
+        return data
     except Exception as e:
         logger.error(f"Error recovering sensor data: {e}")
         return []
@@ -510,6 +752,7 @@ def add_alert(server_name, data):
         )
         db.session.add(new_alert)
         db.session.commit()
+        alert_engine.invalidate(server_name)
         return True
     except Exception as e:
         logger.error(f"❌ Error añadiendo alerta: {e}")
@@ -530,6 +773,7 @@ def update_alert(alert_id, data):
             alert.type = data.get('type', 'warning')
             alert.enabled = data.get('enabled', True)
             db.session.commit()
+            alert_engine.invalidate(alert.server_name)
             return True
         return False
     except Exception as e:
@@ -542,8 +786,10 @@ def delete_alert(alert_id):
     try:
         alert = Alert.query.get(alert_id)
         if alert:
+            server_name = alert.server_name
             db.session.delete(alert)
             db.session.commit()
+            alert_engine.invalidate(server_name)
             return True
         return False
     except Exception as e:
@@ -554,15 +800,21 @@ def delete_alert(alert_id):
 # --- Device Management ---
 def get_or_create_device(dev_id, dev_name, dev_location, server_name):
     """Busca un dispositivo por (id, location). Si no existe, lo crea. Devuelve (alias, fue_creado)."""
+    cached_name = device_registry.get_name(server_name, dev_id, dev_location)
+    if cached_name is not None:
+        return cached_name, False
     try:
         device = Device.query.filter_by(dev_id=dev_id, dev_location=dev_location, dev_server=server_name).first()
         if device:
             display_name = device.dev_alias if device.dev_alias else device.dev_name
+            device_registry.set_name(server_name, dev_id, dev_location, display_name)
             return display_name, False
         else:
             new_device = Device(dev_id=dev_id, dev_name=dev_name, dev_location=dev_location, dev_server=server_name)
             db.session.add(new_device)
             db.session.commit()
+            device_registry.set_name(server_name, dev_id, dev_location, dev_name)
+            state_snapshot.invalidate()  # known_devices del estado inicial
             logger.info(f"🆕 Nuevo dispositivo registrado: {dev_id}@{dev_location}")
             return dev_name, True
     except Exception as e:
@@ -577,6 +829,7 @@ def update_device_alias(dev_id, dev_location, new_alias):
         if device:
             device.dev_alias = new_alias
             db.session.commit()
+            device_registry.rename(device.dev_server, dev_id, dev_location, new_alias or device.dev_name)
             logger.info(f"✏️ Alias actualizado para {dev_id}@{dev_location}: {new_alias}")
             return True
         return False
@@ -613,10 +866,26 @@ def load_known_devices_to_memory(server_name):
                         'last_seen': 'Nunca',
                         'missed_pings': 0
                     }
+                    device_state.mark(key)
         logger.info(f"📥 {len(known_devices)} dispositivos cargados desde BD a memoria.")
     except Exception as e:
         logger.error(f"❌ Error cargando dispositivos a memoria: {e}")
 
+def load_device_registry(server_name):
+    """Carga en la caché de dispositivos los registros y la whitelist de un servidor."""
+    try:
+        known_devices = Device.query.filter_by(dev_server=server_name).all()
+        allowed = Whitelist.query.filter_by(server_name=server_name).all()
+        device_registry.load_server(
+            server_name,
+            ((d.dev_id, d.dev_location, d.dev_alias or d.dev_name) for d in known_devices),
+            ((w.device_id, w.location) for w in allowed)
+        )
+        logger.info(f"📥 Caché de dispositivos cargada para '{server_name}': {len(known_devices)} dispositivos, {len(allowed)} en whitelist.")
+    except Exception as e:
+        device_registry.invalidate_server(server_name)
+        logger.error(f"❌ Error cargando caché de dispositivos: {e}")
+
 # --- Whitelist Management (Strict Mode) ---
 def get_whitelist(server_name):
     """Recupera la whitelist con detalles del dispositivo y grupo."""
@@ -647,6 +916,7 @@ def add_to_whitelist(server_name, device_id, location, group_id=None):
         item = Whitelist(server_name=server_name, device_id=device_id, location=location, group_id=group_id)
         db.session.add(item)
         db.session.commit()
+        device_registry.add_whitelisted(server_name, device_id, location)
         return True
     except Exception:
         db.session.rollback()
@@ -657,6 +927,7 @@ def remove_from_whitelist(server_name, device_id, location):
     try:
         Whitelist.query.filter_by(server_name=server_name, device_id=device_id, location=location).delete()
         db.session.commit()
+        device_registry.discard_whitelisted(server_name, device_id, location)
         return True
     except Exception:
         db.session.rollback()
@@ -664,6 +935,8 @@ def remove_from_whitelist(server_name, device_id, location):
 
 def is_device_allowed(server_name, device_id, location):
     """Verifica si un dispositivo está permitido (debe estar en la whitelist)."""
+    if device_registry.is_loaded(server_name):
+        return device_registry.is_whitelisted(server_name, device_id, location)
     if Whitelist.query.filter_by(server_name=server_name, device_id=device_id, location=location).first():
         return True 
     return False
@@ -671,44 +944,13 @@ def is_device_allowed(server_name, device_id, location):
 # --- Cleanup & Scheduler Persistence ---
 
 def cleanup_sensor_data(days=30):
-    """Elimina registros de sensor_data más antiguos que el número de días especificado."""
-    try:
-        cutoff_date = datetime.now() - timedelta(days=days)
-        deleted_count = SensorData.query.filter(SensorData.timestamp < cutoff_date).delete()
-        if deleted_count > 0:
-            db.session.commit()
-            logger.info(f"🧹 Limpieza de datos históricos: {deleted_count} registros eliminados (anteriores a {cutoff_date.strftime('%Y-%m-%d')}).")
-        return deleted_count
-    except Exception as e:
-        logger.error(f"❌ Error en limpieza de datos históricos: {e}")
-        db.session.rollback()
-        return 0
+    """Saca de sensor_data los registros más antiguos que el número de días especificado.
 
-def should_run_cleanup() -> bool:
-    """Comprueba si debe ejecutarse la limpieza de datos."""
-    try:
-        last_cleanup = Setting.query.filter_by(key='last_cleanup_date').first()
-        if not last_cleanup:
-            return True
-        last_cleanup_date = datetime.strptime(last_cleanup.value, '%Y-%m-%d %H:%M:%S')
-        return (datetime.now() - last_cleanup_date) > timedelta(hours=24)
-    except Exception as e:
-        logger.error(f"❌ Error comprobando fecha de cleanup: {e}")
-        return True
-
-def update_cleanup_timestamp():
-    """Actualiza la fecha del último cleanup."""
-    try:
-        setting = Setting.query.filter_by(key='last_cleanup_date').first()
-        now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        if setting:
-            setting.value = now_str
-        else:
-            db.session.add(Setting(key='last_cleanup_date', value=now_str))
-        db.session.commit()
-    except Exception as e:
-        logger.error(f"❌ Error actualizando fecha de cleanup: {e}")
-        db.session.rollback()
+    Con sensor_archive_enabled (por defecto) se mueven al archivo columnar
+    comprimido (src/sensor_archive.py) en lugar de eliminarse. El borrado se
+    hace por tramos (src/retention.py).
+    """
+    return retention.purge('sensor_data', days)
 
 # --- Device Events ---
 
@@ -729,6 +971,26 @@ def add_device_event(device_id, location, event_type, details=None):
         logger.error(f"❌ Error registrando evento de dispositivo: {e}")
         db.session.rollback()
 
+def add_device_events(events):
+    """Registra varios eventos de dispositivo en una sola transacción.
+
+    events: iterable de (device_id, location, event_type, details).
+    """
+    events = list(events)
+    if not events:
+        return
+    try:
+        with app.app_context():
+            db.session.add_all([
+                DeviceEvent(device_id=device_id, location=location, event_type=event_type, details=details)
+                for device_id, location, event_type, details in events
+            ])
+            db.session.commit()
+            logger.debug(f"📝 {len(events)} eventos de dispositivo registrados.")
+    except Exception as e:
+        logger.error(f"❌ Error registrando eventos de dispositivo: {e}")
+        db.session.rollback()
+
 def get_device_events(device_id, location, limit=100, event_type=None, offset=0):
     """Obtiene el historial de eventos de un dispositivo."""
     try:
@@ -749,18 +1011,8 @@ def get_device_events(device_id, location, limit=100, event_type=None, offset=0)
         return []
 
 def cleanup_old_events(days=30):
-    """Elimina eventos antiguos."""
-    try:
-        cutoff_date = datetime.now() - timedelta(days=days)
-        deleted_count = DeviceEvent.query.filter(DeviceEvent.timestamp < cutoff_date).delete()
-        if deleted_count > 0:
-            db.session.commit()
-            logger.info(f"🧹 Limpieza de eventos: {deleted_count} registros eliminados.")
-        return deleted_count
-    except Exception as e:
-        logger.error(f"❌ Error en limpieza de eventos: {e}")
-        db.session.rollback()
-        return 0
+    """Elimina eventos antiguos (por tramos, ver src/retention.py)."""
+    return retention.purge('device_events', days)
 
 def get_device_detail(device_id, location, server_name):
     """Obtiene toda la información de detalle de un dispositivo."""
@@ -837,6 +1089,11 @@ def get_device_detail(device_id, location, server_name):
                 'temp_st': s.temp_st
             } for s in sensors]
 
+            detail['sensor_stats_24h'] = rollups.summary(
+                device_id, location, datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=24)
+            )
+            detail['stats'] = device_stats.device_summary(server_name, device_key)
+
             return detail
     except Exception as e:
         logger.error(f"Error getting device detail: {e}")
@@ -0,0 +1,155 @@
+import heapq
+import threading
+import zlib
+
+PING_MODES = ('broadcast', 'staggered')
+DEFAULT_PING_MODE = 'broadcast'
+DEFAULT_MAX_BACKOFF = 4      # multiplicador máximo del intervalo para dispositivos estables
+DEFAULT_STABLE_AFTER = 3     # PONGs seguidos antes de duplicar el intervalo
+
+
+class _PingState:
+    __slots__ = ('backoff', 'streak', 'due', 'sent_at', 'pending')
+
+    def __init__(self, due):
+        self.backoff = 1
+        self.streak = 0
+        self.due = due
+        self.sent_at = None
+        self.pending = False
+
+
+class PingScheduler:
+    """Planificación de PINGs de una conexión.
+
+    En modo 'broadcast' se envía un único PING a iot/ping/all por ciclo
+    (comportamiento original). En modo 'staggered' cada dispositivo recibe
+    su PING en iot/ping/<id>/<location> con un desfase fijo dentro del
+    intervalo (hash del device_key), así que los PONG llegan repartidos en
+    lugar de en ráfaga. Los dispositivos que responden stable_after veces
+    seguidas duplican su intervalo hasta max_backoff; un PING sin respuesta
+    lo devuelve al intervalo base.
+
+    En ambos modos se guarda la hora exacta de envío: la latencia se calcula
+    con ella y no con el campo 'time' (en segundos enteros) del PONG.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._heap = []
+        self._broadcast_sent_at = None
+        self.mode = DEFAULT_PING_MODE
+        self.interval = 30
+        self.max_backoff = DEFAULT_MAX_BACKOFF
+        self.stable_after = DEFAULT_STABLE_AFTER
+
+    def configure(self, settings):
+        mode = settings.get('ping_mode', DEFAULT_PING_MODE)
+        self.mode = mode if mode in PING_MODES else DEFAULT_PING_MODE
+        try:
+            self.interval = max(1, int(settings.get('refresh_interval', 30)))
+        except (ValueError, TypeError):
+            self.interval = 30
+        try:
+            self.max_backoff = max(1, int(settings.get('ping_max_backoff', DEFAULT_MAX_BACKOFF)))
+        except (ValueError, TypeError):
+            self.max_backoff = DEFAULT_MAX_BACKOFF
+        try:
+            self.stable_after = max(1, int(settings.get('ping_stable_after', DEFAULT_STABLE_AFTER)))
+        except (ValueError, TypeError):
+            self.stable_after = DEFAULT_STABLE_AFTER
+
+    @property
+    def staggered(self):
+        return self.mode == 'staggered'
+
+    def __len__(self):
+        return len(self._devices)
+
+    def phase(self, device_key):
+        """Desfase fijo (0..1) del dispositivo dentro del intervalo."""
+        return (zlib.crc32(device_key.encode()) % 1000) / 1000
+
+    def track(self, device_key, now):
+        """Empieza a planificar PINGs individuales para un dispositivo."""
+        with self._lock:
+            if device_key in self._devices:
+                return
+            state = _PingState(now + self.phase(device_key) * self.interval)
+            self._devices[device_key] = state
+            heapq.heappush(self._heap, (state.due, device_key))
+
+    def forget(self, device_key):
+        with self._lock:
+            self._devices.pop(device_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._heap.clear()
+            self._broadcast_sent_at = None
+
+    def backoff(self, device_key):
+        """Multiplicador actual del intervalo del dispositivo (1 en modo broadcast)."""
+        if not self.staggered:
+            return 1
+        state = self._devices.get(device_key)
+        return state.backoff if state else 1
+
+    def next_due(self):
+        with self._lock:
+            while self._heap and self._stale(self._heap[0]):
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def due(self, now):
+        """Dispositivos a los que toca enviar PING; quedan replanificados."""
+        ready = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if self._stale(entry):
+                    continue
+                device_key = entry[1]
+                state = self._devices[device_key]
+                if state.pending:
+                    # El PING anterior no tuvo respuesta: vuelta al intervalo base
+                    state.backoff = 1
+                    state.streak = 0
+                state.sent_at = now
+                state.pending = True
+                state.due = now + self.interval * state.backoff
+                heapq.heappush(self._heap, (state.due, device_key))
+                ready.append(device_key)
+        return ready
+
+    def broadcast_sent(self, now):
+        """Registra el envío de un PING a iot/ping/all."""
+        self._broadcast_sent_at = now
+
+    def on_pong(self, device_key, echoed_time, now):
+        """Latencia en ms del PONG, o None si no corresponde a un PING registrado.
+
+        echoed_time es el 'time' (segundos enteros) que el dispositivo
+        devuelve; sirve para emparejar el PONG con el envío exacto.
+        """
+        with self._lock:
+            sent_at = None
+            state = self._devices.get(device_key)
+            if state is not None and state.pending and state.sent_at is not None and int(state.sent_at) == echoed_time:
+                sent_at = state.sent_at
+                state.pending = False
+                state.streak += 1
+                if state.streak >= self.stable_after and state.backoff * 2 <= self.max_backoff:
+                    state.backoff *= 2
+                    state.streak = 0
+            elif self._broadcast_sent_at is not None and int(self._broadcast_sent_at) == echoed_time:
+                sent_at = self._broadcast_sent_at
+        if sent_at is None:
+            return None
+        return (now - sent_at) * 1000
+
+    def _stale(self, entry):
+        state = self._devices.get(entry[1])
+        return state is None or state.due != entry[0]
@@ -0,0 +1,235 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, delete
+
+from src.globals import app, db, config
+from src.models import SensorData, DeviceEvent, DeviceLog, Setting
+from src.cluster import cluster
+from src.rollups import cleanup_rollups
+from src.sensor_archive import sensor_archive, archive_enabled
+from src.db_gate import db_gate
+
+logger = logging.getLogger(__name__)
+
+TABLES = {
+    'sensor_data': SensorData,
+    'device_events': DeviceEvent,
+    'device_logs': DeviceLog,
+}
+
+DEFAULT_RETENTION_DAYS = {'sensor_data': 30, 'device_events': 30, 'device_logs': 30}
+DEFAULT_INTERVAL_HOURS = 24
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_PAUSE_MS = 50
+DEFAULT_VACUUM_PAGES = 2000
+
+VACUUM_STEP = 256      # páginas liberadas por transacción de incremental_vacuum
+STARTUP_DELAY = 60     # s antes de la primera comprobación (no retrasa el arranque)
+CHECK_SECONDS = 300    # cada cuánto se comprueba si toca una pasada
+
+LAST_RUN_KEY = 'last_cleanup_date'
+
+
+def _setting_int(key, default, minimum=0):
+    try:
+        return max(minimum, int(config.get('settings', {}).get(key, default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def retention_days(table):
+    """Días que se conservan de la tabla (retention_<tabla>_days). 0 = sin límite."""
+    return _setting_int(f'retention_{table}_days', DEFAULT_RETENTION_DAYS[table])
+
+
+class RetentionService:
+    """Retención periódica de sensor_data, device_events y device_logs.
+
+    Las filas antiguas se borran por tramos de id (retention_batch_size filas
+    de clave primaria por transacción) con una pausa entre tramos, de modo
+    que el escritor de sensores nunca espera a un DELETE largo. En
+    sensor_data las lecturas se pasan antes al archivo columnar
+    (src/sensor_archive.py) si sensor_archive_enabled está activo.
+
+    Tras borrar, las páginas libres se devuelven al sistema con
+    PRAGMA incremental_vacuum en pasos cortos (solo en BD con
+    auto_vacuum=INCREMENTAL, el modo con el que se crean las BD nuevas; ver
+    src/db_tuning.py). En modo cluster solo actúa el líder.
+
+    Una pasada trabaja dentro de db_gate y corta en el tramo actual si la
+    puerta se cierra (restauración en caliente, src/db_restore.py); en ese
+    caso no se anota como hecha y se repite en la siguiente comprobación.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._running = False
+        self.stats = {
+            'runs': 0, 'chunks': 0, 'purged': {table: 0 for table in TABLES},
+            'last_run': None, 'last_duration_s': 0.0, 'last_purged': {},
+            'vacuumed_pages': 0, 'freelist_pages': None, 'auto_vacuum': None,
+        }
+
+    # --- Ajustes ---
+
+    def _batch_size(self):
+        return _setting_int('retention_batch_size', DEFAULT_BATCH_SIZE, minimum=1)
+
+    def _pause(self):
+        return _setting_int('retention_pause_ms', DEFAULT_PAUSE_MS) / 1000
+
+    def _interval(self):
+        return timedelta(hours=_setting_int('retention_interval_hours', DEFAULT_INTERVAL_HOURS, minimum=1))
+
+    def _interrupted(self):
+        return self._stop_event.is_set() or db_gate.closing
+
+    # --- Borrado por tramos ---
+
+    def delete_chunked(self, model, *conditions):
+        """Borra las filas de model que cumplen conditions en tramos de id. Requiere app_context."""
+        batch, pause = self._batch_size(), self._pause()
+        low, high = db.session.execute(select(func.min(model.id), func.max(model.id)).where(*conditions)).one()
+        db.session.commit()
+        deleted = 0
+        while low is not None and low <= high and not self._interrupted():
+            result = db.session.execute(delete(model).where(model.id >= low, model.id < low + batch, *conditions))
+            db.session.commit()
+            deleted += result.rowcount or 0
+            self.stats['chunks'] += 1
+            if result.rowcount:
+                low += batch
+            else:
+                # Hueco en los ids: saltar a la siguiente fila que cumple las condiciones
+                low = db.session.scalar(select(func.min(model.id)).where(model.id >= low + batch, *conditions))
+                db.session.commit()
+            # Cede el bucle de gevent al escritor de sensores y a la ingesta
+            time.sleep(pause)
+        return deleted
+
+    def purge(self, table, days=None):
+        """Aplica la retención a una tabla. Devuelve las filas que salen de ella. Requiere app_context."""
+        days = retention_days(table) if days is None else days
+        if days <= 0 or self._interrupted():
+            return 0
+        model = TABLES[table]
+        cutoff = datetime.now() - timedelta(days=days)
+        try:
+            if table == 'sensor_data' and archive_enabled():
+                purged = sensor_archive.archive_older_than(
+                    cutoff, purge=lambda *conditions: self.delete_chunked(model, *conditions))
+            else:
+                purged = self.delete_chunked(model, model.timestamp < cutoff)
+        except Exception as e:
+            logger.error(f"❌ Error en la retención de {table}: {e}")
+            db.session.rollback()
+            return 0
+        self.stats['purged'][table] += purged
+        if purged:
+            logger.info(f"🧹 Retención de {table}: {purged} registros anteriores a {cutoff:%Y-%m-%d}.")
+        return purged
+
+    # --- Espacio libre ---
+
+    def vacuum(self, max_pages=None):
+        """Libera hasta max_pages páginas de la freelist con incremental_vacuum. Devuelve las liberadas."""
+        max_pages = _setting_int('retention_vacuum_pages', DEFAULT_VACUUM_PAGES) if max_pages is None else max_pages
+        raw = db.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            self.stats['auto_vacuum'] = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            free = before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # 2 = INCREMENTAL; en BD antiguas (NONE) solo un VACUUM completo recupera el espacio
+            while self.stats['auto_vacuum'] == 2 and free and before - free < max_pages \
+                    and not self._interrupted():
+                step = min(VACUUM_STEP, max_pages - (before - free))
+                # executescript recorre todos los pasos del PRAGMA (execute solo libera una página)
+                conn.executescript(f"PRAGMA incremental_vacuum({step})")
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                time.sleep(self._pause())
+            self.stats['freelist_pages'] = free
+            self.stats['vacuumed_pages'] += before - free
+            return before - free
+        finally:
+            raw.close()
+
+    # --- Pasada completa ---
+
+    def due(self, now=None):
+        """True si la última pasada (Setting last_cleanup_date) es más antigua que retention_interval_hours."""
+        last = db.session.get(Setting, LAST_RUN_KEY)
+        if not last:
+            return True
+        try:
+            return (now or datetime.now()) - datetime.strptime(last.value, '%Y-%m-%d %H:%M:%S') >= self._interval()
+        except ValueError:
+            return True
+
+    def run_once(self):
+        """Retención de todas las tablas, rollups y espacio libre. Devuelve {tabla: filas}."""
+        if not self._lock.acquire(blocking=False):
+            return {}
+        started = time.monotonic()
+        try:
+            with db_gate.hold(), app.app_context():
+                purged = {table: self.purge(table) for table in TABLES}
+                cleanup_rollups()
+                pages = self.vacuum()
+                if not self._interrupted():
+                    db.session.merge(Setting(key=LAST_RUN_KEY, value=datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                    db.session.commit()
+        finally:
+            self._lock.release()
+        duration = round(time.monotonic() - started, 3)
+        self.stats.update(runs=self.stats['runs'] + 1, last_run=datetime.now().isoformat(timespec='seconds'),
+                          last_duration_s=duration, last_purged=purged)
+        logger.info(f"🧹 Retención completada en {duration}s: {purged}, {pages} páginas liberadas.")
+        return purged
+
+    # --- Hilo ---
+
+    def start(self):
+        """Arranca el hilo de retención (idempotente)."""
+        if self._running:
+            return
+        self._running = True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+        logger.info(f"🧹 Retención de datos: cada {self._interval()} ({dict((t, retention_days(t)) for t in TABLES)} días)")
+
+    def stop(self, timeout=5):
+        """Detiene el hilo; un borrado en curso termina en el tramo actual."""
+        if self._running:
+            self._running = False
+            self._stop_event.set()
+            if self._thread:
+                self._thread.join(timeout)
+                self._thread = None
+
+    def _run(self):
+        if self._stop_event.wait(STARTUP_DELAY):
+            return
+        while True:
+            try:
+                if cluster.is_leader():
+                    with app.app_context():
+                        due = self.due()
+                    if due:
+                        self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Error en la retención de datos: {e}")
+            if self._stop_event.wait(CHECK_SECONDS):
+                return
+
+    def get_stats(self):
+        return dict(self.stats, running=self._lock.locked(),
+                    retention_days={table: retention_days(table) for table in TABLES})
+
+
+retention = RetentionService()
@@ -0,0 +1,307 @@
+import calendar
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, func, cast, Integer, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.globals import db, config
+from src.models import SensorData, SensorRollup1m, SensorRollup1h, SensorRollup1d, Setting
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('temp_c', 'temp_h', 'temp_st')
+
+# De la más gruesa a la más fina: (nombre, segundos, modelo)
+ROLLUPS = (
+    ('1d', 86400, SensorRollup1d),
+    ('1h', 3600, SensorRollup1h),
+    ('1m', 60, SensorRollup1m),
+)
+
+DEFAULT_RETENTION_DAYS = {'1m': 7, '1h': 90, '1d': 730}
+
+BACKFILL_BATCH = 5000
+BACKFILL_KEY = 'rollups_backfilled'  # Setting que marca la migración como hecha
+
+
+def to_epoch(dt):
+    """Segundos epoch de un datetime naive en UTC."""
+    return calendar.timegm(dt.timetuple())
+
+
+def _empty_aggregate():
+    agg = {'count': 0}
+    for metric in METRICS:
+        agg[f'{metric}_sum'] = 0.0
+        agg[f'{metric}_n'] = 0
+        agg[f'{metric}_min'] = None
+        agg[f'{metric}_max'] = None
+    return agg
+
+
+def _merge(agg, other):
+    agg['count'] += other['count']
+    for metric in METRICS:
+        agg[f'{metric}_sum'] += other[f'{metric}_sum']
+        agg[f'{metric}_n'] += other[f'{metric}_n']
+        for suffix, pick in (('_min', min), ('_max', max)):
+            key = metric + suffix
+            if other[key] is not None:
+                agg[key] = other[key] if agg[key] is None else pick(agg[key], other[key])
+
+
+def rows_to_partials(rows):
+    """Agrega lecturas (dicts con device_id, location, timestamp y métricas) por minuto.
+
+    Devuelve {(device_id, location, bucket_1m): agregado}.
+    """
+    partials = {}
+    for row in rows:
+        epoch = to_epoch(row['timestamp'])
+        key = (row['device_id'], row['location'], epoch - epoch % 60)
+        agg = partials.get(key)
+        if agg is None:
+            agg = partials[key] = _empty_aggregate()
+        agg['count'] += 1
+        for metric in METRICS:
+            value = row.get(metric)
+            if value is None:
+                continue
+            agg[f'{metric}_sum'] += value
+            agg[f'{metric}_n'] += 1
+            if agg[f'{metric}_min'] is None or value < agg[f'{metric}_min']:
+                agg[f'{metric}_min'] = value
+            if agg[f'{metric}_max'] is None or value > agg[f'{metric}_max']:
+                agg[f'{metric}_max'] = value
+    return partials
+
+
+def _upsert_statement(model):
+    table = model.__table__
+    stmt = sqlite_insert(table)
+    excluded = stmt.excluded
+    values = {'count': table.c.count + excluded.count}
+    for metric in METRICS:
+        values[f'{metric}_sum'] = table.c[f'{metric}_sum'] + excluded[f'{metric}_sum']
+        values[f'{metric}_n'] = table.c[f'{metric}_n'] + excluded[f'{metric}_n']
+        for suffix, fn in (('_min', func.min), ('_max', func.max)):
+            current, new = table.c[metric + suffix], excluded[metric + suffix]
+            # min()/max() escalares de SQLite devuelven NULL si algún argumento lo es
+            values[metric + suffix] = fn(func.coalesce(current, new), func.coalesce(new, current))
+    return stmt.on_conflict_do_update(index_elements=['device_id', 'location', 'bucket'], set_=values)
+
+
+def apply_partials(partials):
+    """Suma agregados por minuto a las tres tablas de rollup (sin commit)."""
+    if not partials:
+        return
+    for _name, seconds, model in ROLLUPS:
+        grouped = {}
+        for (device_id, location, minute), agg in partials.items():
+            key = (device_id, location, minute - minute % seconds)
+            if key not in grouped:
+                grouped[key] = _empty_aggregate()
+            _merge(grouped[key], agg)
+
+        params = [
+            dict(agg, device_id=device_id, location=location, bucket=bucket)
+            for (device_id, location, bucket), agg in grouped.items()
+        ]
+        db.session.execute(_upsert_statement(model), params)
+
+
+def update_rollups(rows):
+    """Mantiene los rollups al insertar lecturas. Debe ir en la misma transacción que el INSERT."""
+    apply_partials(rows_to_partials(rows))
+
+
+def _mark_backfilled():
+    db.session.merge(Setting(key=BACKFILL_KEY, value='true'))
+    db.session.commit()
+
+
+def backfill_rollups():
+    """Genera los rollups a partir de sensor_data una sola vez (migración).
+
+    Se anota en el Setting rollups_backfilled. Que 1m esté vacío no basta:
+    su retención (7 días) puede vaciarlo mientras sensor_data, 1h y 1d
+    siguen con filas, y repetir la migración sumaría dos veces count y sum
+    en los upserts. Una BD anterior al Setting con algún rollup con filas
+    se da por migrada.
+    """
+    try:
+        if db.session.get(Setting, BACKFILL_KEY) is not None:
+            return 0
+        if any(db.session.scalar(select(model.id).limit(1)) is not None for _name, _seconds, model in ROLLUPS) \
+                or db.session.scalar(select(SensorData.id).limit(1)) is None:
+            _mark_backfilled()
+            return 0
+
+        logger.info("📊 Generando rollups de sensores a partir del histórico...")
+        epoch = cast(func.strftime('%s', SensorData.timestamp), Integer)
+        minute = (epoch - epoch % 60).label('minute')
+        columns = [SensorData.device_id, SensorData.location, minute, func.count().label('count')]
+        for metric in METRICS:
+            column = getattr(SensorData, metric)
+            columns += [
+                func.coalesce(func.sum(column), 0).label(f'{metric}_sum'),
+                func.count(column).label(f'{metric}_n'),
+                func.min(column).label(f'{metric}_min'),
+                func.max(column).label(f'{metric}_max'),
+            ]
+        stmt = (
+            select(*columns)
+            .where(SensorData.timestamp.is_not(None))
+            .group_by(SensorData.device_id, SensorData.location, minute)
+            .execution_options(yield_per=BACKFILL_BATCH)
+        )
+
+        # Se leen todos los minutos antes de escribir para no mezclar el
+        # cursor abierto con los upserts en la misma conexión.
+        rows = db.session.execute(stmt).all()
+        total = 0
+        for start in range(0, len(rows), BACKFILL_BATCH):
+            partials = {}
+            for row in rows[start:start + BACKFILL_BATCH]:
+                agg = {key: getattr(row, key) for key in _empty_aggregate()}
+                partials[(row.device_id, row.location, row.minute)] = agg
+            apply_partials(partials)
+            total += len(partials)
+        # Rollups y marca en la misma transacción
+        _mark_backfilled()
+        logger.info(f"📊 Rollups generados: {total} minutos de datos.")
+        return total
+    except Exception as e:
+        logger.error(f"❌ Error generando rollups de sensores: {e}")
+        db.session.rollback()
+        return 0
+
+
+def _retention_days(name):
+    try:
+        return max(1, int(config.get('settings', {}).get(f'rollup_retention_{name}_days', DEFAULT_RETENTION_DAYS[name])))
+    except (ValueError, TypeError):
+        return DEFAULT_RETENTION_DAYS[name]
+
+
+def cleanup_rollups():
+    """Aplica la retención de cada resolución (rollup_retention_1m_days, ..._1h_, ..._1d_)."""
+    deleted = {}
+    try:
+        now = to_epoch(datetime.now(timezone.utc).replace(tzinfo=None))
+        for name, _seconds, model in ROLLUPS:
+            cutoff = now - _retention_days(name) * 86400
+            result = db.session.execute(delete(model).where(model.bucket < cutoff))
+            deleted[name] = result.rowcount or 0
+        db.session.commit()
+        if any(deleted.values()):
+            logger.info(f"🧹 Limpieza de rollups de sensores: {deleted}")
+    except Exception as e:
+        logger.error(f"❌ Error en limpieza de rollups: {e}")
+        db.session.rollback()
+    return deleted
+
+
+def covers(name, range_start, now=None):
+    """True si la retención del rollup (rollup_retention_<name>_days) llega hasta range_start."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return to_epoch(range_start) >= to_epoch(now) - _retention_days(name) * 86400
+
+
+def select_rollup(bucket_seconds, range_start=None, now=None):
+    """Rollup más grueso que no supera bucket_seconds, o None si hay que usar las lecturas.
+
+    Con range_start solo se elige un rollup cuya retención cubra todo el
+    rango: un rollup ya purgado devolvería los primeros buckets vacíos.
+    """
+    for name, seconds, model in ROLLUPS:
+        if seconds <= bucket_seconds:
+            if range_start is not None and not covers(name, range_start, now):
+                continue
+            return name, seconds, model
+    return None
+
+
+def _range_conditions(model, seconds, device_id, location, range_start, range_end):
+    """Buckets que se solapan con el rango (incluye el que contiene a range_start)."""
+    conditions = [model.device_id == device_id, model.location == location]
+    start = to_epoch(range_start)
+    conditions.append(model.bucket >= start - start % seconds)
+    if range_end is not None:
+        conditions.append(model.bucket <= to_epoch(range_end))
+    return conditions
+
+
+def count_readings(device_id, location, range_start, range_end):
+    """Número aproximado de lecturas del rango según el rollup horario (None si no hay)."""
+    if not covers('1h', range_start):
+        return None
+    conditions = _range_conditions(SensorRollup1h, 3600, device_id, location, range_start, range_end)
+    return db.session.scalar(select(func.sum(SensorRollup1h.count)).where(*conditions))
+
+
+def query_rollup(device_id, location, range_start, range_end, bucket_seconds, rollup):
+    """Serie agregada desde un rollup, combinando sus buckets en intervalos de bucket_seconds.
+
+    Devuelve la misma forma que el agrupado sobre sensor_data: media en
+    'temp_c'..., más '_min', '_max' y 'count'.
+    """
+    _name, seconds, model = rollup
+    origin = to_epoch(range_start)
+    # El bucket que contiene a range_start empieza antes del origen: se cuenta en el primer intervalo
+    group = (func.max(model.bucket - origin, 0) // bucket_seconds).label('grp')
+    columns = [group, func.sum(model.count).label('count')]
+    for metric in METRICS:
+        columns += [
+            func.sum(getattr(model, f'{metric}_sum')).label(f'{metric}_sum'),
+            func.sum(getattr(model, f'{metric}_n')).label(f'{metric}_n'),
+            func.min(getattr(model, f'{metric}_min')).label(f'{metric}_min'),
+            func.max(getattr(model, f'{metric}_max')).label(f'{metric}_max'),
+        ]
+    stmt = (
+        select(*columns)
+        .where(*_range_conditions(model, seconds, device_id, location, range_start, range_end))
+        .group_by(group)
+        .order_by(group)
+    )
+
+    data = []
+    for row in db.session.execute(stmt):
+        point = {
+            'id': None,
+            'device_id': device_id,
+            'location': location,
+            'timestamp': (range_start + timedelta(seconds=row.grp * bucket_seconds)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'count': row.count,
+        }
+        for metric in METRICS:
+            n = getattr(row, f'{metric}_n')
+            point[metric] = round(getattr(row, f'{metric}_sum') / n, 2) if n else None
+            point[f'{metric}_min'] = getattr(row, f'{metric}_min')
+            point[f'{metric}_max'] = getattr(row, f'{metric}_max')
+        data.append(point)
+    return data
+
+
+def summary(device_id, location, since):
+    """Mín/máx/media por métrica desde 'since' usando el rollup horario."""
+    conditions = _range_conditions(SensorRollup1h, 3600, device_id, location, since, None)
+    columns = [func.sum(SensorRollup1h.count).label('count')]
+    for metric in METRICS:
+        columns += [
+            func.sum(getattr(SensorRollup1h, f'{metric}_sum')).label(f'{metric}_sum'),
+            func.sum(getattr(SensorRollup1h, f'{metric}_n')).label(f'{metric}_n'),
+            func.min(getattr(SensorRollup1h, f'{metric}_min')).label(f'{metric}_min'),
+            func.max(getattr(SensorRollup1h, f'{metric}_max')).label(f'{metric}_max'),
+        ]
+    row = db.session.execute(select(*columns).where(*conditions)).one()
+    result = {'count': row.count or 0}
+    for metric in METRICS:
+        n = getattr(row, f'{metric}_n')
+        result[metric] = {
+            'avg': round(getattr(row, f'{metric}_sum') / n, 2) if n else None,
+            'min': getattr(row, f'{metric}_min'),
+            'max': getattr(row, f'{metric}_max'),
+        }
+    return result
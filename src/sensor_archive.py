@@ -0,0 +1,267 @@
+import calendar
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import quote
+
+from sqlalchemy import select, delete
+
+from src.globals import db, config, basedir
+from src.models import SensorData
+from src.ts_codec import encode_block, decode_block
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = os.path.join(basedir, 'archive')
+METRICS = ('temp_c', 'temp_h', 'temp_st')
+BLOCK_ROWS = 4096        # filas por bloque comprimido (unidad mínima de lectura)
+ARCHIVE_BATCH = 5000     # filas leídas de sensor_data por lote al archivar
+
+MAGIC = b'TSA1'
+_INDEX = struct.Struct('<qqQII')   # primera marca, última marca, offset, longitud, filas
+_FOOTER = struct.Struct('<QI4s')   # offset del índice, número de bloques, MAGIC
+
+_EPOCH = datetime(1970, 1, 1)
+
+ArchivedRow = namedtuple('ArchivedRow', ('id', 'timestamp') + METRICS)
+BlockInfo = namedtuple('BlockInfo', ('first', 'last', 'offset', 'length', 'count'))
+
+
+def to_micros(dt):
+    return calendar.timegm(dt.timetuple()) * 1_000_000 + dt.microsecond
+
+
+def from_micros(us):
+    return _EPOCH + timedelta(microseconds=us)
+
+
+def _month_start(dt):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(dt):
+    return (_month_start(dt) + timedelta(days=32)).replace(day=1)
+
+
+def archive_enabled():
+    return str(config.get('settings', {}).get('sensor_archive_enabled', 'true')).lower() == 'true'
+
+
+class SensorArchive:
+    """Archivo columnar comprimido de las lecturas de sensor antiguas.
+
+    Las filas de sensor_data que salen de la ventana caliente se mueven a un
+    fichero por dispositivo y mes (archive/<device_id>@<location>/YYYY-MM.tsa).
+    Cada fichero es una secuencia de bloques de hasta BLOCK_ROWS filas
+    codificados con src/ts_codec.py (delta-of-delta para las marcas de
+    tiempo, XOR estilo Gorilla para los floats, zlib) seguida de un índice
+    con el rango de tiempo de cada bloque. La lectura abre el fichero con
+    mmap y solo descomprime los bloques que se solapan con el rango pedido.
+
+    Los ficheros no se modifican en sitio: añadir filas a un mes reescribe
+    el fichero (copiando los bloques existentes tal cual) y lo sustituye con
+    un rename atómico.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self.stats = {'archived_rows': 0, 'files_written': 0, 'blocks_read': 0, 'last_run_s': 0.0}
+
+    # --- Ficheros ---
+
+    def device_dir(self, device_id, location):
+        return self.root / quote(f"{device_id}@{location}", safe='@')
+
+    def month_file(self, device_id, location, month):
+        return self.device_dir(device_id, location) / f"{month:%Y-%m}.tsa"
+
+    def month_files(self, device_id, location, start=None, end=None):
+        """Ficheros de un dispositivo cuyo mes se solapa con [start, end], en orden."""
+        directory = self.device_dir(device_id, location)
+        if not directory.is_dir():
+            return []
+        files = []
+        for path in sorted(directory.glob('*.tsa')):
+            try:
+                month = datetime.strptime(path.stem, '%Y-%m')
+            except ValueError:
+                continue
+            if end is not None and month > end:
+                continue
+            if start is not None and _next_month(month) <= start:
+                continue
+            files.append(path)
+        return files
+
+    def read_index(self, mm):
+        index_offset, n_blocks, magic = _FOOTER.unpack_from(mm, len(mm) - _FOOTER.size)
+        if magic != MAGIC or mm[:4] != MAGIC:
+            raise ValueError("Fichero de archivo inválido")
+        return [BlockInfo(*_INDEX.unpack_from(mm, index_offset + i * _INDEX.size)) for i in range(n_blocks)]
+
+    def _write_month(self, path, timestamps, columns):
+        """Añade filas (ordenadas) al fichero de un mes. Devuelve las filas escritas."""
+        old_blocks, old_data, watermark = [], b'', None
+        if path.exists():
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                old_blocks = self.read_index(mm)
+                index_offset = _FOOTER.unpack_from(mm, len(mm) - _FOOTER.size)[0]
+                old_data = mm[len(MAGIC):index_offset]
+            watermark = max((b.last for b in old_blocks), default=None)
+
+        # Filas ya archivadas en una ejecución interrumpida antes de borrarlas de la BD
+        if watermark is not None:
+            keep = next((i for i, ts in enumerate(timestamps) if ts > watermark), len(timestamps))
+            timestamps = timestamps[keep:]
+            columns = [column[keep:] for column in columns]
+        if not timestamps:
+            return 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f".{path.name}.tmp")
+        blocks = list(old_blocks)
+        with open(partial, 'wb') as f:
+            f.write(MAGIC)
+            f.write(old_data)
+            offset = len(MAGIC) + len(old_data)
+            for start in range(0, len(timestamps), BLOCK_ROWS):
+                chunk = timestamps[start:start + BLOCK_ROWS]
+                data = encode_block(chunk, [column[start:start + BLOCK_ROWS] for column in columns])
+                f.write(data)
+                blocks.append(BlockInfo(chunk[0], chunk[-1], offset, len(data), len(chunk)))
+                offset += len(data)
+            for block in blocks:
+                f.write(_INDEX.pack(*block))
+            f.write(_FOOTER.pack(offset, len(blocks), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+        self.stats['files_written'] += 1
+        return len(timestamps)
+
+    def append(self, device_id, location, rows):
+        """Añade lecturas (timestamp, temp_c, temp_h, temp_st) ordenadas por tiempo, agrupadas por mes."""
+        written = 0
+        month, timestamps, columns = None, [], [[] for _ in METRICS]
+        with self._lock:
+            for row in rows:
+                row_month = _month_start(row[0])
+                if row_month != month and timestamps:
+                    written += self._write_month(self.month_file(device_id, location, month), timestamps, columns)
+                    timestamps, columns = [], [[] for _ in METRICS]
+                month = row_month
+                timestamps.append(to_micros(row[0]))
+                for column, value in zip(columns, row[1:]):
+                    column.append(value)
+            if timestamps:
+                written += self._write_month(self.month_file(device_id, location, month), timestamps, columns)
+        return written
+
+    # --- Lectura ---
+
+    def _blocks(self, device_id, location, start, end):
+        """(BlockInfo, bytes comprimidos, inicio, fin en µs) de los bloques que se solapan con el rango."""
+        start_us = to_micros(start) if start else None
+        end_us = to_micros(end) if end else None
+        for path in self.month_files(device_id, location, start, end):
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for block in self.read_index(mm):
+                    if start_us is not None and block.last < start_us:
+                        continue
+                    if end_us is not None and block.first > end_us:
+                        continue
+                    yield block, mm[block.offset:block.offset + block.length], start_us, end_us
+
+    def rows(self, device_id, location, start=None, end=None):
+        """Lecturas archivadas del rango como ArchivedRow (id None), en orden de tiempo."""
+        for block, data, start_us, end_us in self._blocks(device_id, location, start, end):
+            self.stats['blocks_read'] += 1
+            timestamps, columns = decode_block(data)
+            for i, ts in enumerate(timestamps):
+                if (start_us is not None and ts < start_us) or (end_us is not None and ts > end_us):
+                    continue
+                yield ArchivedRow(None, from_micros(ts), *(column[i] for column in columns))
+
+    def count(self, device_id, location, start=None, end=None):
+        """Lecturas archivadas en el rango; solo se descomprimen los bloques del borde."""
+        total = 0
+        for block, data, start_us, end_us in self._blocks(device_id, location, start, end):
+            inside = (start_us is None or block.first >= start_us) and (end_us is None or block.last <= end_us)
+            if inside:
+                total += block.count
+            else:
+                total += sum(1 for ts in decode_block(data)[0]
+                             if (start_us is None or ts >= start_us) and (end_us is None or ts <= end_us))
+        return total
+
+    def covers(self, device_id, location, start=None, end=None):
+        return bool(self.month_files(device_id, location, start, end))
+
+    # --- Archivado ---
+
+    def archive_older_than(self, cutoff, purge=None):
+        """Mueve de sensor_data al archivo las lecturas anteriores a cutoff. Requiere app_context.
+
+        Por dispositivo: se escriben los ficheros (fsync + rename) y después se
+        borran las filas, con un DELETE o con purge(*condiciones) si se indica
+        (borrado por tramos de src/retention.py). Si el proceso se interrumpe
+        entre ambos pasos, la siguiente ejecución descarta las filas que ya
+        estaban archivadas (marca de agua por fichero).
+        """
+        started = time.monotonic()
+        pairs = db.session.execute(
+            select(SensorData.device_id, SensorData.location).where(SensorData.timestamp < cutoff).distinct()
+        ).all()
+        total = 0
+        for device_id, location in pairs:
+            conditions = (SensorData.device_id == device_id, SensorData.location == location,
+                          SensorData.timestamp < cutoff)
+            stmt = (
+                select(SensorData.timestamp, *(getattr(SensorData, metric) for metric in METRICS))
+                .where(*conditions)
+                .order_by(SensorData.timestamp.asc(), SensorData.id.asc())
+                .execution_options(yield_per=ARCHIVE_BATCH)
+            )
+            read = [0]
+
+            def stream():
+                # En memoria solo queda el mes que se está escribiendo
+                for row in db.session.execute(stmt):
+                    read[0] += 1
+                    yield tuple(row)
+
+            try:
+                written = self.append(device_id, location, stream())
+                if purge:
+                    purge(*conditions)
+                else:
+                    db.session.execute(delete(SensorData).where(*conditions))
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"❌ Error archivando lecturas de {device_id}@{location}: {e}")
+                continue
+            total += read[0]
+            logger.debug(f"🗄️ {device_id}@{location}: {read[0]} lecturas archivadas ({written} nuevas)")
+
+        self.stats['archived_rows'] += total
+        self.stats['last_run_s'] = round(time.monotonic() - started, 3)
+        if total:
+            logger.info(f"🗄️ {total} lecturas anteriores a {cutoff:%Y-%m-%d} movidas al archivo "
+                        f"({len(pairs)} dispositivos, {self.stats['last_run_s']}s).")
+        return total
+
+    def get_stats(self):
+        files = list(self.root.glob('*/*.tsa')) if self.root.is_dir() else []
+        return dict(self.stats, files=len(files),
+                    size_mb=round(sum(p.stat().st_size for p in files) / (1024 * 1024), 2))
+
+
+sensor_archive = SensorArchive()
@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from src.globals import app, db, config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_MS = 1000
+DEFAULT_MAX_PENDING = 50000
+WRITE_RETRIES = 3  # reintentos de un lote que falla antes de descartarlo
+
+
+def _int_setting(key, default):
+    try:
+        return max(1, int(config.get('settings', {}).get(key, default)))
+    except (ValueError, TypeError):
+        return default
+
+
+class SensorDataWriter:
+    """Cola de escritura diferida para las lecturas de sensores.
+
+    insert_sensor_data() solo encola la fila; un hilo de fondo la escribe en
+    lotes (un único INSERT con executemany y un commit) cuando se acumulan
+    batch_size filas o pasan flush_ms milisegundos, lo que ocurra antes. En la
+    misma transacción se actualizan los rollups (src/rollups.py).
+
+    La cola está acotada a max_pending filas: si la BD no da abasto se
+    descartan las lecturas más antiguas y se contabilizan en 'dropped'. Un
+    lote que falla vuelve a la cabeza de la cola y se reintenta en el
+    siguiente ciclo; tras WRITE_RETRIES fallos seguidos se descarta ('failed').
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_ms=DEFAULT_FLUSH_MS, max_pending=DEFAULT_MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.max_pending = max_pending
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._paused = False
+        self._failures = 0
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'retried': 0,
+            'flushes': 0,
+            'pending_high_water': 0,
+            'last_flush_rows': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    @property
+    def running(self):
+        return self._running
+
+    def configure_from_settings(self):
+        """Lee batch_size/flush_ms/max_pending de config['settings']."""
+        self.batch_size = _int_setting('sensor_write_batch_size', DEFAULT_BATCH_SIZE)
+        self.flush_ms = _int_setting('sensor_write_flush_ms', DEFAULT_FLUSH_MS)
+        self.max_pending = _int_setting('sensor_write_max_pending', DEFAULT_MAX_PENDING)
+
+    def start(self):
+        """Arranca el hilo de escritura (idempotente)."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='sensor-writer', daemon=True)
+        self._thread.start()
+        logger.info(f"📊 Escritor de sensores iniciado (lote={self.batch_size}, intervalo={self.flush_ms}ms, max={self.max_pending})")
+
+    def stop(self, timeout=5):
+        """Detiene el hilo y vuelca todo lo pendiente a la BD."""
+        if not self._running:
+            self.flush()
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        # Un lote que falla se reintenta aquí mismo: el proceso va a terminar
+        for _ in range(WRITE_RETRIES + 1):
+            self.flush()
+            if not self._queue:
+                break
+        logger.info(f"📊 Escritor de sensores detenido ({self.stats['written']} filas escritas, {self.stats['dropped']} descartadas)")
+
+    def pause(self):
+        """Deja de escribir en la BD hasta resume(); las lecturas se siguen encolando.
+
+        Espera a que termine el lote que se esté escribiendo.
+        """
+        self._paused = True
+        with self._flush_lock:
+            pass
+
+    def resume(self):
+        self._paused = False
+        with self._cond:
+            self._cond.notify_all()
+
+    def enqueue(self, device_id, location, data, timestamp=None):
+        """Encola una lectura. El timestamp se fija aquí (UTC) para no depender del retardo de escritura."""
+        row = {
+            'device_id': device_id,
+            'location': location,
+            'timestamp': timestamp or datetime.now(timezone.utc).replace(tzinfo=None),
+            'temp_c': data.get('temp_c'),
+            'temp_h': data.get('temp_h'),
+            'temp_st': data.get('temp_st'),
+        }
+        with self._cond:
+            if len(self._queue) >= self.max_pending:
+                self._queue.popleft()
+                self.stats['dropped'] += 1
+            self._queue.append(row)
+            self.stats['enqueued'] += 1
+            pending = len(self._queue)
+            if pending > self.stats['pending_high_water']:
+                self.stats['pending_high_water'] = pending
+            if pending >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self):
+        return len(self._queue)
+
+    def get_stats(self):
+        """Devuelve una copia de las métricas junto con la profundidad actual de la cola."""
+        with self._cond:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._queue)
+            stats['paused'] = self._paused
+        return stats
+
+    def _take_batch(self):
+        with self._cond:
+            count = min(len(self._queue), self.batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def flush(self):
+        """Escribe todas las filas pendientes. Devuelve el número de filas escritas."""
+        total = 0
+        with self._flush_lock:
+            while not self._paused:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                written = self._write(batch)
+                if not written:
+                    # No insistir en bucle contra una BD que falla
+                    break
+                total += written
+        return total
+
+    def _write(self, batch):
+        from src.models import SensorData
+        from src.rollups import update_rollups
+
+        start = time.perf_counter()
+        with app.app_context():
+            try:
+                db.session.execute(SensorData.__table__.insert(), batch)
+                update_rollups(batch)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self._requeue(batch, e)
+                return 0
+
+        self._failures = 0
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats['written'] += len(batch)
+        self.stats['flushes'] += 1
+        self.stats['last_flush_rows'] = len(batch)
+        self.stats['last_flush_ms'] = round(elapsed_ms, 2)
+        logger.debug(f"📊 {len(batch)} lecturas de sensor guardadas en {elapsed_ms:.1f}ms")
+        return len(batch)
+
+    def _requeue(self, batch, error):
+        """Devuelve un lote fallido a la cabeza de la cola, o lo descarta tras WRITE_RETRIES intentos."""
+        self._failures += 1
+        if self._failures > WRITE_RETRIES:
+            self._failures = 0
+            self.stats['failed'] += len(batch)
+            logger.error(f"❌ Descartado lote de {len(batch)} lecturas de sensor tras {WRITE_RETRIES} reintentos: {error}")
+            return
+        with self._cond:
+            self._queue.extendleft(reversed(batch))
+            # Mismo límite que enqueue: se pierden las más antiguas
+            while len(self._queue) > self.max_pending:
+                self._queue.popleft()
+                self.stats['dropped'] += 1
+        self.stats['retried'] += len(batch)
+        logger.warning(f"⚠️ Error guardando lote de {len(batch)} lecturas de sensor "
+                       f"(intento {self._failures}/{WRITE_RETRIES}), se reintentará: {error}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and (self._paused or len(self._queue) < self.batch_size):
+                    self._cond.wait(self.flush_ms / 1000)
+                if not self._running:
+                    break
+                if self._paused:
+                    continue
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ Error en el escritor de sensores: {e}")
+
+
+sensor_writer = SensorDataWriter()
@@ -0,0 +1,51 @@
+import logging
+
+from src.globals import config
+from src.validation import validate_share_group
+
+logger = logging.getLogger(__name__)
+
+SHARE_PREFIX = '$share'
+
+
+def shared_group():
+    """Grupo de suscripción compartida configurado ('' = suscripciones normales)."""
+    group = (config.get('settings', {}).get('mqtt_shared_group') or '').strip()
+    if not group:
+        return ''
+    valid, error = validate_share_group(group)
+    if not valid:
+        logger.error(f"❌ mqtt_shared_group '{group}' ignorado: {error}")
+        return ''
+    return group
+
+
+def share_topic(topic, group=None):
+    """Topic con el que suscribirse: $share/<grupo>/<topic> si hay grupo.
+
+    El broker (MQTT v5) reparte cada mensaje a un único suscriptor del
+    grupo, y lo entrega con el topic original, así que el resto del código
+    (trie de suscripciones, historial, disparadores) sigue usando el topic
+    sin prefijo.
+    """
+    group = shared_group() if group is None else group
+    return f"{SHARE_PREFIX}/{group}/{topic}" if group else topic
+
+
+def merge_device_views(views):
+    """Combina vistas parciales de dispositivos {device_key: info}.
+
+    Cada info lleva 'seen_at' (epoch del último mensaje recibido). Por
+    dispositivo se aplican las entradas de la más antigua a la más reciente,
+    así que cada campo queda con el último valor conocido aunque lo haya
+    recibido otro worker (p. ej. el firmware de un config y el estado de un
+    status posterior).
+    """
+    entries = sorted(
+        ((info.get('seen_at', 0), device_key, info) for view in views for device_key, info in view.items()),
+        key=lambda entry: entry[0]
+    )
+    merged = {}
+    for _, device_key, info in entries:
+        merged.setdefault(device_key, {}).update(info)
+    return merged
@@ -5,13 +5,11 @@ import uuid
 from datetime import datetime
 from flask import session
 from flask_socketio import emit
-import paho.mqtt.client as mqtt
-from paho.mqtt.client import CallbackAPIVersion
 
 from src.globals import (
     socketio, mqtt_state, global_state, config, db,
-    subscribed_topics, scheduled_tasks, message_triggers, devices, devices_lock,
-    scheduler, message_history, alerts,
+    subscribed_topics, subscription_trie, scheduled_tasks, message_triggers, devices, devices_lock,
+    scheduler, message_history, MAX_MESSAGES, alerts,
     DEVICE_PING_TOPIC, DEVICE_CMD_TOPIC_PREFIX, DEVICE_CMD_BROADCAST_TOPIC
 )
 from src.models import Setting
@@ -30,7 +28,16 @@ from src.persistence import (
     load_message_triggers, save_message_triggers,
     create_message_trigger, update_message_trigger, delete_message_trigger
 )
-from src.mqtt_callbacks import on_connect, on_disconnect, on_message, add_message_to_history
+from src.mqtt_callbacks import add_message_to_history
+from src.device_state import device_state
+from src.connection_manager import connection_manager
+from src.cluster import cluster, leader_event, reply
+from src.broadcaster import broadcaster
+from src.shared_subscriptions import share_topic
+from src.device_stats import device_stats
+from src.state_snapshot import state_snapshot
+from src.db_restore import online_restore
+from src.trigger_engine import compile_condition
 
 
 def send_notification(title, body, notification_type='info', tag='general'):
@@ -105,11 +112,8 @@ from src.validation import validate_topic, validate_payload, validate_device_id,
 
 logger = logging.getLogger(__name__)
 
-def get_current_state():
-    """Devuelve un diccionario con el estado actual de la aplicación."""
-    is_mqtt_connected = mqtt_state['client'] is not None and mqtt_state['client'].is_connected()
-    server_name = global_state['active_server_name']
-    
+def _state_db_part(server_name, is_mqtt_connected):
+    """Parte del estado que sale de la BD/config (cacheada hasta invalidate())."""
     active_server_id = None
     if server_name and server_name != "N/A":
         servers = config.get('servers', {})
@@ -117,37 +121,74 @@ def get_current_state():
             if server.get('name') == server_name:
                 active_server_id = server.get('id')
                 break
-    
+
     current_alerts = []
     if is_mqtt_connected and server_name != "N/A":
         current_alerts = get_alerts(server_name)
 
-    with devices_lock:
-        current_devices = devices.copy()
-
     return {
-        'mqtt_status': {'connected': is_mqtt_connected},
         'active_server_id': active_server_id,
-        'topics': subscribed_topics,
-        'tasks': get_tasks_info(),
-        'devices': current_devices,
         'config': config,
-        'history': message_history,
+        'history_limit': MAX_MESSAGES,
+        'history_capacity': message_history.capacity,
         'alerts': current_alerts,
-        'is_admin': session.get('is_admin', False),
         'access_lists': {
             'whitelist': get_whitelist(server_name) if server_name != "N/A" else []
         },
         'known_devices': get_all_known_devices(),
-        'groups': get_groups(server_name) if server_name != "N/A" else []
+        'groups': get_groups(server_name) if server_name != "N/A" else [],
+    }
+
+def _state_live_part(is_mqtt_connected, view=None):
+    """Parte del estado en memoria (o, en un worker seguidor, la publicada por el líder)."""
+    if view is not None:
+        devices_snapshot = {'seq': view.get('seq', 0), 'devices': view.get('devices', {})}
+        topics, tasks, history = view.get('topics', []), view.get('tasks', []), view.get('history', [])
+    else:
+        devices_snapshot = device_state.snapshot()
+        topics, tasks, history = list(subscribed_topics), get_tasks_info(), message_history.latest(MAX_MESSAGES)
+    return {
+        'mqtt_status': {'connected': is_mqtt_connected},
+        'topics': topics,
+        'tasks': tasks,
+        'devices': devices_snapshot['devices'],
+        'devices_seq': devices_snapshot['seq'],
+        'history': history,
+        'connections': connection_manager.summary()
     }
 
+def get_current_state_encoded():
+    """Estado actual ya serializado y compartido entre clientes (ver src/state_snapshot.py)."""
+    server_name = global_state['active_server_name']
+    view = None
+    if cluster.is_leader():
+        is_mqtt_connected = mqtt_state['client'] is not None and mqtt_state['client'].is_connected()
+        fingerprint = (device_state.seq, message_history.last_id, tuple(subscribed_topics),
+                       is_mqtt_connected, len(scheduled_tasks), server_name)
+    else:
+        # En un worker seguidor el estado en memoria es el que publica el líder
+        view = cluster.shared_view() or {}
+        is_mqtt_connected = view.get('connected', False)
+        fingerprint = ('view', view.get('seq'), tuple(view.get('topics', [])), is_mqtt_connected,
+                       view['history'][-1]['id'] if view.get('history') else None, server_name)
+
+    return state_snapshot.get(
+        (server_name, is_mqtt_connected),
+        lambda: _state_db_part(server_name, is_mqtt_connected),
+        fingerprint,
+        lambda: _state_live_part(is_mqtt_connected, view),
+        session.get('is_admin', False)
+    )
+
+def get_current_state():
+    """Devuelve un diccionario con el estado actual de la aplicación."""
+    return get_current_state_encoded().data
+
 def broadcast_full_update():
     """Recarga la configuración y la envía a todos los clientes."""
     load_config()
-    state = get_current_state()
-    # En lugar de emitir eventos individuales, podríamos emitir un solo 'state_update'
-    socketio.emit('state_update', state)
+    state_snapshot.invalidate()
+    socketio.emit('state_update', get_current_state_encoded())
     logger.info("📢 Configuración actualizada y enviada a todos los clientes.")
 
 @socketio.on('connect')
@@ -161,9 +202,8 @@ def handle_connect(auth=None):
         if not devices and global_state['active_server_name'] != "N/A":
             load_known_devices_to_memory(global_state['active_server_name'])
 
-    # CORRECCIÓN: Enviar un único evento con todo el estado
-    state = get_current_state()
-    emit('state_update', state)
+    # Un único evento con todo el estado, serializado una vez para todos los clientes
+    emit('state_update', get_current_state_encoded())
 
 @socketio.on('request_initial_state')
 def handle_request_initial_state():
@@ -175,18 +215,55 @@ def handle_request_initial_state():
         if not devices and global_state['active_server_name'] != "N/A":
             load_known_devices_to_memory(global_state['active_server_name'])
 
-    # CORRECCIÓN: Enviar un único evento con todo el estado
-    state = get_current_state()
-    emit('state_update', state)
+    emit('state_update', get_current_state_encoded())
 
 @socketio.on('clear_message_history')
+@leader_event('clear_message_history')
 def handle_clear_message_history():
     if not session.get('is_admin'): return
     message_history.clear()
+    broadcaster.discard('history_append')
     logger.info("🗑️ Historial de mensajes limpiado.")
-    emit('history_update', {'history': []}, broadcast=True)
+    socketio.emit('history_update', {'history': []})
+
+@socketio.on('query_message_history')
+def handle_query_message_history(data=None):
+    """Consulta paginada del historial en el servidor.
+
+    data: {'topic': 'iot/+/sala' (opcional, admite + y #), 'direction': 'in'|'out',
+           'before_id': id de la última entrada recibida (para la página siguiente),
+           'limit': tamaño de página (100 por defecto)}
+    """
+    data = data or {}
+    try:
+        limit = int(data.get('limit') or MAX_MESSAGES)
+        before_id = data.get('before_id')
+        before_id = int(before_id) if before_id is not None else None
+    except (ValueError, TypeError):
+        emit('message_history_page', {'success': False, 'message': 'Parámetros de paginación no válidos'})
+        return
+
+    entries = message_history.query(
+        topic=data.get('topic') or None,
+        direction=data.get('direction') or None,
+        before_id=before_id,
+        limit=limit
+    )
+    emit('message_history_page', {
+        'success': True,
+        'entries': entries,
+        'next_before_id': entries[-1]['id'] if len(entries) == limit else None,
+        'total': len(message_history),
+        'capacity': message_history.capacity,
+        'last_id': message_history.last_id
+    })
+
+@socketio.on('get_message_history_topics')
+def handle_get_message_history_topics():
+    emit('message_history_topics', {'topics': message_history.topics()})
 
 @socketio.on('ping_all_devices')
+@leader_event('ping_all_devices')
 def handle_ping_all_devices():
     client = mqtt_state.get('client')
     if not (client and client.is_connected()): return
@@ -195,23 +272,30 @@ def handle_ping_all_devices():
     with devices_lock:
         for device_key in devices:
             devices[device_key]['status'] = 'offline'
-        socketio.emit('devices_update', {'devices': devices})
+    device_state.mark_all(('status',))
     
-    ping_command = json.dumps({"cmd": "PING", "time": int(time.time())})
+    now = time.time()
+    ping_command = json.dumps({"cmd": "PING", "time": int(now)})
     mqtt_qos = int(config['settings'].get('mqtt_default_qos', 1))
     client.publish(DEVICE_PING_TOPIC, ping_command, qos=mqtt_qos)
+    connection_manager.active().pinger.broadcast_sent(now)
+    device_stats.record_broadcast(global_state['active_server_name'])
     status_command = json.dumps({"cmd": "STATUS"})
     client.publish(DEVICE_CMD_BROADCAST_TOPIC, status_command, qos=mqtt_qos)
     
     add_message_to_history('SISTEMA', '📢 Actualización completa solicitada...', direction='out')
 
-    def final_check():
-        socketio.sleep(3)
-        with devices_lock:
-            socketio.emit('devices_update', {'devices': devices})
-    socketio.start_background_task(final_check)
+@socketio.on('request_devices_snapshot')
+def handle_request_devices_snapshot():
+    """Estado completo de dispositivos para clientes que detectan un salto en 'devices_patch'."""
+    if cluster.is_leader():
+        emit('devices_snapshot', device_state.snapshot())
+    else:
+        view = cluster.shared_view() or {}
+        emit('devices_snapshot', {'seq': view.get('seq', 0), 'devices': view.get('devices', {})})
 
 @socketio.on('request_single_device_status')
+@leader_event('request_single_device_status')
 def handle_request_single_device_status(data):
     if not session.get('is_admin'): return
     client = mqtt_state.get('client')
@@ -231,6 +315,7 @@ def handle_request_single_device_status(data):
             add_message_to_history('SISTEMA', f'📢 Solicitando estado a <code>{topic}</code>', direction='out')
 
 @socketio.on('request_device_config')
+@leader_event('request_device_config')
 def handle_request_device_config(data):
     """Solicitar configuración a un dispositivo específico."""
     if not session.get('is_admin'): return
@@ -251,6 +336,7 @@ def handle_request_device_config(data):
             add_message_to_history('SISTEMA', f'⚙️ Solicitando configuración a <code>{topic}</code>', direction='out')
 
 @socketio.on('reboot_device')
+@leader_event('reboot_device')
 def handle_reboot_device(data):
     if not session.get('is_admin'): return
     client = mqtt_state.get('client')
@@ -275,11 +361,12 @@ def handle_get_device_history(data):
     location = data.get('location')
     start_date = data.get('start_date')
     end_date = data.get('end_date')
+    resolution = data.get('resolution')
     
-    logger.info(f"[HISTORY] Solicitud: device={device_id}@{location}, start={start_date}, end={end_date}")
+    logger.info(f"[HISTORY] Solicitud: device={device_id}@{location}, start={start_date}, end={end_date}, resolution={resolution}")
     
     if device_id and location:
-        history_data = get_sensor_data_for_device(device_id, location, start_date, end_date)
+        history_data = get_sensor_data_for_device(device_id, location, start_date, end_date, resolution)
         logger.info(f"[HISTORY] Respuesta: {len(history_data)} registros")
         emit('device_history_response', {'device_id': device_id, 'history': history_data})
 
@@ -295,6 +382,7 @@ def handle_get_device_logs(data):
 
 
 @socketio.on('update_device_alias')
+@leader_event('update_device_alias')
 def handle_update_device_alias(data):
     if not session.get('is_admin'): return
     device_id, location, new_alias = data.get('device_id'), data.get('location'), data.get('new_alias')
@@ -305,13 +393,14 @@ def handle_update_device_alias(data):
             with devices_lock:
                 if device_key in devices:
                     devices[device_key]['name'] = new_alias
-                    emit('devices_update', {'devices': devices}, broadcast=True)
+            device_state.mark(device_key, ('name',))
             add_message_to_history('SISTEMA', f"✏️ Alias actualizado para {device_key}: {new_alias}")
         else:
             logger.error(f"❌ Error al actualizar alias para {device_id}@{location}")
 
 # --- Access Control Handlers ---
 @socketio.on('add_to_whitelist')
+@leader_event('add_to_whitelist')
 def handle_add_to_whitelist(data):
     if not session.get('is_admin'): return
     device_id, location = data.get('device_id'), data.get('location')
@@ -320,6 +409,7 @@ def handle_add_to_whitelist(data):
         broadcast_full_update()
 
 @socketio.on('remove_from_whitelist')
+@leader_event('remove_from_whitelist')
 def handle_remove_from_whitelist(data):
     if not session.get('is_admin'): return
     device_id, location = data.get('device_id'), data.get('location')
@@ -328,90 +418,89 @@ def handle_remove_from_whitelist(data):
         with devices_lock:
             if device_key in devices:
                 del devices[device_key]
+        device_state.mark_removed(device_key)
         broadcast_full_update()
 
 @socketio.on('mqtt_connect')
+@leader_event('mqtt_connect')
 def handle_mqtt_connect(data):
     if not session.get('is_admin'): return
     _internal_mqtt_connect(data)
 
 def _internal_mqtt_connect(data):
-    """Lógica interna de conexión MQTT (sin chequeo de sesión para uso interno)."""
-    if mqtt_state.get('client'):
-        mqtt_state['client'].loop_stop()
-        mqtt_state['client'].disconnect()
-        socketio.sleep(0.1)
+    """Muestra un servidor y lo conecta si aún no lo está (sin chequeo de sesión para uso interno).
 
-    with devices_lock:
-        devices.clear()
-    
+    Las conexiones a los demás servidores siguen abiertas: cambiar de
+    servidor es un cambio de vista, no una reconexión.
+    """
     server_name = data.get('server_name')
-    if server_name and server_name in config.get('servers', {}):
-        global_state['active_server_name'] = server_name
-        global_state['active_server_config'] = config['servers'][server_name]
-    else:
+    if not server_name or server_name not in config.get('servers', {}):
         return
 
-    try:
-        mqtt_keepalive = int(config['settings'].get('mqtt_keepalive', 60))
-        mqtt_reconnect_delay = int(config['settings'].get('mqtt_reconnect_delay', 5))
-        mqtt_clean_session = config['settings'].get('mqtt_clean_session', 'true') == 'true'
-
-        client_userdata = {'server_name': global_state['active_server_name']}
-        client_id = f"flask-mqtt-dashboard-{uuid.uuid4()}"
-        new_client = mqtt.Client(client_id=client_id, callback_api_version=CallbackAPIVersion.VERSION2, userdata=client_userdata, clean_session=mqtt_clean_session)
-        new_client.on_connect = on_connect
-        new_client.on_disconnect = on_disconnect
-        new_client.on_message = on_message
-
-        if global_state['active_server_config'].get('username'):
-            new_client.username_pw_set(global_state['active_server_config']['username'], global_state['active_server_config'].get('password'))
-
-        new_client.connect(global_state['active_server_config']['broker'], global_state['active_server_config']['port'], mqtt_keepalive)
-        new_client.loop_start()
-
-        new_client.reconnect_delay_set(min_delay=mqtt_reconnect_delay, max_delay=mqtt_reconnect_delay * 2)
+    switched = connection_manager.active_name != server_name
+    conn = connection_manager.activate(server_name)
+    if switched:
+        save_last_selected_server()
+        device_state.broadcast_snapshot()
+        socketio.emit('state_update', get_current_state_encoded())
 
-        mqtt_state['client'] = new_client
-        mqtt_state['auto_reconnect'] = True
+    if conn.is_connected():
+        return
+    try:
+        connection_manager.connect(server_name)
         save_last_selected_server()
-        logger.info(f"🔄 Conectado a {global_state['active_server_config']['broker']}:{global_state['active_server_config']['port']} (Servidor: {global_state['active_server_name']}, keepalive={mqtt_keepalive}, reconnect={mqtt_reconnect_delay}s, clean_session={mqtt_clean_session})")
     except Exception as e:
         logger.error(f"❌ Error al conectar: {e}")
-        emit('mqtt_status', {'connected': False, 'message': f'❌ Error: {str(e)}', 'timestamp': datetime.now().strftime('%H:%M:%S')})
+        reply('mqtt_status', {'connected': False, 'message': f'❌ Error: {str(e)}', 'timestamp': datetime.now().strftime('%H:%M:%S')})
 
 @socketio.on('mqtt_disconnect')
-def handle_mqtt_disconnect():
+@leader_event('mqtt_disconnect')
+def handle_mqtt_disconnect(data=None):
+    """Desconecta un servidor (por defecto el que se está mostrando)."""
     if not session.get('is_admin'): return
-    client = mqtt_state.get('client')
-    if client:
-        mqtt_state['user_disconnected'] = True
-        mqtt_state['auto_reconnect'] = False
-        client.loop_stop()
-        client.disconnect()
+    server_name = (data or {}).get('server_name') or connection_manager.active_name
+    conn = connection_manager.disconnect(server_name)
+    if conn and conn.active:
         socketio.emit('mqtt_status', {'connected': False})
 
+@socketio.on('get_connections')
+def handle_get_connections():
+    emit('connections_update', {'connections': connection_manager.summary()})
+
 # --- Server Management Handlers ---
 @socketio.on('add_server')
+@leader_event('add_server')
 def handle_add_server(data):
     if not session.get('is_admin'): return
     if add_server(data):
         broadcast_full_update()
 
 @socketio.on('update_server')
+@leader_event('update_server')
 def handle_update_server(data):
     if not session.get('is_admin'): return
+    old_config = next((dict(s) for s in config.get('servers', {}).values() if s.get('id') == data['id']), None)
     if update_server(data['id'], data):
+        if old_config:
+            # Antes de load_config: la vista activa debe seguir apuntando a este servidor
+            connection_manager.rename(old_config['name'], data['name'])
         broadcast_full_update()
+        if old_config:
+            connection_manager.reconnect_if_changed(data['name'], old_config)
 
 @socketio.on('delete_server')
+@leader_event('delete_server')
 def handle_delete_server(data):
     if not session.get('is_admin'): return
+    server_name = next((s['name'] for s in config.get('servers', {}).values() if s.get('id') == data['id']), None)
     if delete_server(data['id']):
+        if server_name:
+            connection_manager.remove(server_name)
         broadcast_full_update()
 
 # --- Settings Handler ---
 @socketio.on('save_settings')
+@leader_event('save_settings')
 def handle_save_settings(data):
     if not session.get('is_admin'): return
     logger.info(f"💾 Recibida petición para guardar ajustes: {data}")
@@ -440,6 +529,7 @@ def handle_save_settings(data):
         db.session.rollback()
 
 @socketio.on('update_mqtt_config')
+@leader_event('update_mqtt_config')
 def handle_update_mqtt_config(data):
     """Actualizar configuración MQTT."""
     if not session.get('is_admin'): return
@@ -463,12 +553,12 @@ def handle_update_mqtt_config(data):
 
         db.session.commit()
         logger.info(f"⚙️ Configuración MQTT guardada exitosamente.")
-        emit('mqtt_config_updated', {'success': True})
+        reply('mqtt_config_updated', {'success': True})
         broadcast_full_update()
     except Exception as e:
         logger.error(f"❌ Error guardando configuración MQTT: {e}", exc_info=True)
         db.session.rollback()
-        emit('mqtt_config_updated', {'success': False, 'message': str(e)})
+        reply('mqtt_config_updated', {'success': False, 'message': str(e)})
 
 @socketio.on('change_password')
 def handle_change_password(data):
@@ -482,18 +572,21 @@ def handle_change_password(data):
 
 # --- Alert Handlers ---
 @socketio.on('add_alert')
+@leader_event('add_alert')
 def handle_add_alert(data):
     if not session.get('is_admin'): return
     if add_alert(global_state['active_server_name'], data):
         broadcast_full_update()
 
 @socketio.on('update_alert')
+@leader_event('update_alert')
 def handle_update_alert(data):
     if not session.get('is_admin'): return
     if update_alert(data['id'], data):
         broadcast_full_update()
 
 @socketio.on('delete_alert')
+@leader_event('delete_alert')
 def handle_delete_alert(data):
     if not session.get('is_admin'): return
     if delete_alert(data['id']):
@@ -501,18 +594,21 @@ def handle_delete_alert(data):
 
 # --- Group Handlers ---
 @socketio.on('add_group')
+@leader_event('add_group')
 def handle_add_group(data):
     if not session.get('is_admin'): return
     if add_group(global_state['active_server_name'], data):
         broadcast_full_update()
 
 @socketio.on('update_group')
+@leader_event('update_group')
 def handle_update_group(data):
     if not session.get('is_admin'): return
     if update_group(data['id'], data):
         broadcast_full_update()
 
 @socketio.on('delete_group')
+@leader_event('delete_group')
 def handle_delete_group(data):
     if not session.get('is_admin'): return
     if delete_group(data['id']):
@@ -520,23 +616,26 @@ def handle_delete_group(data):
 
 # --- Subscription Handlers ---
 @socketio.on('mqtt_subscribe')
+@leader_event('mqtt_subscribe')
 def handle_mqtt_subscribe(data):
     if not session.get('is_admin'): return
     topic = data.get('topic')
     valid, error = validate_topic(topic)
     if not valid:
         logger.warning(f"Intento de suscripción con topic inválido: {topic} - {error}")
-        emit('error', {'message': f'Topic inválido: {error}'})
+        reply('error', {'message': f'Topic inválido: {error}'})
         return
     client = mqtt_state.get('client')
     if client and client.is_connected() and topic and topic not in subscribed_topics:
-        client.subscribe(topic)
+        client.subscribe(share_topic(topic))
         subscribed_topics.append(topic)
+        subscription_trie.add(topic)
         save_subscriptions(global_state['active_server_name'], subscribed_topics)
         add_message_to_history('SISTEMA', f'✅ Suscrito a {topic}')
-        emit('topics_update', {'topics': subscribed_topics}, broadcast=True)
+        broadcaster.emit('topics_update', {'topics': list(subscribed_topics)})
 
 @socketio.on('mqtt_unsubscribe')
+@leader_event('mqtt_unsubscribe')
 def handle_mqtt_unsubscribe(data):
     if not session.get('is_admin'): return
     topic = data.get('topic')
@@ -546,11 +645,12 @@ def handle_mqtt_unsubscribe(data):
         return
     client = mqtt_state.get('client')
     if client and topic and topic in subscribed_topics:
-        client.unsubscribe(topic)
+        client.unsubscribe(share_topic(topic))
         subscribed_topics.remove(topic)
+        subscription_trie.remove(topic)
         save_subscriptions(global_state['active_server_name'], subscribed_topics)
         add_message_to_history('SISTEMA', f'⚠️ Desuscrito de {topic}')
-        emit('topics_update', {'topics': subscribed_topics}, broadcast=True)
+        broadcaster.emit('topics_update', {'topics': list(subscribed_topics)})
 
 
 # --- Device Events Handler ---
@@ -575,8 +675,34 @@ def handle_get_device_events(data):
         'events': events
     })
 
+# --- Ingest Metrics Handler ---
+@socketio.on('get_ingest_stats')
+def handle_get_ingest_stats():
+    if not session.get('is_admin'): return
+    from src.sensor_writer import sensor_writer
+    from src.ingest_pipeline import ingest_pipeline
+    from src import db_tuning
+    from src.sensor_archive import sensor_archive
+    from src.retention import retention
+    try:
+        database = db_tuning.describe(db.engine)
+    except Exception as e:
+        database = {'error': str(e)}
+    emit('ingest_stats', {
+        'cluster': cluster.get_stats(),
+        'device_stats': device_stats.get_stats(),
+        'state_snapshot': state_snapshot.get_stats(),
+        'pipeline': ingest_pipeline.get_stats(),
+        'sensor_writer': sensor_writer.get_stats(),
+        'archive': sensor_archive.get_stats(),
+        'retention': retention.get_stats(),
+        'broadcaster': broadcaster.get_stats(),
+        'database': database
+    })
+
 # --- Publish Handler ---
 @socketio.on('mqtt_publish')
+@leader_event('mqtt_publish')
 def handle_mqtt_publish(data):
     if not session.get('is_admin'): return
     topic = data.get('topic')
@@ -585,11 +711,11 @@ def handle_mqtt_publish(data):
     valid_payload, payload_error = validate_payload(payload)
     if not valid_topic:
         logger.warning(f"Intento de publicación con topic inválido: {topic}")
-        emit('error', {'message': f'Topic inválido: {topic_error}'})
+        reply('error', {'message': f'Topic inválido: {topic_error}'})
         return
     if not valid_payload:
         logger.warning(f"Intento de publicación con payload demasiado grande: {len(str(payload))} bytes")
-        emit('error', {'message': f'Payload inválido: {payload_error}'})
+        reply('error', {'message': f'Payload inválido: {payload_error}'})
         return
     client = mqtt_state.get('client')
     if client and client.is_connected() and topic:
@@ -611,6 +737,7 @@ def get_tasks_info():
     return tasks_info
 
 @socketio.on('task_create')
+@leader_event('task_create')
 def handle_task_create(data):
     if not session.get('is_admin'): return
     try:
@@ -621,12 +748,13 @@ def handle_task_create(data):
         scheduled_tasks[task_id] = {**data, 'schedule_info': schedule_info, 'enabled': True, 'executions': 0, 'last_run': 'Nunca'}
         save_tasks(global_state['active_server_name'])
         add_message_to_history('SISTEMA', f"✅ Tarea creada: {data['name']}")
-        emit('task_update', {'tasks': get_tasks_info()}, broadcast=True)
+        broadcaster.emit('task_update', {'tasks': get_tasks_info()})
     except Exception as e:
         logger.error(f"❌ Error al crear tarea: {e}")
         add_message_to_history('ERROR', f"❌ Error al crear tarea: {e}")
 
 @socketio.on('task_delete')
+@leader_event('task_delete')
 def handle_task_delete(data):
     if not session.get('is_admin'): return
     task_id = data.get('task_id')
@@ -636,9 +764,10 @@ def handle_task_delete(data):
             scheduler.remove_job(task_id)
         save_tasks(global_state['active_server_name'])
         add_message_to_history('SISTEMA', f"🗑️ Tarea eliminada: {task_name}")
-        emit('task_update', {'tasks': get_tasks_info()}, broadcast=True)
+        broadcaster.emit('task_update', {'tasks': get_tasks_info()})
 
 @socketio.on('task_toggle')
+@leader_event('task_toggle')
 def handle_task_toggle(data):
     if not session.get('is_admin'): return
     task_id = data.get('task_id')
@@ -652,9 +781,10 @@ def handle_task_toggle(data):
             scheduler.pause_job(task_id)
         save_tasks(global_state['active_server_name'])
         add_message_to_history('SISTEMA', f"⏯️ Tarea {status}: {task['name']}")
-        emit('task_update', {'tasks': get_tasks_info()}, broadcast=True)
+        broadcaster.emit('task_update', {'tasks': get_tasks_info()})
 
 @socketio.on('task_edit')
+@leader_event('task_edit')
 def handle_task_edit(data):
     if not session.get('is_admin'): return
     try:
@@ -668,43 +798,49 @@ def handle_task_edit(data):
         scheduled_tasks[task_id].update({**data, 'schedule_info': schedule_info, 'enabled': True})
         save_tasks(global_state['active_server_name'])
         add_message_to_history('SISTEMA', f"✏️ Tarea editada: {data['name']}")
-        emit('task_update', {'tasks': get_tasks_info()}, broadcast=True)
+        broadcaster.emit('task_update', {'tasks': get_tasks_info()})
     except Exception as e:
         logger.error(f"❌ Error al editar tarea: {e}")
         add_message_to_history('ERROR', f"Error editing task: {e}")
 
 
 @socketio.on('message_trigger_create')
+@leader_event('message_trigger_create')
 def handle_message_trigger_create(data):
     if not session.get('is_admin'): return
     try:
+        compile_condition(data.get('trigger_condition'))
         trigger_id = str(uuid.uuid4())
         if create_message_trigger(global_state['active_server_name'], {**data, 'id': trigger_id}):
             load_message_triggers(global_state['active_server_name'])
             add_message_to_history('SYSTEM', f"Message trigger created: {data['name']}")
-            emit('message_triggers_update', {'triggers': list(message_triggers.values())}, broadcast=True)
+            broadcaster.emit('message_triggers_update', {'triggers': list(message_triggers.values())})
     except Exception as e:
         logger.error(f"Error creating message trigger: {e}")
         add_message_to_history('ERROR', f"Error creating message trigger: {e}")
 
 
 @socketio.on('message_trigger_edit')
+@leader_event('message_trigger_edit')
 def handle_message_trigger_edit(data):
     if not session.get('is_admin'): return
     try:
         trigger_id = data.get('trigger_id')
+        if 'trigger_condition' in data:
+            compile_condition(data.get('trigger_condition'))
         if update_message_trigger(trigger_id, data):
             if trigger_id in message_triggers:
                 message_triggers[trigger_id].update(data)
             save_message_triggers(global_state['active_server_name'])
             add_message_to_history('SYSTEM', f"Message trigger edited: {data['name']}")
-            emit('message_triggers_update', {'triggers': list(message_triggers.values())}, broadcast=True)
+            broadcaster.emit('message_triggers_update', {'triggers': list(message_triggers.values())})
     except Exception as e:
         logger.error(f"Error editing message trigger: {e}")
         add_message_to_history('ERROR', f"Error editing message trigger: {e}")
 
 
 @socketio.on('message_trigger_delete')
+@leader_event('message_trigger_delete')
 def handle_message_trigger_delete(data):
     if not session.get('is_admin'): return
     try:
@@ -715,13 +851,14 @@ def handle_message_trigger_delete(data):
         if delete_message_trigger(trigger_id):
             save_message_triggers(global_state['active_server_name'])
             add_message_to_history('SYSTEM', f"Message trigger deleted: {trigger_name}")
-            emit('message_triggers_update', {'triggers': list(message_triggers.values())}, broadcast=True)
+            broadcaster.emit('message_triggers_update', {'triggers': list(message_triggers.values())})
     except Exception as e:
         logger.error(f"Error deleting message trigger: {e}")
         add_message_to_history('ERROR', f"Error deleting message trigger: {e}")
 
 
 @socketio.on('message_trigger_toggle')
+@leader_event('message_trigger_toggle')
 def handle_message_trigger_toggle(data):
     if not session.get('is_admin'): return
     try:
@@ -733,7 +870,7 @@ def handle_message_trigger_toggle(data):
             update_message_trigger(trigger_id, {'enabled': trigger['enabled']})
             save_message_triggers(global_state['active_server_name'])
             add_message_to_history('SYSTEM', f"Message trigger {status}: {trigger['name']}")
-            emit('message_triggers_update', {'triggers': list(message_triggers.values())}, broadcast=True)
+            broadcaster.emit('message_triggers_update', {'triggers': list(message_triggers.values())})
     except Exception as e:
         logger.error(f"Error toggling message trigger: {e}")
 
@@ -753,6 +890,23 @@ def handle_get_device_detail(data):
         emit('error', {'message': 'No se pudo obtener el detalle del dispositivo'})
 
 
+@socketio.on('get_fleet_stats')
+def handle_get_fleet_stats(data=None):
+    """Latencia (percentiles), disponibilidad y PINGs perdidos de todos los dispositivos del servidor activo."""
+    if not session.get('is_admin'): return
+    data = data or {}
+    try:
+        limit = int(data['limit']) if data.get('limit') else None
+    except (ValueError, TypeError):
+        limit = None
+    server_name = global_state['active_server_name']
+    emit('fleet_stats', {
+        'server_name': server_name,
+        'sort': data.get('sort', 'p90'),
+        'devices': device_stats.fleet(server_name, sort=data.get('sort', 'p90'), limit=limit)
+    })
+
+
 # --- Backup Handlers ---
 @socketio.on('request_backups')
 def handle_request_backups():
@@ -772,6 +926,7 @@ def handle_request_backups():
 
 
 @socketio.on('trigger_backup')
+@leader_event('trigger_backup')
 def handle_trigger_backup():
     """Trigger backup manual."""
     if not session.get('is_admin'): return
@@ -783,17 +938,18 @@ def handle_trigger_backup():
         
         if result:
             backups = manager.get_backups_for_ui()
-            emit('backup_complete', {'success': True, 'backups': backups})
-            add_message_to_history('SISTEMA', '✅ Backup manual completado')
+            reply('backup_complete', {'success': True, 'backups': backups, 'stats': manager.last_stats})
+            add_message_to_history('SISTEMA', f"✅ Backup manual completado ({manager.last_stats.get('throughput_mb_s', 0)} MB/s)")
             logger.info("✅ Backup manual completado")
         else:
-            emit('backup_complete', {'success': False})
+            reply('backup_complete', {'success': False})
     except Exception as e:
         logger.error(f"❌ Error en backup manual: {e}")
-        emit('backup_complete', {'success': False})
+        reply('backup_complete', {'success': False})
 
 
 @socketio.on('update_backup_config')
+@leader_event('update_backup_config')
 def handle_update_backup_config(data):
     """Actualizar configuración de backup y reconfigurar scheduler."""
     if not session.get('is_admin'): return
@@ -852,20 +1008,21 @@ def handle_update_backup_config(data):
             else:
                 logger.info("Job backup deshabilitado")
 
-        emit('backup_config_updated', {'success': True})
+        reply('backup_config_updated', {'success': True})
     except Exception as e:
         logger.error(f"Error actualizando config de backup: {e}")
-        emit('backup_config_updated', {'success': False, 'error': str(e)})
+        reply('backup_config_updated', {'success': False, 'error': str(e)})
 
 
 @socketio.on('restore_backup')
+@leader_event('restore_backup')
 def handle_restore_backup(data):
     """Restaurar base de datos desde backup."""
     if not session.get('is_admin'): return
     
     filename = data.get('filename')
     if not filename:
-        emit('error', {'message': 'Selecciona un backup'})
+        reply('error', {'message': 'Selecciona un backup'})
         return
     
     try:
@@ -874,24 +1031,29 @@ def handle_restore_backup(data):
         backup_path = manager.backup_path / filename
         
         if not backup_path.exists():
-            emit('error', {'message': 'Archivo de backup no encontrado'})
+            reply('error', {'message': 'Archivo de backup no encontrado'})
             return
         
-        result = manager.restore_backup(backup_path)
-        
-        if result:
-            emit('restore_complete', {'success': True})
-            add_message_to_history('SISTEMA', f'♻️ Restaurado desde: {filename}')
-            logger.info(f"✅ Restaurado backup: {filename}")
-        else:
-            emit('restore_complete', {'success': False})
-            add_message_to_history('ERROR', f'❌ Error restaurando: {filename}')
+        # Se restaura en segundo plano y sin reiniciar: ver src/db_restore.py
+        if not online_restore.start(backup_path, _on_restore_done):
+            reply('error', {'message': 'Ya hay una restauración en curso'})
     except Exception as e:
         logger.error(f"❌ Error restaurando backup: {e}")
-        emit('restore_complete', {'success': False})
+        reply('restore_complete', {'success': False})
+
+
+def _on_restore_done(result):
+    """Notifica a todos los clientes el resultado de una restauración en segundo plano."""
+    if result['success']:
+        add_message_to_history('SISTEMA', f"♻️ Restaurado desde: {result['filename']} ({result['duration_s']}s)")
+        broadcast_full_update()
+    else:
+        add_message_to_history('ERROR', f"❌ Error restaurando: {result['filename']}")
+    socketio.emit('restore_complete', result)
 
 
 @socketio.on('delete_backup')
+@leader_event('delete_backup')
 def handle_delete_backup(data):
     """Eliminar archivo de backup."""
     if not session.get('is_admin'): return
@@ -907,14 +1069,14 @@ def handle_delete_backup(data):
         
         if result:
             backups = manager.get_backups_for_ui()
-            emit('backup_deleted', {'success': True, 'filename': filename, 'backups': backups})
+            reply('backup_deleted', {'success': True, 'filename': filename, 'backups': backups})
             add_message_to_history('SISTEMA', f'🗑️ Eliminado: {filename}')
             logger.info(f"🗑️ Eliminado backup: {filename}")
         else:
-            emit('backup_deleted', {'success': False, 'filename': filename})
+            reply('backup_deleted', {'success': False, 'filename': filename})
     except Exception as e:
         logger.error(f"❌ Error eliminando backup: {e}")
-        emit('backup_deleted', {'success': False, 'filename': filename})
+        reply('backup_deleted', {'success': False, 'filename': filename})
 
 
 @socketio.on('restart_server')
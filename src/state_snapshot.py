@@ -0,0 +1,127 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 60     # s de vida máxima de la parte de BD (cambios fuera de los handlers, otros workers)
+LIVE_MAX_AGE = 5         # s de vida máxima de la parte en memoria (próximas ejecuciones de tareas)
+
+
+class PreEncoded:
+    """Carga útil de un evento ya serializada a JSON.
+
+    SnapshotJSON la inserta tal cual en el paquete Socket.IO, así que un
+    mismo estado se serializa una vez aunque se envíe a cientos de clientes.
+    No es un dict a propósito: python-socketio no la recorre buscando
+    datos binarios.
+    """
+    __slots__ = ('data', 'encoded')
+
+    def __init__(self, data, encoded=None):
+        self.data = data
+        self.encoded = encoded if encoded is not None else _dumps(data)
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'), default=str)
+
+
+class _Encoder(json.JSONEncoder):
+    def default(self, o):
+        # Fuera de un paquete (p. ej. al publicarse en la cola del cluster) se serializa el contenido
+        if isinstance(o, PreEncoded):
+            return o.data
+        return super().default(o)
+
+
+class SnapshotJSON:
+    """Módulo json para SocketIO(json=...) que respeta las cargas PreEncoded."""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        if isinstance(obj, list) and obj and isinstance(obj[-1], PreEncoded):
+            head = json.dumps(obj[:-1], *args, cls=_Encoder, **kwargs)
+            return head[:-1] + (',' if len(obj) > 1 else '') + obj[-1].encoded + ']'
+        return json.dumps(obj, *args, cls=_Encoder, **kwargs)
+
+    @staticmethod
+    def loads(*args, **kwargs):
+        return json.loads(*args, **kwargs)
+
+
+class StateSnapshot:
+    """Instantánea versionada del estado inicial que se envía a cada navegador.
+
+    El estado se divide en dos partes que se cachean ya serializadas:
+
+      - 'db': alertas, whitelist, dispositivos conocidos, grupos y config.
+        Es la parte cara (consultas a SQLite). Se reconstruye cuando algún
+        handler que modifica estado llama a invalidate() (sube la versión),
+        cuando cambia la clave (servidor activo, conectado) o al pasar max_age.
+      - 'live': dispositivos, topics, tareas, historial y conexiones. Está en
+        memoria pero es grande; se reutiliza mientras no cambien su huella
+        (seq de dispositivos, último mensaje del historial, topics...).
+
+    Con 200 navegadores reconectando a la vez se construye y serializa el
+    estado una vez; el resto recibe la misma cadena JSON.
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._version = 0
+        self._db = None      # (version, key, built_at, PreEncoded)
+        self._live = None    # (version, fingerprint, PreEncoded)
+        self.stats = {'hits': 0, 'db_builds': 0, 'live_builds': 0, 'invalidations': 0}
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self.stats['invalidations'] += 1
+
+    def get(self, db_key, build_db, live_fingerprint, build_live, is_admin, now=None):
+        """Estado completo como PreEncoded.
+
+        build_db() y build_live() devuelven dicts con claves disjuntas; solo se
+        llaman si la parte correspondiente no está en caché.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            version = self._version
+            cached = self._db
+            if (not self.enabled or cached is None or cached[0] != version or cached[1] != db_key
+                    or now - cached[2] > self.max_age):
+                cached = (version, db_key, now, PreEncoded(build_db()))
+                self._db = cached
+                self.stats['db_builds'] += 1
+            else:
+                self.stats['hits'] += 1
+            db_part = cached[3]
+
+            live_fingerprint = (live_fingerprint, int(now // LIVE_MAX_AGE))
+            live = self._live
+            if not self.enabled or live is None or live[0] != version or live[1] != live_fingerprint:
+                live = (version, live_fingerprint, PreEncoded(build_live()))
+                self._live = live
+                self.stats['live_builds'] += 1
+            live_part = live[2]
+
+        data = dict(db_part.data)
+        data.update(live_part.data)
+        data['is_admin'] = bool(is_admin)
+        parts = [part.encoded[1:-1] for part in (db_part, live_part) if part.data]
+        parts.append('"is_admin":' + ('true' if is_admin else 'false'))
+        return PreEncoded(data, '{' + ','.join(parts) + '}')
+
+    def get_stats(self):
+        return dict(self.stats, version=self._version)
+
+
+state_snapshot = StateSnapshot()
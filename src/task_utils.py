@@ -6,7 +6,10 @@ from datetime import datetime
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
 
-from src.globals import mqtt_state, socketio, app, config
+from src.globals import socketio, app, config
+from src.broadcaster import broadcaster
+from src.db_gate import db_gate
+from src.shared_subscriptions import share_topic
 
 logger = logging.getLogger(__name__)
 
@@ -165,17 +168,21 @@ def handle_response_action(response_action, response_data, task_name):
 
 def execute_scheduled_task(task_id, topic, payload, task_data=None):
     """Ejecuta una tarea programada: publica MQTT y actualiza BD."""
-    with app.app_context():
+    with db_gate.hold(), app.app_context():
         from src.persistence import update_task_execution
-        from src.globals import scheduled_tasks
+        from src.connection_manager import connection_manager
         from src.mqtt_callbacks import add_message_to_history
 
+        # Tareas y cliente del servidor al que pertenece la tarea
+        conn = connection_manager.find_task(task_id)
+        scheduled_tasks = conn.tasks
+
         # Get task data if not provided
         if task_data is None and task_id in scheduled_tasks:
             task_data = scheduled_tasks[task_id]
 
         try:
-            client = mqtt_state.get('client')
+            client = conn.client
             if client and client.is_connected():
                 processed_payload = process_placeholders(payload, task_id)
                 mqtt_qos = int(config['settings'].get('mqtt_default_qos', 1))
@@ -199,7 +206,7 @@ def execute_scheduled_task(task_id, topic, payload, task_data=None):
 
                 # Handle response analysis if enabled
                 if task_data and task_data.get('response_enabled'):
-                    _handle_response_analysis(task_id, topic, task_data)
+                    _handle_response_analysis(task_id, topic, task_data, conn)
 
             else:
                 logger.warning(f"Task skipped (MQTT disconnected): {topic}")
@@ -208,9 +215,9 @@ def execute_scheduled_task(task_id, topic, payload, task_data=None):
             logger.error(f"Error executing task {task_id}: {e}")
 
 
-def _handle_response_analysis(task_id, topic, task_data):
+def _handle_response_analysis(task_id, topic, task_data, conn):
     """Handle response analysis after publishing a task."""
-    from src.globals import subscribed_topics, devices_lock, devices
+    from src.globals import devices_lock
 
     response_topic = task_data.get('response_topic')
     if not response_topic:
@@ -222,12 +229,14 @@ def _handle_response_analysis(task_id, topic, task_data):
 
     # Subscribe to response topic if not already subscribed
     with devices_lock:
-        if response_topic not in subscribed_topics:
-            client = mqtt_state.get('client')
+        if response_topic not in conn.topics:
+            client = conn.client
             if client and client.is_connected():
-                client.subscribe(response_topic)
-                subscribed_topics.append(response_topic)
-                socketio.emit('topics_update', {'topics': subscribed_topics})
+                client.subscribe(share_topic(response_topic))
+                conn.topics.append(response_topic)
+                conn.trie.add(response_topic)
+                if conn.active:
+                    broadcaster.emit('topics_update', {'topics': conn.topics})
                 logger.debug(f"Subscribed to response topic: {response_topic}")
 
     # Store pending response check
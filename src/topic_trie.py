@@ -0,0 +1,185 @@
+import threading
+
+
+def topic_matches(topic, subscription):
+    """Comprueba si un topic coincide con una suscripción MQTT (soporta + y #)."""
+    if subscription == "#":
+        return True
+
+    topic_parts = topic.split('/')
+    sub_parts = subscription.split('/')
+
+    i = 0
+    while i < len(sub_parts):
+        if sub_parts[i] == '#':
+            return True
+        if i >= len(topic_parts):
+            return False
+        if sub_parts[i] != '+' and sub_parts[i] != topic_parts[i]:
+            return False
+        i += 1
+
+    return i == len(topic_parts)
+
+
+class _TrieNode:
+    __slots__ = ('children', 'subscription')
+
+    def __init__(self):
+        self.children = {}
+        self.subscription = None
+
+
+class TopicTrie:
+    """Índice de suscripciones MQTT en forma de árbol por niveles de topic.
+
+    Cada nivel de una suscripción es un nodo; los comodines '+' y '#' se
+    guardan como hijos normales y se exploran en paralelo al buscar. Así,
+    averiguar qué suscripciones coinciden con un topic cuesta O(profundidad
+    del topic) en lugar de recorrer toda la lista con topic_matches().
+
+    Las escrituras se serializan con un lock; las lecturas no lo necesitan
+    porque rebuild() sustituye la raíz de forma atómica.
+    """
+
+    def __init__(self, subscriptions=None):
+        self._lock = threading.Lock()
+        self._root = _TrieNode()
+        self._count = 0
+        if subscriptions:
+            self.rebuild(subscriptions)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, subscription):
+        node = self._root
+        for level in subscription.split('/'):
+            node = node.children.get(level)
+            if node is None:
+                return False
+        return node.subscription is not None
+
+    @staticmethod
+    def _insert(root, subscription):
+        node = root
+        for level in subscription.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _TrieNode()
+            node = child
+        if node.subscription is not None:
+            return False
+        node.subscription = subscription
+        return True
+
+    def add(self, subscription):
+        """Añade una suscripción. Devuelve False si ya existía."""
+        with self._lock:
+            added = self._insert(self._root, subscription)
+            if added:
+                self._count += 1
+            return added
+
+    def remove(self, subscription):
+        """Elimina una suscripción y poda las ramas vacías. Devuelve False si no existía."""
+        with self._lock:
+            path = [self._root]
+            levels = subscription.split('/')
+            for level in levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+
+            if path[-1].subscription is None:
+                return False
+            path[-1].subscription = None
+            self._count -= 1
+
+            for depth in range(len(levels), 0, -1):
+                node = path[depth]
+                if node.subscription is not None or node.children:
+                    break
+                del path[depth - 1].children[levels[depth - 1]]
+            return True
+
+    def clear(self):
+        """Elimina todas las suscripciones."""
+        with self._lock:
+            self._root = _TrieNode()
+            self._count = 0
+
+    def rebuild(self, subscriptions):
+        """Reconstruye el índice completo a partir de una lista de suscripciones."""
+        root = _TrieNode()
+        count = 0
+        for subscription in subscriptions:
+            if self._insert(root, subscription):
+                count += 1
+        with self._lock:
+            self._root = root
+            self._count = count
+
+    def matches(self, topic):
+        """Devuelve la lista de suscripciones que coinciden con el topic."""
+        levels = topic.split('/')
+        depth_max = len(levels)
+        result = []
+        stack = [(self._root, 0)]
+
+        while stack:
+            node, depth = stack.pop()
+            children = node.children
+
+            multi = children.get('#')
+            if multi is not None and multi.subscription is not None:
+                result.append(multi.subscription)
+
+            if depth == depth_max:
+                if node.subscription is not None:
+                    result.append(node.subscription)
+                continue
+
+            level = levels[depth]
+            if level != '#':
+                child = children.get(level)
+                if child is not None:
+                    stack.append((child, depth + 1))
+            if level != '+':
+                single = children.get('+')
+                if single is not None:
+                    stack.append((single, depth + 1))
+
+        return result
+
+    def has_match(self, topic):
+        """Indica si alguna suscripción coincide con el topic."""
+        levels = topic.split('/')
+        depth_max = len(levels)
+        stack = [(self._root, 0)]
+
+        while stack:
+            node, depth = stack.pop()
+            children = node.children
+
+            multi = children.get('#')
+            if multi is not None and multi.subscription is not None:
+                return True
+
+            if depth == depth_max:
+                if node.subscription is not None:
+                    return True
+                continue
+
+            level = levels[depth]
+            if level != '#':
+                child = children.get(level)
+                if child is not None:
+                    stack.append((child, depth + 1))
+            if level != '+':
+                single = children.get('+')
+                if single is not None:
+                    stack.append((single, depth + 1))
+
+        return False
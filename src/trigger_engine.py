@@ -0,0 +1,272 @@
+import ast
+import logging
+import operator
+import re
+import threading
+
+from src.topic_trie import TopicTrie
+from src.active_view import ActiveProxy
+
+logger = logging.getLogger(__name__)
+
+# Forma simple "campo op valor" (el valor es un número, 'texto' o una palabra)
+_SIMPLE_CONDITION = re.compile(r"^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*('[^']*'|\S+)\s*$")
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+}
+# Con operandos no numéricos repiten o formatean texto ('a' * 10**9, '%999999999d' % 1)
+_NUMERIC_ONLY_OPS = (ast.Mult, ast.Mod)
+_UNARY_OPS = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+_SYMBOLS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+
+class ConditionError(ValueError):
+    """La condición de un trigger no es válida o usa construcciones no permitidas."""
+
+
+class _Missing(Exception):
+    """Un campo referenciado no existe en el payload."""
+
+
+def _compile_simple(field, op, raw_value):
+    """'campo op valor': == y != comparan tal cual; el resto convierte a float."""
+    if raw_value.startswith("'") and raw_value.endswith("'"):
+        value = raw_value[1:-1]
+    else:
+        try:
+            value = float(raw_value)
+        except ValueError:
+            value = raw_value
+    compare = _SYMBOLS[op]
+    numeric = op not in ('==', '!=')
+
+    def condition(payload):
+        if not isinstance(payload, dict):
+            return False
+        field_value = payload.get(field)
+        if not numeric:
+            return compare(field_value, value)
+        try:
+            return compare(float(field_value), float(value))
+        except (ValueError, TypeError):
+            return False
+
+    return condition
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _compile_node(node):
+    """Convierte un nodo AST permitido en una función payload -> valor."""
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body)
+
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda payload: value
+
+    if isinstance(node, ast.Name):
+        if node.id in ('True', 'False', 'None'):
+            value = {'True': True, 'False': False, 'None': None}[node.id]
+            return lambda payload: value
+        name = node.id
+
+        def load_name(payload):
+            if isinstance(payload, dict) and name in payload:
+                return payload[name]
+            raise _Missing(name)
+        return load_name
+
+    if isinstance(node, ast.Attribute):
+        # sensor.temp -> payload['sensor']['temp']
+        if node.attr.startswith('_'):
+            raise ConditionError(f"Campo no permitido: {node.attr}")
+        base, attr = _compile_node(node.value), node.attr
+
+        def load_attr(payload):
+            value = base(payload)
+            if isinstance(value, dict) and attr in value:
+                return value[attr]
+            raise _Missing(attr)
+        return load_attr
+
+    if isinstance(node, ast.Subscript):
+        if not isinstance(node.slice, ast.Constant):
+            raise ConditionError("Solo se permiten índices constantes")
+        base, key = _compile_node(node.value), node.slice.value
+
+        def load_item(payload):
+            value = base(payload)
+            try:
+                return value[key]
+            except (KeyError, IndexError, TypeError):
+                raise _Missing(key)
+        return load_item
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile_node(v) for v in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda payload: all(v(payload) for v in values)
+        return lambda payload: any(v(payload) for v in values)
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        fn, operand = _UNARY_OPS[type(node.op)], _compile_node(node.operand)
+        return lambda payload: fn(operand(payload))
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        fn, left, right = _BIN_OPS[type(node.op)], _compile_node(node.left), _compile_node(node.right)
+        if isinstance(node.op, _NUMERIC_ONLY_OPS):
+            for operand in (node.left, node.right):
+                if isinstance(operand, ast.Constant) and not _is_number(operand.value):
+                    raise ConditionError(f"{type(node.op).__name__} solo admite números")
+
+            def numeric(payload):
+                a, b = left(payload), right(payload)
+                if not (_is_number(a) and _is_number(b)):
+                    raise TypeError(f"{type(node.op).__name__} solo admite números")
+                return fn(a, b)
+            return numeric
+        return lambda payload: fn(left(payload), right(payload))
+
+    if isinstance(node, ast.Compare):
+        left = _compile_node(node.left)
+        steps = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in _COMPARE_OPS:
+                raise ConditionError(f"Operador no permitido: {type(op).__name__}")
+            steps.append((_COMPARE_OPS[type(op)], _compile_node(comparator)))
+
+        def compare(payload):
+            current = left(payload)
+            for fn, right in steps:
+                value = right(payload)
+                if not fn(current, value):
+                    return False
+                current = value
+            return True
+        return compare
+
+    if isinstance(node, (ast.Tuple, ast.List)):
+        items = [_compile_node(e) for e in node.elts]
+        return lambda payload: tuple(item(payload) for item in items)
+
+    raise ConditionError(f"Construcción no permitida: {type(node).__name__}")
+
+
+def compile_condition(condition):
+    """Compila la condición de un trigger a una función payload -> bool.
+
+    Admite la forma simple 'campo > 20' y, para el resto, un subconjunto de
+    expresiones Python (comparaciones, and/or/not, aritmética, in, acceso
+    a campos con punto o [clave]) que se valida sobre el AST: nunca se llama
+    a eval(). Un campo ausente o un error de tipo hacen que la condición sea
+    falsa. Lanza ConditionError si la expresión no es válida.
+    """
+    if not condition or not condition.strip():
+        return lambda payload: True
+
+    simple = _SIMPLE_CONDITION.match(condition)
+    if simple:
+        return _compile_simple(*simple.groups())
+
+    try:
+        tree = ast.parse(condition.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ConditionError(f"Sintaxis inválida: {e.msg}")
+    evaluate = _compile_node(tree)
+
+    def condition_fn(payload):
+        try:
+            return bool(evaluate(payload))
+        except (_Missing, ValueError, TypeError, ZeroDivisionError, ArithmeticError):
+            return False
+
+    return condition_fn
+
+
+class CompiledTrigger:
+    __slots__ = ('trigger_id', 'topic_pattern', 'condition')
+
+    def __init__(self, trigger_id, topic_pattern, condition):
+        self.trigger_id = trigger_id
+        self.topic_pattern = topic_pattern
+        self.condition = condition
+
+
+class MessageTriggerEngine:
+    """Índice de los message triggers habilitados.
+
+    Los topic_pattern se guardan en un TopicTrie y cada trigger lleva su
+    condición ya compilada, así que un mensaje solo evalúa los triggers cuyo
+    patrón coincide con el topic. Se reconstruye entero con rebuild() cada
+    vez que cambia message_triggers (carga, alta, edición, borrado, toggle).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trie = TopicTrie()
+        self._by_pattern = {}
+        self.invalid = {}
+
+    def rebuild(self, triggers):
+        """Compila {id: trigger_info} (formato de globals.message_triggers)."""
+        by_pattern = {}
+        invalid = {}
+        for trigger_id, trigger in triggers.items():
+            if not trigger.get('enabled', True) or not trigger.get('topic_pattern'):
+                continue
+            try:
+                condition = compile_condition(trigger.get('trigger_condition'))
+            except ConditionError as e:
+                invalid[trigger_id] = str(e)
+                logger.warning(f"⚠️ Condición inválida en trigger '{trigger.get('name')}': {e}")
+                continue
+            compiled = CompiledTrigger(trigger_id, trigger['topic_pattern'], condition)
+            by_pattern.setdefault(compiled.topic_pattern, []).append(compiled)
+
+        trie = TopicTrie(by_pattern.keys())
+        with self._lock:
+            self._trie = trie
+            self._by_pattern = by_pattern
+            self.invalid = invalid
+
+    def match(self, topic):
+        """Triggers compilados cuyo patrón coincide con el topic."""
+        by_pattern = self._by_pattern
+        if not by_pattern:
+            return []
+        matched = []
+        for pattern in self._trie.matches(topic):
+            matched.extend(by_pattern.get(pattern, ()))
+        return matched
+
+    def __len__(self):
+        return sum(len(v) for v in self._by_pattern.values())
+
+
+# Motor de la conexión que se muestra en la UI
+trigger_engine = ActiveProxy('trigger_engine')
@@ -0,0 +1,137 @@
+import struct
+import sys
+import zlib
+from array import array
+
+COMPRESS_LEVEL = 6
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def _unzigzag(n):
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _varints(data):
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+def encode_timestamps(timestamps):
+    """Delta-of-delta en varints zigzag: una serie regular ocupa ~1 byte por marca."""
+    out = bytearray()
+    prev = prev_delta = 0
+    for ts in timestamps:
+        delta = ts - prev
+        _put_varint(out, _zigzag(delta - prev_delta))
+        prev, prev_delta = ts, delta
+    return bytes(out)
+
+
+def decode_timestamps(data):
+    timestamps = []
+    prev = prev_delta = 0
+    for value in _varints(data):
+        prev_delta += _unzigzag(value)
+        prev += prev_delta
+        timestamps.append(prev)
+    return timestamps
+
+
+def _shuffle(raw, width=8):
+    """Agrupa los bytes por posición: los ceros de los XOR quedan contiguos para zlib."""
+    return b''.join(raw[i::width] for i in range(width))
+
+
+def _unshuffle(data, width=8):
+    n = len(data) // width
+    out = bytearray(len(data))
+    for i in range(width):
+        out[i::width] = data[i * n:(i + 1) * n]
+    return bytes(out)
+
+
+def _to_le(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_floats(values):
+    """Estilo Gorilla: cada valor se guarda como XOR de sus bits con los del anterior.
+
+    Los None se marcan en un bitmap de presencia (un byte por fila) y no
+    rompen la cadena de XOR. Devuelve (presencia, XOR reordenados por byte).
+    """
+    present = bytearray(len(values))
+    xors = array('Q', bytes(8 * len(values)))
+    prev = 0
+    for i, value in enumerate(values):
+        if value is None:
+            continue
+        bits = struct.unpack('<Q', struct.pack('<d', value))[0]
+        xors[i] = bits ^ prev
+        present[i] = 1
+        prev = bits
+    return bytes(present), _shuffle(_to_le(xors))
+
+
+def decode_floats(present, shuffled):
+    xors = array('Q')
+    xors.frombytes(_unshuffle(shuffled))
+    if sys.byteorder != 'little':
+        xors.byteswap()
+    values = []
+    prev = 0
+    for flag, xor in zip(present, xors):
+        if not flag:
+            values.append(None)
+            continue
+        prev ^= xor
+        values.append(struct.unpack('<d', struct.pack('<Q', prev))[0])
+    return values
+
+
+def encode_block(timestamps, columns, level=COMPRESS_LEVEL):
+    """Codifica un bloque columnar: marcas de tiempo enteras y columnas de floats (o None)."""
+    sections = [encode_timestamps(timestamps)]
+    for column in columns:
+        sections.extend(encode_floats(column))
+    raw = bytearray(struct.pack('<II', len(timestamps), len(columns)))
+    for section in sections:
+        raw += struct.pack('<I', len(section))
+        raw += section
+    return zlib.compress(bytes(raw), level)
+
+
+def decode_block(data):
+    """Inversa de encode_block: devuelve (timestamps, [columna, ...])."""
+    raw = memoryview(zlib.decompress(data))
+    count, n_columns = struct.unpack_from('<II', raw, 0)
+    offset = 8
+    sections = []
+    for _ in range(1 + 2 * n_columns):
+        (length,) = struct.unpack_from('<I', raw, offset)
+        offset += 4
+        sections.append(bytes(raw[offset:offset + length]))
+        offset += length
+    timestamps = decode_timestamps(sections[0])
+    if len(timestamps) != count:
+        raise ValueError(f"Bloque inconsistente: {len(timestamps)} marcas de tiempo, se esperaban {count}")
+    columns = [decode_floats(sections[1 + 2 * i], sections[2 + 2 * i]) for i in range(n_columns)]
+    return timestamps, columns
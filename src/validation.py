@@ -114,3 +114,23 @@ def validate_location(location: str) -> tuple[bool, str]:
         return False, 'La ubicación contiene caracteres inválidos'
     
     return True, ''
+
+def validate_share_group(group: str) -> tuple[bool, str]:
+    """Valida el nombre de grupo de una suscripción compartida ($share/<grupo>/...).
+
+    Args:
+        group: Nombre del grupo
+
+    Returns:
+        Tupla (es_válido, mensaje_error)
+    """
+    if not group:
+        return False, 'El grupo no puede estar vacío'
+
+    if len(group) > 100:
+        return False, 'El grupo es demasiado largo'
+
+    if not re.match(r'^[a-zA-Z0-9_\-.]+$', group):
+        return False, 'El grupo contiene caracteres inválidos'
+
+    return True, ''
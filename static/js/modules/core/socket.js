@@ -1,4 +1,4 @@
-import { state, scheduleDevicesUpdate } from './state.js';
+import { state, scheduleDevicesUpdate, applyDevicesPatch, applyHistoryAppend } from './state.js';
 import { elements } from './dom.js';
 import * as ui from '../ui/ui.js';
 import { displayHistoryChart } from '../ui/charts.js';
@@ -20,6 +20,7 @@ export function initSocketListeners() {
         state.topics = newState.topics || []; // Mantener compatibilidad
         state.tasks = newState.tasks || [];
         state.devices = newState.devices || {};
+        state.devicesSeq = newState.devices_seq ?? null;
         state.alerts = newState.alerts || [];
         state.accessLists = newState.access_lists || { whitelist: [] };
         state.knownDevices = newState.known_devices || [];
@@ -45,7 +46,9 @@ export function initSocketListeners() {
 
         // Renderizar mensajes del estado completo (para persistencia entre páginas)
         if (newState.history) {
-            ui.renderMessages(newState.history);
+            state.messageHistory = newState.history;
+            state.historyLimit = newState.history_limit || state.historyLimit;
+            ui.renderMessages(state.messageHistory);
         }
 
         // Actualizar campos de configuración
@@ -92,7 +95,11 @@ export function initSocketListeners() {
     });
 
     // --- Listeners para eventos de alta frecuencia o específicos ---
-    state.socket.on('history_update', (data) => ui.renderMessages(data.history || []));
+    state.socket.on('history_update', (data) => {
+        state.messageHistory = data.history || [];
+        ui.renderMessages(state.messageHistory);
+    });
+    state.socket.on('history_append', (data) => ui.renderMessages(applyHistoryAppend(data.entries)));
     state.socket.on('new_alert', (data) => showToast(`ALERTA: ${data.message}`, data.type || 'warning'));
     state.socket.on('device_history_response', (data) => {
         if (data.history && elements.historyChartCanvas) {
@@ -101,11 +108,17 @@ export function initSocketListeners() {
     });
 
     // --- Listeners para actualizaciones parciales y rápidas ---
-    state.socket.on('devices_update', (data) => {
-        scheduleDevicesUpdate(() => {
-            state.devices = data.devices || {};
-            renderDevices();
-        });
+    state.socket.on('devices_patch', (patch) => {
+        if (!applyDevicesPatch(patch)) {
+            state.socket.emit('request_devices_snapshot');
+            return;
+        }
+        scheduleDevicesUpdate(() => renderDevices());
+    });
+    state.socket.on('devices_snapshot', (data) => {
+        state.devices = data.devices || {};
+        state.devicesSeq = data.seq;
+        scheduleDevicesUpdate(() => renderDevices());
     });
     state.socket.on('alerts_update', (data) => { state.alerts = data.alerts || []; ui.renderAlerts(); });
     state.socket.on('access_lists_update', (data) => {
@@ -145,7 +158,10 @@ export function initSocketListeners() {
     
     state.socket.on('backup_complete', (data) => {
         if (data.success) {
-            showToast('Backup completado exitosamente', 'success');
+            const stats = data.stats;
+            showToast(stats
+                ? `Backup completado: ${stats.db_size_mb} MB en ${stats.duration_s} s (${stats.throughput_mb_s} MB/s)`
+                : 'Backup completado exitosamente', 'success');
             if (data.backups) {
                 renderBackupsList(data.backups);
             }
@@ -174,11 +190,22 @@ export function initSocketListeners() {
         }
     });
     
+    state.socket.on('restore_progress', (data) => {
+        const stages = {
+            staging: 'Preparando y verificando backup...',
+            swapping: 'Sustituyendo base de datos...',
+            reloading: 'Recargando configuracion...'
+        };
+        showToast(stages[data.stage] || data.stage, 'info');
+    });
+
     state.socket.on('restore_complete', (data) => {
-        if (data.success) {
+        if (data.success && data.restart_required) {
             showRestartConfirmNotification();
+        } else if (data.success) {
+            showToast(`Backup restaurado en ${data.duration_s} s`, 'success');
         } else {
-            showToast('Error al restaurar backup', 'error');
+            showToast(data.error ? `Error al restaurar backup: ${data.error}` : 'Error al restaurar backup', 'error');
         }
     });
     
@@ -6,6 +6,9 @@ export const state = {
     activeServerId: null,
     config: {},
     devices: {},
+    devicesSeq: null,
+    messageHistory: [],
+    historyLimit: 100,
     knownDevices: [],
     tasks: [],
     alerts: [],
@@ -25,6 +28,31 @@ export const state = {
     deviceDetailData: null
 };
 
+// Aplica un 'devices_patch' sobre state.devices. Devuelve false si falta algún
+// patch intermedio (salto en seq) y hay que pedir el estado completo.
+export function applyDevicesPatch(patch) {
+    if (state.devicesSeq !== null && patch.seq !== state.devicesSeq + 1) {
+        return patch.seq <= state.devicesSeq;
+    }
+    for (const [key, fields] of Object.entries(patch.devices || {})) {
+        state.devices[key] = { ...(state.devices[key] || {}), ...fields };
+    }
+    for (const key of patch.removed || []) {
+        delete state.devices[key];
+    }
+    state.devicesSeq = patch.seq;
+    return true;
+}
+
+// Añade al historial las entradas de un 'history_append' (más recientes primero),
+// ignorando las que ya se tenían, y recorta al límite del servidor.
+export function applyHistoryAppend(entries) {
+    const lastId = state.messageHistory.length ? (state.messageHistory[0].id ?? 0) : 0;
+    const fresh = (entries || []).filter(msg => msg.id === undefined || msg.id > lastId);
+    state.messageHistory = fresh.concat(state.messageHistory).slice(0, state.historyLimit);
+    return state.messageHistory;
+}
+
 // Throttle para actualizaciones de dispositivos (evita renders excesivos)
 export function scheduleDevicesUpdate(updateFn) {
     state._pendingDevicesUpdate = updateFn;
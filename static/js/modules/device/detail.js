@@ -74,10 +74,11 @@ function setupSocketListeners() {
         handleDeviceDetailResponse(data);
     });
 
-    state.socket.on('devices_update', (data) => {
+    // El patch solo trae los campos modificados: se combina con el estado conocido
+    state.socket.on('devices_patch', (data) => {
         if (data.devices && deviceDetailData) {
             const key = `${deviceDetailData.deviceId}@${deviceDetailData.location}`;
-            const deviceData = data.devices[key];
+            const deviceData = data.devices[key] && { ...(state.devices[key] || {}), ...data.devices[key] };
             if (deviceData) {
                 handleDeviceDetailResponse({
                     device_id: deviceDetailData.deviceId,
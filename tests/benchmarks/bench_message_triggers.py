@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Benchmark: evaluación de message triggers con MessageTriggerEngine frente al
+recorrido anterior (todos los triggers por mensaje, regex + eval por condición).
+
+Uso:
+    python tests/benchmarks/bench_message_triggers.py [--triggers 500] [--messages 5000]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.trigger_engine import MessageTriggerEngine
+
+
+# --- Implementación anterior (copia para comparar) ---
+
+def legacy_topic_matches(topic, pattern):
+    topic_parts = topic.split('/')
+    pattern_parts = pattern.split('/')
+    if len(topic_parts) != len(pattern_parts):
+        return False
+    for t, p in zip(topic_parts, pattern_parts):
+        if p == '#':
+            return True
+        if p == '+':
+            continue
+        if t != p:
+            return False
+    return True
+
+
+def legacy_condition(condition, payload_data):
+    if not condition:
+        return True
+    match = re.match(r'(\w+)\s*(==|!=|<|>|<=|>=)\s*(.+)', condition)
+    if match:
+        field, op, value = match.groups()
+        field_value = payload_data
+        for key in field.split('.'):
+            if isinstance(field_value, dict):
+                field_value = field_value.get(key)
+            else:
+                return False
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        try:
+            if op == '>':
+                return float(field_value) > float(value)
+            if op == '<':
+                return float(field_value) < float(value)
+            if op == '==':
+                return field_value == value
+        except (ValueError, TypeError):
+            return False
+    try:
+        return bool(eval(condition, {"__builtins__": {}}, dict(payload_data) if isinstance(payload_data, dict) else {}))
+    except Exception:
+        return False
+
+
+def legacy_check(triggers, topic, payload_str):
+    try:
+        payload_data = json.loads(payload_str)
+    except ValueError:
+        payload_data = payload_str
+    fired = 0
+    for trigger in triggers.values():
+        if not trigger['enabled'] or not legacy_topic_matches(topic, trigger['topic_pattern']):
+            continue
+        if legacy_condition(trigger['trigger_condition'], payload_data):
+            fired += 1
+    return fired
+
+
+def engine_check(engine, topic, payload_str):
+    matched = engine.match(topic)
+    if not matched:
+        return 0
+    try:
+        payload_data = json.loads(payload_str)
+    except ValueError:
+        payload_data = payload_str
+    return sum(1 for compiled in matched if compiled.condition(payload_data))
+
+
+# --- Datos sintéticos ---
+
+def build_triggers(count):
+    triggers = {}
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            pattern, condition = f"planta{i % 25}/linea{i}/temp", f"temp > {20 + i % 10}"
+        elif kind == 1:
+            pattern, condition = f"planta{i % 25}/+/hum", f"hum < {30 + i % 40}"
+        else:
+            pattern, condition = f"edificio{i}/+/estado", "temp > 25 and hum < 50"
+        triggers[f't{i}'] = {'id': f't{i}', 'name': f'trigger{i}', 'topic_pattern': pattern,
+                             'trigger_condition': condition, 'enabled': True}
+    return triggers
+
+
+def build_messages(count, rng):
+    messages = []
+    for _ in range(count):
+        n = rng.randint(0, 600)
+        topic = rng.choice([
+            f"planta{n % 25}/linea{n}/temp",
+            f"planta{n % 25}/zona{n}/hum",
+            f"edificio{n}/piso/estado",
+            f"otro/topic/{n}",
+        ])
+        payload = json.dumps({'temp': rng.uniform(15, 35), 'hum': rng.uniform(20, 80)})
+        messages.append((topic, payload))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de message triggers')
+    parser.add_argument('--triggers', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    triggers = build_triggers(args.triggers)
+    messages = build_messages(args.messages, rng)
+
+    start = time.perf_counter()
+    engine = MessageTriggerEngine()
+    engine.rebuild(triggers)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    legacy_fired = sum(legacy_check(triggers, topic, payload) for topic, payload in messages)
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine_fired = sum(engine_check(engine, topic, payload) for topic, payload in messages)
+    engine_s = time.perf_counter() - start
+
+    print(f"Triggers: {args.triggers}  Mensajes: {args.messages}  Compilación: {compile_ms:.1f} ms")
+    print(f"Anterior:            {legacy_s * 1000:8.1f} ms  ({args.messages / legacy_s:10.0f} msg/s)  disparos={legacy_fired}")
+    print(f"MessageTriggerEngine:{engine_s * 1000:8.1f} ms  ({args.messages / engine_s:10.0f} msg/s)  disparos={engine_fired}")
+    print(f"Mejora:              {legacy_s / engine_s:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ingesta concurrente + consultas de historial sobre SQLite, con la
+configuración por defecto frente a la de src/db_tuning.py (WAL, pragmas, pool).
+
+Uso:
+    python tests/benchmarks/bench_sqlite_tuning.py [--seconds 5] [--writers 2] [--readers 4] [--batch 200]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from src import db_tuning
+
+SCHEMA = """
+CREATE TABLE sensor_data (
+    id INTEGER PRIMARY KEY,
+    device_id VARCHAR(100) NOT NULL,
+    location VARCHAR(100) NOT NULL,
+    timestamp DATETIME,
+    temp_c FLOAT, temp_h FLOAT, temp_st FLOAT
+)
+"""
+INDEXES = (
+    "CREATE INDEX ix_sensor_data_device_id ON sensor_data (device_id)",
+    "CREATE INDEX ix_sensor_data_timestamp ON sensor_data (timestamp)",
+)
+INSERT = text("INSERT INTO sensor_data (device_id, location, timestamp, temp_c, temp_h, temp_st) "
+              "VALUES (:device_id, :location, :timestamp, :temp_c, :temp_h, :temp_st)")
+QUERY = text("SELECT timestamp, temp_c, temp_h FROM sensor_data "
+             "WHERE device_id = :device_id AND location = 'sala' AND timestamp >= :since ORDER BY timestamp")
+
+
+def build_engine(path, tuned):
+    uri = f'sqlite:///{path}'
+    if not tuned:
+        return create_engine(uri)
+    engine = create_engine(uri, **db_tuning.engine_options(uri))
+    db_tuning.install(engine)
+    return engine
+
+
+def seed(engine, devices, rows, base):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(SCHEMA)
+        for index in INDEXES:
+            conn.exec_driver_sql(index)
+        conn.execute(INSERT, [
+            {'device_id': f'dev{i % devices}', 'location': 'sala', 'timestamp': base + timedelta(seconds=i),
+             'temp_c': 20.0, 'temp_h': 50.0, 'temp_st': None}
+            for i in range(rows)
+        ])
+
+
+def run(tuned, args):
+    stats = {'rows': 0, 'queries': 0, 'locked': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+    base = datetime(2026, 1, 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(os.path.join(tmp, 'bench.db'), tuned)
+        seed(engine, args.devices, args.seed_rows, base)
+
+        def writer(n):
+            rng = random.Random(n)
+            clock = base + timedelta(seconds=args.seed_rows)
+            while not stop.is_set():
+                batch = [{'device_id': f'dev{rng.randrange(args.devices)}', 'location': 'sala', 'timestamp': clock,
+                          'temp_c': rng.uniform(15, 30), 'temp_h': rng.uniform(30, 70), 'temp_st': None}
+                         for _ in range(args.batch)]
+                clock += timedelta(seconds=1)
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(INSERT, batch)
+                    with lock:
+                        stats['rows'] += len(batch)
+                except OperationalError:
+                    with lock:
+                        stats['locked'] += 1
+
+        def reader(n):
+            rng = random.Random(100 + n)
+            while not stop.is_set():
+                since = base + timedelta(seconds=rng.randrange(args.seed_rows))
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(QUERY, {'device_id': f'dev{rng.randrange(args.devices)}', 'since': since}).fetchall()
+                    with lock:
+                        stats['queries'] += 1
+                except OperationalError:
+                    with lock:
+                        stats['locked'] += 1
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+        for t in threads:
+            t.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        engine.dispose()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la configuración de SQLite')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--seed-rows', type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"Escritores: {args.writers}  Lectores: {args.readers}  Lote: {args.batch}  Duración: {args.seconds}s")
+    results = {}
+    for label, tuned in (('Por defecto', False), ('db_tuning', True)):
+        stats = results[label] = run(tuned, args)
+        print(f"{label:12s} {stats['rows'] / args.seconds:10.0f} filas/s  "
+              f"{stats['queries'] / args.seconds:8.1f} consultas/s  {stats['locked']:5d} 'database is locked'")
+
+    before, after = results['Por defecto'], results['db_tuning']
+    if before['rows'] and before['queries']:
+        print(f"Mejora:      {after['rows'] / before['rows']:8.1f}x ingesta  {after['queries'] / before['queries']:8.1f}x consultas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark: N navegadores conectando a la vez (tormenta de reconexión) con la
+instantánea cacheada de StateSnapshot frente a construir y serializar el
+estado completo para cada cliente.
+
+La parte de BD se simula con consultas reales a una SQLite en memoria
+(dispositivos conocidos, alertas, whitelist) y la parte en memoria con un
+diccionario de dispositivos y el historial de mensajes.
+
+Uso:
+    python tests/benchmarks/bench_state_snapshot.py [--clients 200] [--devices 1000] [--updates-every 20]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.state_snapshot import StateSnapshot, SnapshotJSON
+
+
+def build_db(device_count, rng):
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute('CREATE TABLE devices (dev_id TEXT, dev_name TEXT, dev_location TEXT, dev_alias TEXT)')
+    conn.execute('CREATE TABLE alerts (id INTEGER PRIMARY KEY, topic TEXT, field TEXT, op TEXT, value REAL)')
+    conn.execute('CREATE TABLE whitelist (device_id TEXT, location TEXT)')
+    conn.executemany('INSERT INTO devices VALUES (?, ?, ?, ?)',
+                     [(f'esp{n}', f'Sensor {n}', f'sala{n % 40}', None) for n in range(device_count)])
+    conn.executemany('INSERT INTO alerts (topic, field, op, value) VALUES (?, ?, ?, ?)',
+                     [(f'planta{n}/+/temp', 'temp', '>', rng.uniform(20, 40)) for n in range(100)])
+    conn.executemany('INSERT INTO whitelist VALUES (?, ?)',
+                     [(f'esp{n}', f'sala{n % 40}') for n in range(0, device_count, 3)])
+    conn.commit()
+    return conn
+
+
+def db_part(conn):
+    return {
+        'alerts': [dict(zip(('id', 'topic', 'field', 'op', 'value'), row))
+                   for row in conn.execute('SELECT id, topic, field, op, value FROM alerts')],
+        'access_lists': {'whitelist': [f'{d}@{l}' for d, l in conn.execute('SELECT device_id, location FROM whitelist')]},
+        'known_devices': [dict(zip(('dev_id', 'dev_name', 'dev_location', 'dev_alias'), row))
+                          for row in conn.execute('SELECT dev_id, dev_name, dev_location, dev_alias FROM devices')],
+        'config': {'settings': {'refresh_interval': '30'}, 'servers': {}},
+    }
+
+
+def live_part(devices, history, seq):
+    return {
+        'mqtt_status': {'connected': True},
+        'devices': dict(devices),
+        'devices_seq': seq,
+        'history': list(history),
+        'topics': ['iot/#'],
+    }
+
+
+def storm(snapshot, conn, devices, history, clients, updates_every, rng):
+    """Simula los connect: get + serialización del paquete 'state_update'."""
+    seq = 0
+    sent = 0
+    start = time.perf_counter()
+    for n in range(clients):
+        if updates_every and n and n % updates_every == 0:
+            # Llega un estado de dispositivo entre conexiones
+            seq += 1
+            key = f'esp{rng.randrange(len(devices))}@sala0'
+            devices[key] = dict(devices.get(key, {}), status='online', last_seen=time.time())
+        payload = snapshot.get(('A', True), lambda: db_part(conn), seq,
+                               lambda: live_part(devices, history, seq), is_admin=n % 2 == 0)
+        sent += len(SnapshotJSON.dumps(['state_update', payload]))
+    return time.perf_counter() - start, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la instantánea del estado inicial')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=500)
+    parser.add_argument('--updates-every', type=int, default=20,
+                        help='cambios de dispositivo cada N conexiones (0 = ninguno)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    conn = build_db(args.devices, rng)
+    devices = {f'esp{n}@sala{n % 40}': {'status': 'online', 'latency': rng.uniform(5, 200), 'last_seen': time.time()}
+               for n in range(args.devices)}
+    history = [{'id': n, 'topic': f'iot/sala{n % 40}/temp', 'payload': json.dumps({'temp': rng.uniform(15, 35)}),
+                'timestamp': '12:00:00'} for n in range(args.history)]
+
+    uncached = StateSnapshot()
+    uncached.enabled = False
+    legacy_s, legacy_bytes = storm(uncached, conn, dict(devices), history, args.clients, args.updates_every, random.Random(1))
+
+    cached = StateSnapshot()
+    cached_s, cached_bytes = storm(cached, conn, dict(devices), history, args.clients, args.updates_every, random.Random(1))
+    stats = cached.get_stats()
+
+    print(f"Clientes: {args.clients}  Dispositivos: {args.devices}  Historial: {args.history}  "
+          f"Cambios cada: {args.updates_every or '-'}")
+    print(f"Sin caché:   {legacy_s * 1000:8.1f} ms  ({legacy_s / args.clients * 1000:6.2f} ms/cliente)  "
+          f"{legacy_bytes / 1e6:.1f} MB")
+    print(f"Instantánea: {cached_s * 1000:8.1f} ms  ({cached_s / args.clients * 1000:6.2f} ms/cliente)  "
+          f"{cached_bytes / 1e6:.1f} MB  construcciones BD={stats['db_builds']} en memoria={stats['live_builds']}")
+    print(f"Mejora:      {legacy_s / cached_s:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
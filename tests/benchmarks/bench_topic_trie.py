@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: TopicTrie frente al escaneo lineal con topic_matches().
+
+Uso:
+    python tests/benchmarks/bench_topic_trie.py [--subs 300] [--messages 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.topic_trie import TopicTrie, topic_matches
+
+
+def build_subscriptions(count, rng):
+    subs = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            subs.append(f"planta{i % 20}/linea{i}/temperatura")
+        elif kind == 1:
+            subs.append(f"planta{i % 20}/+/sensor{i}")
+        elif kind == 2:
+            subs.append(f"edificio{i}/#")
+        else:
+            subs.append(f"iot/+/dev{i}/+")
+    return subs
+
+
+def build_topics(count, rng):
+    topics = []
+    for _ in range(count):
+        n = rng.randint(0, 400)
+        topics.append(rng.choice([
+            f"planta{n % 20}/linea{n}/temperatura",
+            f"planta{n % 20}/zona{n}/sensor{n}",
+            f"edificio{n}/piso/{n}",
+            f"iot/status/dev{n}/salon",
+            f"otro/topic/{n}",
+        ]))
+    return topics
+
+
+def linear_scan(topics, subs):
+    hits = 0
+    for topic in topics:
+        if any(topic_matches(topic, sub) for sub in subs):
+            hits += 1
+    return hits
+
+
+def trie_scan(topics, trie):
+    hits = 0
+    for topic in topics:
+        if trie.has_match(topic):
+            hits += 1
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TopicTrie vs escaneo lineal')
+    parser.add_argument('--subs', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    subs = build_subscriptions(args.subs, rng)
+    topics = build_topics(args.messages, rng)
+    trie = TopicTrie(subs)
+
+    start = time.perf_counter()
+    linear_hits = linear_scan(topics, subs)
+    linear_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    trie_hits = trie_scan(topics, trie)
+    trie_s = time.perf_counter() - start
+
+    assert linear_hits == trie_hits, (linear_hits, trie_hits)
+
+    print(f"Suscripciones: {args.subs}  Mensajes: {args.messages}  Coincidencias: {trie_hits}")
+    print(f"Escaneo lineal: {linear_s * 1000:8.1f} ms  ({args.messages / linear_s:10.0f} msg/s)")
+    print(f"TopicTrie:      {trie_s * 1000:8.1f} ms  ({args.messages / trie_s:10.0f} msg/s)")
+    print(f"Mejora:         {linear_s / trie_s:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
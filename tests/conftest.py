@@ -36,6 +36,38 @@ def app():
     if os.path.exists(db_path):
         os.unlink(db_path)
 
+@pytest.fixture(scope='function')
+def app_db(tmp_path, monkeypatch):
+    """Point the application's own app/db (src.globals) at a temporary database file.
+
+    Yields the path of the file. The real dashboard.db is never opened.
+    """
+    from sqlalchemy import create_engine
+    from src import globals as app_globals
+    from src import db_tuning
+    from src.database import init_db
+
+    flask_app, app_db = app_globals.app, app_globals.db
+    db_path = str(tmp_path / 'dashboard.db')
+    uri = f'sqlite:///{db_path}'
+    engine = create_engine(uri, **db_tuning.engine_options(uri))
+    db_tuning.install(engine)
+    monkeypatch.setattr(app_globals, 'db_path', db_path)
+
+    with flask_app.app_context():
+        app_db.session.remove()
+        engines = app_db.engines
+        original = engines[None]
+        engines[None] = engine
+        init_db()
+
+    yield db_path
+
+    with flask_app.app_context():
+        app_db.session.remove()
+        app_db.engines[None] = original
+    engine.dispose()
+
 @pytest.fixture(scope='function')
 def db(app):
     """Get database from app fixture."""
@@ -0,0 +1,65 @@
+"""Unit tests for alert_engine module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.alert_engine import AlertEngine
+
+
+def _alert(alert_id, device_id, metric, operator, value, enabled=True):
+    return {
+        'id': alert_id, 'name': f'alerta{alert_id}', 'device_id': device_id, 'metric': metric,
+        'operator': operator, 'value': value, 'message': '{device_name}: {value}',
+        'type': 'warning', 'enabled': enabled
+    }
+
+
+@pytest.fixture
+def engine():
+    e = AlertEngine()
+    e.load('Local', [
+        _alert(1, '*', 'temp_c', '>', '30'),
+        _alert(2, 'ESP32_001', 'temp_c', '<', '5'),
+        _alert(3, 'ESP32_001@Salon', 'status', '==', 'offline'),
+        _alert(4, 'ESP32_002', 'temp_h', '>', '80'),
+        _alert(5, '*', 'temp_c', '>', '10', enabled=False),
+        _alert(6, '*', 'temp_c', '>=', '10'),
+    ])
+    return e
+
+
+def _ids(triggered):
+    return sorted(alert.id for alert, _value in triggered)
+
+
+class TestAlertEngine:
+    """Tests para la evaluación de alertas compiladas."""
+
+    def test_comodin_y_dispositivo(self, engine):
+        """Se evalúan las alertas '*', por dev_id y por dev_id@location."""
+        assert _ids(engine.evaluate('Local', 'ESP32_001', 'Salon', {'temp_c': 35})) == [1]
+        assert _ids(engine.evaluate('Local', 'ESP32_001', 'Salon', {'temp_c': '2.5'})) == [2]
+        assert _ids(engine.evaluate('Local', 'ESP32_003', 'Cocina', {'temp_c': 2})) == []
+
+    def test_comparacion_de_texto(self, engine):
+        """'==' con valores no numéricos compara como texto."""
+        assert _ids(engine.evaluate('Local', 'ESP32_001', 'Salon', {'status': 'offline'})) == [3]
+        assert _ids(engine.evaluate('Local', 'ESP32_001', 'Cocina', {'status': 'offline'})) == []
+
+    def test_metricas_ausentes_o_no_numericas(self, engine):
+        """Sin la métrica o con un valor no numérico, '>' y '<' no disparan."""
+        assert engine.evaluate('Local', 'ESP32_002', 'Salon', {'temp_c': 'n/a'}) == []
+        assert engine.evaluate('Local', 'ESP32_002', 'Salon', {'status': 'online'}) == []
+
+    def test_deshabilitadas_y_operadores_desconocidos(self, engine):
+        """Las alertas deshabilitadas o con operador desconocido no se indexan."""
+        assert _ids(engine.evaluate('Local', 'ESP32_009', 'Salon', {'temp_c': 20})) == []
+
+    def test_invalidate(self, engine):
+        """invalidate() descarta el índice hasta la siguiente carga."""
+        assert engine.is_loaded('Local')
+        engine.invalidate('Local')
+        assert not engine.is_loaded('Local')
+        assert engine.evaluate('Local', 'ESP32_001', 'Salon', {'temp_c': 35}) == []
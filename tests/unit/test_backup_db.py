@@ -0,0 +1,144 @@
+"""Unit tests for backup_db module."""
+import gzip
+import sqlite3
+from contextlib import closing
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_db import BackupManager
+
+
+@pytest.fixture
+def live_db(tmp_path):
+    """BD en modo WAL con datos y una conexión abierta que sigue escribiendo."""
+    path = tmp_path / 'dashboard.db'
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE sensor_data (id INTEGER PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO sensor_data (value) VALUES (?)", [('x' * 200,) for _ in range(5000)])
+    yield path, conn
+    conn.close()
+
+
+def _manager(tmp_path, path):
+    return BackupManager(backup_dir=str(tmp_path / 'backups'), db_file=str(path))
+
+
+def _rows(backup, tmp_path):
+    restored = tmp_path / 'restored.db'
+    with gzip.open(backup, 'rb') as f:
+        restored.write_bytes(f.read())
+    with sqlite3.connect(restored) as conn:
+        return conn.execute("SELECT count(*) FROM sensor_data").fetchone()[0]
+
+
+class TestOnlineBackup:
+    """Tests para el backup en caliente."""
+
+    def test_instantanea_consistente_con_escrituras(self, tmp_path, live_db):
+        path, writer = live_db
+        manager = _manager(tmp_path, path)
+        manager.pages_per_step = 16
+        steps = []
+
+        def on_progress(done, total):
+            steps.append(done)
+            # La aplicación sigue escribiendo durante la copia
+            writer.execute("INSERT INTO sensor_data (value) VALUES ('nuevo')")
+
+        backup = manager.create_backup(on_progress, incremental=False)
+        assert backup is not None and backup.name.endswith('.db.gz')
+        assert len(steps) > 1
+        assert _rows(backup, tmp_path) == 5000
+        stats = manager.last_stats
+        assert stats['method'] == 'backup_api'
+        assert stats['pages'] == steps[-1]
+        assert stats['throughput_mb_s'] > 0
+        assert manager.list_backups() == [backup]
+
+    def test_bd_grande_via_fichero_temporal(self, tmp_path, live_db):
+        path, _ = live_db
+        manager = _manager(tmp_path, path)
+        manager.memory_limit = 0
+        backup = manager.create_backup(incremental=False)
+        assert _rows(backup, tmp_path) == 5000
+        assert manager.last_stats['method'] == 'backup_api_file'
+        # Ni el temporal ni el parcial quedan en el directorio
+        assert [p.name for p in manager.backup_path.iterdir()] == [backup.name]
+
+    def test_restaurar_copia(self, tmp_path, live_db):
+        path, writer = live_db
+        manager = _manager(tmp_path, path)
+        backup = manager.create_backup(incremental=False)
+        writer.execute("DELETE FROM sensor_data")
+        writer.close()
+        assert manager.restore_backup(backup)
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT count(*) FROM sensor_data").fetchone()[0] == 5000
+
+    def test_sin_bd(self, tmp_path):
+        manager = _manager(tmp_path, tmp_path / 'no_existe.db')
+        assert manager.create_backup() is None
+
+
+class TestIncrementalBackup:
+    """Tests para los backups incrementales por bloques."""
+
+    def _manager(self, tmp_path, path):
+        manager = _manager(tmp_path, path)
+        manager.block_size = 16 * 1024
+        names = iter(f"dashboard_backup_2026010{n}_000000.db" for n in range(1, 10))
+        manager.get_backup_filename = lambda: next(names)
+        return manager
+
+    def test_solo_guarda_bloques_cambiados(self, tmp_path, live_db):
+        path, writer = live_db
+        manager = self._manager(tmp_path, path)
+        first = manager.create_backup()
+        assert first.name.endswith('.db.manifest')
+        total = manager.last_stats['blocks']
+        assert manager.last_stats['new_blocks'] == total
+
+        writer.execute("UPDATE sensor_data SET value = 'cambiado' WHERE id = 10")
+        second = manager.create_backup()
+        # Cambia la cabecera y la pagina modificada, no toda la BD
+        assert 0 < manager.last_stats['new_blocks'] <= 3
+        assert manager.last_stats['stored_bytes'] < manager.last_stats['db_bytes'] / 10
+
+        writer.close()
+        assert manager.restore_backup(first)
+        # swap_in no sustituye una BD con conexiones abiertas: se cierran antes de restaurar
+        with closing(sqlite3.connect(path)) as conn:
+            assert conn.execute("SELECT value FROM sensor_data WHERE id = 10").fetchone()[0] == 'x' * 200
+        assert manager.restore_backup(second)
+        with closing(sqlite3.connect(path)) as conn:
+            assert conn.execute("SELECT value FROM sensor_data WHERE id = 10").fetchone()[0] == 'cambiado'
+            assert conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+
+    def test_rotacion_elimina_bloques_huerfanos(self, tmp_path, live_db):
+        path, writer = live_db
+        manager = self._manager(tmp_path, path)
+        manager.max_backups = 1
+        manager.create_backup()
+        writer.execute("DELETE FROM sensor_data WHERE id > 100")
+        writer.execute("VACUUM")
+        latest = manager.create_backup()
+        blocks = {p.stem for p in manager.chunks_path.glob('*/*.gz')}
+        assert manager.list_backups() == [latest]
+        assert blocks == set(manager.read_manifest(latest)['blocks'])
+        ui = manager.get_backups_for_ui()
+        assert ui[0]['is_incremental'] and ui[0]['filename'] == latest.name
+
+    def test_bloque_corrupto(self, tmp_path, live_db):
+        path, _ = live_db
+        manager = self._manager(tmp_path, path)
+        backup = manager.create_backup()
+        block = manager.block_file(manager.read_manifest(backup)['blocks'][0])
+        block.write_bytes(gzip.compress(b'otro contenido'))
+        assert manager.restore_backup(backup) is False
+        # La BD actual queda intacta
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT count(*) FROM sensor_data").fetchone()[0] == 5000
@@ -0,0 +1,81 @@
+"""Unit tests for broadcaster module."""
+import pytest
+import sys
+import os
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def broadcaster():
+    """Broadcaster aislado sin tareas de fondo ni emisiones reales."""
+    from src.broadcaster import Broadcaster
+    from src.globals import socketio
+
+    bc = Broadcaster()
+    with patch.object(socketio, 'start_background_task') as mock_task, patch.object(socketio, 'emit') as mock_emit:
+        bc.mock_task = mock_task
+        bc.mock_emit = mock_emit
+        yield bc
+
+
+class TestBroadcaster:
+    """Tests para la agrupación de emisiones Socket.IO en frames."""
+
+    def test_flush_sin_pendientes_no_emite(self, broadcaster):
+        """flush() sin eventos pendientes no emite nada."""
+        assert broadcaster.flush() == 0
+        broadcaster.mock_emit.assert_not_called()
+
+    def test_emit_solo_envia_el_ultimo_valor(self, broadcaster):
+        """Varias emisiones del mismo evento en un frame envían solo la última."""
+        broadcaster.emit('topics_update', {'topics': ['a']})
+        broadcaster.emit('topics_update', {'topics': ['a', 'b']})
+        broadcaster.flush()
+
+        broadcaster.mock_emit.assert_called_once_with('topics_update', {'topics': ['a', 'b']})
+        stats = broadcaster.get_stats()
+        assert stats['sent'] == {'topics_update': 1}
+        assert stats['suppressed'] == {'topics_update': 1}
+
+    def test_una_sola_tarea_por_frame(self, broadcaster):
+        """Solo se programa una tarea de fondo mientras el frame está pendiente."""
+        broadcaster.emit('task_update', {'tasks': []})
+        broadcaster.emit('alerts_update', {'alerts': []})
+        broadcaster.append('history_append', {'id': 1})
+        assert broadcaster.mock_task.call_count == 1
+
+        broadcaster.flush()
+        broadcaster.emit('task_update', {'tasks': []})
+        assert broadcaster.mock_task.call_count == 2
+
+    def test_append_agrupa_entradas_mas_recientes_primero(self, broadcaster):
+        """append() envía todas las entradas del frame, la más reciente primero."""
+        broadcaster.append('history_append', {'id': 1})
+        broadcaster.append('history_append', {'id': 2})
+        broadcaster.append('history_append', {'id': 3})
+        broadcaster.flush()
+
+        broadcaster.mock_emit.assert_called_once_with(
+            'history_append', {'entries': [{'id': 3}, {'id': 2}, {'id': 1}]}
+        )
+
+    def test_discard_olvida_lo_pendiente(self, broadcaster):
+        """discard() elimina las entradas pendientes de un evento."""
+        broadcaster.append('history_append', {'id': 1})
+        broadcaster.emit('topics_update', {'topics': []})
+        broadcaster.discard('history_append')
+        broadcaster.flush()
+
+        broadcaster.mock_emit.assert_called_once_with('topics_update', {'topics': []})
+
+    def test_frames_contabilizados(self, broadcaster):
+        """Cada flush con contenido cuenta como un frame."""
+        broadcaster.emit('topics_update', {'topics': []})
+        broadcaster.flush()
+        broadcaster.flush()
+        broadcaster.emit('topics_update', {'topics': []})
+        broadcaster.flush()
+
+        assert broadcaster.get_stats()['frames'] == 2
@@ -0,0 +1,210 @@
+"""Unit tests for cluster and message_bus modules."""
+import json
+import queue
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.globals import app, db
+from src.models import ClusterCommand
+from src.cluster import Cluster
+from src.message_bus import LoopbackManager, socketio_options, LOOPBACK_URL
+
+
+@pytest.fixture
+def cluster_db(app_db):
+    """Tablas de cluster vacías en una BD temporal de la aplicación."""
+    with app.app_context():
+        yield db
+
+
+def _worker(name):
+    worker = Cluster(worker_id=name)
+    worker.configure('loopback://')
+    # Sin efectos sobre MQTT/scheduler en los tests
+    worker._on_elected = lambda: None
+    worker._on_demoted = lambda: None
+    return worker
+
+
+class TestMessageBus:
+    """Tests para la selección y el reparto de la cola de Socket.IO."""
+
+    def test_opciones(self):
+        assert socketio_options('') == {}
+        assert socketio_options('redis://localhost:6379/0') == {'message_queue': 'redis://localhost:6379/0'}
+        assert isinstance(socketio_options(LOOPBACK_URL)['client_manager'], LoopbackManager)
+
+    def test_loopback_reparte_a_todas_las_instancias(self):
+        a, b = LoopbackManager(), LoopbackManager()
+        # Sin servidor Socket.IO: solo se registran los buzones
+        for manager in (a, b):
+            manager._inbox = queue.Queue()
+            LoopbackManager._inboxes.append(manager._inbox)
+        try:
+            a._publish({'method': 'emit', 'event': 'x', 'data': [1]})
+            received = json.loads(next(b._listen()))
+            assert received['event'] == 'x'
+            assert not a._inbox.empty()
+        finally:
+            a.close()
+            b.close()
+
+
+class TestLeaderElection:
+    """Tests para el lease de líder en la BD."""
+
+    def test_un_solo_lider(self, cluster_db):
+        a, b = _worker('a'), _worker('b')
+        assert a.try_acquire(now=1000)
+        assert not b.try_acquire(now=1001)
+        # El líder renueva su propio lease
+        assert a.try_acquire(now=1005)
+
+    def test_relevo_al_caducar(self, cluster_db):
+        a, b = _worker('a'), _worker('b')
+        assert a.try_acquire(now=1000)
+        assert b.try_acquire(now=1000 + 60)
+        assert not a.try_acquire(now=1000 + 61)
+
+    def test_release(self, cluster_db):
+        a, b = _worker('a'), _worker('b')
+        a.try_acquire(now=1000)
+        a.release()
+        assert b.try_acquire(now=1001)
+
+    def test_sin_cola_siempre_lider(self):
+        single = Cluster(worker_id='solo')
+        single.configure('')
+        assert single.is_leader()
+
+
+class TestLeaderEvents:
+    """Tests para el reenvío de eventos de los seguidores al líder."""
+
+    def test_seguidor_reenvia_y_lider_aplica(self, cluster_db):
+        from flask import session
+        leader, follower = _worker('lider'), _worker('seguidor')
+        calls = []
+
+        def handler(data):
+            calls.append((data, session.get('is_admin')))
+
+        leader.leader_event('evento')(handler)
+        wrapped = follower.leader_event('evento')(handler)
+
+        leader.tick(now=1000)
+        follower.tick(now=1000)
+        assert leader.is_leader() and not follower.is_leader()
+
+        with app.test_request_context():
+            session['is_admin'] = True
+            wrapped({'topic': 'a/b'})
+        assert calls == []
+        assert follower.stats['forwarded'] == 1
+
+        assert leader.apply_commands() == 1
+        assert calls == [({'topic': 'a/b'}, True)]
+        assert ClusterCommand.query.count() == 0
+
+    def test_respuesta_al_cliente_de_origen(self, cluster_db, monkeypatch):
+        from flask import request
+        from unittest.mock import MagicMock
+        from src import cluster as module
+        from src.socket_handlers import handle_mqtt_publish
+        leader, follower = _worker('lider'), _worker('seguidor')
+        leader._events['mqtt_publish'] = module.cluster._events['mqtt_publish']
+        wrapped = follower.leader_event('mqtt_publish')(handle_mqtt_publish)
+        emitted = MagicMock()
+        monkeypatch.setattr(module.socketio, 'emit', emitted)
+
+        leader.tick(now=1000)
+        follower.tick(now=1000)
+        with app.test_request_context():
+            from flask import session
+            session['is_admin'] = True
+            request.sid = 'sid-cliente'
+            wrapped({'topic': '', 'payload': '1'})
+
+        # El handler falla la validación y responde con un error, sin petición Socket.IO en el líder
+        assert leader.apply_commands() == 1
+        assert leader.stats['applied'] == 1
+        emitted.assert_called_once()
+        assert emitted.call_args.args[0] == 'error'
+        assert emitted.call_args.kwargs == {'to': 'sid-cliente'}
+
+    def test_reply_sin_cliente_no_envia(self, monkeypatch):
+        from unittest.mock import MagicMock
+        from src import cluster as module
+        emitted = MagicMock()
+        monkeypatch.setattr(module.socketio, 'emit', emitted)
+        module.reply('error', {'message': 'x'})
+        with app.test_request_context():
+            module.reply('error', {'message': 'x'})
+        emitted.assert_not_called()
+
+
+class TestSharedIngest:
+    """Tests para la consolidación de vistas parciales con suscripciones compartidas."""
+
+    def _manager(self, monkeypatch, conn):
+        from types import SimpleNamespace
+        from src import connection_manager as module
+        monkeypatch.setattr(module, 'connection_manager', SimpleNamespace(connections=lambda: [conn]))
+
+    def test_lider_incorpora_lo_recibido_por_un_seguidor(self, cluster_db, monkeypatch):
+        from src.connection_manager import BrokerConnection
+        leader, follower = _worker('lider'), _worker('seguidor')
+
+        received = BrokerConnection('A')
+        received.devices['esp1@sala'] = {'status': 'online', 'temp_c': 21, 'missed_pings': 0}
+        received.seen_at['esp1@sala'] = 2000
+        self._manager(monkeypatch, received)
+        assert follower.publish_partial()
+        assert not follower.publish_partial()
+
+        own = BrokerConnection('A')
+        own.devices['esp1@sala'] = {'status': 'offline', 'missed_pings': 3, 'firmware': '1.0'}
+        own.seen_at['esp1@sala'] = 1000
+        self._manager(monkeypatch, own)
+        assert leader.consolidate() == 1
+        assert own.devices['esp1@sala'] == {'status': 'online', 'temp_c': 21, 'missed_pings': 0, 'firmware': '1.0'}
+        assert own.seen_at['esp1@sala'] == 2000
+        # Nada nuevo que aplicar
+        assert leader.consolidate() == 0
+
+    def test_lider_conserva_datos_mas_recientes(self, cluster_db, monkeypatch):
+        from src.connection_manager import BrokerConnection
+        leader, follower = _worker('lider'), _worker('seguidor')
+
+        received = BrokerConnection('A')
+        received.devices['esp1@sala'] = {'status': 'online'}
+        received.seen_at['esp1@sala'] = 1000
+        self._manager(monkeypatch, received)
+        follower.publish_partial()
+
+        own = BrokerConnection('A')
+        own.devices['esp1@sala'] = {'status': 'offline'}
+        own.seen_at['esp1@sala'] = 1500
+        self._manager(monkeypatch, own)
+        assert leader.consolidate() == 0
+        assert own.devices['esp1@sala']['status'] == 'offline'
+
+    def test_seguidor_recarga_la_whitelist_del_lider(self, cluster_db, monkeypatch):
+        from src.connection_manager import BrokerConnection
+        from src import persistence
+        follower = _worker('seguidor')
+        self._manager(monkeypatch, BrokerConnection('A'))
+        loaded = []
+        monkeypatch.setattr(persistence, 'load_device_registry', loaded.append)
+
+        view = {'leader': 'lider', 'registry_version': 3}
+        assert follower.follow_registry(view)
+        assert not follower.follow_registry(view)
+        # El líder añade un dispositivo a la whitelist
+        assert follower.follow_registry(dict(view, registry_version=4))
+        # Un líder nuevo empieza su contador desde cero
+        assert follower.follow_registry({'leader': 'otro', 'registry_version': 4})
+        assert loaded == ['A', 'A', 'A']
@@ -0,0 +1,169 @@
+"""Unit tests for connection_manager module."""
+import json
+import pytest
+import sys
+import os
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.globals import mqtt_state, devices, subscribed_topics, subscription_trie, global_state
+from src.active_view import active_view
+from src.connection_manager import ConnectionManager
+
+
+@pytest.fixture
+def manager():
+    """ConnectionManager nuevo; restaura la vista activa al terminar."""
+    saved_view, saved_state = active_view.conn, dict(global_state)
+    yield ConnectionManager()
+    active_view.conn = saved_view
+    global_state.clear(); global_state.update(saved_state)
+
+
+class TestConnectionManager:
+    """Tests para las conexiones simultáneas y el cambio de vista."""
+
+    def test_sin_conexiones_usa_los_globales(self, manager):
+        devices['d1@sala'] = {'status': 'online'}
+        assert manager.active().devices == {'d1@sala': {'status': 'online'}}
+        assert manager.active_name is None
+
+    def test_get_de_un_servidor_desconocido(self, manager):
+        manager.activate('A')
+        assert manager.get('desconocido') is None
+
+    def test_activate_intercambia_el_estado_sin_reconectar(self, manager):
+        a = manager.activate('A')
+        client_a = MagicMock()
+        a.state['client'] = client_a
+        devices['d1@sala'] = {'status': 'online'}
+        subscribed_topics.append('a/#')
+        subscription_trie.add('a/#')
+
+        b = manager.activate('B')
+        assert manager.active_name == 'B'
+        assert global_state['active_server_name'] == 'B'
+        assert not a.active and b.active
+        assert devices == {} and subscribed_topics == []
+        # A conserva su estado y su cliente en contenedores propios
+        assert a.devices == {'d1@sala': {'status': 'online'}}
+        assert a.topics == ['a/#'] and a.trie.has_match('a/x')
+        assert a.client is client_a
+
+        manager.activate('A')
+        assert devices == {'d1@sala': {'status': 'online'}}
+        assert subscribed_topics == ['a/#']
+        assert mqtt_state['client'] is client_a
+        client_a.disconnect.assert_not_called()
+
+    def test_la_vista_es_un_puntero(self, manager):
+        a = manager.activate('A')
+        a_devices = a.devices
+        manager.activate('B').devices['x@y'] = {'status': 'online'}
+        # Los proxies de src.globals resuelven la conexión activa en cada acceso
+        assert 'x@y' in devices
+        manager.activate('A')
+        assert 'x@y' not in devices
+        # Cambiar de vista no copia ni sustituye los contenedores de la conexión
+        assert a.devices is a_devices
+
+    def test_publicador_solo_de_la_conexion_visible(self, manager, monkeypatch):
+        from src import connection_manager as module
+        published = MagicMock()
+        monkeypatch.setattr(module, 'device_state', published)
+        a = manager.activate('A')
+        publisher = a.publisher
+        publisher.mark('d1@sala')
+        # Un callback en curso deja de publicar si la UI cambia de servidor a mitad
+        manager.activate('B')
+        publisher.mark('d1@sala')
+        publisher.mark_all()
+        published.mark.assert_called_once_with('d1@sala', None)
+        published.mark_all.assert_not_called()
+
+    def test_estado_de_conexion_en_segundo_plano(self, manager):
+        manager.activate('A')
+        b = manager.activate('B')
+        a = manager.get('A')
+        manager.activate('A')
+
+        b.devices['x@y'] = {'status': 'online'}
+        assert 'x@y' not in devices
+        assert manager.get('B') is b
+        summary = {s['server_name']: s for s in manager.summary()}
+        assert summary['B']['online'] == 1 and not summary['B']['active']
+        assert summary['A']['active']
+        assert manager.get('A') is a
+
+    def test_find_task(self, manager):
+        manager.activate('A')
+        b = manager.activate('B')
+        manager.activate('A')
+        b.tasks['t1'] = {'name': 'tarea'}
+        assert manager.find_task('t1') is b
+        assert manager.find_task('otra') is manager.get('A')
+
+    def test_process_message_actualiza_la_conexion_del_servidor(self, manager, monkeypatch):
+        from src import mqtt_callbacks
+        monkeypatch.setattr(mqtt_callbacks, 'connection_manager', manager)
+        monkeypatch.setattr(mqtt_callbacks, 'get_or_create_device', lambda *a, **k: ('sensor', False))
+        monkeypatch.setattr(mqtt_callbacks, 'is_device_allowed', lambda *a, **k: True)
+        monkeypatch.setattr(mqtt_callbacks, 'insert_sensor_data', lambda *a, **k: None)
+        monkeypatch.setattr(mqtt_callbacks, 'check_alerts', lambda *a, **k: None)
+
+        manager.activate('A')
+        b = manager.activate('B')
+        manager.activate('A')
+
+        payload = json.dumps({'status': 'online', 'temp_c': 21}).encode()
+        mqtt_callbacks.process_message('iot/status/esp1/sala', payload, 'B')
+
+        assert b.devices['esp1@sala']['status'] == 'online'
+        assert 'esp1@sala' not in devices
+
+    def test_process_message_descarta_servidores_desconocidos(self, manager, monkeypatch):
+        from src import mqtt_callbacks
+        monkeypatch.setattr(mqtt_callbacks, 'connection_manager', manager)
+        insert = MagicMock()
+        monkeypatch.setattr(mqtt_callbacks, 'insert_sensor_data', insert)
+
+        manager.activate('A')
+        payload = json.dumps({'status': 'online', 'temp_c': 21}).encode()
+        mqtt_callbacks.process_message('iot/status/esp1/sala', payload, 'borrado')
+
+        assert devices == {}
+        insert.assert_not_called()
+
+    def test_rename_reindexa_la_conexion(self, manager):
+        a = manager.activate('A')
+        a.state['client'] = client = MagicMock()
+        assert manager.rename('A', 'A2') is a
+        assert manager.get('A') is None and manager.get('A2') is a
+        assert a.server_name == 'A2' and manager.active_name == 'A2'
+        assert global_state['active_server_name'] == 'A2'
+        # Los mensajes del cliente llegan ya con el nombre nuevo
+        client.user_data_set.assert_called_once_with({'server_name': 'A2'})
+
+    def test_reconecta_si_cambian_los_parametros(self, manager, monkeypatch):
+        from src.globals import config
+        old = {'name': 'A', 'broker': 'viejo', 'port': 1883, 'username': '', 'password': ''}
+        monkeypatch.setitem(config, 'servers', {'A': dict(old, broker='nuevo')})
+        a = manager.activate('A')
+        a.state['client'] = MagicMock()
+        connect = MagicMock()
+        monkeypatch.setattr(a, 'connect', connect)
+
+        assert manager.reconnect_if_changed('A', old)
+        connect.assert_called_once_with(config['servers']['A'])
+        # Sin cambios de conexión (p. ej. solo el nombre) no se reconecta
+        assert not manager.reconnect_if_changed('A', dict(old, broker='nuevo'))
+
+    def test_connect_all(self, manager, monkeypatch):
+        from src.globals import config
+        monkeypatch.setitem(config, 'servers', {'A': {}, 'B': {}})
+        connected = []
+        monkeypatch.setattr(manager, 'connect', connected.append)
+        manager.connect_all('B')
+        assert connected == ['A', 'B']
+        assert manager.active_name == 'B'
@@ -0,0 +1,50 @@
+"""Unit tests for db_gate module."""
+import threading
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.db_gate import DbGate
+
+
+class TestDbGate:
+    """Tests para la puerta de la BD del trabajo en segundo plano."""
+
+    def test_quiesce_espera_a_los_que_estan_dentro(self):
+        gate = DbGate()
+        inside, leave = threading.Event(), threading.Event()
+
+        def worker():
+            with gate.hold():
+                inside.set()
+                leave.wait(5)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        inside.wait(5)
+        assert not gate.quiesce(timeout=0.05)
+        assert gate.closing
+        leave.set()
+        assert gate.quiesce(timeout=5)
+        thread.join(5)
+        gate.release()
+        assert not gate.closing
+        assert gate.get_stats()['timeouts'] == 1
+
+    def test_hold_espera_mientras_esta_cerrada(self):
+        gate = DbGate()
+        assert gate.quiesce(timeout=1)
+        entered = threading.Event()
+
+        def worker():
+            with gate.hold():
+                entered.set()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert not entered.wait(0.1)
+        gate.release()
+        assert entered.wait(5)
+        thread.join(5)
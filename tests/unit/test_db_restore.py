@@ -0,0 +1,131 @@
+"""Unit tests for db_restore module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.globals import app, db, config
+from src.models import Setting
+from src.sensor_writer import sensor_writer
+from src.ingest_pipeline import ingest_pipeline
+from src.db_restore import OnlineRestore
+from backup_db import BackupManager
+
+
+@pytest.fixture
+def manager(tmp_path, app_db):
+    """Backup de una BD temporal de la aplicación con un ajuste conocido."""
+    with app.app_context():
+        db.session.merge(Setting(key='restore_test', value='antes'))
+        db.session.commit()
+    return BackupManager(backup_dir=str(tmp_path / 'backups'), db_file=app_db)
+
+
+def _setting():
+    with app.app_context():
+        setting = db.session.get(Setting, 'restore_test')
+        return setting.value if setting else None
+
+
+class TestOnlineRestore:
+    """Tests para la restauración sin reinicio."""
+
+    def test_restaura_y_recarga_en_caliente(self, manager):
+        backup = manager.create_backup(incremental=False)
+        with app.app_context():
+            db.session.get(Setting, 'restore_test').value = 'despues'
+            db.session.commit()
+        assert _setting() == 'despues'
+
+        result = OnlineRestore().restore(backup, manager)
+        assert result['success'], result
+        # El engine ve la BD restaurada sin reiniciar el proceso
+        assert _setting() == 'antes'
+        assert config['settings']['restore_test'] == 'antes'
+        assert not ingest_pipeline.paused
+        assert not sensor_writer.get_stats()['paused']
+        assert not manager.staging_path().exists()
+
+    def test_backup_corrupto_no_toca_la_bd(self, manager, tmp_path):
+        corrupt = manager.backup_path / 'dashboard_backup_20260101_000000.db'
+        corrupt.write_bytes(b'no es una base de datos' * 100)
+
+        result = OnlineRestore().restore(corrupt, manager)
+        assert not result['success']
+        assert 'error' in result
+        assert _setting() == 'antes'
+        assert not manager.staging_path().exists()
+
+    def test_cancela_si_la_ingesta_no_se_detiene(self, manager, monkeypatch):
+        backup = manager.create_backup(incremental=False)
+        with app.app_context():
+            db.session.get(Setting, 'restore_test').value = 'despues'
+            db.session.commit()
+        monkeypatch.setattr(ingest_pipeline, 'pause', lambda timeout=5: False)
+
+        result = OnlineRestore().restore(backup, manager)
+        assert not result['success']
+        assert _setting() == 'despues'
+        assert not ingest_pipeline.paused
+        assert not sensor_writer.get_stats()['paused']
+        assert not manager.staging_path().exists()
+
+    def test_cancela_si_el_trabajo_en_segundo_plano_no_suelta_la_bd(self, manager, monkeypatch):
+        from src import db_restore
+        from src.db_gate import db_gate
+        backup = manager.create_backup(incremental=False)
+        with app.app_context():
+            db.session.get(Setting, 'restore_test').value = 'despues'
+            db.session.commit()
+        monkeypatch.setattr(db_restore, 'PAUSE_TIMEOUT', 0.1)
+
+        with db_gate.hold():
+            result = OnlineRestore().restore(backup, manager)
+        assert not result['success']
+        assert _setting() == 'despues'
+        assert not db_gate.closing
+
+    def test_swap_in_rechaza_una_bd_abierta(self, tmp_path):
+        import sqlite3
+        path = tmp_path / 'app.db'
+        live = sqlite3.connect(path)
+        live.execute("PRAGMA journal_mode=WAL")
+        live.execute("CREATE TABLE t (x)")
+        live.execute("INSERT INTO t VALUES (1)")
+        live.commit()
+        staging = tmp_path / 'app.db.restore'
+        sqlite3.connect(staging).close()
+        manager = BackupManager(backup_dir=str(tmp_path / 'backups'), db_file=str(path))
+
+        with pytest.raises(RuntimeError):
+            manager.swap_in(staging, timeout=0.1)
+        # El WAL de la conexión viva sigue en su sitio y la BD no se ha sustituido
+        assert (tmp_path / 'app.db-wal').exists()
+        assert live.execute("SELECT x FROM t").fetchall() == [(1,)]
+        live.close()
+
+        staging = tmp_path / 'app.db.restore'
+        sqlite3.connect(staging).close()
+        manager.swap_in(staging)
+        assert not (tmp_path / 'app.db-wal').exists()
+        assert not staging.exists()
+
+    def test_fallo_de_recarga_tras_el_rename(self, manager, monkeypatch):
+        backup = manager.create_backup(incremental=False)
+        with app.app_context():
+            db.session.get(Setting, 'restore_test').value = 'despues'
+            db.session.commit()
+        restore = OnlineRestore()
+
+        def broken_reload():
+            raise RuntimeError('recarga rota')
+        monkeypatch.setattr(restore, '_reload', broken_reload)
+
+        result = restore.restore(backup, manager)
+        # La BD restaurada está en servicio: no es un error de restauración
+        assert result['success'] and 'error' not in result
+        assert result['reload_error'] == 'recarga rota'
+        assert result['restart_required']
+        assert _setting() == 'antes'
+        assert not ingest_pipeline.paused
@@ -0,0 +1,90 @@
+"""Unit tests for device_registry module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.device_registry import DeviceRegistry
+
+
+@pytest.fixture
+def registry():
+    reg = DeviceRegistry()
+    reg.load_server(
+        'TestServer',
+        [('ESP32_001', 'Salon', 'Mi Sensor'), ('ESP32_002', 'Cocina', 'ESP32_002')],
+        [('ESP32_001', 'Salon')]
+    )
+    return reg
+
+
+class TestDeviceRegistry:
+    """Tests para la caché de dispositivos y whitelist."""
+
+    def test_version_solo_con_cambios(self, registry):
+        """Cachear un nombre no cambia la versión; whitelist y alias sí."""
+        version = registry.version
+        registry.set_name('TestServer', 'ESP32_003', 'Sala', 'ESP32_003')
+        assert registry.version == version
+        registry.add_whitelisted('TestServer', 'ESP32_003', 'Sala')
+        registry.rename('TestServer', 'ESP32_003', 'Sala', 'Sensor sala')
+        registry.invalidate_server('OtroServer')
+        assert registry.version == version + 3
+        assert registry.get_name('TestServer', 'ESP32_003', 'Sala') == 'Sensor sala'
+
+    def test_servidor_cargado(self, registry):
+        """Tras load_server el servidor queda marcado como cargado."""
+        assert registry.is_loaded('TestServer') is True
+        assert registry.is_loaded('OtroServer') is False
+        assert len(registry) == 2
+
+    def test_nombre_visible(self, registry):
+        """Devuelve el nombre cacheado o None si no existe."""
+        assert registry.get_name('TestServer', 'ESP32_001', 'Salon') == 'Mi Sensor'
+        assert registry.get_name('TestServer', 'ESP32_999', 'Salon') is None
+        assert registry.get_name('OtroServer', 'ESP32_001', 'Salon') is None
+
+    def test_whitelist(self, registry):
+        """La whitelist se consulta por (servidor, id, location)."""
+        assert registry.is_whitelisted('TestServer', 'ESP32_001', 'Salon') is True
+        assert registry.is_whitelisted('TestServer', 'ESP32_002', 'Cocina') is False
+
+        registry.add_whitelisted('TestServer', 'ESP32_002', 'Cocina')
+        assert registry.is_whitelisted('TestServer', 'ESP32_002', 'Cocina') is True
+
+        registry.discard_whitelisted('TestServer', 'ESP32_001', 'Salon')
+        assert registry.is_whitelisted('TestServer', 'ESP32_001', 'Salon') is False
+
+    def test_set_name_actualiza_alias(self, registry):
+        """set_name sobrescribe el nombre visible (alias actualizado)."""
+        registry.set_name('TestServer', 'ESP32_001', 'Salon', 'Nuevo Alias')
+
+        assert registry.get_name('TestServer', 'ESP32_001', 'Salon') == 'Nuevo Alias'
+
+    def test_recarga_no_afecta_otros_servidores(self, registry):
+        """Recargar un servidor sustituye solo sus entradas."""
+        registry.load_server('OtroServer', [('X', 'Y', 'Z')], [('X', 'Y')])
+        registry.load_server('TestServer', [('ESP32_003', 'Baño', 'ESP32_003')], [])
+
+        assert registry.get_name('TestServer', 'ESP32_001', 'Salon') is None
+        assert registry.get_name('TestServer', 'ESP32_003', 'Baño') == 'ESP32_003'
+        assert registry.is_whitelisted('TestServer', 'ESP32_001', 'Salon') is False
+        assert registry.is_whitelisted('OtroServer', 'X', 'Y') is True
+
+    def test_invalidate_server(self, registry):
+        """invalidate_server olvida el servidor y obliga a consultar la BD."""
+        registry.invalidate_server('TestServer')
+
+        assert registry.is_loaded('TestServer') is False
+        assert registry.get_name('TestServer', 'ESP32_001', 'Salon') is None
+        assert len(registry) == 0
+
+    def test_invalidate_todo(self, registry):
+        """invalidate_server() sin argumentos vacía la caché."""
+        registry.load_server('OtroServer', [('X', 'Y', 'Z')], [])
+        registry.invalidate_server()
+
+        assert registry.is_loaded('TestServer') is False
+        assert registry.is_loaded('OtroServer') is False
+        assert len(registry) == 0
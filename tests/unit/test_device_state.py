@@ -0,0 +1,110 @@
+"""Unit tests for device_state module."""
+import pytest
+import sys
+import os
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def publisher():
+    """Publicador aislado con 'devices' limpio y sin tareas de fondo."""
+    from src.device_state import DeviceStatePublisher
+    from src.globals import devices, socketio
+
+    devices.clear()
+    pub = DeviceStatePublisher()
+    with patch.object(socketio, 'start_background_task'), patch.object(socketio, 'emit') as mock_emit:
+        pub.mock_emit = mock_emit
+        yield pub
+    devices.clear()
+
+
+class TestDeviceStatePublisher:
+    """Tests para la difusión incremental de dispositivos."""
+
+    def test_sin_cambios_no_emite(self, publisher):
+        """flush() sin cambios pendientes no emite nada."""
+        assert publisher.flush() is None
+        publisher.mock_emit.assert_not_called()
+
+    def test_patch_solo_campos_modificados(self, publisher):
+        """Un mark con campos envía solo esos campos."""
+        from src.globals import devices
+        devices['ESP32_001@Salon'] = {'id': 'ESP32_001', 'status': 'online', 'latency': '10.00', 'ip': '1.2.3.4'}
+
+        publisher.mark('ESP32_001@Salon', ('latency',))
+        patch_data = publisher.flush()
+
+        assert patch_data['devices'] == {'ESP32_001@Salon': {'latency': '10.00'}}
+        publisher.mock_emit.assert_called_once_with('devices_patch', patch_data)
+
+    def test_coalesce_varios_cambios(self, publisher):
+        """Varios mark del mismo dispositivo se agrupan en un único patch."""
+        from src.globals import devices
+        devices['ESP32_001@Salon'] = {'status': 'online', 'latency': '5.00', 'last_seen': '10:00:00'}
+
+        publisher.mark('ESP32_001@Salon', ('latency',))
+        publisher.mark('ESP32_001@Salon', ('last_seen',))
+        patch_data = publisher.flush()
+
+        assert patch_data['devices']['ESP32_001@Salon'] == {'latency': '5.00', 'last_seen': '10:00:00'}
+        assert publisher.mock_emit.call_count == 1
+
+    def test_mark_completo_prevalece(self, publisher):
+        """Un mark sin campos envía el dispositivo completo aunque después se marquen campos."""
+        from src.globals import devices
+        devices['ESP32_001@Salon'] = {'id': 'ESP32_001', 'status': 'online'}
+
+        publisher.mark('ESP32_001@Salon')
+        publisher.mark('ESP32_001@Salon', ('status',))
+        patch_data = publisher.flush()
+
+        assert patch_data['devices']['ESP32_001@Salon'] == {'id': 'ESP32_001', 'status': 'online'}
+
+    def test_seq_creciente(self, publisher):
+        """Cada patch emitido incrementa seq en uno."""
+        from src.globals import devices
+        devices['a@b'] = {'status': 'online'}
+
+        publisher.mark('a@b', ('status',))
+        first = publisher.flush()
+        publisher.mark('a@b', ('status',))
+        second = publisher.flush()
+
+        assert second['seq'] == first['seq'] + 1
+
+    def test_eliminados(self, publisher):
+        """Los dispositivos eliminados se listan en 'removed'."""
+        publisher.mark_removed('ESP32_001@Salon')
+        patch_data = publisher.flush()
+
+        assert patch_data['devices'] == {}
+        assert patch_data['removed'] == ['ESP32_001@Salon']
+
+    def test_snapshot_con_seq(self, publisher):
+        """snapshot() devuelve una copia completa con el seq actual."""
+        from src.globals import devices
+        devices['a@b'] = {'status': 'online'}
+        publisher.mark('a@b', ('status',))
+        publisher.flush()
+
+        snapshot = publisher.snapshot()
+        snapshot['devices']['a@b']['status'] = 'offline'
+
+        assert snapshot['seq'] == publisher.seq
+        assert devices['a@b']['status'] == 'online'
+
+    def test_broadcast_snapshot_descarta_pendientes(self, publisher):
+        """broadcast_snapshot() emite el estado completo y vacía los cambios pendientes."""
+        from src.globals import devices
+        devices['a@b'] = {'status': 'online'}
+        publisher.mark('a@b', ('status',))
+
+        publisher.broadcast_snapshot()
+
+        assert publisher.flush() is None
+        event, data = publisher.mock_emit.call_args[0]
+        assert event == 'devices_snapshot'
+        assert data['devices'] == {'a@b': {'status': 'online'}}
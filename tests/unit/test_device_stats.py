@@ -0,0 +1,103 @@
+"""Unit tests for device_stats module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.globals import app, db
+from src.models import DeviceStatsSnapshot
+from src.latency_histogram import LatencyHistogram
+from src.device_stats import DeviceStats, DeviceStatsRegistry
+
+
+@pytest.fixture
+def stats_db(app_db):
+    """Tabla device_stats vacía en una BD temporal de la aplicación."""
+    with app.app_context():
+        yield db
+
+
+class TestDeviceStats:
+    """Tests para las estadísticas de un dispositivo."""
+
+    def test_disponibilidad(self):
+        stats = DeviceStats()
+        stats.set_status('online', 0)
+        stats.set_status('offline', 75)
+        stats.set_status('online', 100)
+        summary = stats.summary(broadcasts=0, now=200)
+        assert summary['online_seconds'] == 175
+        assert summary['uptime_ratio'] == 0.875
+        assert summary['offline_events'] == 1
+
+    def test_estado_fuera_de_orden_no_resta(self):
+        stats = DeviceStats()
+        stats.set_status('online', 100)
+        stats.set_status('online', 90)
+        assert stats.summary(0, now=100)['online_seconds'] == 0
+
+    def test_pings_perdidos_con_broadcast(self):
+        stats = DeviceStats(broadcast_base=10)
+        stats.pings = 2
+        stats.pongs = 5
+        summary = stats.summary(broadcasts=15, now=0)
+        assert summary['pings'] == 7
+        assert summary['missed_pings'] == 2
+
+    def test_ida_y_vuelta(self):
+        stats = DeviceStats()
+        for latency in (5, 12, 40):
+            stats.latency.record(latency)
+        stats.pongs = 3
+        stats.set_status('online', 0)
+        restored = DeviceStats.from_dict(stats.to_dict(broadcasts=4), broadcasts=100)
+        assert restored.latency.snapshot() == stats.latency.snapshot()
+        assert restored.pings_sent(broadcasts=101) == 5
+
+    def test_histograma_ida_y_vuelta(self):
+        histogram = LatencyHistogram()
+        histogram.record(3)
+        histogram.record(700)
+        assert LatencyHistogram.from_dict(histogram.to_dict()).snapshot() == histogram.snapshot()
+
+
+class TestDeviceStatsRegistry:
+    """Tests para el registro de estadísticas por servidor."""
+
+    def test_pong_actualiza_latencia_y_estado(self):
+        registry = DeviceStatsRegistry()
+        registry.record_broadcast('A')
+        registry.record_pong('A', 'esp1@sala', 42.0, at=0)
+        registry.record_pong('A', 'esp1@sala', -1, at=1)
+        summary = registry.device_summary('A', 'esp1@sala', now=10)
+        assert summary['pongs'] == 2
+        assert summary['latency']['count'] == 1
+        assert summary['last_latency'] == 42.0
+        assert summary['uptime_ratio'] == 1.0
+        assert registry.device_summary('B', 'esp1@sala') is None
+
+    def test_flota_los_mas_lentos_primero(self):
+        registry = DeviceStatsRegistry()
+        registry.record_pong('A', 'rapido@x', 5, at=0)
+        registry.record_pong('A', 'lento@x', 900, at=0)
+        registry.record_status('A', 'sin_pong@x', 'online', at=0)
+        registry.record_pong('B', 'otro@x', 5000, at=0)
+        fleet = registry.fleet('A', now=1)
+        assert [d['device_key'] for d in fleet] == ['lento@x', 'rapido@x', 'sin_pong@x']
+        assert len(registry.fleet('A', limit=1, now=1)) == 1
+
+    def test_instantanea_y_carga(self, stats_db):
+        registry = DeviceStatsRegistry()
+        registry.record_pong('A', 'esp1@sala', 30, at=0)
+        assert registry.snapshot() == 1
+        assert registry.snapshot() == 0
+        registry.record_pong('A', 'esp1@sala', 60, at=5)
+        assert registry.snapshot() == 1
+        assert DeviceStatsSnapshot.query.count() == 1
+
+        restored = DeviceStatsRegistry()
+        assert restored.load_server('A') == 1
+        assert restored.device_summary('A', 'esp1@sala', now=10)['latency']['count'] == 2
+        # Solo se carga una vez por servidor
+        assert restored.load_server('A') == 0
@@ -0,0 +1,70 @@
+"""Unit tests for downsampling module."""
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.downsampling import parse_resolution, bucket_seconds_for_range, lttb, MAX_POINTS
+
+
+class TestParseResolution:
+    """Tests para la normalización de la resolución pedida."""
+
+    def test_modos_con_nombre(self):
+        assert parse_resolution(None) == 'auto'
+        assert parse_resolution('') == 'auto'
+        assert parse_resolution('RAW') == 'raw'
+        assert parse_resolution('lttb') == 'lttb'
+
+    def test_resoluciones_en_segundos(self):
+        assert parse_resolution('1h') == 3600
+        assert parse_resolution('120') == 120
+        assert parse_resolution(30) == 30
+
+    def test_resolucion_invalida(self):
+        with pytest.raises(ValueError):
+            parse_resolution('semana')
+        with pytest.raises(ValueError):
+            parse_resolution(0)
+
+
+class TestBucketSeconds:
+    """Tests para el cálculo del tamaño de bucket."""
+
+    def test_rango_cabe_en_max_points(self):
+        start = datetime(2026, 1, 1)
+        seconds = bucket_seconds_for_range(start, start + timedelta(days=30))
+        assert (30 * 86400) / seconds <= MAX_POINTS
+
+    def test_rango_vacio(self):
+        start = datetime(2026, 1, 1)
+        assert bucket_seconds_for_range(start, start) == 1
+
+
+class TestLTTB:
+    """Tests para el downsampling visual Largest-Triangle-Three-Buckets."""
+
+    def test_serie_corta_no_se_modifica(self):
+        points = [(i, i) for i in range(10)]
+        assert lttb(points, 20) == points
+
+    def test_conserva_extremos_y_tamano(self):
+        points = [(i, (i % 7) * 1.0) for i in range(500)]
+        sampled = lttb(points, 50)
+        assert len(sampled) == 50
+        assert sampled[0] == points[0]
+        assert sampled[-1] == points[-1]
+        assert [p[0] for p in sampled] == sorted(p[0] for p in sampled)
+
+    def test_conserva_picos(self):
+        points = [(i, 0.0) for i in range(1000)]
+        points[500] = (500, 100.0)
+        sampled = lttb(points, 20)
+        assert (500, 100.0) in sampled
+
+    def test_ignora_valores_nulos(self):
+        points = [(i, None if i % 2 else float(i)) for i in range(100)]
+        sampled = lttb(points, 10)
+        assert all(p[1] is not None for p in sampled[1:-1])
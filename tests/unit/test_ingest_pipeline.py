@@ -0,0 +1,214 @@
+"""Unit tests for ingest_pipeline and latency_histogram modules."""
+import threading
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ingest_pipeline import IngestPipeline, device_key_for_topic
+from src.latency_histogram import LatencyHistogram
+
+
+class TestLatencyHistogram:
+    """Tests para el histograma de latencias."""
+
+    def test_vacio(self):
+        snap = LatencyHistogram().snapshot()
+        assert snap['count'] == 0
+        assert snap['p99'] is None
+
+    def test_percentiles_por_bucket(self):
+        histogram = LatencyHistogram(bounds=(1, 10, 100))
+        for _ in range(90):
+            histogram.record(0.5)
+        for _ in range(10):
+            histogram.record(50)
+
+        snap = histogram.snapshot()
+        assert snap['count'] == 100
+        assert snap['p50'] == 1
+        assert snap['p99'] == 50  # acotado por el máximo observado
+        assert snap['min'] == 0.5 and snap['max'] == 50
+
+
+class TestIngestPipeline:
+    """Tests para la cola acotada y las políticas de desbordamiento."""
+
+    def _collecting(self, **kwargs):
+        kwargs.setdefault('workers', 1)
+        seen = []
+        pipeline = IngestPipeline(handler=lambda topic, payload, server, received_at, clock: seen.append(topic), **kwargs)
+        return pipeline, seen
+
+    def test_drain_procesa_en_orden(self):
+        pipeline, seen = self._collecting()
+        for i in range(5):
+            assert pipeline.submit(f't/{i}', b'{}', 'srv')
+        pipeline.drain()
+
+        assert seen == [f't/{i}' for i in range(5)]
+        stats = pipeline.get_stats()
+        assert stats['processed'] == 5
+        assert stats['pending'] == 0
+        assert stats['stages']['total']['count'] == 5
+        assert stats['stages']['queue']['count'] == 5
+
+    def test_drop_oldest(self):
+        pipeline, seen = self._collecting(queue_size=3, policy='drop-oldest')
+        for i in range(5):
+            assert pipeline.submit(f't/{i}', b'', 'srv')
+        pipeline.drain()
+
+        assert seen == ['t/2', 't/3', 't/4']
+        assert pipeline.stats['dropped'] == 2
+
+    def test_block_con_timeout_descarta_el_nuevo(self):
+        pipeline, seen = self._collecting(queue_size=2, policy='block')
+        pipeline.block_timeout = 0.01
+        pipeline._running = True  # sin workers: nadie vacía la cola
+        assert pipeline.submit('a', b'', 'srv')
+        assert pipeline.submit('b', b'', 'srv')
+
+        start = time.monotonic()
+        assert not pipeline.submit('c', b'', 'srv')
+        assert time.monotonic() - start >= 0.01
+        pipeline._running = False
+        pipeline.drain()
+
+        assert seen == ['a', 'b']
+        assert pipeline.stats['dropped'] == 1
+
+    def test_sample_por_encima_del_umbral(self):
+        pipeline, seen = self._collecting(queue_size=10, policy='sample')
+        pipeline.sample_every = 2
+        results = [pipeline.submit(f't/{i}', b'', 'srv') for i in range(12)]
+
+        # Hasta el 80% (8) se admite todo; después uno de cada dos
+        assert all(results[:8])
+        assert results[8:] == [False, True, False, True]
+        assert pipeline.stats['sampled_out'] == 2
+
+    def test_error_en_handler_no_detiene_el_pipeline(self):
+        def handler(topic, payload, server, received_at, clock):
+            if topic == 'malo':
+                raise ValueError('boom')
+            clock.lap('parse')
+
+        pipeline = IngestPipeline(handler=handler)
+        pipeline.submit('malo', b'', 'srv')
+        pipeline.submit('bueno', b'', 'srv')
+        pipeline.drain()
+
+        assert pipeline.stats['failed'] == 1
+        assert pipeline.stats['processed'] == 1
+        assert pipeline.get_stats()['stages']['parse']['count'] == 1
+
+    def test_workers_procesan_y_stop_vacia(self):
+        done = threading.Event()
+        seen = []
+
+        def handler(topic, payload, server, received_at, clock):
+            seen.append(topic)
+            if len(seen) == 20:
+                done.set()
+
+        pipeline = IngestPipeline(handler=handler, workers=2)
+        pipeline.start()
+        try:
+            for i in range(20):
+                pipeline.submit(f't/{i}', b'', 'srv')
+            assert done.wait(5)
+        finally:
+            pipeline.stop()
+
+        assert sorted(seen) == sorted(f't/{i}' for i in range(20))
+        assert not pipeline.running
+
+
+class TestDeviceLanes:
+    """Tests para el reparto por dispositivo en lanes serie."""
+
+    def test_clave_de_dispositivo(self):
+        assert device_key_for_topic('iot/status/esp1/salon') == 'esp1@salon'
+        assert device_key_for_topic('iot/pong/esp1/salon') == 'esp1@salon'
+        assert device_key_for_topic('iot/config/esp1/salon/extra') == 'esp1@salon'
+        assert device_key_for_topic('iot/ping/esp1/salon') == 'iot/ping/esp1/salon'
+        assert device_key_for_topic('casa/temp') == 'casa/temp'
+
+    def test_mismo_dispositivo_misma_lane(self):
+        pipeline = IngestPipeline(handler=None, workers=8)
+        lane = pipeline.lane_for('iot/status/esp1/salon')
+        assert pipeline.lane_for('iot/pong/esp1/salon') is lane
+        assert pipeline.lane_for('iot/config/esp1/salon') is lane
+        used = {pipeline.lane_for(f'iot/status/esp{i}/salon').index for i in range(100)}
+        assert len(used) > 1
+
+    def test_orden_por_dispositivo_con_varias_lanes(self):
+        seen = []
+        lock = threading.Lock()
+        done = threading.Event()
+        total = 10 * 50
+
+        def handler(topic, payload, server, received_at, clock):
+            time.sleep(0)
+            with lock:
+                seen.append((device_key_for_topic(topic), payload))
+                if len(seen) == total:
+                    done.set()
+
+        pipeline = IngestPipeline(handler=handler, workers=4)
+        pipeline.start()
+        try:
+            for seq in range(50):
+                for device in range(10):
+                    pipeline.submit(f'iot/status/esp{device}/salon', seq, 'srv')
+            assert done.wait(5)
+        finally:
+            pipeline.stop()
+
+        for device in range(10):
+            key = f'esp{device}@salon'
+            assert [seq for k, seq in seen if k == key] == list(range(50))
+
+    def test_metricas_por_lane(self):
+        pipeline = IngestPipeline(handler=lambda *args: None, queue_size=40, workers=4)
+        for i in range(12):
+            pipeline.submit(f'iot/status/esp{i}/salon', b'', 'srv')
+
+        stats = pipeline.get_stats()
+        assert len(stats['lanes']) == 4
+        assert sum(lane['depth'] for lane in stats['lanes']) == 12
+        assert stats['pending'] == 12
+        pipeline.drain()
+        assert pipeline.get_stats()['pending'] == 0
+        assert pipeline.stats['processed'] == 12
+
+    def test_pausa_retiene_los_mensajes(self):
+        release = threading.Event()
+        seen = []
+
+        def handler(topic, payload, server, received_at, clock):
+            if topic == 'lento':
+                release.wait(5)
+            seen.append(topic)
+
+        pipeline = IngestPipeline(handler=handler, workers=1)
+        pipeline.start()
+        try:
+            pipeline.submit('lento', b'', 'srv')
+            time.sleep(0.05)
+            threading.Timer(0.05, release.set).start()
+            # pause() espera a que termine el mensaje en curso
+            assert pipeline.pause(timeout=5)
+            assert seen == ['lento']
+            pipeline.submit('retenido', b'', 'srv')
+            time.sleep(0.1)
+            assert seen == ['lento'] and pipeline.pending() == 1
+            pipeline.resume()
+            deadline = time.monotonic() + 5
+            while pipeline.pending() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            pipeline.stop()
+        assert seen == ['lento', 'retenido']
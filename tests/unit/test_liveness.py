@@ -0,0 +1,76 @@
+"""Unit tests for liveness module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.liveness import LivenessTracker, liveness_timeout, COMPACT_MIN
+
+
+class TestLivenessTracker:
+    """Tests para los plazos de vida de los dispositivos."""
+
+    def test_caduca_al_vencer_el_plazo(self):
+        tracker = LivenessTracker(timeout=10)
+        tracker.touch('a@x', at=100)
+        tracker.touch('b@x', at=105)
+        assert tracker.expire(now=109) == []
+        assert tracker.expire(now=110) == ['a@x']
+        assert tracker.expire(now=200) == ['b@x']
+        assert len(tracker) == 0
+
+    def test_nueva_senal_aplaza_el_plazo(self):
+        tracker = LivenessTracker(timeout=10)
+        tracker.touch('a@x', at=100)
+        tracker.touch('a@x', at=108)
+        assert tracker.expire(now=115) == []
+        assert tracker.next_deadline() == 118
+        assert tracker.expire(now=118) == ['a@x']
+
+    def test_senal_antigua_no_adelanta_el_plazo(self):
+        tracker = LivenessTracker(timeout=10)
+        tracker.touch('a@x', at=108)
+        tracker.touch('a@x', at=100)
+        assert tracker.expire(now=115) == []
+
+    def test_forget(self):
+        tracker = LivenessTracker(timeout=10)
+        tracker.touch('a@x', at=100)
+        tracker.forget('a@x')
+        assert 'a@x' not in tracker
+        assert tracker.next_deadline() is None
+        assert tracker.expire(now=1000) == []
+
+    def test_el_heap_no_crece_sin_limite(self):
+        tracker = LivenessTracker(timeout=10)
+        for n in range(10 * COMPACT_MIN):
+            tracker.touch('a@x', at=n)
+        assert len(tracker._heap) <= 2 + COMPACT_MIN + 1
+        assert tracker.expire(now=10 * COMPACT_MIN + 9) == ['a@x']
+
+    def test_timeout_desde_ajustes(self):
+        assert liveness_timeout({'refresh_interval': '30', 'max_missed_pings': '2'}) == 90
+        assert liveness_timeout({'refresh_interval': 'x'}) == 90
+
+
+class TestMarkDevicesOffline:
+    """Tests para el paso a offline de los dispositivos caducados."""
+
+    def test_solo_transiciones_y_eventos_en_lote(self, monkeypatch):
+        from src import mqtt_callbacks
+        from src.connection_manager import BrokerConnection
+        batches = []
+        monkeypatch.setattr(mqtt_callbacks, 'add_device_events', lambda events: batches.append(list(events)))
+
+        conn = BrokerConnection('A')
+        conn.devices.update({
+            'a@x': {'status': 'online'},
+            'b@x': {'status': 'offline'},
+            'c@x': {'status': 'online'},
+        })
+        assert mqtt_callbacks.mark_devices_offline(conn, ['a@x', 'b@x', 'borrado@x', 'c@x'], 2) == 2
+        assert conn.devices['a@x'] == {'status': 'offline', 'missed_pings': 3}
+        assert conn.devices['b@x'] == {'status': 'offline'}
+        assert len(batches) == 1
+        assert [(e[0], e[2]) for e in batches[0]] == [('a', 'disconnected'), ('c', 'disconnected')]
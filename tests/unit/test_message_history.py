@@ -0,0 +1,81 @@
+"""Unit tests for message_history module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.message_history import MessageHistory, MAX_HISTORY_CAPACITY
+
+
+def _msg(topic, direction='in', payload='x'):
+    return {'topic': topic, 'payload': payload, 'timestamp': '12:00:00', 'direction': direction}
+
+
+@pytest.fixture
+def history():
+    h = MessageHistory(5)
+    for i in range(3):
+        h.append(_msg('iot/status/a', payload=str(i)))
+    h.append(_msg('iot/cmd/a', direction='out'))
+    h.append(_msg('iot/status/b'))
+    return h
+
+
+class TestMessageHistory:
+    """Tests para el buffer circular del historial de mensajes."""
+
+    def test_orden_mas_reciente_primero(self, history):
+        """Indexación e iteración empiezan por la entrada más reciente."""
+        assert len(history) == 5
+        assert history[0]['topic'] == 'iot/status/b'
+        assert history[-1]['payload'] == '0'
+        assert [m['id'] for m in history] == [5, 4, 3, 2, 1]
+
+    def test_capacidad_expulsa_las_mas_antiguas(self, history):
+        """Al superar la capacidad se sobrescriben las entradas más antiguas."""
+        history.append(_msg('iot/status/c'))
+        history.append(_msg('iot/status/c'))
+
+        assert len(history) == 5
+        assert [m['id'] for m in history] == [7, 6, 5, 4, 3]
+        assert history.topics() == {'iot/status/a': 1, 'iot/cmd/a': 1, 'iot/status/b': 1, 'iot/status/c': 2}
+
+    def test_query_por_topic_y_direccion(self, history):
+        """query() filtra con los índices por topic y dirección."""
+        assert [m['payload'] for m in history.query(topic='iot/status/a')] == ['2', '1', '0']
+        assert [m['topic'] for m in history.query(direction='out')] == ['iot/cmd/a']
+        assert history.query(topic='iot/cmd/a', direction='in') == []
+        assert history.query(topic='no/existe') == []
+
+    def test_query_con_comodines(self, history):
+        """Los filtros con + y # combinan varios topics en orden."""
+        ids = [m['id'] for m in history.query(topic='iot/status/+')]
+        assert ids == [5, 3, 2, 1]
+        assert len(history.query(topic='iot/#')) == 5
+
+    def test_paginacion_con_before_id(self, history):
+        """before_id devuelve la página siguiente sin repetir entradas."""
+        page1 = history.query(limit=2)
+        page2 = history.query(limit=2, before_id=page1[-1]['id'])
+        page3 = history.query(limit=2, before_id=page2[-1]['id'])
+
+        assert [m['id'] for m in page1 + page2 + page3] == [5, 4, 3, 2, 1]
+
+    def test_clear_mantiene_ids_crecientes(self, history):
+        """Tras clear() los ids siguen creciendo."""
+        history.clear()
+        assert len(history) == 0
+        entry = history.append(_msg('iot/status/a'))
+        assert entry['id'] == 6
+        assert history.topics() == {'iot/status/a': 1}
+
+    def test_resize_conserva_las_mas_recientes(self, history):
+        """Reducir la capacidad conserva las entradas más recientes e índices coherentes."""
+        history.resize(2)
+        assert [m['id'] for m in history] == [5, 4]
+        assert history.query(topic='iot/status/a') == []
+
+        history.resize(MAX_HISTORY_CAPACITY * 2)
+        assert history.capacity == MAX_HISTORY_CAPACITY
+        assert [m['id'] for m in history] == [5, 4]
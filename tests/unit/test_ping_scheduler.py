@@ -0,0 +1,84 @@
+"""Unit tests for ping_scheduler module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ping_scheduler import PingScheduler
+
+
+def _staggered(**settings):
+    pinger = PingScheduler()
+    pinger.configure({'ping_mode': 'staggered', 'refresh_interval': '30', **settings})
+    return pinger
+
+
+class TestPingScheduler:
+    """Tests para la planificación de PINGs."""
+
+    def test_modo_por_defecto_broadcast(self):
+        pinger = PingScheduler()
+        pinger.configure({})
+        assert not pinger.staggered
+        pinger.configure({'ping_mode': 'otro'})
+        assert pinger.mode == 'broadcast'
+
+    def test_pings_repartidos_en_el_intervalo(self):
+        pinger = _staggered()
+        for n in range(300):
+            pinger.track(f'esp{n}@sala', now=0)
+        # Cada segundo solo sale una fracción de la flota
+        per_second = [len(pinger.due(t)) for t in range(1, 31)]
+        assert sum(per_second) == 300
+        assert max(per_second) < 40
+        # El siguiente ciclo respeta el intervalo
+        assert pinger.due(30.5) == []
+
+    def test_latencia_con_la_hora_de_envio(self):
+        pinger = _staggered()
+        pinger.track('a@x', now=0)
+        due_at = pinger.next_due()
+        assert pinger.due(due_at) == ['a@x']
+        latency = pinger.on_pong('a@x', int(due_at), due_at + 0.042)
+        assert latency == pytest.approx(42)
+        # PONG repetido: ya no hay PING pendiente
+        assert pinger.on_pong('a@x', int(due_at), due_at + 1) is None
+
+    def test_latencia_con_broadcast(self):
+        pinger = PingScheduler()
+        pinger.broadcast_sent(1000.25)
+        assert pinger.on_pong('a@x', 1000, 1000.5) == pytest.approx(250)
+        assert pinger.on_pong('a@x', 999, 1000.5) is None
+
+    def test_backoff_para_dispositivos_estables(self):
+        pinger = _staggered(ping_stable_after='2', ping_max_backoff='4')
+        pinger.track('a@x', now=0)
+        t = pinger.next_due()
+        backoffs = []
+        for _ in range(6):
+            assert pinger.due(t) == ['a@x']
+            pinger.on_pong('a@x', int(t), t + 0.01)
+            backoffs.append(pinger.backoff('a@x'))
+            t = pinger.next_due()
+        assert backoffs == [1, 2, 2, 4, 4, 4]
+        assert t - pinger._devices['a@x'].sent_at == 120
+
+    def test_ping_sin_respuesta_vuelve_al_intervalo_base(self):
+        pinger = _staggered(ping_stable_after='1')
+        pinger.track('a@x', now=0)
+        t = pinger.next_due()
+        pinger.due(t)
+        pinger.on_pong('a@x', int(t), t)
+        assert pinger.backoff('a@x') == 2
+        t = pinger.next_due()
+        pinger.due(t)          # sin PONG
+        pinger.due(pinger.next_due())
+        assert pinger.backoff('a@x') == 1
+
+    def test_forget(self):
+        pinger = _staggered()
+        pinger.track('a@x', now=0)
+        pinger.forget('a@x')
+        assert pinger.next_due() is None
+        assert pinger.due(1000) == []
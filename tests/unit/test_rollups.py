@@ -0,0 +1,108 @@
+"""Unit tests for rollups module."""
+import pytest
+import sys
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, delete
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rollups import rows_to_partials, select_rollup, to_epoch, _empty_aggregate, _merge
+
+
+def _row(ts, temp_c=None, temp_h=None):
+    return {'device_id': 'ESP32_001', 'location': 'Salon', 'timestamp': ts, 'temp_c': temp_c, 'temp_h': temp_h, 'temp_st': None}
+
+
+class TestRollupAggregation:
+    """Tests para la agregación por minuto de las lecturas."""
+
+    def test_agrupa_por_minuto(self):
+        """Lecturas del mismo minuto comparten bucket; cambia al pasar de minuto."""
+        partials = rows_to_partials([
+            _row(datetime(2026, 1, 1, 10, 0, 5), 20.0),
+            _row(datetime(2026, 1, 1, 10, 0, 55), 22.0),
+            _row(datetime(2026, 1, 1, 10, 1, 0), 21.0),
+        ])
+        minute = to_epoch(datetime(2026, 1, 1, 10, 0))
+        assert set(partials) == {('ESP32_001', 'Salon', minute), ('ESP32_001', 'Salon', minute + 60)}
+
+        agg = partials[('ESP32_001', 'Salon', minute)]
+        assert agg['count'] == 2
+        assert agg['temp_c_sum'] == 42.0
+        assert agg['temp_c_n'] == 2
+        assert (agg['temp_c_min'], agg['temp_c_max']) == (20.0, 22.0)
+
+    def test_valores_nulos_no_cuentan(self):
+        """Las métricas nulas cuentan como lectura pero no en la media ni en mín/máx."""
+        agg = next(iter(rows_to_partials([_row(datetime(2026, 1, 1), 20.0, None)]).values()))
+        assert agg['count'] == 1
+        assert agg['temp_h_n'] == 0
+        assert agg['temp_h_min'] is None
+
+    def test_merge_combina_agregados(self):
+        """_merge suma contadores y conserva los extremos."""
+        a = _empty_aggregate()
+        b = next(iter(rows_to_partials([_row(datetime(2026, 1, 1), 25.0)]).values()))
+        c = next(iter(rows_to_partials([_row(datetime(2026, 1, 1), 18.0)]).values()))
+        _merge(a, b)
+        _merge(a, c)
+        assert a['count'] == 2
+        assert a['temp_c_sum'] == 43.0
+        assert (a['temp_c_min'], a['temp_c_max']) == (18.0, 25.0)
+
+
+class TestSelectRollup:
+    """Tests para la elección del rollup según el tamaño de bucket."""
+
+    @pytest.mark.parametrize('bucket_seconds,expected', [
+        (30, None),
+        (60, '1m'),
+        (600, '1m'),
+        (3600, '1h'),
+        (7200, '1h'),
+        (86400 * 7, '1d'),
+    ])
+    def test_rollup_mas_grueso_que_encaja(self, bucket_seconds, expected):
+        rollup = select_rollup(bucket_seconds)
+        assert (rollup[0] if rollup else None) == expected
+
+    @pytest.mark.parametrize('bucket_seconds,days_ago,expected', [
+        (600, 6, '1m'),
+        # El rollup de 1m solo guarda 7 días: se agrupa sobre sensor_data
+        (600, 8, None),
+        (7200, 8, '1h'),
+        (7200, 100, None),
+        (86400, 100, '1d'),
+    ])
+    def test_respeta_la_retencion(self, bucket_seconds, days_ago, expected):
+        now = datetime(2026, 6, 1)
+        rollup = select_rollup(bucket_seconds, now - timedelta(days=days_ago), now=now)
+        assert (rollup[0] if rollup else None) == expected
+
+
+class TestBackfill:
+    """Tests para la migración de sensor_data a los rollups."""
+
+    def _rollup_counts(self):
+        from src.globals import db
+        from src.models import SensorRollup1h
+        return db.session.scalar(select(func.sum(SensorRollup1h.count)))
+
+    def test_solo_una_vez(self, app_db):
+        from src.globals import app, db
+        from src.models import SensorData, SensorRollup1m
+        from src.rollups import backfill_rollups
+        now = datetime.now().replace(microsecond=0)
+        with app.app_context():
+            db.session.add_all(SensorData(device_id='ESP32_001', location='Salon', timestamp=now - timedelta(days=20, minutes=i),
+                                          temp_c=20.0) for i in range(30))
+            db.session.commit()
+            assert backfill_rollups() == 30
+            assert self._rollup_counts() == 30
+            # La retención de 1m lo vacía; 1h y 1d conservan las filas
+            db.session.execute(delete(SensorRollup1m))
+            db.session.commit()
+            assert backfill_rollups() == 0
+            assert self._rollup_counts() == 30
@@ -0,0 +1,110 @@
+"""Unit tests for sensor_archive module."""
+from datetime import datetime, timedelta
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.globals import app, db
+from src.models import SensorData
+from src.sensor_archive import SensorArchive, sensor_archive, BLOCK_ROWS
+from src.persistence import cleanup_sensor_data, get_sensor_data_for_device
+
+DEVICE, LOCATION = 'archive_test', 'lab/1'
+
+
+def _readings(start, n, step=timedelta(seconds=30)):
+    return [(start + i * step, 20.0 + (i % 10) / 10, None if i % 7 == 0 else 50.0, 21.0) for i in range(n)]
+
+
+class TestSensorArchive:
+    """Tests para el archivo columnar por dispositivo y mes."""
+
+    def test_lectura_por_rango(self, tmp_path):
+        archive = SensorArchive(tmp_path)
+        readings = _readings(datetime(2026, 1, 1), BLOCK_ROWS * 2 + 10)
+        assert archive.append(DEVICE, LOCATION, readings) == len(readings)
+
+        rows = list(archive.rows(DEVICE, LOCATION))
+        assert [(r.timestamp, r.temp_c, r.temp_h, r.temp_st) for r in rows] == readings
+        assert rows[0].id is None
+
+        start, end = readings[100][0], readings[BLOCK_ROWS + 5][0]
+        assert archive.count(DEVICE, LOCATION, start, end) == BLOCK_ROWS - 94
+        assert len(list(archive.rows(DEVICE, LOCATION, start, end))) == BLOCK_ROWS - 94
+        assert archive.count(DEVICE, LOCATION, datetime(2026, 3, 1)) == 0
+
+    def test_un_fichero_por_mes(self, tmp_path):
+        archive = SensorArchive(tmp_path)
+        archive.append(DEVICE, LOCATION, _readings(datetime(2026, 1, 31, 23), 240))
+        files = [p.name for p in archive.month_files(DEVICE, LOCATION)]
+        assert files == ['2026-01.tsa', '2026-02.tsa']
+        assert [p.name for p in archive.month_files(DEVICE, LOCATION, datetime(2026, 2, 1))] == ['2026-02.tsa']
+        assert not archive.covers(DEVICE, LOCATION, datetime(2026, 3, 1))
+
+    def test_filas_repetidas_no_se_duplican(self, tmp_path):
+        archive = SensorArchive(tmp_path)
+        readings = _readings(datetime(2026, 1, 1), 100)
+        archive.append(DEVICE, LOCATION, readings[:60])
+        # Ejecución interrumpida antes del DELETE: se vuelven a archivar las mismas filas
+        assert archive.append(DEVICE, LOCATION, readings) == 40
+        assert archive.count(DEVICE, LOCATION) == 100
+        assert archive.get_stats()['files'] == 1
+
+
+@pytest.fixture
+def app_archive(tmp_path, monkeypatch, app_db):
+    """Lecturas antiguas y recientes en una BD temporal de la aplicación, archivo en tmp_path."""
+    monkeypatch.setattr(sensor_archive, 'root', tmp_path)
+    now = datetime.now().replace(microsecond=0)
+    old = _readings(now - timedelta(days=40), 200)
+    recent = _readings(now - timedelta(days=1), 50)
+    with app.app_context():
+        db.session.add_all(SensorData(device_id=DEVICE, location=LOCATION, timestamp=ts,
+                                      temp_c=c, temp_h=h, temp_st=st) for ts, c, h, st in old + recent)
+        db.session.commit()
+    return now, old, recent
+
+
+class TestArchiveIntegration:
+    """Tests para el archivado desde sensor_data y la lectura combinada."""
+
+    def test_cleanup_mueve_al_archivo(self, app_archive):
+        now, old, recent = app_archive
+        with app.app_context():
+            assert cleanup_sensor_data(30) == len(old)
+            assert SensorData.query.filter_by(device_id=DEVICE).count() == len(recent)
+            assert cleanup_sensor_data(30) == 0
+        assert sensor_archive.count(DEVICE, LOCATION) == len(old)
+
+    def test_lectura_combinada(self, app_archive):
+        now, old, recent = app_archive
+        start, end = f"{now - timedelta(days=41):%Y-%m-%d}", f"{now:%Y-%m-%d}"
+        with app.app_context():
+            before = get_sensor_data_for_device(DEVICE, LOCATION, start, end, 'raw')
+            # 45s no encaja en ningún rollup: buckets calculados sobre las lecturas
+            bucketed = get_sensor_data_for_device(DEVICE, LOCATION, start, end, '45')
+            cleanup_sensor_data(30)
+            after = get_sensor_data_for_device(DEVICE, LOCATION, start, end, 'raw')
+            assert get_sensor_data_for_device(DEVICE, LOCATION, start, end, '45') == bucketed
+            assert get_sensor_data_for_device(DEVICE, LOCATION, start, end)[:len(old)] == after[:len(old)]
+            # 10 min encaja en el rollup de 1m, pero su retención (7 días) no cubre el rango
+            tenminute = get_sensor_data_for_device(DEVICE, LOCATION, start, end, '600')
+        assert len(after) == len(old) + len(recent)
+        assert sum(p['count'] for p in tenminute) == len(old) + len(recent)
+        strip = lambda points: [{k: v for k, v in p.items() if k != 'id'} for p in points]
+        assert strip(after) == strip(before)
+
+    def test_bucket_del_borde_se_combina(self):
+        from src.persistence import _merge_buckets
+        point = lambda ts, avg, low, high, count: {
+            'timestamp': ts, 'count': count, 'temp_c': avg, 'temp_c_min': low, 'temp_c_max': high,
+            **{f'{m}{s}': None for m in ('temp_h', 'temp_st') for s in ('', '_min', '_max')}}
+        older = [point('T0', 10.0, 9.0, 11.0, 2), point('T1', 20.0, 19.0, 21.0, 1)]
+        newer = [point('T1', 23.0, 22.0, 24.0, 2), point('T2', 30.0, 30.0, 30.0, 1)]
+        merged = _merge_buckets(older, newer)
+        assert [p['timestamp'] for p in merged] == ['T0', 'T1', 'T2']
+        assert merged[1]['count'] == 3 and merged[1]['temp_c'] == 22.0
+        assert (merged[1]['temp_c_min'], merged[1]['temp_c_max']) == (19.0, 24.0)
+        assert merged[1]['temp_h'] is None
@@ -0,0 +1,152 @@
+"""Unit tests for sensor_writer module."""
+import pytest
+import sys
+import os
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def writer():
+    """Escritor con _write sustituido para capturar los lotes sin BD."""
+    from src.sensor_writer import SensorDataWriter
+
+    w = SensorDataWriter(batch_size=3, flush_ms=50, max_pending=5)
+    w.batches = []
+
+    def fake_write(batch):
+        w.batches.append(batch)
+        w.stats['written'] += len(batch)
+        return len(batch)
+
+    with patch.object(w, '_write', side_effect=fake_write):
+        yield w
+    if w.running:
+        w.stop()
+
+
+class TestSensorDataWriter:
+    """Tests para la cola de escritura por lotes."""
+
+    def test_enqueue_no_escribe_inmediatamente(self, writer):
+        """Encolar no toca la BD hasta el flush."""
+        writer.enqueue('ESP32_001', 'Salon', {'temp_c': 21.5})
+
+        assert writer.pending() == 1
+        assert writer.batches == []
+
+    def test_flush_en_lotes(self, writer):
+        """flush() vacía la cola en lotes de batch_size."""
+        for i in range(5):
+            writer.enqueue('ESP32_001', 'Salon', {'temp_c': i})
+
+        assert writer.flush() == 5
+        assert [len(b) for b in writer.batches] == [3, 2]
+        assert writer.pending() == 0
+
+    def test_fila_con_timestamp_y_metricas(self, writer):
+        """Cada fila lleva su timestamp y las tres métricas."""
+        writer.enqueue('ESP32_001', 'Salon', {'temp_c': 21.5, 'temp_h': 40})
+        writer.flush()
+
+        row = writer.batches[0][0]
+        assert row['device_id'] == 'ESP32_001'
+        assert row['location'] == 'Salon'
+        assert row['timestamp'] is not None
+        assert row['temp_c'] == 21.5
+        assert row['temp_h'] == 40
+        assert row['temp_st'] is None
+
+    def test_cola_acotada_descarta_antiguas(self, writer):
+        """Al superar max_pending se descartan las lecturas más antiguas."""
+        for i in range(8):
+            writer.enqueue('ESP32_001', 'Salon', {'temp_c': i})
+
+        stats = writer.get_stats()
+        assert stats['pending'] == 5
+        assert stats['dropped'] == 3
+        assert stats['enqueued'] == 8
+
+        writer.flush()
+        valores = [row['temp_c'] for batch in writer.batches for row in batch]
+        assert valores == [3, 4, 5, 6, 7]
+
+    def test_hilo_vuelca_por_tiempo(self, writer):
+        """El hilo de fondo escribe aunque no se llene el lote."""
+        writer.start()
+        writer.enqueue('ESP32_001', 'Salon', {'temp_c': 1})
+
+        deadline = time.time() + 2
+        while not writer.batches and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert len(writer.batches) == 1
+
+    def test_stop_vuelca_pendientes(self, writer):
+        """stop() garantiza que no queda nada en la cola."""
+        writer.flush_ms = 60000
+        writer.start()
+        writer.enqueue('ESP32_001', 'Salon', {'temp_c': 1})
+        writer.enqueue('ESP32_001', 'Salon', {'temp_c': 2})
+        writer.stop()
+
+        assert writer.running is False
+        assert writer.pending() == 0
+        assert sum(len(b) for b in writer.batches) == 2
+
+    def test_pausa_retiene_las_filas(self, writer):
+        """En pausa las lecturas se encolan pero no se escriben."""
+        writer.pause()
+        writer.enqueue('ESP32_001', 'Salon', {'temp_c': 21.5})
+        assert writer.flush() == 0
+        assert writer.pending() == 1
+
+        writer.resume()
+        assert writer.flush() == 1
+
+
+class TestWriteRetries:
+    """Tests para los reintentos de lotes fallidos contra la BD."""
+
+    def _rows(self):
+        from src.globals import app
+        from src.models import SensorData
+        with app.app_context():
+            return [r.temp_c for r in SensorData.query.filter_by(device_id='writer_retry').order_by(SensorData.id)]
+
+    @pytest.fixture
+    def db_writer(self, app_db):
+        from src.sensor_writer import SensorDataWriter
+        return SensorDataWriter(batch_size=2, flush_ms=50, max_pending=10)
+
+    def test_lote_fallido_vuelve_a_la_cola(self, db_writer):
+        from src.rollups import update_rollups
+        failures = iter([RuntimeError('database is locked')] * 2)
+
+        def flaky(batch):
+            error = next(failures, None)
+            if error:
+                raise error
+            return update_rollups(batch)
+
+        for i in range(3):
+            db_writer.enqueue('writer_retry', 'lab', {'temp_c': float(i)})
+        with patch('src.rollups.update_rollups', side_effect=flaky):
+            assert db_writer.flush() == 0
+            assert db_writer.pending() == 3
+            db_writer.flush()
+            assert db_writer.flush() == 3
+        assert self._rows() == [0.0, 1.0, 2.0]
+        assert db_writer.stats['retried'] == 4 and db_writer.stats['failed'] == 0
+
+    def test_descarta_tras_los_reintentos(self, db_writer):
+        from src.sensor_writer import WRITE_RETRIES
+        db_writer.enqueue('writer_retry', 'lab', {'temp_c': 1.0})
+        with patch('src.rollups.update_rollups', side_effect=RuntimeError('disk I/O error')):
+            for _ in range(WRITE_RETRIES + 1):
+                db_writer.flush()
+        assert db_writer.pending() == 0
+        assert db_writer.stats['failed'] == 1
+        assert self._rows() == []
@@ -0,0 +1,106 @@
+"""Unit tests for shared_subscriptions module."""
+import itertools
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.globals import config, global_state, DEVICE_STATUS_TOPIC
+from src.topic_trie import topic_matches
+from src.shared_subscriptions import shared_group, share_topic, merge_device_views, SHARE_PREFIX
+
+
+@pytest.fixture
+def group_setting():
+    """Permite fijar mqtt_shared_group y lo restaura al terminar."""
+    settings = config.setdefault('settings', {})
+    saved = settings.get('mqtt_shared_group')
+
+    def set_group(value):
+        settings['mqtt_shared_group'] = value
+    yield set_group
+    if saved is None:
+        settings.pop('mqtt_shared_group', None)
+    else:
+        settings['mqtt_shared_group'] = saved
+
+
+class SharedBrokerStandIn:
+    """Broker mínimo: reparte cada mensaje entre los suscriptores de un grupo $share."""
+
+    def __init__(self):
+        self._groups = {}
+
+    def subscribe(self, worker, topic):
+        _, group, topic_filter = topic.split('/', 2)
+        members = self._groups.setdefault((group, topic_filter), {'workers': [], 'next': None})
+        members['workers'].append(worker)
+        members['next'] = itertools.cycle(members['workers'])
+
+    def publish(self, topic, payload):
+        for (group, topic_filter), members in self._groups.items():
+            if topic_matches(topic, topic_filter):
+                next(members['next']).append((topic, payload))
+
+
+class TestShareTopic:
+    """Tests para los topics de suscripción compartida."""
+
+    def test_sin_grupo_topic_normal(self, group_setting):
+        group_setting('')
+        assert shared_group() == ''
+        assert share_topic(DEVICE_STATUS_TOPIC) == DEVICE_STATUS_TOPIC
+
+    def test_con_grupo(self, group_setting):
+        group_setting('dashboard')
+        assert share_topic(DEVICE_STATUS_TOPIC) == f'{SHARE_PREFIX}/dashboard/{DEVICE_STATUS_TOPIC}'
+        assert share_topic('a/b', group='otro') == '$share/otro/a/b'
+
+    def test_grupo_invalido_se_ignora(self, group_setting):
+        group_setting('mal/grupo')
+        assert shared_group() == ''
+        assert share_topic('a/b') == 'a/b'
+
+    def test_topic_de_respuesta_de_tareas(self, group_setting, monkeypatch):
+        from unittest.mock import MagicMock
+        from src import task_utils
+        from src.connection_manager import BrokerConnection
+        group_setting('dashboard')
+        conn = BrokerConnection('A')
+        conn.state['client'] = client = MagicMock()
+        monkeypatch.setattr(task_utils, 'broadcaster', MagicMock())
+        monkeypatch.setitem(global_state, 'pending_responses', {})
+        task_utils._handle_response_analysis('t1', 'cmd/x', {'response_topic': 'resp/x'}, conn)
+        # Como el resto de suscripciones: un solo worker del grupo recibe la respuesta
+        client.subscribe.assert_called_once_with('$share/dashboard/resp/x')
+        assert conn.topics == ['resp/x'] and conn.trie.has_match('resp/x')
+
+
+class TestMergeDeviceViews:
+    """Tests para la combinación de vistas parciales de dispositivos."""
+
+    def test_gana_el_valor_mas_reciente_por_campo(self):
+        a = {'esp1@sala': {'status': 'online', 'firmware': '1.0', 'seen_at': 100}}
+        b = {'esp1@sala': {'status': 'offline', 'seen_at': 200}}
+        merged = merge_device_views([b, a])
+        assert merged['esp1@sala'] == {'status': 'offline', 'firmware': '1.0', 'seen_at': 200}
+
+    def test_union_de_dispositivos(self):
+        merged = merge_device_views([{'a@x': {'seen_at': 1}}, {'b@x': {'seen_at': 2}}, {}])
+        assert set(merged) == {'a@x', 'b@x'}
+
+    def test_broker_reparte_y_la_union_es_completa(self):
+        broker = SharedBrokerStandIn()
+        workers = [[], [], []]
+        for worker in workers:
+            broker.subscribe(worker, share_topic(DEVICE_STATUS_TOPIC, group='dashboard'))
+
+        for n in range(30):
+            broker.publish(f'iot/status/esp{n}/sala', {'status': 'online', 'seen_at': n})
+
+        # Cada mensaje llega a un único worker
+        assert [len(w) for w in workers] == [10, 10, 10]
+        views = [{topic.split('/')[2] + '@sala': payload for topic, payload in worker} for worker in workers]
+        merged = merge_device_views(views)
+        assert len(merged) == 30
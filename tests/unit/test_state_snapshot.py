@@ -0,0 +1,93 @@
+"""Unit tests for state_snapshot module."""
+import json
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.state_snapshot import StateSnapshot, SnapshotJSON, PreEncoded
+
+
+class _Builders:
+    def __init__(self):
+        self.db_calls = 0
+        self.live_calls = 0
+
+    def db(self):
+        self.db_calls += 1
+        return {'known_devices': ['esp1@sala'], 'alerts': []}
+
+    def live(self):
+        self.live_calls += 1
+        return {'devices': {'esp1@sala': {'status': 'online'}}, 'devices_seq': 3}
+
+
+def _get(snapshot, builders, key=('A', True), fingerprint=1, is_admin=False, now=0):
+    return snapshot.get(key, builders.db, fingerprint, builders.live, is_admin, now=now)
+
+
+class TestSnapshotJSON:
+    """Tests para la serialización de paquetes con cargas ya codificadas."""
+
+    def test_inserta_la_carga_tal_cual(self):
+        payload = PreEncoded({'a': 1}, '{"a":1}')
+        encoded = SnapshotJSON.dumps(['state_update', payload], separators=(',', ':'))
+        assert encoded == '["state_update",{"a":1}]'
+        assert json.loads(encoded) == ['state_update', {'a': 1}]
+
+    def test_carga_sola_y_anidada(self):
+        payload = PreEncoded({'a': 1})
+        assert json.loads(SnapshotJSON.dumps([payload])) == [{'a': 1}]
+        # Dentro de otra estructura se serializa su contenido
+        assert json.loads(SnapshotJSON.dumps({'p': payload})) == {'p': {'a': 1}}
+
+
+class TestStateSnapshot:
+    """Tests para la instantánea versionada del estado inicial."""
+
+    def test_reutiliza_la_instantanea(self):
+        snapshot, builders = StateSnapshot(), _Builders()
+        first = _get(snapshot, builders)
+        second = _get(snapshot, builders, now=1)
+        assert builders.db_calls == 1 and builders.live_calls == 1
+        assert first.encoded == second.encoded
+        assert json.loads(first.encoded) == first.data
+        assert first.data['is_admin'] is False
+
+    def test_is_admin_por_cliente(self):
+        snapshot, builders = StateSnapshot(), _Builders()
+        _get(snapshot, builders)
+        admin = _get(snapshot, builders, is_admin=True)
+        assert json.loads(admin.encoded)['is_admin'] is True
+        assert builders.db_calls == 1
+
+    def test_invalidate_reconstruye(self):
+        snapshot, builders = StateSnapshot(), _Builders()
+        _get(snapshot, builders)
+        snapshot.invalidate()
+        _get(snapshot, builders)
+        assert builders.db_calls == 2 and builders.live_calls == 2
+        assert snapshot.get_stats()['version'] == 1
+
+    def test_cambio_de_clave_y_caducidad(self):
+        snapshot, builders = StateSnapshot(max_age=60), _Builders()
+        _get(snapshot, builders)
+        _get(snapshot, builders, key=('B', True))
+        assert builders.db_calls == 2
+        _get(snapshot, builders, key=('B', True), now=61)
+        assert builders.db_calls == 3
+
+    def test_huella_en_memoria(self):
+        snapshot, builders = StateSnapshot(), _Builders()
+        _get(snapshot, builders, fingerprint=1)
+        _get(snapshot, builders, fingerprint=2)
+        # Solo se reconstruye la parte en memoria
+        assert builders.db_calls == 1 and builders.live_calls == 2
+
+    def test_desactivada(self):
+        snapshot, builders = StateSnapshot(), _Builders()
+        snapshot.enabled = False
+        _get(snapshot, builders)
+        _get(snapshot, builders)
+        assert builders.db_calls == 2 and builders.live_calls == 2
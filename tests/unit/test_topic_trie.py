@@ -0,0 +1,127 @@
+"""Unit tests for topic_trie module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.topic_trie import TopicTrie, topic_matches
+
+
+SUSCRIPCIONES = [
+    'casa/salon/temperatura',
+    'casa/+/temperatura',
+    'casa/#',
+    'garaje/+',
+    '+/+/humedad',
+    'iot/status/+/+',
+    'sport/tennis/#',
+]
+
+TOPICS = [
+    'casa/salon/temperatura',
+    'casa/dormitorio/temperatura',
+    'casa',
+    'casa/salon/humedad',
+    'garaje/puerta',
+    'garaje/puerta/abierta',
+    'garaje',
+    'oficina/sala/humedad',
+    'iot/status/esp32/salon',
+    'iot/status/esp32',
+    'sport/tennis',
+    'sport/tennis/player1/score',
+    'otro/topic',
+    '',
+]
+
+
+class TestTopicTrieMatches:
+    """Tests de coincidencia: el trie debe comportarse igual que topic_matches."""
+
+    @pytest.mark.parametrize('topic', TOPICS)
+    def test_equivalente_a_escaneo_lineal(self, topic):
+        """Las coincidencias del trie son las mismas que las del escaneo lineal."""
+        trie = TopicTrie(SUSCRIPCIONES)
+        esperado = {sub for sub in SUSCRIPCIONES if topic_matches(topic, sub)}
+
+        assert set(trie.matches(topic)) == esperado
+        assert trie.has_match(topic) is bool(esperado)
+
+    def test_hash_raiz_coincide_todo(self):
+        """'#' en la raíz coincide con cualquier topic."""
+        trie = TopicTrie(['#'])
+
+        assert trie.matches('cualquier/cosa/aqui') == ['#']
+        assert trie.has_match('x') is True
+
+    def test_hash_coincide_nivel_padre(self):
+        """'a/#' coincide también con 'a'."""
+        trie = TopicTrie(['a/#'])
+
+        assert trie.has_match('a') is True
+        assert trie.has_match('b') is False
+
+    def test_topic_con_comodin_literal(self):
+        """Un topic que contiene '+' no duplica resultados."""
+        trie = TopicTrie(['casa/+/sensor/#'])
+
+        assert trie.matches('casa/+/sensor/#') == ['casa/+/sensor/#']
+
+    def test_trie_vacio(self):
+        """Un trie vacío no coincide con nada."""
+        trie = TopicTrie()
+
+        assert trie.matches('casa/salon') == []
+        assert trie.has_match('casa/salon') is False
+
+
+class TestTopicTrieMutaciones:
+    """Tests de mantenimiento incremental del índice."""
+
+    def test_add_duplicado(self):
+        """Añadir dos veces la misma suscripción no la duplica."""
+        trie = TopicTrie()
+
+        assert trie.add('casa/+') is True
+        assert trie.add('casa/+') is False
+        assert len(trie) == 1
+        assert 'casa/+' in trie
+
+    def test_remove_poda_ramas(self):
+        """Eliminar una suscripción deja de coincidir y poda nodos vacíos."""
+        trie = TopicTrie(['casa/salon/temp', 'casa/#'])
+
+        assert trie.remove('casa/salon/temp') is True
+        assert trie.matches('casa/salon/temp') == ['casa/#']
+        assert 'salon' not in trie._root.children['casa'].children
+        assert len(trie) == 1
+
+    def test_remove_prefijo_no_afecta_hijos(self):
+        """Eliminar 'a/b' conserva 'a/b/c'."""
+        trie = TopicTrie(['a/b', 'a/b/c'])
+
+        assert trie.remove('a/b') is True
+        assert trie.has_match('a/b') is False
+        assert trie.has_match('a/b/c') is True
+
+    def test_remove_inexistente(self):
+        """Eliminar algo que no existe devuelve False."""
+        trie = TopicTrie(['a/b/c'])
+
+        assert trie.remove('a/b') is False
+        assert trie.remove('x') is False
+        assert len(trie) == 1
+
+    def test_rebuild_y_clear(self):
+        """rebuild() sustituye el contenido y clear() lo vacía."""
+        trie = TopicTrie(['a/b'])
+        trie.rebuild(['c/+', 'c/+', 'd/#'])
+
+        assert len(trie) == 2
+        assert trie.has_match('a/b') is False
+        assert trie.has_match('c/x') is True
+
+        trie.clear()
+        assert len(trie) == 0
+        assert trie.has_match('c/x') is False
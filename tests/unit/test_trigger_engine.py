@@ -0,0 +1,79 @@
+"""Unit tests for trigger_engine module."""
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.trigger_engine import compile_condition, ConditionError, MessageTriggerEngine
+
+
+class TestCompileCondition:
+    """Tests para la compilación segura de condiciones."""
+
+    def test_sin_condicion_siempre_verdadera(self):
+        assert compile_condition(None)({'a': 1})
+        assert compile_condition('  ')('texto')
+
+    @pytest.mark.parametrize('condition,payload,expected', [
+        ('temp > 20', {'temp': 25}, True),
+        ('temp > 20', {'temp': '19.5'}, False),
+        ('temp >= 20', {'temp': 20}, True),
+        ('temp <= 20', {'temp': 21}, False),
+        ("status == 'online'", {'status': 'online'}, True),
+        ('status != offline', {'status': 'online'}, True),
+        ('temp > 20', {'hum': 50}, False),
+        ('temp > 20', 'no es json', False),
+    ])
+    def test_forma_simple(self, condition, payload, expected):
+        assert compile_condition(condition)(payload) is expected
+
+    @pytest.mark.parametrize('condition,payload,expected', [
+        ('temp > 20 and hum < 60', {'temp': 25, 'hum': 50}, True),
+        ('temp > 20 and hum < 60', {'temp': 25, 'hum': 70}, False),
+        ('not enabled or temp * 2 > 50', {'enabled': True, 'temp': 30}, True),
+        ('sensor.temp > 20', {'sensor': {'temp': 21}}, True),
+        ("data['x'] == 1", {'data': {'x': 1}}, True),
+        ("mode in ('auto', 'eco')", {'mode': 'eco'}, True),
+        ('10 < temp < 20', {'temp': 15}, True),
+        ('falta > 1', {'temp': 1}, False),
+        ('temp / 0 > 1', {'temp': 1}, False),
+        ('temp % 2 == 1', {'temp': 3}, True),
+        # Repetir o formatear texto con datos del payload no se evalúa
+        ('name * count == x', {'name': 'a', 'count': 10 ** 9, 'x': ''}, False),
+        ('fmt % temp == x', {'fmt': '%999999999d', 'temp': 1, 'x': ''}, False),
+    ])
+    def test_expresiones(self, condition, payload, expected):
+        assert compile_condition(condition)(payload) is expected
+
+    @pytest.mark.parametrize('condition', [
+        "__import__('os').system('ls')",
+        'temp.__class__',
+        'open("x")',
+        '(lambda: 1)()',
+        'temp >',
+        "'a' * 1000000000 == x",
+        "'%999999999d' % temp == x",
+    ])
+    def test_construcciones_no_permitidas(self, condition):
+        with pytest.raises(ConditionError):
+            compile_condition(condition)({'temp': 1})
+
+
+class TestMessageTriggerEngine:
+    """Tests para el índice de triggers por topic."""
+
+    def test_match_por_patron(self):
+        engine = MessageTriggerEngine()
+        engine.rebuild({
+            't1': {'name': 'uno', 'topic_pattern': 'casa/+/temp', 'trigger_condition': 'v > 1', 'enabled': True},
+            't2': {'name': 'dos', 'topic_pattern': 'casa/#', 'trigger_condition': None, 'enabled': True},
+            't3': {'name': 'tres', 'topic_pattern': 'casa/salon/temp', 'trigger_condition': None, 'enabled': False},
+            't4': {'name': 'cuatro', 'topic_pattern': 'casa/salon/temp', 'trigger_condition': 'v >', 'enabled': True},
+        })
+
+        assert sorted(c.trigger_id for c in engine.match('casa/salon/temp')) == ['t1', 't2']
+        assert [c.trigger_id for c in engine.match('casa/salon/hum')] == ['t2']
+        assert engine.match('otro/topic') == []
+        assert set(engine.invalid) == {'t4'}
+        assert len(engine) == 2
@@ -0,0 +1,63 @@
+"""Unit tests for ts_codec module."""
+import math
+import random
+import zlib
+import pytest
+import struct
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ts_codec import encode_timestamps, decode_timestamps, encode_floats, decode_floats, encode_block, decode_block
+
+
+class TestTimestamps:
+    """Tests para la codificación delta-of-delta."""
+
+    def test_ida_y_vuelta_irregular(self):
+        timestamps = [0, 1_000_000, 2_000_000, 2_000_001, 10_000_000, 9_999_999, 1 << 52]
+        assert decode_timestamps(encode_timestamps(timestamps)) == timestamps
+
+    def test_serie_regular_ocupa_un_byte(self):
+        start = 1_767_225_600_000_000
+        timestamps = [start + i * 5_000_000 for i in range(1000)]
+        encoded = encode_timestamps(timestamps)
+        # Primera marca y primer delta en varints largos, el resto en ceros
+        assert len(encoded) < 1000 + 20
+        assert decode_timestamps(encoded) == timestamps
+
+
+class TestFloats:
+    """Tests para la codificación XOR de floats."""
+
+    def test_ida_y_vuelta_con_none(self):
+        values = [21.5, 21.5, None, 21.625, -3.0, None, 0.0, 1e300, float('inf')]
+        assert decode_floats(*encode_floats(values)) == values
+
+    def test_nan(self):
+        decoded = decode_floats(*encode_floats([1.0, float('nan')]))
+        assert decoded[0] == 1.0 and math.isnan(decoded[1])
+
+
+class TestBlock:
+    """Tests para los bloques columnares."""
+
+    def test_ida_y_vuelta(self):
+        timestamps = [i * 5_000_000 + random.randint(0, 1000) for i in range(500)]
+        columns = [[round(20 + random.random(), 2) for _ in timestamps],
+                   [None] * len(timestamps),
+                   [None if i % 3 else 40.0 for i in range(len(timestamps))]]
+        assert decode_block(encode_block(timestamps, columns)) == (timestamps, columns)
+
+    def test_bloque_vacio(self):
+        assert decode_block(encode_block([], [[], []])) == ([], [[], []])
+
+    def test_comprime_mejor_que_filas(self):
+        timestamps = [1_767_225_600_000_000 + i * 5_000_000 for i in range(4096)]
+        columns = [[round(21 + 0.1 * math.sin(i / 50), 1) for i in range(4096)],
+                   [round(45 + 0.5 * math.cos(i / 80), 1) for i in range(4096)],
+                   [21.0] * 4096]
+        rows = b''.join(struct.pack('<qddd', ts, *(c[i] for c in columns)) for i, ts in enumerate(timestamps))
+        block = encode_block(timestamps, columns)
+        assert len(block) * 3 < len(zlib.compress(rows, 6))